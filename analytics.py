@@ -0,0 +1,290 @@
+# Analytics rollups: appointments per status and prescriptions per medicine,
+# counted per doctor, per specialty and overall, per day and for all time.
+# SQLite triggers keep them current on every write, which is why create_app
+# refuses other databases; `flask analytics rebuild` backfills them in batches
+import sys
+import time as clock
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import DDL, bindparam, event, func, select, text
+
+from config import db
+from models import AnalyticsRollup
+
+APPOINTMENTS, PRESCRIPTIONS = 'appointments', 'prescriptions'
+DOCTOR, SPECIALTY, ALL = 'doctor', 'specialty', 'all'
+ALL_TIME = ''
+MAX_DAYS = 366
+DEFAULT_DAYS = 30
+
+_TABLE = AnalyticsRollup.__tablename__
+_COLUMNS = 'metric, scope, scope_key, day, bucket, count'
+_UPSERT = (f'INSERT INTO {_TABLE} ({_COLUMNS}) {{select}} '
+           f'ON CONFLICT (metric, scope, scope_key, day, bucket) DO UPDATE SET count = count + excluded.count;')
+# Every source row counts once per scope (its doctor, the doctor's specialty,
+# everyone) and per period (its day, all time)
+_FANOUT = ("CROSS JOIN (SELECT 'doctor' AS scope UNION ALL SELECT 'specialty' UNION ALL SELECT 'all') s "
+           "CROSS JOIN (SELECT 0 AS whole UNION ALL SELECT 1) p")
+_SCOPE_KEY = "CASE s.scope WHEN 'doctor' THEN CAST(doc.id AS TEXT) WHEN 'specialty' THEN doc.specialty ELSE '' END"
+
+
+def _contribution(metric, bucket, day, sign, source, where):
+    """Upsert adding ``sign`` to every rollup row one source row belongs to."""
+    return _UPSERT.format(select=(
+        f"SELECT '{metric}', s.scope, {_SCOPE_KEY}, CASE p.whole WHEN 1 THEN '' ELSE {day} END, {bucket}, {sign} "
+        f'FROM {source} {_FANOUT} WHERE {where}'))
+
+
+def _appointment(row, sign):
+    return _contribution(APPOINTMENTS, f'{row}.status', f'{row}.date', sign,
+                         'doctors doc', f'doc.id = {row}.doctor_id')
+
+
+def _prescription(row, sign):
+    return _contribution(PRESCRIPTIONS, f'{row}.medicine', 'a.date', sign,
+                         'appointments a JOIN doctors doc ON doc.id = a.doctor_id', f'a.id = {row}.appointment_id')
+
+
+def _moved_prescriptions(row, sign):
+    # Prescriptions count under their appointment's doctor and day
+    return _contribution(PRESCRIPTIONS, 'pr.medicine', f'{row}.date', sign,
+                         f'prescriptions pr JOIN doctors doc ON doc.id = {row}.doctor_id',
+                         f'pr.appointment_id = {row}.id')
+
+
+def _respecialize(specialty, sign):
+    return _UPSERT.format(select=(
+        f"SELECT metric, 'specialty', {specialty}, day, bucket, {sign} * count FROM {_TABLE} "
+        f"WHERE scope = 'doctor' AND scope_key = CAST(old.id AS TEXT)"))
+
+
+def ddl():
+    """Triggers maintaining the rollups (SQLite)."""
+    def trigger(name, event_, table, body, when=None):
+        condition = f' WHEN {when}' if when else ''
+        return f'CREATE TRIGGER IF NOT EXISTS analytics_{name} {event_} ON {table}{condition} BEGIN {body} END'
+
+    return [
+        trigger('appointments_insert', 'AFTER INSERT', 'appointments', _appointment('new', 1)),
+        trigger('appointments_delete', 'AFTER DELETE', 'appointments', _appointment('old', -1)),
+        trigger('appointments_update', 'AFTER UPDATE OF doctor_id, date, status', 'appointments',
+                _appointment('old', -1) + ' ' + _appointment('new', 1),
+                'old.doctor_id IS NOT new.doctor_id OR old.date IS NOT new.date OR old.status IS NOT new.status'),
+        trigger('appointments_move', 'AFTER UPDATE OF doctor_id, date', 'appointments',
+                _moved_prescriptions('old', -1) + ' ' + _moved_prescriptions('new', 1),
+                'old.doctor_id IS NOT new.doctor_id OR old.date IS NOT new.date'),
+        trigger('prescriptions_insert', 'AFTER INSERT', 'prescriptions', _prescription('new', 1)),
+        trigger('prescriptions_delete', 'AFTER DELETE', 'prescriptions', _prescription('old', -1)),
+        trigger('prescriptions_update', 'AFTER UPDATE OF appointment_id, medicine', 'prescriptions',
+                _prescription('old', -1) + ' ' + _prescription('new', 1),
+                'old.appointment_id IS NOT new.appointment_id OR old.medicine IS NOT new.medicine'),
+        trigger('doctors_specialty', 'AFTER UPDATE OF specialty', 'doctors',
+                _respecialize('old.specialty', -1) + ' ' + _respecialize('new.specialty', 1),
+                'old.specialty IS NOT new.specialty'),
+    ]
+
+
+TRIGGERS = [
+    'appointments_insert', 'appointments_delete', 'appointments_update', 'appointments_move',
+    'prescriptions_insert', 'prescriptions_delete', 'prescriptions_update', 'doctors_specialty',
+]
+
+# The rebuild counts per doctor and day from the source tables, then derives
+# the coarser rows from those, which are far fewer than the source rows
+_REBUILD = [
+    f'DELETE FROM {_TABLE}',
+    f"INSERT INTO {_TABLE} ({_COLUMNS}) SELECT 'appointments', 'doctor', CAST(doctor_id AS TEXT), "
+    f'CAST(date AS TEXT), status, count(*) FROM (SELECT doctor_id, date, status FROM appointments '
+    f'UNION ALL SELECT doctor_id, date, status FROM appointments_archive) a GROUP BY doctor_id, date, status',
+    f"INSERT INTO {_TABLE} ({_COLUMNS}) SELECT 'prescriptions', 'doctor', CAST(doctor_id AS TEXT), "
+    f'CAST(date AS TEXT), medicine, count(*) FROM ('
+    f'SELECT a.doctor_id, a.date, pr.medicine FROM prescriptions pr JOIN appointments a ON a.id = pr.appointment_id '
+    f'UNION ALL SELECT a.doctor_id, a.date, pr.medicine FROM prescriptions_archive pr '
+    f'JOIN appointments_archive a ON a.id = pr.appointment_id) p GROUP BY doctor_id, date, medicine',
+    f"INSERT INTO {_TABLE} ({_COLUMNS}) SELECT r.metric, 'specialty', doc.specialty, r.day, r.bucket, sum(r.count) "
+    f"FROM {_TABLE} r JOIN doctors doc ON CAST(doc.id AS TEXT) = r.scope_key WHERE r.scope = 'doctor' "
+    f'GROUP BY r.metric, doc.specialty, r.day, r.bucket',
+    f"INSERT INTO {_TABLE} ({_COLUMNS}) SELECT metric, 'all', '', day, bucket, sum(count) FROM {_TABLE} "
+    f"WHERE scope = 'specialty' GROUP BY metric, day, bucket",
+    f"INSERT INTO {_TABLE} ({_COLUMNS}) SELECT metric, scope, scope_key, '', bucket, sum(count) FROM {_TABLE} "
+    f'GROUP BY metric, scope, scope_key, bucket',
+]
+
+
+def rebuild(session):
+    """Recount every rollup from the appointments and prescriptions tables, archived ones included."""
+    for statement in _REBUILD:
+        session.execute(text(statement))
+
+
+def _installed(session):
+    return session.get_bind().dialect.name == 'sqlite' and session.execute(text(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name = 'analytics_appointments_insert'"
+    )).scalar()
+
+
+def count_archived(session, appointment_ids):
+    """Count appointments just moved to the archive tables, and their prescriptions, back in.
+
+    Archived history still counts, but deleting the rows from the hot tables
+    ran the delete triggers. Without the triggers nothing was subtracted.
+    """
+    if not appointment_ids or not _installed(session):
+        return
+    ids = bindparam('ids', expanding=True)
+    session.execute(text(_contribution(
+        APPOINTMENTS, 'a.status', 'a.date', 1, 'appointments_archive a JOIN doctors doc ON doc.id = a.doctor_id',
+        'a.id IN :ids')).bindparams(ids), {'ids': appointment_ids})
+    session.execute(text(_contribution(
+        PRESCRIPTIONS, 'pr.medicine', 'a.date', 1,
+        'prescriptions_archive pr JOIN appointments_archive a ON a.id = pr.appointment_id '
+        'JOIN doctors doc ON doc.id = a.doctor_id', 'a.id IN :ids')).bindparams(ids), {'ids': appointment_ids})
+
+
+@contextmanager
+def bulk_load(session):
+    """Run a bulk load with the triggers dropped, then recount and restore them.
+
+    The triggers cost about 40 us per written row, a recount a small
+    fraction of that. Writes other connections commit in the meantime are
+    picked up by the recount, which runs in the same transaction that
+    recreates the triggers. Outside SQLite, or where the triggers are not
+    installed, the load runs as is.
+    """
+    if not _installed(session):
+        yield
+        return
+    for name in TRIGGERS:
+        session.execute(text(f'DROP TRIGGER IF EXISTS analytics_{name}'))
+    session.commit()
+    try:
+        yield
+    finally:
+        session.rollback()
+        rebuild(session)
+        for statement in ddl():
+            session.execute(text(statement))
+        session.commit()
+
+
+def date_range(args):
+    """``(start, end)`` from ``date_from``/``date_to``, or ``(None, None)`` for all time.
+
+    Given one end, the other is DEFAULT_DAYS away; a range is at most
+    MAX_DAYS long. Raises ValueError.
+    """
+    start, end = args.get('date_from'), args.get('date_to')
+    if start is None and end is None:
+        return None, None
+    try:
+        start = date.fromisoformat(start) if start else None
+        end = date.fromisoformat(end) if end else None
+    except ValueError:
+        raise ValueError("'date_from' and 'date_to' must be dates (YYYY-MM-DD)")
+    if end is None:
+        end = start + timedelta(days=DEFAULT_DAYS - 1)
+    if start is None:
+        start = end - timedelta(days=DEFAULT_DAYS - 1)
+    if start > end:
+        raise ValueError("'date_from' must not be after 'date_to'")
+    if (end - start).days >= MAX_DAYS:
+        raise ValueError(f'A range covers at most {MAX_DAYS} days')
+    return start, end
+
+
+def subject(args):
+    """``(scope, scope_key)`` picked by ``doctor_id`` or ``specialty``; everyone by default. Raises ValueError."""
+    doctor_id, specialty = args.get('doctor_id'), args.get('specialty')
+    if doctor_id is not None and specialty is not None:
+        raise ValueError("Pass 'doctor_id' or 'specialty', not both")
+    if doctor_id is not None:
+        if not doctor_id.isdigit():
+            raise ValueError("'doctor_id' must be an integer")
+        return DOCTOR, str(int(doctor_id))
+    if specialty is not None:
+        return SPECIALTY, specialty
+    return ALL, ''
+
+
+def _rows(session, metric, scope, keys, start, end):
+    r = AnalyticsRollup
+    query = select(r.scope_key, r.day, r.bucket, r.count).where(r.metric == metric, r.scope == scope, r.count != 0)
+    if keys is not None:
+        query = query.where(r.scope_key.in_(keys))
+    if start is None:
+        query = query.where(r.day == ALL_TIME)
+    else:
+        query = query.where(r.day.between(start.isoformat(), end.isoformat()))
+    return session.execute(query).all()
+
+
+def _statuses(counts):
+    total = sum(counts.values())
+    return {
+        'total': total,
+        'statuses': {status: {'count': count, 'ratio': round(count / total, 4)}
+                     for status, count in sorted(counts.items())},
+    }
+
+
+def _by_key(rows):
+    counts = {}
+    for key, _, bucket, count in rows:
+        per_key = counts.setdefault(key, {})
+        per_key[bucket] = per_key.get(bucket, 0) + count
+    return counts
+
+
+def appointments(session, scope, key, start=None, end=None):
+    """Status counts and ratios for one doctor, specialty or everyone; per day too for a range."""
+    rows = _rows(session, APPOINTMENTS, scope, [key], start, end)
+    body = _statuses(_by_key(rows).get(key, {}))
+    if start is not None:
+        days = {}
+        for _, day, status, count in rows:
+            days.setdefault(day, {})[status] = count
+        body['days'] = [{'date': day, 'total': sum(counts.values()), 'statuses': counts}
+                        for day, counts in sorted(days.items())]
+    return body
+
+
+def by_key(session, scope, keys=None, start=None, end=None):
+    """Status counts and ratios for each of ``keys`` (every key of ``scope`` when None)."""
+    counts = _by_key(_rows(session, APPOINTMENTS, scope, keys, start, end))
+    return {key: _statuses(counts.get(key, {})) for key in (keys if keys is not None else sorted(counts))}
+
+
+def medicines(session, scope, key, start=None, end=None, limit=50):
+    """Prescriptions per medicine for one doctor, specialty or everyone, most prescribed first."""
+    counts = _by_key(_rows(session, PRESCRIPTIONS, scope, [key], start, end)).get(key, {})
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    return [{'medicine': medicine, 'count': count} for medicine, count in ranked if count]
+
+
+# db.create_all() / drop_all() (seed.py, scratch databases) manage the
+# triggers too, once every table they name exists; an existing database gets
+# them from the migration
+for _statement in ddl():
+    event.listen(db.metadata, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _name in TRIGGERS:
+    event.listen(db.metadata, 'before_drop', DDL(f'DROP TRIGGER IF EXISTS analytics_{_name}').execute_if(dialect='sqlite'))
+
+
+@click.group('analytics')
+def analytics_command():
+    """Maintain the analytics rollups."""
+
+
+@analytics_command.command('rebuild')
+@with_appcontext
+def rebuild_command():
+    """Recount the rollups from existing appointments and prescriptions."""
+    started = clock.perf_counter()
+    db.session.info['immediate'] = True
+    rebuild(db.session)
+    db.session.commit()
+    rows = db.session.query(func.count()).select_from(AnalyticsRollup).scalar()
+    click.echo(f'Rebuilt {rows} rollup rows in {clock.perf_counter() - started:.1f} s', file=sys.stderr)
@@ -0,0 +1,134 @@
+# Archival: appointments older than ARCHIVE_AFTER_DAYS move, with their
+# prescriptions, from the hot tables to appointments_archive and
+# prescriptions_archive, a batch per transaction, so the hot tables and their
+# indexes hold recent history only however many years accumulate
+import signal
+import sys
+import threading
+import time as clock
+from datetime import date, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, literal, select
+
+import analytics
+from cache import cache
+from conditional import touch
+from config import db
+from models import Appointment, ArchivedAppointment, ArchivedPrescription, Prescription, utcnow
+from search import INDEXES
+
+_APPOINTMENTS, _PRESCRIPTIONS = Appointment.__table__, Prescription.__table__
+_ARCHIVED_APPOINTMENTS, _ARCHIVED_PRESCRIPTIONS = ArchivedAppointment.__table__, ArchivedPrescription.__table__
+TABLES = {table.name for table in (_APPOINTMENTS, _PRESCRIPTIONS, _ARCHIVED_APPOINTMENTS, _ARCHIVED_PRESCRIPTIONS)}
+
+
+def _copy(source, target, where, **extra):
+    """INSERT INTO target SELECT the rows of ``source`` matching ``where``, column for column."""
+    names = [column.name for column in source.columns]
+    values = [*source.columns, *(literal(value) for value in extra.values())]
+    return insert(target).from_select([*names, *extra], select(*values).where(where))
+
+
+def archive_batch(session, cutoff, batch_size):
+    """Move up to ``batch_size`` appointments dated before ``cutoff``, and their prescriptions.
+
+    One transaction, committed here. Returns ``(appointments, prescriptions)`` moved.
+    The hot tables are AUTOINCREMENT on SQLite, so no id moved here is handed
+    out again, even once it was the highest.
+    """
+    query = select(_APPOINTMENTS.c.id).where(_APPOINTMENTS.c.date < cutoff)
+    ids = session.scalars(query.order_by(_APPOINTMENTS.c.id).limit(batch_size)).all()
+    if not ids:
+        session.commit()
+        return 0, 0
+    prescription_ids = session.scalars(
+        select(_PRESCRIPTIONS.c.id).where(_PRESCRIPTIONS.c.appointment_id.in_(ids))).all()
+    session.execute(_copy(_APPOINTMENTS, _ARCHIVED_APPOINTMENTS, _APPOINTMENTS.c.id.in_(ids), archived_at=utcnow()))
+    session.execute(_copy(_PRESCRIPTIONS, _ARCHIVED_PRESCRIPTIONS, _PRESCRIPTIONS.c.appointment_id.in_(ids)))
+    # Prescriptions first: the foreign key, and their analytics trigger finds the day through the appointment
+    session.execute(delete(_PRESCRIPTIONS).where(_PRESCRIPTIONS.c.appointment_id.in_(ids)))
+    session.execute(delete(_APPOINTMENTS).where(_APPOINTMENTS.c.id.in_(ids)))
+    analytics.count_archived(session, ids)
+    # Table-level statements bypass the hooks that advance change tokens and the cache
+    touch(session, TABLES)
+    session.commit()
+    cache.invalidate(*TABLES, *(f'appointment:{row_id}' for row_id in ids),
+                     *(f'prescription:{row_id}' for row_id in prescription_ids))
+    return len(ids), len(prescription_ids)
+
+
+def archive(session, cutoff, batch_size=1000, pause=0.0, stop=None, report=None):
+    """Archive every appointment dated before ``cutoff``; returns ``(appointments, prescriptions)`` moved.
+
+    ``pause`` seconds between batches let other writers take SQLite's write
+    lock; ``stop`` (a threading.Event) ends the run after the current batch.
+    The prescription search index is compacted at the end.
+    """
+    appointments = prescriptions = 0
+    while stop is None or not stop.is_set():
+        moved, moved_prescriptions = archive_batch(session, cutoff, batch_size)
+        appointments += moved
+        prescriptions += moved_prescriptions
+        if report:
+            report(appointments, prescriptions)
+        if moved < batch_size:
+            break
+        if pause:
+            clock.sleep(pause)
+    if prescriptions:
+        INDEXES['prescriptions'].optimize(session)
+        session.commit()
+    return appointments, prescriptions
+
+
+@click.group('archive')
+def archive_command():
+    """Move old appointments and their prescriptions to the archive tables."""
+
+
+@archive_command.command('run')
+@click.option('--days', type=int, help='Archive appointments dated more than this many days ago '
+                                       '(default ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', type=int, help='Appointments per transaction (default ARCHIVE_BATCH_SIZE).')
+@click.option('--pause', default=0.05, show_default=True, help='Seconds between batches, for other writers.')
+@click.option('--every', type=float, help='Keep running and archive again every this many seconds.')
+@with_appcontext
+def run_command(days, batch_size, pause, every):
+    """Archive what is old enough now, or on a schedule with --every (SIGINT/SIGTERM stop it)."""
+    config = current_app.config
+    days = config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    batch_size = batch_size or config['ARCHIVE_BATCH_SIZE']
+    # Each batch reads then writes: take SQLite's write lock up front like write requests do
+    db.session.info['immediate'] = True
+    stop = threading.Event()
+    if every:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stop.set())
+
+    def report(appointments, prescriptions):
+        click.echo(f'\rappointments: {appointments:<10} prescriptions: {prescriptions:<10}', nl=False, file=sys.stderr)
+
+    while not stop.is_set():
+        cutoff = date.today() - timedelta(days=days)
+        started = clock.perf_counter()
+        appointments, prescriptions = archive(db.session, cutoff, batch_size, pause, stop, report)
+        click.echo(f'\rArchived {appointments} appointments and {prescriptions} prescriptions before {cutoff} '
+                   f'in {clock.perf_counter() - started:.1f} s', file=sys.stderr)
+        if not every:
+            break
+        stop.wait(every)
+
+
+@archive_command.command('stats')
+@with_appcontext
+def stats_command():
+    """Rows in the hot and archive tables, and the oldest hot appointment."""
+    for model in (Appointment, ArchivedAppointment, Prescription, ArchivedPrescription):
+        count = db.session.query(func.count()).select_from(model).scalar()
+        click.echo(f'{model.__tablename__:<24}{count:>12}')
+    oldest = db.session.query(func.min(Appointment.date)).scalar()
+    if oldest is not None:
+        click.echo(f'oldest hot appointment  {oldest.isoformat():>12}')
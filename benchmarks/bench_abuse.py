@@ -0,0 +1,146 @@
+"""Latency of well-behaved clients while others abuse the API, with and without limits.py.
+
+    python benchmarks/bench_abuse.py [--config 1x4] [--good 4] [--abusers 8] [--rate 10]
+                                     [--duration 10] [--rounds 10]
+
+Fills a scratch database with datagen.generate() at the small scale, then
+starts gunicorn (``--config`` as in bench_server.py) on it three times.
+"quiet" has only the good clients, each sending ``--rate`` cheap requests a
+second: one appointment, a patient's calendar, one doctor. "unlimited" adds
+abusers looping as fast as they can over pages of 200 appointments with
+their prescriptions and logins (bcrypt at ``--rounds``), with rate limiting
+and admission control off. "limited" is the same load with both on, at
+their defaults. Every client poses as its own address through
+X-Forwarded-For (RATE_LIMIT_PROXIES=1). Abusers ignore Retry-After, so the
+refusals themselves still cost the server something.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import signal
+import subprocess
+import time
+import urllib.request
+from collections import Counter
+
+from common import scratch_app
+
+from bench_api import ROOT, SCALES, HttpClient, percentile
+from bench_server import command, wait_ready
+from datagen import PASSWORD, generate
+
+SCALE = SCALES['small']
+ABUSE = [('GET', '/appointments?limit=200&expand=prescriptions', None)] + [
+    ('POST', '/login', {'email': f'user{n}@example.com', 'password': PASSWORD}) for n in range(1, 6)]
+
+
+def good(url, address, rate, duration, seed):
+    rng = random.Random(seed)
+    connection = HttpClient(url, {'X-Forwarded-For': address})
+    latencies, statuses = [], Counter()
+    started = time.perf_counter()
+    deadline = started + duration
+    due = started
+    while due < deadline:
+        # Fixed schedule, latency counted from when the request was due: a slow
+        # response delays the ones behind it and they count that wait too
+        time.sleep(max(0.0, due - time.perf_counter()))
+        path = rng.choice([f'/appointments/{rng.randint(1, SCALE["appointments"])}',
+                           f'/appointments/user/{rng.randint(1, SCALE["users"])}',
+                           f'/doctors/{rng.randint(1, SCALE["doctors"])}'])
+        status, _ = connection.request('GET', path)
+        latencies.append(time.perf_counter() - due)
+        statuses[status] += 1
+        due += 1 / rate
+    return latencies, statuses
+
+
+def abuser(url, address, duration, seed):
+    rng = random.Random(seed)
+    connection = HttpClient(url, {'X-Forwarded-For': address})
+    statuses = Counter()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        method, path, body = rng.choice(ABUSE)
+        statuses[connection.request(method, path, body)[0]] += 1
+    return [], statuses
+
+
+def run_client(args):
+    role, *rest = args
+    return good(*rest) if role == 'good' else abuser(*rest)
+
+
+def throttled(url):
+    """http_requests_throttled_total by reason, from /metrics (exact with one worker)."""
+    totals = Counter()
+    with urllib.request.urlopen(url + '/metrics') as response:
+        lines = response.read().decode().splitlines()
+    for line in lines:
+        if line.startswith('http_requests_throttled_total{'):
+            totals[line.split('reason="')[1].split('"')[0]] += float(line.rsplit(' ', 1)[1])
+    return totals
+
+
+def measure(database_url, args, abusers, limited):
+    argv, env = command(args.config, args.port)
+    env = {**os.environ, **env, 'DATABASE_URL': database_url, 'FLASK_APP': 'app.py',
+           'BCRYPT_ROUNDS': str(args.rounds), 'RATE_LIMIT_PROXIES': '1'}
+    if not limited:
+        env.update(RATE_LIMIT_BACKEND='none', ADMISSION_LIMIT='0')
+    process = subprocess.Popen(argv, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{args.port}'
+    jobs = [('good', url, f'10.0.0.{n}', args.rate, args.duration, n) for n in range(args.good)]
+    jobs += [('abuser', url, f'10.1.0.{n}', args.duration, n) for n in range(abusers)]
+    try:
+        wait_ready(url, process)
+        with multiprocessing.Pool(len(jobs)) as pool:
+            results = pool.map(run_client, jobs)
+        refused = throttled(url)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+    good_results, abuse_results = results[:args.good], results[args.good:]
+    latencies = sorted(latency for samples, _ in good_results for latency in samples)
+    good_statuses = sum((statuses for _, statuses in good_results), Counter())
+    abuse_statuses = sum((statuses for _, statuses in abuse_results), Counter())
+    served = sum(count for status, count in abuse_statuses.items() if status < 400)
+    return (percentile(latencies, 0.50), percentile(latencies, 0.99), latencies[-1] * 1000,
+            sum(count for status, count in good_statuses.items() if status >= 400),
+            served / args.duration, abuse_statuses[429] / args.duration, abuse_statuses[503] / args.duration,
+            refused)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='1x4')
+    parser.add_argument('--good', type=int, default=4)
+    parser.add_argument('--abusers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=10)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    app = scratch_app(BCRYPT_ROUNDS=args.rounds)
+    with app.app_context():
+        generate(**SCALE)
+    database_url = app.config['DATABASE_URL']
+
+    print(f'{os.cpu_count()} CPUs, gunicorn {args.config}, {args.good} good clients at {args.rate:g} req/s, '
+          f'{args.abusers} abusers, {args.duration:g} s each')
+    print(f'{"scenario":<11}{"good p50":>10}{"p99":>9}{"max":>9}{"errors":>8}'
+          f'{"abuse ok/s":>12}{"429/s":>8}{"503/s":>8}')
+    for label, abusers, limited in (('quiet', 0, True), ('unlimited', args.abusers, False),
+                                    ('limited', args.abusers, True)):
+        p50, p99, worst, errors, served, limited_rate, shed, refused = measure(database_url, args, abusers, limited)
+        print(f'{label:<11}{p50:>10.2f}{p99:>9.2f}{worst:>9.1f}{errors:>8}'
+              f'{served:>12.1f}{limited_rate:>8.1f}{shed:>8.1f}')
+        if refused:
+            print(f'{"":<11}http_requests_throttled_total: ' +
+                  ', '.join(f'{reason} {count:.0f}' for reason, count in sorted(refused.items())))
+
+
+if __name__ == '__main__':
+    main()
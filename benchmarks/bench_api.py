@@ -0,0 +1,343 @@
+"""Load test every API resource and save throughput and latency percentiles as JSON.
+
+    python benchmarks/bench_api.py [--scale small|medium|large] [--requests 200] [--threads 4]
+                                   [--url http://127.0.0.1:5000] [--output results.json]
+                                   [--compare previous.json]
+
+Without --url the app runs in-process through the Flask test client on a
+scratch SQLite database filled by datagen.generate() at the chosen scale.
+With --url requests go to a running server; that server's database should
+have been filled with ``flask generate`` using the same scale figures, so
+the ids the scenarios pick exist.
+
+Each scenario runs on its own, ``--requests`` times from ``--threads``
+threads. Reads come first, then writes, deletes last. The JSON output
+records the commit, the dataset and per-scenario throughput and
+p50/p95/p99 latency; --compare prints the change against an earlier file.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import quote, urlsplit
+
+from common import scratch_app
+
+import sqlalchemy
+
+from datagen import DAY_START, LAST_NAMES, MEDICINES, SLOT_MINUTES, SLOTS_PER_DAY, SPECIALTIES, generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCALES = {
+    'small': dict(users=1000, doctors=50, appointments=10000, prescriptions=20000),
+    'medium': dict(users=100000, doctors=2000, appointments=500000, prescriptions=1000000),
+    'large': dict(users=1000000, doctors=50000, appointments=10000000, prescriptions=20000000),
+}
+
+
+class TestClient:
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self._client.open(path, method=method, json=body)
+        response.get_data()  # drain streamed bodies like a real client would
+        response.close()
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """Keep-alive HTTP client that carries the session cookie like a browser would."""
+
+    def __init__(self, url, headers=None):
+        parts = urlsplit(url)
+        self._connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        self._cookie = None
+        self._headers = headers or {}
+
+    def request(self, method, path, body=None):
+        headers = dict(self._headers)
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        if self._cookie:
+            headers['Cookie'] = self._cookie
+        # Search terms include names such as Müller; the request line must be ASCII
+        self._connection.request(method, quote(path, safe="/?&=%+,:"), json.dumps(body) if body is not None else None,
+                                 headers)
+        response = self._connection.getresponse()
+        data = response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self._cookie = cookie.split(';', 1)[0]
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+class Workload:
+    """Request factories for every resource, picking ids from the generated dataset."""
+
+    def __init__(self, users, doctors, appointments, prescriptions, first=0, **_):
+        self.users, self.doctors = users, doctors
+        self.appointments, self.prescriptions = appointments, prescriptions
+        # Separate loaders pass disjoint ``first`` values so their bookings never collide
+        self._counter = itertools.count(first)
+        self._lock = threading.Lock()
+        self.created = {'appointments': [], 'prescriptions': []}
+        # New bookings go to weekdays from 2030 on, clear of the generated ones
+        start = date(2030, 1, 7)
+        self._days = [start + timedelta(days=offset) for offset in range(3650)
+                      if (start + timedelta(days=offset)).weekday() < 5]
+
+    def unique(self):
+        with self._lock:
+            return next(self._counter)
+
+    def booking(self, status='Scheduled'):
+        n = self.unique()
+        slot = n // self.doctors
+        minute = DAY_START + slot % SLOTS_PER_DAY * SLOT_MINUTES
+        return {'user_id': random.randint(1, self.users), 'doctor_id': n % self.doctors + 1,
+                'date': self._days[slot // SLOTS_PER_DAY].isoformat(),
+                'time': f'{minute // 60:02d}:{minute % 60:02d}', 'status': status}
+
+    def prescription(self):
+        return {'appointment_id': random.randint(1, self.appointments), 'medicine': 'Aspirin',
+                'dosage': '1 x 100 mg', 'instructions': 'Take after meal'}
+
+    def remember(self, kind, result):
+        status, body = result
+        if status in (200, 201) and isinstance(body, dict) and 'id' in body:
+            with self._lock:
+                self.created[kind].append(body['id'])
+
+    def take(self, kind):
+        with self._lock:
+            return self.created[kind].pop() if self.created[kind] else None
+
+    def user(self):
+        return random.randint(1, self.users)
+
+    def doctor(self):
+        return random.randint(1, self.doctors)
+
+    def scenarios(self):
+        """(name, expected statuses, fn(client) -> (status, body)) in run order."""
+        def user_body(user_id):
+            return {'name': f'User {user_id}', 'email': f'user{user_id}@example.com', 'age': 40,
+                    'gender': 'Female', 'phone_number': '555-0000'}
+
+        def logged_in(client, fn):
+            client.request('POST', '/login', {'email': f'user{self.user()}@example.com', 'password': 'password'})
+            return fn(client)
+
+        def appointment_put(client):
+            appointment_id = self.take('appointments')
+            if appointment_id is None:
+                return 404, None
+            result = client.request('PUT', f'/appointments/{appointment_id}', {**self.booking(), 'status': 'Completed'})
+            self.remember('appointments', result)
+            return result
+
+        def prescription_put(client):
+            prescription_id = self.take('prescriptions')
+            if prescription_id is None:
+                return 404, None
+            result = client.request('PUT', f'/prescriptions/{prescription_id}', self.prescription())
+            self.remember('prescriptions', result)
+            return result
+
+        def delete(kind):
+            def run(client):
+                object_id = self.take(kind)
+                return client.request('DELETE', f'/{kind}/{object_id}') if object_id else (404, None)
+            return run
+
+        hours = [{'weekday': day, 'start_time': '09:00', 'end_time': '17:00'} for day in range(5)]
+        ok = (200,)
+        return [
+            ('users_list', ok, lambda c: c.request('GET', '/users?limit=50')),
+            ('users_detail', ok, lambda c: c.request('GET', f'/users/{self.user()}')),
+            ('doctors_list', ok, lambda c: c.request('GET', f'/doctors?specialty={random.choice(SPECIALTIES)}')),
+            ('doctors_detail', ok, lambda c: c.request('GET', f'/doctors/{self.doctor()}?expand=working_hours')),
+            ('doctor_schedule', ok, lambda c: c.request('GET', f'/doctors/{self.doctor()}/schedule')),
+            ('availability', ok, lambda c: c.request('GET', f'/availability?specialty={random.choice(SPECIALTIES)}')),
+            ('doctor_availability', ok, lambda c: c.request('GET', f'/doctors/{self.doctor()}/availability?days=14')),
+            ('appointments_list', ok, lambda c: c.request('GET', f'/appointments?doctor_id={self.doctor()}')),
+            ('appointments_detail', ok,
+             lambda c: c.request('GET', f'/appointments/{random.randint(1, self.appointments)}?expand=prescriptions')),
+            ('user_calendar', ok, lambda c: c.request('GET', f'/appointments/user/{self.user()}')),
+            ('doctor_calendar', ok, lambda c: c.request('GET', f'/appointments/doctor/{self.doctor()}?date_from=2026-06-01')),
+            ('prescriptions_list', ok, lambda c: c.request('GET', '/prescriptions?medicine=Aspirin')),
+            ('prescriptions_detail', ok, lambda c: c.request('GET', f'/prescriptions/{random.randint(1, self.prescriptions)}')),
+            ('doctors_search', ok, lambda c: c.request('GET', f'/doctors/search?q={random.choice(LAST_NAMES)[:4]}')),
+            ('prescriptions_search', ok, lambda c: c.request('GET', f'/prescriptions/search?q={random.choice(MEDICINES)[:3]}')),
+            ('user_medications', ok, lambda c: c.request('GET', f'/users/{self.user()}/medications')),
+            ('medications_list', ok, lambda c: c.request('GET', f'/medications?medicine={random.choice(MEDICINES)}&current=1')),
+            ('appointments_export', ok, lambda c: c.request('GET', f'/appointments/export?doctor_id={self.doctor()}&limit=500')),
+            ('metrics', ok, lambda c: c.request('GET', '/metrics')),
+            ('login', ok, lambda c: c.request('POST', '/login', {'email': f'user{self.user()}@example.com', 'password': 'password'})),
+            ('doctor_login', ok, lambda c: c.request('POST', '/doctor_login', {'email': f'doctor{self.doctor()}@example.com', 'password': 'password'})),
+            ('check_session', ok, lambda c: logged_in(c, lambda c: c.request('GET', '/check_session'))),
+            ('logout', (204,), lambda c: c.request('DELETE', '/logout')),
+            ('clear_session', (204,), lambda c: c.request('DELETE', '/clear')),
+            ('signup', (201,), lambda c: c.request('POST', '/signup', {
+                **user_body(0), 'email': f'load{self.unique()}-{time.time_ns()}@example.com', 'password': 'password'})),
+            ('users_update', ok, lambda c: (lambda user_id: c.request('PUT', f'/users/{user_id}', user_body(user_id)))(self.user())),
+            ('doctors_create', (201,), lambda c: c.request('POST', '/doctors', {
+                'name': 'Dr. Load', 'email': f'load{self.unique()}-{time.time_ns()}@example.com', 'password': 'password',
+                'specialty': random.choice(SPECIALTIES), 'experience_years': 5, 'availability': 'Available'})),
+            ('doctor_schedule_update', ok,
+             lambda c: c.request('PUT', f'/doctors/{self.doctor()}/schedule', {'slot_minutes': SLOT_MINUTES, 'working_hours': hours})),
+            ('appointments_create', (201,), lambda c: (lambda result: self.remember('appointments', result) or result)(
+                c.request('POST', '/appointments', self.booking()))),
+            ('appointments_update', ok, appointment_put),
+            ('appointments_bulk', (201,), lambda c: c.request('POST', '/appointments/bulk', [self.booking() for _ in range(100)])),
+            ('prescriptions_create', (201,), lambda c: (lambda result: self.remember('prescriptions', result) or result)(
+                c.request('POST', '/prescriptions', self.prescription()))),
+            ('prescriptions_update', ok, prescription_put),
+            ('prescriptions_bulk', (201,), lambda c: c.request('POST', '/prescriptions/bulk', [self.prescription() for _ in range(100)])),
+            ('prescriptions_delete', (204,), delete('prescriptions')),
+            ('appointments_delete', (204,), delete('appointments')),
+        ]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))] * 1000, 3)
+
+
+def run_scenario(make_client, fn, expected, requests, threads):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+
+    def worker():
+        client = make_client()
+        local = []
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    break
+            started = time.perf_counter()
+            status, _ = fn(client)
+            local.append(time.perf_counter() - started)
+            if status not in expected:
+                with lock:
+                    errors.append(status)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_statuses': sorted(set(errors)),
+        'throughput': round(len(latencies) / elapsed, 1),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _change(new, old):
+    if not old or new is None:
+        return ''
+    return f'{(new - old) / old * 100:+.0f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--url', help='Drive a running server instead of the in-process app.')
+    parser.add_argument('--rounds', type=int, default=4, help='bcrypt cost for the in-process app (default 4).')
+    parser.add_argument('--only', help='Comma-separated scenario names to run.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Earlier results file to compare against.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    dataset = SCALES[args.scale]
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+        load_seconds = None
+    else:
+        app = scratch_app(BCRYPT_ROUNDS=args.rounds, HASHING_WORKERS=0)
+        with app.app_context():
+            load_seconds = round(generate(**dataset, seed=args.seed), 1)
+        make_client = lambda: TestClient(app)
+
+    workload = Workload(**dataset)
+    scenarios = workload.scenarios()
+    if args.only:
+        wanted = set(args.only.split(','))
+        scenarios = [scenario for scenario in scenarios if scenario[0] in wanted]
+
+    results = {}
+    print(f'{"scenario":<24}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}')
+    for name, expected, fn in scenarios:
+        result = results[name] = run_scenario(make_client, fn, expected, args.requests, args.threads)
+        print(f'{name:<24}{result["throughput"]:>9.1f}{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+              f'{result["p99_ms"]:>9.2f}{result["errors"]:>8}')
+
+    report = {
+        'meta': {
+            'commit': _commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'target': args.url or 'in-process',
+            'scale': args.scale,
+            'dataset': dataset,
+            'load_seconds': load_seconds,
+            'requests': args.requests,
+            'threads': args.threads,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f'\nagainst {previous["meta"].get("commit")} ({previous["meta"].get("timestamp")})')
+        print(f'{"scenario":<24}{"req/s":>9}{"p95 ms":>9}')
+        for name, result in results.items():
+            old = previous['results'].get(name)
+            if old:
+                print(f'{name:<24}{_change(result["throughput"], old["throughput"]):>9}'
+                      f'{_change(result["p95_ms"], old["p95_ms"]):>9}')
+
+
+if __name__ == '__main__':
+    main()
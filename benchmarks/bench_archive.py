@@ -0,0 +1,83 @@
+"""Read latency on the hot tables before and after archiving old appointments.
+
+    python benchmarks/bench_archive.py [appointments] [years] [repeat]
+
+datagen.generate() spreads ``appointments`` (and twice as many
+prescriptions) evenly over ``years`` years up to three months from now.
+Every endpoint below is timed through the test client with the cache off,
+median of ``repeat`` runs. Then everything older than ARCHIVE_AFTER_DAYS is
+archived and the same requests are timed again. Queries the indexes seek
+straight to barely change; those that sort or scan the table shrink with it.
+"""
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+from common import scratch_app
+
+from sqlalchemy import func
+
+from archive import archive
+from config import db
+from datagen import generate
+from models import Appointment, Prescription
+
+RECENT = (date.today() - timedelta(days=30)).isoformat()
+REQUESTS = [
+    ('all, first page', '/appointments?limit=50'),
+    ('by status', '/appointments?status=Cancelled&limit=50'),
+    ('doctor, recent', f'/appointments?doctor_id=7&date_from={RECENT}&limit=50'),
+    ('user calendar', f'/appointments/user/42?date_from={RECENT}'),
+    ('doctor calendar', f'/appointments/doctor/7?date_from={RECENT}&limit=50'),
+    ('prescriptions, by medicine', '/prescriptions?medicine=Insulin&limit=50'),
+    ('prescription search', '/prescriptions/search?q=insulin morning'),
+    ('doctor availability', '/doctors/7/availability?days=14'),
+]
+
+
+def median_ms(client, path, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(path)
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200, (path, response.status_code)
+    return statistics.median(samples) * 1000
+
+
+def sizes():
+    return [db.session.query(func.count()).select_from(model).scalar() for model in (Appointment, Prescription)]
+
+
+def main(appointments=200000, years=5, repeat=20):
+    app = scratch_app(CACHE_BACKEND='none', COMPRESS=False, HASHING_WORKERS=0, BCRYPT_ROUNDS=4)
+    days = years * 365
+    with app.app_context():
+        generate(users=20000, doctors=200, appointments=appointments, prescriptions=2 * appointments,
+                 start=date.today() - timedelta(days=days - 90), days=days)
+    client = app.test_client()
+    for _, path in REQUESTS:
+        client.get(path)
+    before = {label: median_ms(client, path, repeat) for label, path in REQUESTS}
+    with app.app_context():
+        hot_before = sizes()
+        cutoff = date.today() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+        started = time.perf_counter()
+        moved = archive(db.session, cutoff, app.config['ARCHIVE_BATCH_SIZE'])
+        elapsed = time.perf_counter() - started
+        hot_after = sizes()
+    for _, path in REQUESTS:
+        client.get(path)
+    after = {label: median_ms(client, path, repeat) for label, path in REQUESTS}
+
+    print(f'{years} years of history; archived {moved[0]} appointments and {moved[1]} prescriptions '
+          f'before {cutoff} in {elapsed:.1f} s ({sum(moved) / elapsed:.0f} rows/s)')
+    print(f'hot rows: appointments {hot_before[0]} -> {hot_after[0]}, prescriptions {hot_before[1]} -> {hot_after[1]}')
+    print(f'{"request":<28}{"before ms":>11}{"after ms":>10}{"speedup":>9}')
+    for label, _ in REQUESTS:
+        print(f'{label:<28}{before[label]:>11.2f}{after[label]:>10.2f}{before[label] / after[label]:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,51 @@
+"""Rows/second importing appointments one request at a time vs. through /appointments/bulk.
+
+    python benchmarks/bench_bulk.py [rows]
+"""
+import sys
+import time
+from datetime import date, timedelta
+
+from common import populate, scratch_app
+
+from config import db
+from models import Appointment
+
+
+def make_items(rows, first_day):
+    """Distinct hourly slots for 20 doctors, eight per working day."""
+    items = []
+    for i in range(rows):
+        slot = i // 20
+        items.append(dict(user_id=i % 100 + 1, doctor_id=i % 20 + 1,
+                          date=(first_day + timedelta(days=slot // 8)).isoformat(),
+                          time=f'{9 + slot % 8:02d}:00', status='Scheduled'))
+    return items
+
+
+def main(rows=2000):
+    bench_app = scratch_app()
+    with bench_app.app_context():
+        populate(users=100, doctors=20, appointments=0, prescriptions_per_appointment=0)
+    client = bench_app.test_client()
+
+    started = time.perf_counter()
+    for item in make_items(rows, date(2024, 1, 1)):
+        assert client.post('/appointments', json=item).status_code == 201
+    single = time.perf_counter() - started
+
+    items = make_items(rows, date(2025, 1, 1))
+    started = time.perf_counter()
+    response = client.post('/appointments/bulk', json=items)
+    bulk = time.perf_counter() - started
+    assert response.status_code == 201, response.json
+
+    with bench_app.app_context():
+        assert db.session.query(Appointment).count() == 2 * rows
+    print(f'{"path":<10}{"seconds":>10}{"rows/s":>12}')
+    print(f'{"single":<10}{single:>10.2f}{rows / single:>12.0f}')
+    print(f'{"bulk":<10}{bulk:>10.2f}{rows / bulk:>12.0f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
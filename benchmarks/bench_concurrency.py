@@ -0,0 +1,101 @@
+"""Mixed read/write load against SQLite under two engine profiles.
+
+    python benchmarks/bench_concurrency.py [threads] [seconds] [write_percent]
+
+Each worker thread loops for ``seconds``: reads fetch a page of one
+doctor's calendar through the read-only bind (as a GET handler would),
+writes book a fresh appointment and commit. "legacy" is a rollback-journal
+database with full fsync, the setup before the engine profile existed;
+"tuned" is the default profile from database.py.
+"""
+import itertools
+import random
+import sys
+import threading
+import time as clock
+from datetime import date, time, timedelta
+
+from common import SLOTS_PER_DAY, populate, scratch_app
+
+from sqlalchemy.exc import OperationalError
+
+from config import db
+from models import Appointment
+
+PROFILES = {
+    'legacy': dict(SQLITE_JOURNAL_MODE='DELETE', SQLITE_SYNCHRONOUS='FULL', SQLITE_MMAP_SIZE=0,
+                   SQLITE_CACHE_SIZE=2000),
+    'tuned': {},
+}
+DOCTORS = 20
+
+
+def run(settings, threads, seconds, write_percent):
+    app = scratch_app(DATABASE_POOL_SIZE=threads, **settings)
+    with app.app_context():
+        populate(users=200, doctors=DOCTORS, appointments=5000, prescriptions_per_appointment=0)
+
+    # Writes go to 2030 onwards, one distinct slot each, so they never collide
+    slots = itertools.count()
+    slots_lock = threading.Lock()
+    start_day = date(2030, 1, 1)
+    deadline = clock.perf_counter() + seconds
+    latencies = {'read': [], 'write': []}
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while clock.perf_counter() < deadline:
+            kind = 'write' if rng.randrange(100) < write_percent else 'read'
+            started = clock.perf_counter()
+            with app.app_context():
+                try:
+                    if kind == 'read':
+                        db.session.info['read_only'] = True
+                        (Appointment.query.filter_by(doctor_id=rng.randint(1, DOCTORS))
+                         .order_by(Appointment.date, Appointment.time, Appointment.id).limit(50).all())
+                    else:
+                        with slots_lock:
+                            slot = next(slots)
+                        db.session.add(Appointment(
+                            user_id=rng.randint(1, 200), doctor_id=slot % DOCTORS + 1,
+                            date=start_day + timedelta(days=slot // DOCTORS // SLOTS_PER_DAY),
+                            time=time(8 + slot // DOCTORS % SLOTS_PER_DAY // 2, 30 * (slot // DOCTORS % 2)),
+                            status='Scheduled'))
+                        db.session.commit()
+                except OperationalError as error:
+                    db.session.rollback()
+                    errors.append(str(error.orig))
+                    continue
+            latencies[kind].append(clock.perf_counter() - started)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def main(threads=8, seconds=5, write_percent=20):
+    print(f'{threads} threads, {seconds} s, {write_percent}% writes')
+    for name, settings in PROFILES.items():
+        latencies, errors = run(settings, threads, seconds, write_percent)
+        total = len(latencies['read']) + len(latencies['write'])
+        print(f'{name:>7}: {total / seconds:7.0f} ops/s  '
+              f"reads p50 {percentile(latencies['read'], .5):6.2f} ms p95 {percentile(latencies['read'], .95):6.2f} ms  "
+              f"writes p50 {percentile(latencies['write'], .5):6.2f} ms p95 {percentile(latencies['write'], .95):6.2f} ms  "
+              f'errors {len(errors)}')
+        for message in sorted(set(errors)):
+            print(f'         {message}')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
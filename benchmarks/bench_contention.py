@@ -0,0 +1,83 @@
+"""Concurrent read-modify-write on a few hot prescriptions, three ways.
+
+    python benchmarks/bench_contention.py [threads] [seconds] [rows]
+
+Every thread loops for ``seconds``: pick one of ``rows`` prescriptions,
+GET it, increment the counter kept in its ``instructions`` and PATCH it
+back. "blind" sends the PATCH unconditionally, as clients did before
+If-Match: concurrent increments overwrite each other and are lost.
+"coarse lock" serializes the whole GET + PATCH behind one lock, the usual
+workaround; here it is a threading.Lock, which only exists because the
+benchmark runs in one process. "if-match" sends the ETag it read and starts
+over on 409. Lost is successful increments minus what the counters actually
+went up by.
+"""
+import random
+import sys
+import threading
+import time
+
+from common import scratch_app
+
+from datagen import generate
+
+
+def run(strategy, threads, seconds, rows):
+    app = scratch_app(CACHE_BACKEND='none', COMPRESS=False)
+    with app.app_context():
+        generate(users=100, doctors=10, appointments=1000, prescriptions=1000)
+    setup = app.test_client()
+    for row in range(1, rows + 1):
+        assert setup.patch(f'/prescriptions/{row}', json={'instructions': '0'}).status_code == 200
+
+    lock = threading.Lock()
+    coarse = threading.Lock()
+    totals = {'writes': 0, 'conflicts': 0}
+    deadline = time.perf_counter() + seconds
+
+    def increment(client, row):
+        response = client.get(f'/prescriptions/{row}')
+        count = int(response.get_json()['instructions'])
+        headers = {'If-Match': response.headers['ETag']} if strategy == 'if-match' else {}
+        return client.patch(f'/prescriptions/{row}', json={'instructions': str(count + 1)}, headers=headers).status_code
+
+    def worker():
+        client = app.test_client()
+        writes = conflicts = 0
+        while time.perf_counter() < deadline:
+            row = random.randint(1, rows)
+            if strategy == 'coarse lock':
+                with coarse:
+                    status = increment(client, row)
+            else:
+                status = increment(client, row)
+            if status == 409:
+                conflicts += 1
+            else:
+                assert status == 200, status
+                writes += 1
+        with lock:
+            totals['writes'] += writes
+            totals['conflicts'] += conflicts
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    counted = sum(int(setup.get(f'/prescriptions/{row}').get_json()['instructions']) for row in range(1, rows + 1))
+    return totals['writes'] / elapsed, totals['conflicts'], totals['writes'] - counted
+
+
+def main(threads=8, seconds=5, rows=4):
+    print(f'{threads} threads, {rows} hot rows, {seconds} s each')
+    print(f'{"strategy":<14}{"writes/s":>10}{"conflicts":>11}{"lost":>7}')
+    for strategy in ('blind', 'coarse lock', 'if-match'):
+        rate, conflicts, lost = run(strategy, threads, seconds, rows)
+        print(f'{strategy:<14}{rate:>10.0f}{conflicts:>11}{lost:>7}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
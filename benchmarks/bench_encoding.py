@@ -0,0 +1,64 @@
+"""JSON encoding time and bytes on the wire per response body, before and after encoding.py.
+
+    python benchmarks/bench_encoding.py [repeat]
+
+The bodies are real responses from a scratch database filled by
+datagen.generate(). "flask-restful" is how they were encoded before:
+json.dumps with its default separators plus a newline. Encode times are
+milliseconds per body, best of five runs; the compression rows add the time
+to compress the orjson output on top of encoding it.
+"""
+import gzip
+import json
+import sys
+import timeit
+
+from common import scratch_app
+
+import orjson
+
+from datagen import generate
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BODIES = [
+    ('appointments, 500', '/appointments?limit=500'),
+    ('appointments, 200 expanded', '/appointments?limit=200&expand=prescriptions'),
+    ('doctors, 100 expanded', '/doctors?limit=100&expand=working_hours'),
+    ('prescriptions, 500', '/prescriptions?limit=500'),
+    ('one appointment', '/appointments/7'),
+]
+
+
+def encoders():
+    yield 'flask-restful (before)', lambda data: (json.dumps(data) + '\n').encode('utf-8')
+    yield 'stdlib, compact', lambda data: json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    yield 'orjson', lambda data: orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    for level in (1, 6):
+        yield f'orjson + gzip {level}', lambda data, level=level: gzip.compress(orjson.dumps(data), level, mtime=0)
+    if brotli is not None:
+        for quality in (4, 5):
+            yield f'orjson + br {quality}', lambda data, quality=quality: brotli.compress(orjson.dumps(data), quality=quality)
+
+
+def main(repeat=20):
+    app = scratch_app(CACHE_BACKEND='none', COMPRESS=False)
+    with app.app_context():
+        generate(users=1000, doctors=100, appointments=20000, prescriptions=40000)
+    client = app.test_client()
+    if brotli is None:
+        print('brotli is not installed; skipping the br rows')
+    for label, path in BODIES:
+        data = client.get(path).get_json()
+        print(f'\n{label} ({path})')
+        print(f'{"encoder":<26}{"ms/body":>9}{"bytes":>10}')
+        for name, encode in encoders():
+            best = min(timeit.repeat(lambda: encode(data), number=repeat, repeat=5)) / repeat
+            print(f'{name:<26}{best * 1000:>9.3f}{len(encode(data)):>10}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,63 @@
+"""Export throughput and peak memory: paging GET /appointments vs. the streaming export.
+
+    python benchmarks/bench_export.py [rows ...]
+
+Peak memory is measured with tracemalloc while the response body is
+consumed, so it covers the rows, the encoding and the compression. The
+streaming rows should stay flat as the table grows.
+"""
+import sys
+import time
+import tracemalloc
+
+from common import populate, scratch_app
+
+
+def measure(consume):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = consume()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def paged(client):
+    size, url = 0, '/appointments?limit=200'
+    while url:
+        response = client.get(url)
+        size += len(response.data)
+        link = response.headers.get('Link')
+        url = link[link.index('/appointments'):link.index('>')] if link else None
+    return size
+
+
+def streamed(client, query, headers=None):
+    response = client.get(f'/appointments/export?{query}', headers=headers or {}, buffered=False)
+    size = sum(len(chunk) for chunk in response.response)
+    response.close()
+    return size
+
+
+def main(*sizes):
+    for rows in sizes or (20000, 100000):
+        app = scratch_app(HASHING_WORKERS=0)
+        with app.app_context():
+            populate(users=1000, doctors=100, appointments=rows, prescriptions_per_appointment=0)
+        client = app.test_client()
+        print(f'{rows} appointments')
+        print(f'  {"path":<22}{"rows/s":>10}{"peak MiB":>10}{"MiB out":>10}')
+        cases = [('paged JSON', lambda: paged(client))] if rows <= 20000 else []
+        cases += [
+            ('export ndjson', lambda: streamed(client, 'format=ndjson')),
+            ('export csv', lambda: streamed(client, 'format=csv')),
+            ('export csv gzip', lambda: streamed(client, 'format=csv', {'Accept-Encoding': 'gzip'})),
+        ]
+        for name, consume in cases:
+            elapsed, peak, size = measure(consume)
+            print(f'  {name:<22}{rows / elapsed:>10.0f}{peak / 2 ** 20:>10.1f}{size / 2 ** 20:>10.1f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,76 @@
+"""Latency of a cheap endpoint (GET /doctors) while /login is being hammered.
+
+    python benchmarks/bench_login_storm.py [request_threads] [rounds]
+
+A fixed pool of request threads stands in for the WSGI server's workers.
+The login storm is submitted together with a trickle of directory reads,
+and directory latency is measured from submission to response, so time
+spent waiting for a free worker counts. Runs once with bcrypt inline on
+the request thread and once through the bounded hashing pool.
+"""
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import populate, scratch_app
+
+from config import db
+from hashing import hasher
+from models import User
+
+LOGINS = 400
+READS = 200
+
+
+def percentile(values, pct):
+    return statistics.quantiles(values, n=100)[pct - 1]
+
+
+def run(bench_app, request_threads, workers, max_pending):
+    hasher.configure(workers=workers, max_pending=max_pending)
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = bench_app.test_client()
+        return local.client
+
+    def login():
+        return client().post('/login', json={'email': 'user0@example.com', 'password': 'secret'}).status_code
+
+    def read(submitted):
+        client().get('/doctors')
+        return time.perf_counter() - submitted
+
+    with ThreadPoolExecutor(max_workers=request_threads) as server:
+        logins, reads = [], []
+        for i in range(LOGINS):
+            logins.append(server.submit(login))
+            if i % (LOGINS // READS) == 0:
+                reads.append(server.submit(read, time.perf_counter()))
+        statuses = [f.result() for f in logins]
+        latencies = [f.result() * 1000 for f in reads]
+
+    mode = 'inline' if not workers else f'pool({workers}, max_pending={max_pending})'
+    print(f'{mode:<28}{percentile(latencies, 50):>9.1f}{percentile(latencies, 99):>9.1f}'
+          f'{statuses.count(200):>8}{statuses.count(503):>8}')
+
+
+def main(request_threads=8, rounds=10):
+    bench_app = scratch_app()
+    hasher.configure(rounds=rounds, workers=0)
+    with bench_app.app_context():
+        populate(users=10, doctors=50, appointments=100)
+        user = db.session.get(User, 1)
+        user.password = 'secret'
+        db.session.commit()
+
+    print(f'{"hashing":<28}{"p50 ms":>9}{"p99 ms":>9}{"200":>8}{"503":>8}')
+    run(bench_app, request_threads, workers=0, max_pending=1)
+    run(bench_app, request_threads, workers=2, max_pending=2)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
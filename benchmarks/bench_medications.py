@@ -0,0 +1,115 @@
+"""Medication lookups: the patient_medications read model against walking appointments and prescriptions.
+
+    python benchmarks/bench_medications.py [users] [appointments] [repeat]
+
+datagen.generate() spreads ``appointments`` (two prescriptions each) over
+``users`` patients, so fewer users means longer histories. "A patient's
+medications" is every medicine one patient was prescribed, with the latest
+dosage. Before the read model that took the user's nested to_dict() (every
+appointment, its prescriptions and doctor) or GET /users/<id> expanded to
+appointments.prescriptions, folded by the caller. "Patients on a medicine"
+is every patient ever prescribed one; before, that meant paging through
+GET /prescriptions?medicine= expanded to the appointment. Each row is the
+median of ``repeat`` runs over different patients and medicines, through
+the test client with the cache off; queries are SQL statements per lookup.
+"""
+import statistics
+import sys
+import time
+from contextlib import ExitStack
+
+from common import QueryCounter, scratch_app
+
+from config import db
+from datagen import MEDICINES, generate
+from models import User
+
+
+def latest_per_medicine(appointments):
+    """What the caller had to compute from the nested appointments: the newest dosage of each medicine."""
+    latest = {}
+    for appointment in sorted(appointments, key=lambda a: (a['date'], a['time'])):
+        for prescription in appointment['prescriptions']:
+            latest[prescription['medicine']] = prescription['dosage']
+    return latest
+
+
+def nested_to_dict(app, client, user_id):
+    with app.app_context():
+        result = latest_per_medicine(db.session.get(User, user_id).to_dict()['appointments'])
+        db.session.remove()
+    return result
+
+
+def expanded_get(app, client, user_id):
+    body = client.get(f'/users/{user_id}?expand=appointments.prescriptions').get_json()
+    return latest_per_medicine(body['appointments'])
+
+
+def read_model(app, client, user_id):
+    return {row['medicine']: row['dosage'] for row in client.get(f'/users/{user_id}/medications').get_json()}
+
+
+def every_page(client, path):
+    rows, after = [], None
+    while True:
+        response = client.get(path + (f'&after={after}' if after else ''))
+        rows.extend(response.get_json())
+        after = response.headers.get('X-Next-Cursor')
+        if not after:
+            return rows
+
+
+def prescriptions_pages(app, client, medicine):
+    rows = every_page(client, f'/prescriptions?medicine={medicine}&expand=appointment&limit=200')
+    return {row['appointment']['user_id'] for row in rows}
+
+
+def medications_pages(app, client, medicine):
+    return {row['user_id'] for row in every_page(client, f'/medications?medicine={medicine}&limit=200')}
+
+
+def measure(app, client, engines, lookup, keys):
+    samples, queries = [], []
+    for key in keys:
+        # GETs read through the read bind, the ORM path through the primary
+        with ExitStack() as stack:
+            counters = [stack.enter_context(QueryCounter(engine)) for engine in engines]
+            started = time.perf_counter()
+            result = lookup(app, client, key)
+            samples.append(time.perf_counter() - started)
+        queries.append(sum(counter.count for counter in counters))
+    return statistics.median(samples) * 1000, statistics.median(queries), result
+
+
+def main(users=2000, appointments=100000, repeat=20):
+    app = scratch_app(CACHE_BACKEND='none', COMPRESS=False, BCRYPT_ROUNDS=4)
+    with app.app_context():
+        generate(users=users, doctors=100, appointments=appointments, prescriptions=2 * appointments)
+        engines = list(db.engines.values())
+    client = app.test_client()
+    patients = [1 + n * users // repeat for n in range(repeat)]
+    medicines = [MEDICINES[n % len(MEDICINES)] for n in range(repeat)]
+
+    print(f'{users} patients, {appointments} appointments, {2 * appointments} prescriptions '
+          f'(about {2 * appointments // users} per patient)')
+    print(f'{"lookup":<44}{"ms":>9}{"queries":>9}')
+    for label, lookup, keys in (
+            ("patient's medications, nested to_dict()", nested_to_dict, patients),
+            ("patient's medications, expanded GET", expanded_get, patients),
+            ("patient's medications, read model", read_model, patients),
+            ('patients on a medicine, prescription pages', prescriptions_pages, medicines[:max(1, repeat // 4)]),
+            ('patients on a medicine, read model pages', medications_pages, medicines[:max(1, repeat // 4)])):
+        for key in keys[:2]:
+            lookup(app, client, key)
+        ms, queries, _ = measure(app, client, engines, lookup, keys)
+        print(f'{label:<44}{ms:>9.2f}{queries:>9.0f}')
+
+    # The paths must agree on what they return
+    for user_id in patients[:3]:
+        assert nested_to_dict(app, client, user_id).keys() == read_model(app, client, user_id).keys()
+    assert prescriptions_pages(app, client, medicines[0]) == medications_pages(app, client, medicines[0])
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,76 @@
+"""Outbox cost on the booking path and dispatcher throughput.
+
+    python benchmarks/bench_outbox.py [bookings]
+
+Booking latency is POST /appointments with and without the outbox hook
+(the hook is detached for the baseline). Throughput drains the queued
+messages into a FileSink with no rate limit, in batches of 100 and 500.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from common import scratch_app
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+import outbox
+from config import db
+from datagen import DAY_START, SLOT_MINUTES, SLOTS_PER_DAY, generate
+from models import OutboxMessage
+
+
+def book(client, count, doctors, offset):
+    day = date.today() + timedelta(days=60)
+    days = [day + timedelta(days=n) for n in range(3650) if (day + timedelta(days=n)).weekday() < 5]
+    samples = []
+    for n in range(offset, offset + count):
+        slot = n // doctors
+        minute = DAY_START + slot % SLOTS_PER_DAY * SLOT_MINUTES
+        body = {'user_id': 1, 'doctor_id': n % doctors + 1, 'date': days[slot // SLOTS_PER_DAY].isoformat(),
+                'time': f'{minute // 60:02d}:{minute % 60:02d}', 'status': 'Scheduled'}
+        started = time.perf_counter()
+        response = client.post('/appointments', json=body)
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 201, response.get_json()
+    samples.sort()
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.95)] * 1000
+
+
+def main(bookings=2000):
+    path = os.path.join(tempfile.mkdtemp(prefix='good-doctor-outbox-'), 'outbox.ndjson')
+    app = scratch_app(HASHING_WORKERS=0, BCRYPT_ROUNDS=4, REMINDER_HOURS=24 * 3650, OUTBOX_FILE=path)
+    with app.app_context():
+        generate(users=100, doctors=50, appointments=0, prescriptions=0)
+    client = app.test_client()
+
+    print(f'{"POST /appointments":<24}{"p50 ms":>9}{"p95 ms":>9}')
+    event.remove(Session, 'after_flush', outbox._enqueue_appointment_changes)
+    p50, p95 = book(client, bookings, 50, 0)
+    print(f'{"without outbox":<24}{p50:>9.2f}{p95:>9.2f}')
+    event.listen(Session, 'after_flush', outbox._enqueue_appointment_changes)
+    p50, p95 = book(client, bookings, 50, bookings)
+    print(f'{"with outbox":<24}{p50:>9.2f}{p95:>9.2f}')
+
+    with app.app_context():
+        db.session.info['immediate'] = True
+        queued = db.session.query(func.count(OutboxMessage.id)).scalar()
+        print(f'\n{queued} messages queued (notification + reminder per booking)')
+        print(f'{"batch size":<24}{"msgs/s":>9}')
+        for batch_size in (100, 500):
+            db.session.query(OutboxMessage).update({'status': outbox.PENDING, 'attempts': 0,
+                                                    'available_at': OutboxMessage.created_at})
+            db.session.commit()
+            dispatcher = outbox.Dispatcher(outbox.make_sink(app.config), batch_size=batch_size, rate=0)
+            started = time.perf_counter()
+            while dispatcher.run_once():
+                pass
+            print(f'{batch_size:<24}{queued / (time.perf_counter() - started):>9.0f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
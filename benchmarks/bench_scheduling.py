@@ -0,0 +1,116 @@
+"""Availability at scale: index build time, free-slot search and booking checks.
+
+    python benchmarks/bench_scheduling.py [doctors] [days] [fill_percent]
+
+Every doctor works 09:00-17:00 on weekdays with 30-minute slots and
+``fill_percent`` of the slots over ``days`` days are booked. Free-slot search
+runs on the in-memory index, populated directly. Bookings are checked the way
+the endpoints check them, by scheduling.booking_conflicts against the same
+calendar written to a scratch database.
+"""
+import random
+import sys
+import time as clock
+from datetime import date, datetime, time, timedelta
+
+from common import scratch_app, timed
+from sqlalchemy import insert
+
+import analytics
+import medications
+from config import db
+from models import Appointment, Doctor, User, WorkingHours
+from scheduling import AvailabilityIndex, booking_conflicts
+
+SPECIALTIES = ['Cardiology', 'Neurology', 'Pediatrics', 'Dermatology', 'Oncology',
+               'Orthopedics', 'Psychiatry', 'Radiology', 'Urology', 'Ophthalmology']
+BATCH = 50000
+
+
+def write_calendar(doctors, bookings):
+    """The same doctors, hours and bookings as the index, as rows. Must run inside an app context."""
+    with analytics.bulk_load(db.session), medications.bulk_load(db.session):
+        _write_calendar(doctors, bookings)
+
+
+def _write_calendar(doctors, bookings):
+    db.session.execute(insert(User), [dict(name='User 1', email='user1@example.com', password_hash='x', age=40,
+                                           gender='Female', phone_number='555-0001')])
+    db.session.execute(insert(Doctor), [
+        dict(id=doctor_id, name=f'Dr. {doctor_id}', email=f'doctor{doctor_id}@example.com', password_hash='x',
+             specialty=SPECIALTIES[doctor_id % len(SPECIALTIES)], experience_years=10, availability='Available')
+        for doctor_id in range(1, doctors + 1)
+    ])
+    db.session.execute(insert(WorkingHours), [
+        dict(doctor_id=doctor_id, weekday=weekday, start_time=time(9), end_time=time(17))
+        for doctor_id in range(1, doctors + 1) for weekday in range(5)
+    ])
+    for start in range(0, len(bookings), BATCH):
+        db.session.execute(insert(Appointment), [
+            dict(user_id=1, doctor_id=doctor_id, date=day, time=slot, status='Scheduled')
+            for doctor_id, day, slot in bookings[start:start + BATCH]
+        ])
+    db.session.commit()
+
+
+def main(doctors=10000, days=90, fill_percent=30):
+    rng = random.Random(0)
+    index = AvailabilityIndex(max_age=float('inf'))
+    start = date(2026, 1, 5)
+    now = datetime.combine(start, time(0))
+    hours = {weekday: [(9 * 60, 17 * 60)] for weekday in range(5)}
+
+    started = clock.perf_counter()
+    index.clear()
+    bookings = []
+    for doctor_id in range(1, doctors + 1):
+        index.set_doctor(doctor_id, SPECIALTIES[doctor_id % len(SPECIALTIES)], 30, hours)
+        booked = index._doctors[doctor_id].booked
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            if day.weekday() >= 5:
+                continue
+            base = day.toordinal() * 1440
+            for minute in range(9 * 60, 17 * 60, 30):
+                if rng.randrange(100) < fill_percent:
+                    booked.append(base + minute)
+                    bookings.append((doctor_id, day, time(minute // 60, minute % 60)))
+    build = clock.perf_counter() - started
+    print(f'built {doctors} doctors x {days} days, {len(bookings)} bookings in {build:.1f} s')
+
+    specialty = SPECIALTIES[0]
+    for limit in (50, 500):
+        ms = timed(lambda: index.free_slots(specialty=specialty, start=start, days=7, limit=limit, now=now))
+        print(f'free slots, {specialty}, next 7 days, limit {limit}: {ms:.2f} ms')
+    ms = timed(lambda: index.free_slots(doctor_id=42, start=start, days=90, limit=500, now=now))
+    print(f'free slots, one doctor, 90 days: {ms:.2f} ms')
+
+    checks = [(rng.randint(1, doctors), start + timedelta(days=rng.randrange(days)), time(rng.randint(9, 16), 0))
+              for _ in range(100000)]
+    ms = timed(lambda: [index.add_booking(doctor, day, slot) or index.remove_booking(doctor, day, slot)
+                        for doctor, day, slot in checks[:10000]], repeat=1)
+    print(f'incremental book+release: {10000 / ms * 1000:.0f} per second')
+
+    bench_app = scratch_app()
+    with bench_app.app_context():
+        started = clock.perf_counter()
+        write_calendar(doctors, bookings)
+        print(f'wrote the calendar to the database in {clock.perf_counter() - started:.1f} s')
+
+        items = [(n, dict(user_id=1, doctor_id=doctor_id, date=day, time=slot, status='Scheduled'))
+                 for n, (doctor_id, day, slot) in enumerate(checks)]
+        # One booking per call, as POST /appointments checks it
+        singles, answers = items[:5000], []
+        ms = timed(lambda: answers.extend(booking_conflicts([item]) for item in singles), repeat=1)
+        refused = sum(map(bool, answers))
+        print(f'booking checks, one at a time: {len(singles) / ms * 1000:.0f} per second '
+              f'({refused / len(singles):.0%} refused)')
+        # A whole batch per call, as POST /appointments/bulk checks it
+        for size in (100, 1000, 10000):
+            ms = timed(lambda: booking_conflicts(items[:size]), repeat=3)
+            print(f'booking checks, batches of {size}: {size / ms * 1000:.0f} per second')
+        db.session.rollback()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
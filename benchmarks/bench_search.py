@@ -0,0 +1,78 @@
+"""Search latency: FTS5 endpoints vs. an unindexed ILIKE scan of the same columns.
+
+    python benchmarks/bench_search.py [doctors] [prescriptions] [repeat]
+
+Rows come from datagen.generate(). Each query is timed end to end through
+the test client for its first page of 20 and for the page after it; the
+scan column runs the equivalent ILIKE query directly, which is what the
+search replaces (and what clients did by downloading whole lists).
+"""
+import statistics
+import sys
+import time
+
+from common import scratch_app
+
+from sqlalchemy import and_, or_
+
+from config import db
+from datagen import generate
+from search import INDEXES, terms
+
+QUERIES = [
+    ('doctors', 'smi'),
+    ('doctors', 'john smi'),
+    ('doctors', 'cardio'),
+    ('doctors', 'dr'),
+    ('prescriptions', 'asp'),
+    ('prescriptions', 'insulin morning'),
+    ('prescriptions', 'take'),
+]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000, result
+
+
+def scan(table, text):
+    index = INDEXES[table]
+    model = index.model
+    matches = and_(*(or_(*(getattr(model, col).ilike(f'%{term}%') for col in index.columns))
+                     for term in terms(text)))
+    return db.session.query(model).filter(matches).order_by(model.id).limit(20).all()
+
+
+def count(table, text):
+    index = INDEXES[table]
+    query, _, _ = index.query(db.session, text)
+    return query.count()
+
+
+def main(doctors=50000, prescriptions=1000000, repeat=20):
+    app = scratch_app(HASHING_WORKERS=0, BCRYPT_ROUNDS=4)
+    with app.app_context():
+        started = time.perf_counter()
+        generate(users=10000, doctors=doctors, appointments=prescriptions // 2,
+                 prescriptions=prescriptions, days=3650)
+        print(f'{doctors} doctors, {prescriptions} prescriptions loaded in {time.perf_counter() - started:.0f} s\n')
+    client = app.test_client()
+
+    print(f'{"query":<34}{"matches":>9}{"page 1 ms":>11}{"page 2 ms":>11}{"ILIKE ms":>10}')
+    for table, text in QUERIES:
+        url = f'/{table}/search?q={text}&limit=20'
+        first, response = timed(lambda: client.get(url), repeat)
+        cursor = response.headers.get('X-Next-Cursor')
+        second = timed(lambda: client.get(f'{url}&after={cursor}'), repeat)[0] if cursor else float('nan')
+        with app.app_context():
+            matches = count(table, text)
+            baseline = timed(lambda: scan(table, text), max(1, repeat // 5))[0]
+        print(f'{table + ": " + text:<34}{matches:>9}{first:>11.2f}{second:>11.2f}{baseline:>10.1f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
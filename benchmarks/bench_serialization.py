@@ -0,0 +1,49 @@
+"""Compare SQL statements, time and payload size per list page.
+
+    python benchmarks/bench_serialization.py [page_size]
+
+Paths compared for each model:
+  to_dict    generic SerializerMixin output with lazy loads
+  serialize  same output, eager-loaded and precompiled
+  flat       the default API representation (no relationships)
+"""
+import json
+import sys
+
+from common import QueryCounter, populate, scratch_app, timed
+
+from config import db
+from models import User, Doctor, Appointment, Prescription
+from serializers import eager_options, serialize, view
+
+
+def main(page_size=50):
+    app = scratch_app()
+    with app.app_context():
+        populate(users=200, doctors=50, appointments=5000)
+        print(f'{"model":<14}{"path":<12}{"queries":>8}{"ms":>10}{"bytes":>10}')
+        for model in (User, Doctor, Appointment, Prescription):
+            def lazy():
+                db.session.expunge_all()
+                return [row.to_dict() for row in model.query.order_by(model.id).limit(page_size)]
+
+            def eager():
+                db.session.expunge_all()
+                query = model.query.options(*eager_options(model)).order_by(model.id).limit(page_size)
+                return [serialize(row) for row in query]
+
+            def flat():
+                db.session.expunge_all()
+                flat_view = view(model)
+                query = model.query.options(*flat_view.options).order_by(model.id).limit(page_size)
+                return [flat_view.serialize(row) for row in query]
+
+            assert lazy() == eager()
+            for name, fn in (('to_dict', lazy), ('serialize', eager), ('flat', flat)):
+                with QueryCounter(db.engine) as counter:
+                    size = len(json.dumps(fn()))
+                print(f'{model.__name__:<14}{name:<12}{counter.count:>8}{timed(fn):>10.1f}{size:>10}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,124 @@
+"""Throughput of the production server per worker configuration, over real HTTP.
+
+    python benchmarks/bench_server.py [--scale small] [--configs dev,1x1,1x4,2x4,4x4]
+                                      [--clients 16] [--duration 10] [--mix reads|mixed]
+
+Fills a scratch SQLite database with datagen.generate() once, then for each
+configuration starts a server on it, waits for /ready and drives it from
+``--clients`` client processes (one keep-alive connection each) for
+``--duration`` seconds. ``WxT`` is gunicorn with W worker processes of T
+threads (gunicorn.conf.py); ``dev`` is ``flask run``, the threaded Werkzeug
+development server. The clients run on the same machine and compete with the
+server for CPU, so compare configurations with each other rather than with
+figures from elsewhere.
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+
+from common import scratch_app
+
+from bench_api import ROOT, SCALES, HttpClient, Workload, percentile
+from datagen import generate
+
+READS = ['users_detail', 'doctors_list', 'doctors_detail', 'doctor_availability', 'appointments_list',
+         'appointments_detail', 'user_calendar', 'prescriptions_detail', 'doctors_search']
+WRITES = ['appointments_create', 'users_update']
+BOOKINGS_PER_CLIENT = 5000
+
+
+def command(config, port):
+    if config == 'dev':
+        return [sys.executable, '-m', 'flask', 'run', '--port', str(port)], {}
+    workers, threads = config.split('x')
+    return ([sys.executable, '-m', 'gunicorn', 'app:app'],
+            {'WEB_BIND': f'127.0.0.1:{port}', 'WEB_CONCURRENCY': workers, 'WEB_THREADS': threads})
+
+
+def wait_ready(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with status {process.returncode}')
+        try:
+            if HttpClient(url).request('GET', '/ready')[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('server did not become ready')
+
+
+def client(args):
+    url, names, scale, duration, seed = args
+    random.seed(seed)
+    scenarios = {name: fn for name, _, fn in Workload(**scale, first=seed * BOOKINGS_PER_CLIENT).scenarios()}
+    fns = [scenarios[name] for name in names]
+    connection = HttpClient(url)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    while True:
+        started = time.perf_counter()
+        if started >= deadline:
+            break
+        status, _ = random.choice(fns)(connection)
+        latencies.append(time.perf_counter() - started)
+        errors += status >= 400
+    return latencies, errors
+
+
+def measure(config, database_url, port, names, scale, clients, duration, seeds):
+    argv, env = command(config, port)
+    env = {**os.environ, **env, 'DATABASE_URL': database_url, 'FLASK_APP': 'app.py', 'BCRYPT_ROUNDS': '4',
+           'RATE_LIMIT_BACKEND': 'none', 'ADMISSION_LIMIT': '0'}
+    process = subprocess.Popen(argv, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        wait_ready(url, process)
+        # Warm every worker's caches and connection pools before timing
+        with multiprocessing.Pool(clients) as pool:
+            pool.map(client, [(url, names, scale, 1, next(seeds)) for _ in range(clients)])
+            results = pool.map(client, [(url, names, scale, duration, next(seeds)) for _ in range(clients)])
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+    latencies = sorted(latency for samples, _ in results for latency in samples)
+    return (len(latencies) / duration, sum(errors for _, errors in results),
+            percentile(latencies, 0.50), percentile(latencies, 0.95), percentile(latencies, 0.99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--configs', default='dev,1x1,1x4,2x4,4x4')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--mix', choices=['reads', 'mixed'], default='reads')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    scale = SCALES[args.scale]
+    app = scratch_app()
+    with app.app_context():
+        generate(**scale)
+    database_url = app.config['DATABASE_URL']
+    names = READS + WRITES if args.mix == 'mixed' else READS
+    seeds = itertools.count()
+
+    print(f'{os.cpu_count()} CPUs, {args.scale} dataset, {args.mix}, {args.clients} clients, {args.duration:g} s each')
+    print(f'{"server":<16}{"req/s":>9}{"errors":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}')
+    for config in args.configs.split(','):
+        rate, errors, p50, p95, p99 = measure(config, database_url, args.port, names, scale,
+                                              args.clients, args.duration, seeds)
+        label = 'flask run' if config == 'dev' else f'gunicorn {config}'
+        print(f'{label:<16}{rate:>9.0f}{errors:>8}{p50:>9.2f}{p95:>9.2f}{p99:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""/check_session throughput per session store.
+
+    python benchmarks/bench_sessions.py [sessions] [requests]
+
+Logs ``sessions`` users in (one test client each) and then requests
+/check_session round-robin across them. The baseline is what every page
+load cost before the session store: reading the principal's row,
+measured as GET /users/<id> with the response cache off.
+"""
+import statistics
+import sys
+import time
+
+from common import scratch_app
+
+from datagen import PASSWORD, generate
+from models import User
+
+
+def measure(clients, url, requests):
+    samples = []
+    for n in range(requests):
+        client, path = clients[n % len(clients)]
+        started = time.perf_counter()
+        response = client.get(url or path)
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+    samples.sort()
+    return len(samples) / sum(samples), statistics.median(samples) * 1000, samples[int(len(samples) * 0.95)] * 1000
+
+
+def login(backend, sessions):
+    app = scratch_app(HASHING_WORKERS=0, BCRYPT_ROUNDS=4, CACHE_BACKEND='none', SESSION_BACKEND=backend)
+    with app.app_context():
+        generate(users=max(sessions, 1000), doctors=10, appointments=0, prescriptions=0)
+        emails = [email for email, in User.query.with_entities(User.email).order_by(User.id).limit(sessions)]
+    clients = []
+    for n, email in enumerate(emails, 1):
+        client = app.test_client()
+        assert client.post('/login', json={'email': email, 'password': PASSWORD}).status_code == 200
+        clients.append((client, f'/users/{n}'))
+    return clients
+
+
+def main(sessions=200, requests=5000):
+    print(f'{"":<28}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}')
+    clients = login('database', sessions)
+    rate, p50, p95 = measure(clients, None, requests)
+    print(f'{"row lookup (baseline)":<28}{rate:>9.0f}{p50:>9.3f}{p95:>9.3f}')
+    for backend in ('database', 'memory'):
+        clients = login(backend, sessions)
+        rate, p50, p95 = measure(clients, '/check_session', requests)
+        print(f'{"check_session, " + backend:<28}{rate:>9.0f}{p50:>9.3f}{p95:>9.3f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,93 @@
+"""Worker boot cost: import time, create_app() and the first request.
+
+    python benchmarks/bench_startup.py [repeat]
+
+Each cold measurement runs in a fresh interpreter. The fork rows compare
+a worker that builds the app after fork with one forked from a parent
+that already built it, which is what ``gunicorn --preload`` does.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import scratch_app
+
+from config import create_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPETS = {
+    'interpreter': 'pass',
+    'import config': 'import config',
+    'create_app(resources=False)': 'from config import create_app; create_app(resources=False)',
+    'create_app()': 'from config import create_app; create_app()',
+}
+
+
+def cold(code, repeat):
+    """Median wall-clock of running ``code`` in a new interpreter, in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def slowest_imports(code, count=8):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # top-level imports only
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def forked(setup, request, repeat):
+    """Median time for a forked child to run ``setup()`` and serve one request, in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        read, write = os.pipe()
+        started = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            app = setup()
+            app.test_client().get(request)
+            os.write(write, b'x')
+            os._exit(0)
+        os.close(write)
+        os.read(read, 1)
+        samples.append(time.perf_counter() - started)
+        os.close(read)
+        os.waitpid(pid, 0)
+    return statistics.median(samples) * 1000
+
+
+def main(repeat=5):
+    print(f'{"cold start":<32}{"ms":>8}')
+    for name, code in SNIPPETS.items():
+        print(f'{name:<32}{cold(code, repeat):>8.0f}')
+
+    print('\nslowest top-level imports for create_app() (cumulative ms)')
+    for micros, name in slowest_imports(SNIPPETS['create_app()']):
+        print(f'  {name:<30}{micros / 1000:>8.1f}')
+
+    if not hasattr(os, 'fork'):
+        return
+    preloaded = scratch_app(HASHING_WORKERS=0)
+    url = preloaded.config['DATABASE_URL']
+    print(f'\n{"fork + first GET /doctors":<32}{"ms":>8}')
+    print(f'{"create_app() after fork":<32}'
+          f'{forked(lambda: create_app({"DATABASE_URL": url, "HASHING_WORKERS": 0}), "/doctors", repeat):>8.1f}')
+    print(f'{"preloaded (--preload)":<32}{forked(lambda: preloaded, "/doctors", repeat):>8.1f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,64 @@
+"""Validation overhead per request body: schemas.py against the ad-hoc parsing it replaced.
+
+    python benchmarks/bench_validation.py [repeat]
+
+"ad hoc" is what the handlers did before: index the dict and strptime the
+date and time, with no type or range checks at all. Times are microseconds
+per body, best of five runs.
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schemas import APPOINTMENT, SIGNUP, USER, ValidationError
+
+APPOINTMENT_BODY = {'user_id': 17, 'doctor_id': 4, 'date': '2030-03-14', 'time': '10:30', 'status': 'Scheduled'}
+SIGNUP_BODY = {'name': 'Ada Moreau', 'email': 'ada@example.com', 'password': 'correct horse',
+               'age': 36, 'gender': 'Female', 'phone_number': '555-0100'}
+INVALID_BODY = {'user_id': '17', 'doctor_id': 4, 'date': '14/03/2030', 'status': ''}
+
+
+def ad_hoc_appointment(data):
+    return {
+        'user_id': data['user_id'],
+        'doctor_id': data['doctor_id'],
+        'date': datetime.strptime(data['date'], '%Y-%m-%d').date(),
+        'time': datetime.strptime(data['time'], '%H:%M').time(),
+        'status': data['status'],
+    }
+
+
+def ad_hoc_signup(data):
+    return {name: data[name] for name in ('name', 'email', 'password', 'age', 'gender', 'phone_number')}
+
+
+def invalid(data):
+    try:
+        APPOINTMENT.load(data)
+    except ValidationError as e:
+        return e.errors
+
+
+CASES = [
+    ('appointment, ad hoc', lambda: ad_hoc_appointment(APPOINTMENT_BODY)),
+    ('appointment, schema', lambda: APPOINTMENT.load(APPOINTMENT_BODY)),
+    ('appointment PATCH, schema', lambda: APPOINTMENT.load({'status': 'Completed'}, partial=True)),
+    ('appointment invalid, schema', lambda: invalid(INVALID_BODY)),
+    ('signup, ad hoc', lambda: ad_hoc_signup(SIGNUP_BODY)),
+    ('signup, schema', lambda: SIGNUP.load(SIGNUP_BODY)),
+    ('user PATCH, schema', lambda: USER.load({'phone_number': '555-0199'}, partial=True)),
+]
+
+
+def main(repeat=100000):
+    print(f'{"body":<32}{"us/body":>9}')
+    for label, fn in CASES:
+        best = min(timeit.repeat(fn, number=repeat, repeat=5)) / repeat
+        print(f'{label:<32}{best * 1e6:>9.2f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,100 @@
+"""Shared setup for the benchmark scripts.
+
+Benchmarks never touch instance/app.db: each run gets a throwaway SQLite
+file in a temporary directory.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta, time as dtime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, insert
+
+from config import create_app, db
+from models import User, Doctor, Appointment, Prescription
+
+
+def scratch_app(**settings):
+    """Full app on a fresh SQLite file with the production engine profile, adjusted by ``settings``.
+
+    Rate limiting and admission control are off unless ``settings`` turn them
+    on: a benchmark is one client asking for far more than any real one.
+    """
+    path = os.path.join(tempfile.mkdtemp(prefix='good-doctor-bench-'), 'bench.db')
+    app = create_app({'DATABASE_URL': f'sqlite:///{path}', 'RATE_LIMIT_BACKEND': 'none', 'ADMISSION_LIMIT': 0,
+                      **settings})
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+SLOTS_PER_DAY = 18  # 08:00-17:00 in 30-minute steps
+
+
+def _insert(model, rows):
+    if rows:
+        db.session.execute(insert(model), rows)
+
+
+def populate(users=100, doctors=20, appointments=1000, prescriptions_per_appointment=2, seed=0):
+    """Bulk-insert sample rows. Must run inside an app context."""
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    _insert(User, [
+        dict(name=f'User {i}', email=f'user{i}@example.com', password_hash='x',
+             age=rng.randint(18, 90), gender=rng.choice(['Female', 'Male']), phone_number=f'555-{i:04d}')
+        for i in range(users)
+    ])
+    _insert(Doctor, [
+        dict(name=f'Dr. {i}', email=f'doctor{i}@example.com', password_hash='x',
+             specialty=rng.choice(['Cardiology', 'Neurology', 'Pediatrics', 'Dermatology']),
+             experience_years=rng.randint(1, 40), availability='Available')
+        for i in range(doctors)
+    ])
+    # Distinct (doctor, day, half-hour slot) triples, since a doctor cannot be double-booked
+    slots = rng.sample(range(doctors * 366 * SLOTS_PER_DAY), appointments)
+    _insert(Appointment, [
+        dict(user_id=rng.randint(1, users), doctor_id=slot // (366 * SLOTS_PER_DAY) + 1,
+             date=start + timedelta(days=slot // SLOTS_PER_DAY % 366),
+             time=dtime(8 + slot % SLOTS_PER_DAY // 2, 30 * (slot % 2)),
+             status=rng.choice(['Scheduled', 'Completed', 'Cancelled']))
+        for slot in slots
+    ])
+    _insert(Prescription, [
+        dict(appointment_id=a, medicine=rng.choice(['Aspirin', 'Ibuprofen', 'Amoxicillin', 'Metformin']),
+             dosage='1 pill', instructions='Take after meal')
+        for a in range(1, appointments + 1) for _ in range(prescriptions_per_appointment)
+    ])
+    db.session.commit()
+
+
+class QueryCounter:
+    """Count SQL statements sent to the engine while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def timed(fn, repeat=5):
+    """Best wall-clock time of ``repeat`` runs, in milliseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
@@ -0,0 +1,179 @@
+# Batch import helpers: parse JSON arrays or NDJSON, validate in one pass,
+# write in chunks inside a single transaction
+import json
+from itertools import groupby
+
+from flask import request
+from sqlalchemy import bindparam, insert, update
+
+from config import db
+from conditional import touch
+from models import utcnow
+from schemas import integer
+
+CHUNK_SIZE = 500
+MAX_ITEMS = 10000
+_id = integer(1)
+
+
+class BulkError(ValueError):
+    """Raised when a batch body cannot be read at all."""
+
+
+def read_items():
+    """Read a JSON array, or one JSON object per line for application/x-ndjson."""
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for number, line in enumerate(request.stream, 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                raise BulkError(f'Invalid JSON on line {number}')
+            if len(items) > MAX_ITEMS:
+                break
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            raise BulkError('Expected a JSON array')
+    if len(items) > MAX_ITEMS:
+        raise BulkError(f'At most {MAX_ITEMS} items per request')
+    return items
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _existing_ids(model, ids):
+    found = set()
+    for chunk in _chunks(sorted(ids)):
+        found.update(db.session.scalars(db.select(model.id).where(model.id.in_(chunk))))
+    return found
+
+
+def _check_references(valid, references, results):
+    """Drop rows pointing at missing parents; one IN query per referenced table."""
+    for column, model in references.items():
+        wanted = {values[column] for _, values in valid if column in values}
+        missing = wanted - _existing_ids(model, wanted)
+        if not missing:
+            continue
+        for index, values in valid:
+            if values.get(column) in missing:
+                results[index] = {'index': index, 'status': 400, 'errors': {column: 'does not exist'}}
+        valid = [(index, values) for index, values in valid if index not in results]
+    return valid
+
+
+def _check_conflicts(valid, check, results):
+    """Drop rows ``check`` refuses, as 409s; ``check(valid)`` returns ``{index: reason}``."""
+    if check is None or not valid:
+        return valid
+    for index, reason in check(valid).items():
+        results[index] = {'index': index, 'status': 409, 'error': reason}
+    return [(index, values) for index, values in valid if index not in results]
+
+
+def reference_errors(values, references):
+    """``{column: 'does not exist'}`` for a parent one row names that is missing, or None."""
+    results = {}
+    _check_references([(0, values)], references, results)
+    return results[0]['errors'] if results else None
+
+
+def _finish(results, success_status):
+    ordered = [results[index] for index in sorted(results)]
+    failed = any(result['status'] != success_status for result in ordered)
+    return {'results': ordered}, 207 if failed else success_status
+
+
+def bulk_create(model, items, schema, references, after_write=None, check=None):
+    """Insert every valid item in one transaction and report per-item results.
+
+    ``check(valid)`` can refuse items that are valid on their own, e.g. double
+    bookings; it runs inside the transaction, after the reference check.
+    ``after_write(ids)`` runs inside the transaction, before the commit.
+    """
+    results, valid = {}, []
+    for index, item in enumerate(items):
+        values, errors = schema.validate(item)
+        if errors:
+            results[index] = {'index': index, 'status': 400, 'errors': errors}
+        else:
+            valid.append((index, values))
+    valid = _check_references(valid, references, results)
+    valid = _check_conflicts(valid, check, results)
+
+    statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+    for chunk in _chunks(valid):
+        ids = db.session.scalars(statement, [values for _, values in chunk]).all()
+        for (index, _), new_id in zip(chunk, ids):
+            results[index] = {'index': index, 'status': 201, 'id': new_id}
+    if valid:
+        touch(db.session, {model.__tablename__})
+        if after_write:
+            after_write([results[index]['id'] for index, _ in valid])
+    db.session.commit()
+    return _finish(results, 201)
+
+
+def bulk_update(model, items, schema, references, after_write=None, check=None, before_write=None):
+    """Apply partial updates keyed by ``id`` in one transaction; ``check`` and ``after_write`` as for bulk_create.
+
+    ``before_write(ids)`` runs once the batch has been checked, before any
+    row changes, to record what the rows were.
+    """
+    results, valid, seen = {}, [], set()
+    for index, item in enumerate(items):
+        values, errors = schema.validate(item, partial=True)
+        if values is not None:
+            if not values and not errors:
+                errors['item'] = 'has no fields to update'
+            try:
+                values['id'] = _id(item.get('id'))
+            except ValueError:
+                errors['id'] = 'is required'
+            else:
+                # A conflict check compares each item with its row as stored
+                if check is not None and values['id'] in seen:
+                    errors['id'] = 'appears more than once in the batch'
+                seen.add(values['id'])
+        if errors:
+            results[index] = {'index': index, 'status': 400, 'errors': errors}
+        else:
+            valid.append((index, values))
+
+    existing = _existing_ids(model, {values['id'] for _, values in valid})
+    for index, values in valid:
+        if values['id'] not in existing:
+            results[index] = {'index': index, 'status': 404, 'errors': {'id': 'not found'}}
+    valid = [(index, values) for index, values in valid if index not in results]
+    valid = _check_references(valid, references, results)
+    valid = _check_conflicts(valid, check, results)
+
+    # Table-level statements: the ORM's bulk UPDATE would check each row's
+    # version_id_col one statement at a time. Consecutive items that set the
+    # same fields share one executemany, which also bumps the version the flush
+    # hook would; the statements keep request order, as the conflict check did
+    if valid and before_write:
+        before_write([values['id'] for _, values in valid])
+    table = model.__table__
+    now = utcnow()
+    for names, group in groupby(valid, key=lambda item: tuple(sorted(item[1]))):
+        group = list(group)
+        fields = [name for name in names if name != 'id']
+        statement = update(table).where(table.c.id == bindparam('_id')).values(
+            **{name: bindparam(f'_{name}') for name in fields}, version=table.c.version + 1, updated_at=now)
+        for chunk in _chunks(group):
+            db.session.execute(statement, [{f'_{name}': values[name] for name in names} for _, values in chunk])
+            for index, values in chunk:
+                results[index] = {'index': index, 'status': 200, 'id': values['id']}
+    if valid:
+        touch(db.session, {model.__tablename__})
+        if after_write:
+            after_write([values['id'] for _, values in valid])
+    db.session.commit()
+    return _finish(results, 200)
@@ -0,0 +1,176 @@
+# Read-through cache for serialized representations, invalidated on commit
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from metrics import registry
+
+LOOKUPS = registry.counter('cache_lookups_total', 'Cache lookups, by result: hit or miss.', ('result',))
+
+
+class LRUBackend:
+    """In-process LRU with per-entry expiry. Counters are kept apart and never evicted."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def counters(self, names):
+        with self._lock:
+            return [self._counters.get(name, 0) for name in names]
+
+    def incr(self, names):
+        with self._lock:
+            for name in names:
+                self._counters[name] = self._counters.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared backend for multi-process deployments; needs the optional ``redis`` package."""
+
+    def __init__(self, url, prefix='good-doctor:'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        raw = self._client.get(self._prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def counters(self, names):
+        values = self._client.mget([self._prefix + 'gen:' + name for name in names])
+        return [int(value) if value is not None else 0 for value in values]
+
+    def incr(self, names):
+        pipeline = self._client.pipeline()
+        for name in names:
+            pipeline.incr(self._prefix + 'gen:' + name)
+        pipeline.execute()
+
+    def clear(self):
+        for key in self._client.scan_iter(self._prefix + '*'):
+            self._client.delete(key)
+
+    def __len__(self):
+        return sum(1 for _ in self._client.scan_iter(self._prefix + '*'))
+
+
+class Cache:
+    """Generation-keyed read-through cache.
+
+    Every key embeds the current generation of the rows and tables it was
+    built from (``doctor:3``, ``appointments`` ...). A commit that touches
+    one of them bumps its generation, so stale entries simply stop being
+    addressed and age out; nothing has to enumerate or delete keys. The
+    generations are per process with the in-process backend, so callers
+    that must see other processes' writes also put a version read from the
+    database in the suffix (the resources use the ETag).
+    """
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend or LRUBackend()
+        self.ttl = ttl
+        self.enabled = True
+
+    def configure(self, backend=None, ttl=None, enabled=None):
+        if backend is not None:
+            self.backend = backend
+        if ttl is not None:
+            self.ttl = ttl
+        if enabled is not None:
+            self.enabled = enabled
+
+    def key(self, prefix, generations, suffix=''):
+        values = self.backend.counters(generations)
+        stamp = '.'.join(f'{name}={value}' for name, value in zip(generations, values))
+        return f'{prefix}|{stamp}|{suffix}'
+
+    def get_or_set(self, prefix, generations, suffix, build):
+        """Return the cached value for the key, or store what ``build()`` returns.
+
+        ``build`` may return None to signal "do not cache" (e.g. a 404).
+        """
+        if not self.enabled:
+            return build()
+        key = self.key(prefix, generations, suffix)
+        value = self.backend.get(key)
+        if value is not None:
+            LOOKUPS.inc(('hit',))
+            return value
+        LOOKUPS.inc(('miss',))
+        value = build()
+        if value is not None:
+            self.backend.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, *names):
+        if names:
+            self.backend.incr(sorted(set(names)))
+
+
+cache = Cache()
+
+
+def _touched(obj):
+    """Generation names a change to ``obj`` makes stale.
+
+    Expanded representations are keyed on the generations of every table
+    they embed, so related rows only need their table bumped.
+    """
+    return [obj.__tablename__, f'{type(obj).__name__.lower()}:{obj.id}']
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_invalidations(session, flush_context):
+    names = session.info.setdefault('cache_invalidations', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if hasattr(obj, '__tablename__'):
+            names.update(_touched(obj))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_invalidations(session):
+    names = session.info.pop('cache_invalidations', None)
+    if names:
+        cache.invalidate(*names)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('cache_invalidations', None)
@@ -0,0 +1,172 @@
+# Conditional GET: strong ETags and Last-Modified from row versions and
+# per-table change tokens, so unchanged resources answer 304 unserialized
+import hashlib
+import logging
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from flask import request
+from sqlalchemy import event, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from config import db
+from models import ChangeToken, utcnow
+
+_UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+logger = logging.getLogger(__name__)
+
+
+def bump_tokens(connection, tables):
+    """Advance the change token of each table on ``connection``."""
+    if not tables:
+        return
+    now = utcnow()
+    insert = _UPSERTS.get(connection.dialect.name)
+    table = ChangeToken.__table__
+    for name in sorted(tables):
+        if insert is not None:
+            statement = insert(table).values(table_name=name, version=1, updated_at=now)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.table_name],
+                set_={'version': table.c.version + 1, 'updated_at': now})
+            connection.execute(statement)
+        else:
+            result = connection.execute(update(table).where(table.c.table_name == name)
+                                        .values(version=table.c.version + 1, updated_at=now))
+            if not result.rowcount:
+                connection.execute(table.insert().values(table_name=name, version=1, updated_at=now))
+
+
+def touch(session, tables):
+    """Advance the change tokens of ``tables`` once ``session`` commits; for
+    rows written with statements that bypass the flush."""
+    session.info.setdefault('changed_tables', set()).update(tables)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_tables(session, flush_context):
+    changed = [*session.new, *session.deleted, *(obj for obj in session.dirty if session.is_modified(obj))]
+    touch(session, {obj.__tablename__ for obj in changed if hasattr(obj, '__tablename__')})
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_collection_tokens(session):
+    # In a transaction of its own: bumped inside the write, the token row
+    # would stay locked until commit and serialize every writer to the table
+    # on PostgreSQL. Until this commits too, a list can be read with the new
+    # rows under the old token; the next read after it gets a fresh ETag.
+    tables = session.info.pop('changed_tables', None)
+    if not tables:
+        return
+    try:
+        with session.get_bind().begin() as connection:
+            bump_tokens(connection, tables)
+    except SQLAlchemyError:
+        # The write is committed; failing its request would invite a retry
+        logger.exception('Failed to advance the change tokens of %s', ', '.join(sorted(tables)))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+
+def _tokens(tables):
+    rows = db.session.query(ChangeToken.table_name, ChangeToken.version, ChangeToken.updated_at).filter(
+        ChangeToken.table_name.in_(tables))
+    return {name: (version, updated_at) for name, version, updated_at in rows}
+
+
+def _etag(*parts, version=None):
+    digest = hashlib.sha1('|'.join(map(str, parts)).encode('utf-8')).hexdigest()[:20]
+    # Row ETags lead with the row version, so If-Match maps onto a WHERE clause
+    return f'"{version}.{digest}"' if version is not None else f'"{digest}"'
+
+
+def collection_validators(model, view):
+    """ETag and Last-Modified for a list of ``model`` in the given view."""
+    # Read models written by triggers change with the tables they derive from
+    tables = (*getattr(model, 'derived_from', (model.__tablename__,)), *view.tables)
+    tokens = _tokens(tables)
+    versions = [tokens.get(name, (0, None))[0] for name in tables]
+    stamps = [stamp for _, stamp in tokens.values() if stamp is not None]
+    return (_etag(request.path, request.query_string.decode(), *tables, *versions),
+            max(stamps) if stamps else None)
+
+
+def row_validators(model, object_id, view):
+    """ETag and Last-Modified for one row, or None when it does not exist."""
+    row = db.session.query(model.version, model.updated_at).filter(model.id == object_id).first()
+    if row is None:
+        return None
+    version, updated_at = row
+    stamps = [updated_at]
+    parts = [model.__tablename__, object_id, version, request.query_string.decode()]
+    if view.tables:
+        # Expanded relationships change with their own tables
+        tokens = _tokens(view.tables)
+        parts.extend(tokens.get(name, (0, None))[0] for name in view.tables)
+        stamps.extend(stamp for _, stamp in tokens.values() if stamp is not None)
+    return _etag(*parts, version=version), max(stamps)
+
+
+def row_etag(model, object_id, version):
+    """ETag of the plain representation of a row at ``version``, e.g. for a write's response."""
+    return _etag(model.__tablename__, object_id, version, '', version=version)
+
+
+def _strong(tag):
+    """``tag`` without its weakness indicator, W/"x" being compared as "x"."""
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def if_match_versions():
+    """Row versions named by the request's If-Match, or None when any version will do.
+
+    The set is empty when no tag is a row ETag, which no row can match.
+    Weak tags count: compression is what weakens them (see encoding.py).
+    """
+    header = request.headers.get('If-Match')
+    if header is None:
+        return None
+    versions = set()
+    for tag in header.split(','):
+        tag = _strong(tag)
+        if tag == '*':
+            return None
+        version, dot, _ = tag.strip('"').partition('.')
+        if dot and version.isdigit():
+            versions.add(int(version))
+    return versions
+
+
+def validator_headers(validators):
+    etag, last_modified = validators
+    headers = {'ETag': etag}
+    if last_modified is not None:
+        # Timestamps are stored as naive UTC
+        stamp = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+        headers['Last-Modified'] = format_datetime(stamp, usegmt=True)
+    return headers
+
+
+def not_modified(validators):
+    """Whether the request's If-None-Match / If-Modified-Since match ``validators``."""
+    etag, last_modified = validators
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        # Weak comparison: a compressed response carries the weak form of the ETag
+        candidates = {_strong(tag) for tag in if_none_match.split(',')}
+        return '*' in candidates or etag in candidates
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return False
+        return last_modified.replace(microsecond=0) <= since
+    return False
@@ -1,31 +1,148 @@
 # Standard library imports
+import importlib
+import os
+from datetime import timedelta
 
 # Remote library imports
 from flask import Flask
 from flask_cors import CORS
 from flask_migrate import Migrate
-from flask_restful import Api
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import MetaData
+from sqlalchemy.engine import make_url
 
 # Local imports
-
-# Instantiate app, set attributes
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.json.compact = False
+import database
 
 # Define metadata, instantiate db
 metadata = MetaData(naming_convention={
     "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
 })
-db = SQLAlchemy(metadata=metadata)
-migrate = Migrate(app, db)
-db.init_app(app)
+db = SQLAlchemy(metadata=metadata, session_options={'class_': database.RoutingSession})
+migrate = Migrate()
+
+
+def settings():
+    """Application settings read from the environment."""
+    return {
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'your_secret_key'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'BCRYPT_ROUNDS': int(os.environ.get('BCRYPT_ROUNDS', 12)),
+        'HASHING_WORKERS': int(os.environ.get('HASHING_WORKERS', 2)),
+        'HASHING_MAX_PENDING': int(os.environ.get('HASHING_MAX_PENDING', 32)),
+        'CACHE_BACKEND': os.environ.get('CACHE_BACKEND', 'memory'),
+        'CACHE_URL': os.environ.get('CACHE_URL', 'redis://localhost:6379/0'),
+        'CACHE_TTL': int(os.environ.get('CACHE_TTL', 60)),
+        'CACHE_MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 10000)),
+        'SESSION_BACKEND': os.environ.get('SESSION_BACKEND', 'database'),
+        'SESSION_URL': os.environ.get('SESSION_URL', 'redis://localhost:6379/0'),
+        'SESSION_TTL': int(os.environ.get('SESSION_TTL', 7 * 24 * 3600)),
+        'SESSION_REFRESH': int(os.environ.get('SESSION_REFRESH', 300)),
+        'SERVER_TIMING': os.environ.get('SERVER_TIMING', '1') != '0',
+        'JSON_PROVIDER': os.environ.get('JSON_PROVIDER', 'auto'),
+        'COMPRESS': os.environ.get('COMPRESS', '1') != '0',
+        'COMPRESS_MIN_SIZE': int(os.environ.get('COMPRESS_MIN_SIZE', 1024)),
+        'COMPRESS_GZIP_LEVEL': int(os.environ.get('COMPRESS_GZIP_LEVEL', 6)),
+        'COMPRESS_BROTLI_QUALITY': int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4)),
+        'SLOW_REQUEST_MS': int(os.environ.get('SLOW_REQUEST_MS', 0)),
+        'REMINDER_HOURS': int(os.environ.get('REMINDER_HOURS', 24)),
+        'OUTBOX_SINK': os.environ.get('OUTBOX_SINK', 'file'),
+        'OUTBOX_FILE': os.environ.get('OUTBOX_FILE'),
+        'OUTBOX_BATCH_SIZE': int(os.environ.get('OUTBOX_BATCH_SIZE', 100)),
+        'OUTBOX_RATE': float(os.environ.get('OUTBOX_RATE', 20)),
+        'OUTBOX_MAX_ATTEMPTS': int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8)),
+        'SMTP_HOST': os.environ.get('SMTP_HOST', 'localhost'),
+        'SMTP_PORT': int(os.environ.get('SMTP_PORT', 25)),
+        'SMTP_SENDER': os.environ.get('SMTP_SENDER', 'noreply@localhost'),
+        'SMTP_USERNAME': os.environ.get('SMTP_USERNAME'),
+        'SMTP_PASSWORD': os.environ.get('SMTP_PASSWORD'),
+        'SMTP_STARTTLS': os.environ.get('SMTP_STARTTLS', '0') == '1',
+        'ARCHIVE_AFTER_DAYS': int(os.environ.get('ARCHIVE_AFTER_DAYS', 365)),
+        'ARCHIVE_BATCH_SIZE': int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000)),
+        'RATE_LIMIT_BACKEND': os.environ.get('RATE_LIMIT_BACKEND', 'memory'),
+        'RATE_LIMIT_URL': os.environ.get('RATE_LIMIT_URL', 'redis://localhost:6379/0'),
+        'RATE_LIMIT': float(os.environ.get('RATE_LIMIT', 20)),
+        'RATE_LIMIT_BURST': float(os.environ.get('RATE_LIMIT_BURST', 100)),
+        'RATE_LIMIT_PROXIES': int(os.environ.get('RATE_LIMIT_PROXIES', 0)),
+        'RATE_LIMIT_API_KEYS': os.environ.get('RATE_LIMIT_API_KEYS'),
+        'ADMISSION_LIMIT': int(os.environ.get('ADMISSION_LIMIT', 4)),
+        'ADMISSION_WAIT_MS': int(os.environ.get('ADMISSION_WAIT_MS', 0)),
+    }
+
+
+def create_app(config=None, resources=True):
+    """Build the application.
+
+    ``config`` overrides the environment settings (including the database
+    ones, see database.configure). With ``resources=False`` the HTTP layer is
+    never imported, which is all scripts such as seed.py and the CLI need.
+    """
+    app = Flask(__name__)
+    app.config.update(settings())
+    database.configure(app, **(config or {}))
+    # The analytics rollups and the medication history are kept by SQLite
+    # triggers; on another database every write would leave them behind
+    # without an error
+    backend = make_url(app.config['DATABASE_URL']).get_backend_name()
+    if backend != 'sqlite':
+        raise ValueError(f'DATABASE_URL must be a SQLite database, not {backend}: '
+                         'the analytics rollups and medication history are maintained by SQLite triggers')
+    database.init_app(app, db)
+    migrate.init_app(app, db)
+
+    # Write-side hooks (change tokens, cache generations, the search index,
+    # analytics and medication trigger DDL for create_all, the notification
+    # outbox, cached login principals) must be registered in every process
+    # that can commit, not only in the web server
+    import analytics
+    import medications
+    import outbox
+    import sessions
+    for module in ('conditional', 'search'):
+        # Nothing to call: importing them registers their hooks
+        importlib.import_module(module)
+    from cache import LRUBackend, RedisBackend, cache
+    from hashing import hasher
+    hasher.configure(
+        rounds=app.config['BCRYPT_ROUNDS'],
+        workers=app.config['HASHING_WORKERS'],
+        max_pending=app.config['HASHING_MAX_PENDING'],
+    )
+    cache.configure(
+        backend=RedisBackend(app.config['CACHE_URL']) if app.config['CACHE_BACKEND'] == 'redis'
+        else LRUBackend(app.config['CACHE_MAX_ENTRIES']),
+        ttl=app.config['CACHE_TTL'],
+        enabled=app.config['CACHE_BACKEND'] != 'none',
+    )
+    sessions.session_store.configure(
+        backend=sessions.make_store(app.config),
+        ttl=app.config['SESSION_TTL'],
+        refresh=app.config['SESSION_REFRESH'],
+    )
+    # The cookie only holds the session id; it slides along with the server-side expiry
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(seconds=app.config['SESSION_TTL'])
 
-# Instantiate REST API
-api = Api(app)
+    from archive import archive_command
+    from datagen import generate_command
+    from export import export_command
+    app.cli.add_command(analytics.analytics_command)
+    app.cli.add_command(archive_command)
+    app.cli.add_command(export_command)
+    app.cli.add_command(generate_command)
+    app.cli.add_command(medications.medications_command)
+    app.cli.add_command(outbox.outbox_command)
+    app.cli.add_command(sessions.sessions_command)
 
-# Instantiate CORS
-CORS(app)
+    if resources:
+        import encoding
+        import metrics
+        metrics.init_app(app, db)
+        # Registered after metrics so its after_request runs first and the
+        # compression time is part of the recorded request
+        encoding.init_app(app)
+        import limits
+        limits.init_app(app)
+        CORS(app, supports_credentials=True, expose_headers=['X-Next-Cursor', 'Link', 'ETag', 'Server-Timing'])
+        import resources as resource_module
+        resource_module.register(app)
+    return app
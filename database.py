@@ -0,0 +1,221 @@
+# Engine configuration: DATABASE_URL, pool sizing, SQLite pragmas and a
+# read-only bind that GET requests are routed to
+import os
+import time
+import weakref
+from contextvars import ContextVar
+from functools import lru_cache
+
+from flask import request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from werkzeug.exceptions import ServiceUnavailable
+
+READ_BIND = 'read'
+READ_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+# Monotonic time after which the current request's statements are interrupted
+_deadline = ContextVar('query_deadline', default=None)
+
+
+class QueryTimeout(ServiceUnavailable):
+    """A statement was interrupted because its request ran past REQUEST_TIMEOUT."""
+
+    data = {'error': 'Request timed out'}
+
+
+# Every engine init_app has set up, for the fork hook below
+_engines = weakref.WeakSet()
+
+
+def _dispose_engines():
+    # A worker forked from a preloaded app (gunicorn --preload) must not reuse
+    # the parent's sockets or file handles; close=False leaves them to the parent
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_engines)
+
+
+def _past_deadline():
+    deadline = _deadline.get()
+    return deadline is not None and time.monotonic() > deadline
+
+
+@lru_cache(maxsize=None)
+def _immediate(engine):
+    return engine.execution_options(sqlite_begin='IMMEDIATE')
+
+
+class RoutingSession(Session):
+    """Session that sends everything to the read-only bind once marked ``read_only``.
+
+    A flush attempted on such a session fails at the database instead of
+    silently writing from a GET handler. A session marked ``immediate`` takes
+    SQLite's write lock when its transaction begins.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_only'):
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if self.info.get('immediate') and engine.dialect.name == 'sqlite':
+            return _immediate(engine)
+        return engine
+
+
+def _url(value):
+    # Hosting platforms still hand out the pre-1.4 scheme name
+    if value.startswith('postgres://'):
+        value = 'postgresql://' + value[len('postgres://'):]
+    return value
+
+
+def _is_memory(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def _engine_options(url, config):
+    if url.get_backend_name() == 'sqlite':
+        if _is_memory(url):
+            # One shared connection; a pool would hand out empty databases
+            return {}
+        return {
+            'pool_size': config['DATABASE_POOL_SIZE'],
+            'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+            'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+        }
+    options = {
+        'pool_size': config['DATABASE_POOL_SIZE'],
+        'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+        'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+        'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+    if config['REQUEST_TIMEOUT'] and url.get_backend_name() == 'postgresql':
+        # The server enforces it per statement rather than per request
+        timeout_ms = int(config['REQUEST_TIMEOUT'] * 1000)
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout_ms}'}
+    return options
+
+
+def configure(app, url=None, **overrides):
+    """Read the database settings from the environment into ``app.config``.
+
+    ``url`` and keyword ``overrides`` (e.g. ``SQLITE_JOURNAL_MODE='DELETE'``)
+    take precedence over the environment; benchmarks use them.
+    """
+    config = app.config
+    config['DATABASE_URL'] = url or os.environ.get('DATABASE_URL', 'sqlite:///app.db')
+    config['DATABASE_READ_URL'] = os.environ.get('DATABASE_READ_URL')
+    config['DATABASE_POOL_SIZE'] = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    config['DATABASE_MAX_OVERFLOW'] = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    config['DATABASE_POOL_TIMEOUT'] = int(os.environ.get('DATABASE_POOL_TIMEOUT', 30))
+    config['DATABASE_POOL_RECYCLE'] = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+    config['REQUEST_TIMEOUT'] = float(os.environ.get('REQUEST_TIMEOUT', 30))
+    config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    config['SQLITE_CACHE_SIZE'] = int(os.environ.get('SQLITE_CACHE_SIZE', 65536))
+    config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    config.update(overrides)
+    config['DATABASE_URL'] = _url(config['DATABASE_URL'])
+    config['DATABASE_READ_URL'] = _url(config['DATABASE_READ_URL'] or config['DATABASE_URL'])
+
+    url = make_url(config['DATABASE_URL'])
+    config['SQLALCHEMY_DATABASE_URI'] = config['DATABASE_URL']
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = _engine_options(url, config)
+    binds = {}
+    if not _is_memory(url):
+        read_url = make_url(config['DATABASE_READ_URL'])
+        options = _engine_options(read_url, config)
+        if read_url.get_backend_name() == 'postgresql':
+            options['execution_options'] = {'postgresql_readonly': True}
+        binds[READ_BIND] = {'url': config['DATABASE_READ_URL'], **options}
+    config['SQLALCHEMY_BINDS'] = binds
+
+
+def _sqlite_pragmas(config, read_only):
+    pragmas = [f"busy_timeout = {config['SQLITE_BUSY_TIMEOUT']}"]
+    pragmas.append(f"journal_mode = {config['SQLITE_JOURNAL_MODE']}")
+    pragmas.append(f"synchronous = {config['SQLITE_SYNCHRONOUS']}")
+    # Negative cache_size is in KiB rather than pages
+    pragmas.append(f"cache_size = -{config['SQLITE_CACHE_SIZE']}")
+    pragmas.append(f"mmap_size = {config['SQLITE_MMAP_SIZE']}")
+    pragmas.append('foreign_keys = ON')
+    pragmas.append('temp_store = MEMORY')
+    if read_only:
+        pragmas.append('query_only = ON')
+    return pragmas
+
+
+def _prepare_sqlite(engine, config, read_only):
+    pragmas = _sqlite_pragmas(config, read_only)
+    memory = _is_memory(engine.url)
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        # Take over transaction control from pysqlite, which would not BEGIN
+        # before a SELECT; a request's reads then share one snapshot
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            if memory and pragma.startswith(('journal_mode', 'mmap_size')):
+                continue
+            cursor.execute(f'PRAGMA {pragma}')
+        cursor.close()
+        # Polled every few thousand VM steps; a true return aborts the statement
+        dbapi_connection.set_progress_handler(_past_deadline, 10000)
+
+    @event.listens_for(engine, 'begin')
+    def _on_begin(connection):
+        # Deferred unless asked otherwise: a deferred transaction that reads
+        # and then writes cannot upgrade once another writer has committed
+        # ("database is locked"), so writing requests begin IMMEDIATE
+        mode = connection.get_execution_options().get('sqlite_begin')
+        connection.exec_driver_sql(f'BEGIN {mode}' if mode else 'BEGIN')
+
+    @event.listens_for(engine, 'handle_error')
+    def _on_error(context):
+        if _past_deadline() and 'interrupted' in str(context.original_exception):
+            raise QueryTimeout() from context.original_exception
+
+
+def init_app(app, db):
+    """Bind ``db`` to ``app`` and apply the engine profile from ``configure``."""
+    db.init_app(app)
+    with app.app_context():
+        engines = list(db.engines.items())
+    for key, engine in engines:
+        if engine.dialect.name == 'sqlite':
+            _prepare_sqlite(engine, app.config, read_only=key == READ_BIND)
+
+    _engines.update(engine for _, engine in engines)
+
+    @app.before_request
+    def _route_reads():
+        if request.method in READ_METHODS:
+            db.session.info['read_only'] = True
+            return
+        # Resources whose POST mostly reads (logins, around bcrypt) set
+        # ``read_mostly`` so they do not hold the write lock while hashing
+        view_class = getattr(app.view_functions.get(request.endpoint), 'view_class', None)
+        if not getattr(view_class, 'read_mostly', False):
+            db.session.info['immediate'] = True
+
+    @app.before_request
+    def _start_deadline():
+        # Resources that stream for as long as the client reads (exports)
+        # set ``request_timeout = None``
+        view_class = getattr(app.view_functions.get(request.endpoint), 'view_class', None)
+        timeout = getattr(view_class, 'request_timeout', app.config['REQUEST_TIMEOUT'])
+        _deadline.set(time.monotonic() + timeout if timeout else None)
+
+    @app.teardown_request
+    def _clear_deadline(exc):
+        # Server threads are reused; the next request must not inherit this one
+        _deadline.set(None)
@@ -0,0 +1,176 @@
+# Synthetic data at scale: deterministic rows written with executemany
+# INSERTs in batched transactions, for load tests and benchmarks
+import random
+import sys
+import time as clock
+from datetime import date, time, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert
+
+import analytics
+import medications
+from config import db
+from conditional import touch
+from hashing import hasher
+from models import (User, Doctor, Appointment, Prescription, WorkingHours, ArchivedAppointment, ArchivedPrescription,
+                    utcnow)
+
+BATCH_SIZE = 50000
+PASSWORD = 'password'
+SPECIALTIES = ['Cardiology', 'Neurology', 'Pediatrics', 'Dermatology', 'Oncology',
+               'Orthopedics', 'Psychiatry', 'Radiology', 'Urology', 'Ophthalmology']
+STATUSES = ['Scheduled'] * 6 + ['Completed'] * 3 + ['Cancelled']
+MEDICINES = ['Aspirin', 'Ibuprofen', 'Amoxicillin', 'Metformin', 'Lisinopril', 'Atorvastatin',
+             'Omeprazole', 'Levothyroxine', 'Amlodipine', 'Sertraline', 'Paracetamol', 'Azithromycin',
+             'Simvastatin', 'Losartan', 'Gabapentin', 'Hydrochlorothiazide', 'Prednisone', 'Cetirizine',
+             'Montelukast', 'Pantoprazole', 'Escitalopram', 'Warfarin', 'Clopidogrel', 'Insulin',
+             'Salbutamol', 'Furosemide', 'Tramadol', 'Doxycycline', 'Citalopram', 'Fluoxetine']
+INSTRUCTIONS = ['Take after meal', 'Take before bed', 'Take with water', 'Take on an empty stomach',
+                'Take in the morning', 'Do not drive after taking', 'Avoid alcohol', 'Finish the full course']
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David',
+               'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas',
+               'Sarah', 'Amina', 'Wanjiru', 'Kamau', 'Akinyi', 'Otieno', 'Fatima', 'Chen', 'Priya',
+               'Mateo', 'Sofia', 'Yuki', 'Olga', 'Ahmed', 'Zanele', 'Lucas', 'Ines', 'Hiroshi', 'Grace']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore',
+              'Jackson', 'Martin', 'Lee', 'Mwangi', 'Ochieng', 'Kariuki', 'Njoroge', 'Okafor', 'Nguyen',
+              'Kim', 'Patel', 'Sato', 'Ivanova', 'Haddad', 'Dlamini', 'Silva', 'Müller', 'Rossi', 'Cohen']
+# Every generated doctor works 09:00-17:00 on weekdays in 30-minute slots
+DAY_START, DAY_END, SLOT_MINUTES = 9 * 60, 17 * 60, 30
+SLOTS_PER_DAY = (DAY_END - DAY_START) // SLOT_MINUTES
+
+
+def _next_id(*models):
+    """One past the highest id in any of ``models``, e.g. a hot table and its archive."""
+    return max(db.session.query(func.max(model.id)).scalar() or 0 for model in models) + 1
+
+
+def _write(model, rows, batch_size, report):
+    """Insert ``rows`` (an iterable of dicts) ``batch_size`` per transaction."""
+    # Core table insert: a plain executemany, without the ORM's per-row bookkeeping
+    statement, batch, written = insert(model.__table__), [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            db.session.connection().execute(statement, batch)
+            db.session.commit()
+            written += len(batch)
+            report(model, written)
+            batch = []
+    if batch:
+        db.session.connection().execute(statement, batch)
+        db.session.commit()
+        written += len(batch)
+        report(model, written)
+    return written
+
+
+def _weekdays(start, days):
+    """Working days in ``[start, start + days)``."""
+    return [start + timedelta(days=offset) for offset in range(days)
+            if (start + timedelta(days=offset)).weekday() < 5]
+
+
+def generate(users=1000, doctors=50, appointments=10000, prescriptions=20000,
+             start=date(2026, 1, 1), days=730, seed=0, batch_size=BATCH_SIZE, report=None):
+    """Append synthetic rows after whatever is already in the tables.
+
+    Rows use explicit ids continuing from the current maximum, so prescriptions
+    can reference the appointments generated alongside them. Appointments are
+    spread evenly over the doctors, each at a distinct weekday slot within the
+    doctor's hours, so they satisfy the double-booking index. Every account
+    shares one bcrypt hash of ``PASSWORD``. Must run inside an app context.
+    """
+    rng = random.Random(seed)
+    report = report or (lambda model, written: None)
+    # One timestamp for the whole load instead of a default evaluated per row
+    now = utcnow()
+    password_hash = hasher.hash(PASSWORD)
+    weekdays = _weekdays(start, days)
+    slots_per_doctor = len(weekdays) * SLOTS_PER_DAY
+    if doctors and appointments > doctors * slots_per_doctor:
+        raise ValueError(f'{appointments} appointments do not fit in {doctors} doctors x {days} days')
+    if (appointments and not (doctors and users)) or (prescriptions and not appointments):
+        raise ValueError('appointments need users and doctors, prescriptions need appointments')
+
+    first_user, first_doctor = _next_id(User), _next_id(Doctor)
+    # Archived rows keep their ids, which AUTOINCREMENT will never hand out again
+    first_appointment = _next_id(Appointment, ArchivedAppointment)
+    first_prescription = _next_id(Prescription, ArchivedPrescription)
+    started = clock.perf_counter()
+
+    # Per-row analytics and medication triggers would dominate the load: recount once at the end
+    with analytics.bulk_load(db.session), medications.bulk_load(db.session):
+        _write(User, ({
+            'id': first_user + n, 'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', 'email': f'user{first_user + n}@example.com',
+            'password_hash': password_hash, 'age': rng.randint(18, 95), 'gender': rng.choice(('Female', 'Male')),
+            'phone_number': f'555-{(first_user + n) % 10000000:07d}', 'version': 1, 'updated_at': now,
+        } for n in range(users)), batch_size, report)
+
+        _write(Doctor, ({
+            'id': first_doctor + n, 'name': f'Dr. {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', 'email': f'doctor{first_doctor + n}@example.com',
+            'password_hash': password_hash, 'specialty': SPECIALTIES[(first_doctor + n) % len(SPECIALTIES)],
+            'experience_years': rng.randint(1, 40), 'availability': 'Available', 'slot_minutes': SLOT_MINUTES,
+            'version': 1, 'updated_at': now,
+        } for n in range(doctors)), batch_size, report)
+
+        _write(WorkingHours, ({
+            'doctor_id': first_doctor + n, 'weekday': weekday,
+            'start_time': time(DAY_START // 60), 'end_time': time(DAY_END // 60),
+        } for n in range(doctors) for weekday in range(5)), batch_size, report)
+
+        def appointment_rows():
+            appointment_id = first_appointment
+            for n in range(doctors):
+                count = appointments // doctors + (1 if n < appointments % doctors else 0)
+                for slot in sorted(rng.sample(range(slots_per_doctor), count)):
+                    minute = DAY_START + slot % SLOTS_PER_DAY * SLOT_MINUTES
+                    yield {
+                        'id': appointment_id, 'user_id': first_user + rng.randrange(users),
+                        'doctor_id': first_doctor + n, 'date': weekdays[slot // SLOTS_PER_DAY],
+                        'time': time(minute // 60, minute % 60), 'status': rng.choice(STATUSES),
+                        'version': 1, 'updated_at': now,
+                    }
+                    appointment_id += 1
+
+        _write(Appointment, appointment_rows(), batch_size, report)
+
+        _write(Prescription, ({
+            'id': first_prescription + n, 'appointment_id': first_appointment + rng.randrange(appointments),
+            'medicine': rng.choice(MEDICINES), 'dosage': f'{rng.choice((1, 2))} x {rng.choice((5, 10, 20, 50))} mg',
+            'instructions': rng.choice(INSTRUCTIONS),
+            'version': 1, 'updated_at': now,
+        } for n in range(prescriptions)), batch_size, report)
+
+        # Core inserts bypass the session hooks that advance the collection ETags
+        touch(db.session, {model.__tablename__ for model, count in (
+            (User, users), (Doctor, doctors), (WorkingHours, doctors), (Appointment, appointments),
+            (Prescription, prescriptions)) if count})
+        db.session.commit()
+    return clock.perf_counter() - started
+
+
+@click.command('generate')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--doctors', default=50, show_default=True)
+@click.option('--appointments', default=10000, show_default=True)
+@click.option('--prescriptions', default=20000, show_default=True)
+@click.option('--start', default='2026-01-01', show_default=True, help='First appointment day (YYYY-MM-DD).')
+@click.option('--days', default=730, show_default=True, help='Days the appointments are spread over.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True, help='Rows per transaction.')
+@with_appcontext
+def generate_command(users, doctors, appointments, prescriptions, start, days, seed, batch_size):
+    """Append synthetic users, doctors, appointments and prescriptions."""
+    def report(model, written):
+        click.echo(f'\r{model.__tablename__}: {written:<12}', nl=False, file=sys.stderr)
+
+    try:
+        elapsed = generate(users, doctors, appointments, prescriptions, date.fromisoformat(start),
+                           days, seed, batch_size, report)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    total = users + doctors * 6 + appointments + prescriptions
+    click.echo(f'\r{"":<40}\rGenerated {total} rows in {elapsed:.1f} s ({total / elapsed:.0f} rows/s)', file=sys.stderr)
@@ -0,0 +1,140 @@
+# Response bodies: a pluggable JSON provider (orjson when installed, the
+# standard library otherwise) and gzip/brotli negotiated on Accept-Encoding
+import gzip
+import json
+from datetime import date, datetime, time
+
+from flask import current_app, request
+from flask.json.provider import JSONProvider
+
+from metrics import timed
+
+COMPRESSIBLE = frozenset(['application/json', 'text/plain', 'text/csv', 'text/html'])
+
+
+def _default(value):
+    # Same ISO forms orjson writes natively
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class StdlibProvider(JSONProvider):
+    """Compact JSON through the json module; dates and times as ISO strings."""
+
+    name = 'stdlib'
+
+    def dumps(self, obj, **kwargs):
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_default)
+
+    def loads(self, s, **kwargs):
+        return json.loads(s)
+
+    def encode(self, obj):
+        """``obj`` as UTF-8 bytes, ready to be a response body."""
+        return self.dumps(obj).encode('utf-8')
+
+
+class OrjsonProvider(StdlibProvider):
+    """The same output through the optional ``orjson`` package, several times faster."""
+
+    name = 'orjson'
+
+    def __init__(self, app):
+        import orjson
+        super().__init__(app)
+        self._orjson = orjson
+        # Integer keys (e.g. weekday buckets) become strings, as with json.dumps
+        self._option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return self.encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return self._orjson.loads(s)
+
+    def encode(self, obj):
+        return self._orjson.dumps(obj, default=_default, option=self._option)
+
+
+PROVIDERS = {'stdlib': StdlibProvider, 'orjson': OrjsonProvider}
+
+
+def make_provider(app):
+    """The provider named by JSON_PROVIDER; ``auto`` prefers orjson when it is installed."""
+    name = app.config['JSON_PROVIDER']
+    if name == 'auto':
+        try:
+            return OrjsonProvider(app)
+        except ImportError:
+            return StdlibProvider(app)
+    return PROVIDERS[name](app)
+
+
+@timed('encode')
+def output_json(data, code, headers=None):
+    """Flask-RESTful representation for application/json through the app's provider."""
+    response = current_app.response_class(current_app.json.encode(data), code, mimetype='application/json')
+    response.headers.extend(headers or {})
+    return response
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def negotiate(accept_encodings, available):
+    """The encoding in ``available`` (in order of preference) the client rates highest, or None."""
+    best, best_quality = None, 0
+    for name in available:
+        quality = accept_encodings.quality(name)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def init_app(app):
+    """Use the configured JSON provider and compress large enough responses."""
+    app.json = make_provider(app)
+    if not app.config['COMPRESS']:
+        return
+
+    brotli = _brotli()
+    min_size = app.config['COMPRESS_MIN_SIZE']
+    gzip_level = app.config['COMPRESS_GZIP_LEVEL']
+    brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+    # Brotli is smaller at a similar cost, so it wins a tie in Accept-Encoding
+    available = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    @timed('compress')
+    def compress(data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=brotli_quality)
+        return gzip.compress(data, gzip_level, mtime=0)
+
+    @app.after_request
+    def _compress(response):
+        # Streams (exports) compress themselves a chunk at a time
+        if (response.direct_passthrough or response.is_streamed or response.status_code in (204, 304)
+                or response.status_code < 200 or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE):
+            return response
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings, available)
+        if encoding is None:
+            return response
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        # The validators stay those of the resource, but a strong ETag would
+        # claim byte equality with the uncompressed representation
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,146 @@
+# Streaming exports: rows read through a server-side cursor and written out
+# as NDJSON or CSV a chunk at a time, optionally gzipped on the fly
+import csv
+import io
+import json
+import sys
+import zlib
+
+import click
+from flask.cli import with_appcontext
+
+from config import db
+from filters import APPOINTMENT_FILTERS, PRESCRIPTION_FILTERS
+from models import Appointment, Prescription
+from pagination import QueryError, apply_filters
+from serializers import FIELDS, formatter
+
+CHUNK_ROWS = 1000
+
+EXPORTS = {
+    'appointments': (Appointment, APPOINTMENT_FILTERS),
+    'prescriptions': (Prescription, PRESCRIPTION_FILTERS),
+}
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def export_query(table, args, after=None, limit=None):
+    """Column names and a column-only query for ``table``, ordered by id.
+
+    Ordering by the primary key is what makes an export resumable: pass the
+    last id received as ``after`` to continue where a broken transfer stopped.
+    """
+    model, filters = EXPORTS[table]
+    names = FIELDS[model]
+    query = apply_filters(db.session.query(*(getattr(model, name) for name in names)), filters, args)
+    if after is not None:
+        query = query.filter(model.id > after)
+    query = query.order_by(model.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return names, query
+
+
+def _chunks(table, names, query, progress):
+    """Lists of formatted rows, CHUNK_ROWS at a time; only one chunk is ever held."""
+    columns = EXPORTS[table][0].__table__.columns
+    formatters = [formatter(columns[name].type) for name in names]
+    id_index = names.index('id')
+    chunk = []
+    # Plain tuples, no identity map: memory does not grow with the row count
+    for row in query.yield_per(CHUNK_ROWS):
+        chunk.append([fmt(value) if fmt else value for fmt, value in zip(formatters, row)])
+        if len(chunk) == CHUNK_ROWS:
+            progress['rows'] += len(chunk)
+            progress['last_id'] = chunk[-1][id_index]
+            yield chunk
+            chunk = []
+    if chunk:
+        progress['rows'] += len(chunk)
+        progress['last_id'] = chunk[-1][id_index]
+        yield chunk
+
+
+def _ndjson(names, chunks):
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    for chunk in chunks:
+        yield ''.join(encode(dict(zip(names, row))) + '\n' for row in chunk)
+
+
+def _csv(names, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(names)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream(table, names, query, fmt, progress=None):
+    """Encoded export body as a generator of bytes."""
+    progress = progress if progress is not None else {}
+    progress.update(rows=0, last_id=None)
+    encoder = _ndjson if fmt == 'ndjson' else _csv
+    try:
+        for text in encoder(names, _chunks(table, names, query, progress)):
+            yield text.encode('utf-8')
+    finally:
+        # A streamed response outlives the request teardown that removed this
+        # session, so nothing else would hand its connection back to the pool
+        query.session.close()
+
+
+def gzip_stream(chunks, level=6):
+    """Gzip a byte stream chunk by chunk without buffering the whole body."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _filter_args(values):
+    args = {}
+    for value in values:
+        name, sep, raw = value.partition('=')
+        if not sep:
+            raise click.BadParameter(f"'{value}' is not NAME=VALUE", param_hint='--filter')
+        args[name] = raw
+    return args
+
+
+@click.command('export')
+@click.argument('table', type=click.Choice(sorted(EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='ndjson', show_default=True)
+@click.option('--filter', 'filters', multiple=True, metavar='NAME=VALUE',
+              help='Same filters as the list endpoint, e.g. --filter status=Scheduled.')
+@click.option('--after', type=int, help='Resume after this id.')
+@click.option('--limit', type=int, help='Stop after this many rows.')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--output', '-o', default='-', type=click.Path(dir_okay=False, allow_dash=True),
+              help='File to write (default: stdout).')
+@with_appcontext
+def export_command(table, fmt, filters, after, limit, compress, output):
+    """Stream TABLE as NDJSON or CSV."""
+    db.session.info['read_only'] = True
+    try:
+        names, query = export_query(table, _filter_args(filters), after, limit)
+    except QueryError as e:
+        raise click.UsageError(str(e))
+    progress = {}
+    chunks = stream(table, names, query, fmt, progress)
+    if compress:
+        chunks = gzip_stream(chunks)
+    with click.open_file(output, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+    last = f", last id {progress['last_id']}" if progress['last_id'] is not None else ''
+    click.echo(f"Exported {progress['rows']} {table}{last}", file=sys.stderr)
@@ -0,0 +1,48 @@
+# Query-string filters shared by the list endpoints and the exports
+import operator
+from datetime import date
+
+from models import Doctor, Appointment, Prescription, ArchivedAppointment, ArchivedPrescription, PatientMedication
+
+# List filters: query-string argument -> (column, comparison, parser)
+DOCTOR_FILTERS = {
+    'specialty': (Doctor.specialty, operator.eq, str),
+}
+CALENDAR_FILTERS = {
+    'status': (Appointment.status, operator.eq, str),
+    'date_from': (Appointment.date, operator.ge, date.fromisoformat),
+    'date_to': (Appointment.date, operator.le, date.fromisoformat),
+}
+APPOINTMENT_FILTERS = {
+    'user_id': (Appointment.user_id, operator.eq, int),
+    'doctor_id': (Appointment.doctor_id, operator.eq, int),
+    **CALENDAR_FILTERS,
+}
+PRESCRIPTION_FILTERS = {
+    'appointment_id': (Prescription.appointment_id, operator.eq, int),
+    'medicine': (Prescription.medicine, operator.eq, str),
+}
+APPOINTMENT_ORDER = (Appointment.date, Appointment.time, Appointment.id)
+# Medication history: date_from / date_to bound when each medicine was last prescribed
+MEDICATION_FILTERS = {
+    'medicine': (PatientMedication.medicine, operator.eq, str),
+    'doctor_id': (PatientMedication.doctor_id, operator.eq, int),
+    'date_from': (PatientMedication.last_date, operator.ge, date.fromisoformat),
+    'date_to': (PatientMedication.last_date, operator.le, date.fromisoformat),
+}
+PATIENT_MEDICATION_FILTERS = {
+    'user_id': (PatientMedication.user_id, operator.eq, int),
+    **MEDICATION_FILTERS,
+}
+# Patients on a medicine, served by the (medicine, user_id) index
+PATIENT_MEDICATION_ORDER = (PatientMedication.medicine, PatientMedication.user_id)
+
+
+def _archived(model, filters):
+    return {arg: (getattr(model, column.key), compare, cast) for arg, (column, compare, cast) in filters.items()}
+
+# The archive tables (?archived=1) have the same columns, filters and order
+ARCHIVED_CALENDAR_FILTERS = _archived(ArchivedAppointment, CALENDAR_FILTERS)
+ARCHIVED_APPOINTMENT_FILTERS = _archived(ArchivedAppointment, APPOINTMENT_FILTERS)
+ARCHIVED_PRESCRIPTION_FILTERS = _archived(ArchivedPrescription, PRESCRIPTION_FILTERS)
+ARCHIVED_APPOINTMENT_ORDER = (ArchivedAppointment.date, ArchivedAppointment.time, ArchivedAppointment.id)
@@ -0,0 +1,46 @@
+# Production server settings. gunicorn reads this file from the working
+# directory, so ``gunicorn app:app`` is the whole command; every value comes
+# from the environment and gunicorn's own flags still take precedence
+import os
+
+bind = os.environ.get('WEB_BIND', f"0.0.0.0:{os.environ.get('PORT', 8000)}")
+
+# Processes scale the CPU-bound part of a request (routing, serialization);
+# threads overlap the waits (SQLite's busy timeout, the hashing pool, slow
+# clients) without another copy of the app per thread
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+
+# A worker that stops heartbeating for ``timeout`` seconds is killed; statements
+# are interrupted sooner, at REQUEST_TIMEOUT (see database.py). On SIGTERM or
+# SIGHUP, workers get ``graceful_timeout`` seconds to finish what they serve
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+
+# Replace each worker after this many requests (0 = never), staggered so
+# they do not all restart at once
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# Build the app once in the master and fork it, so workers start with the
+# mappers and serializers prepared. SIGHUP then replaces the workers but keeps
+# the loaded code; with WEB_PRELOAD=0 each new worker imports it afresh
+preload_app = os.environ.get('WEB_PRELOAD', '1') != '0'
+
+# The heartbeat file is touched on every request; keep it off disk-backed /tmp
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.environ.get('WEB_ACCESS_LOG')
+errorlog = '-'
+pidfile = os.environ.get('WEB_PIDFILE')
+
+# Every worker starts its own bcrypt pool; together they get at most half the
+# CPUs, so logins cannot starve the workers serving everything else
+os.environ.setdefault('HASHING_WORKERS', str(max(1, min(2, (os.cpu_count() or 1) // 2 // workers))))
+
+# Expensive requests (lists, search, exports, logins) may hold all but one
+# thread; see limits.py
+os.environ.setdefault('ADMISSION_LIMIT', str(max(1, threads - 1)))
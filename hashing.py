@@ -0,0 +1,109 @@
+# Password hashing service: bcrypt runs in a bounded process pool
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+
+from metrics import timed
+
+DEFAULT_ROUNDS = 12
+# bcrypt reads no further; bcrypt>=5 raises instead of ignoring the rest
+MAX_BYTES = 72
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full or a job did not finish in time."""
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def _secret(password):
+    # What older bcrypt releases hashed for longer passwords; new ones are
+    # capped at MAX_BYTES by the schemas
+    return password.encode('utf-8')[:MAX_BYTES]
+
+
+def hash_rounds(hashed):
+    """Cost factor stored in a bcrypt hash such as ``$2b$12$...``."""
+    return int(hashed.split('$')[2])
+
+
+class HashingService:
+    """Run bcrypt outside the request thread with a bounded queue.
+
+    At most ``max_pending`` jobs (running or queued) are accepted per
+    process; beyond that ``HashingBusy`` is raised immediately so the caller
+    can answer 503 instead of parking a request worker behind a login storm.
+    ``workers=0`` hashes inline, which is what scripts like seed.py want.
+    """
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=0, max_pending=32, timeout=10.0):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.configure(rounds=rounds, workers=workers, max_pending=max_pending, timeout=timeout)
+
+    def configure(self, rounds=None, workers=None, max_pending=None, timeout=None):
+        with self._lock:
+            if rounds is not None:
+                self.rounds = rounds
+            if workers is not None:
+                self.workers = workers
+            if max_pending is not None:
+                self.max_pending = max_pending
+                self._slots = threading.BoundedSemaphore(max_pending)
+            if timeout is not None:
+                self.timeout = timeout
+            self._shutdown()
+
+    def _shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def _get_executor(self):
+        # A pool inherited across fork() is unusable, so each process builds its own
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    @timed('bcrypt')
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HashingBusy('Too many password operations in progress')
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # The slot is held until the job is done, not until the caller stops
+        # waiting: a timed-out job still occupies a worker
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingBusy('Password operation timed out')
+
+    def hash(self, password):
+        return self._run(_hashpw, _secret(password), self.rounds)
+
+    def verify(self, password, hashed):
+        return self._run(_checkpw, _secret(password), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+
+hasher = HashingService()
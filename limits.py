@@ -0,0 +1,233 @@
+# Per-client rate limiting and admission control. Every client (API key,
+# else address) draws from a token bucket refilled at
+# RATE_LIMIT tokens a second up to RATE_LIMIT_BURST; each request costs what
+# its resource declares in ``rate_cost``. Expensive requests also need one of
+# ADMISSION_LIMIT slots per process, so a burst of them is shed with 503
+# instead of queueing every thread on the database
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from flask import current_app, g, request
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COST = 1
+# Requests costing at least this much go through admission control
+EXPENSIVE_COST = 5
+SWEEP_INTERVAL = 60  # seconds between sweeps of idle in-process buckets
+
+THROTTLED = registry.counter('http_requests_throttled_total',
+                             'Requests refused, by reason: rate (429) or concurrency (503).',
+                             ('endpoint', 'reason'))
+
+# Refill then take, atomically and on the server's clock. Returns the seconds
+# to wait as a string (Lua numbers would be truncated to integers)
+_TAKE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local cost, rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+
+class MemoryBuckets:
+    """In-process buckets: no round trip, but every worker process counts on its own."""
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, monotonic time of the last update)
+        self._lock = threading.Lock()
+        self._swept = time.monotonic()
+
+    def take(self, key, cost, rate, burst):
+        """Take ``cost`` tokens from ``key``'s bucket: 0 if granted, else seconds until it would be."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._swept > SWEEP_INTERVAL:
+                self._sweep(now, burst / rate)
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+
+    def _sweep(self, now, refill):
+        # A bucket idle long enough to be full again is the same as no bucket
+        self._swept = now
+        for key in [key for key, (_, updated) in self._buckets.items() if now - updated > refill]:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisBuckets:
+    """Buckets shared by every process; needs the optional ``redis`` package.
+
+    If Redis cannot be reached requests are let through: an outage of the
+    limiter should not become an outage of the API.
+    """
+
+    def __init__(self, url, prefix='good-doctor:rate:'):
+        import redis
+        self._errors = redis.RedisError
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_TAKE)
+        self._prefix = prefix
+
+    def take(self, key, cost, rate, burst):
+        try:
+            return float(self._take(keys=[self._prefix + key], args=[cost, rate, burst]))
+        except self._errors as e:
+            logger.warning('Rate limiter unavailable, not limiting: %s', e)
+            return 0.0
+
+    def __len__(self):
+        return sum(1 for _ in self._client.scan_iter(self._prefix + '*'))
+
+
+def make_buckets(config):
+    """The buckets named by RATE_LIMIT_BACKEND: ``memory`` (default), ``redis``, or None for ``none``."""
+    name = config['RATE_LIMIT_BACKEND']
+    if name == 'redis':
+        return RedisBuckets(config['RATE_LIMIT_URL'])
+    if name == 'memory':
+        return MemoryBuckets()
+    if name == 'none':
+        return None
+    raise ValueError(f'Unknown RATE_LIMIT_BACKEND {name!r}')
+
+
+class Admission:
+    """At most ``limit`` expensive requests at once in this process.
+
+    A request finding every slot taken is refused, after waiting up to
+    ``wait`` seconds for one. Cheap requests keep a thread and the database's
+    queue stays short, rather than every thread queueing behind slow pages.
+    The wait is spent holding a server thread, so keep it short or zero.
+    """
+
+    def __init__(self, limit, wait):
+        self._slots = threading.BoundedSemaphore(limit)
+        self.wait = wait
+
+    def enter(self):
+        if not self.wait:
+            return self._slots.acquire(blocking=False)
+        return self._slots.acquire(timeout=self.wait)
+
+    def leave(self):
+        self._slots.release()
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode()).hexdigest()[:16]
+
+
+def client_address(proxies):
+    """The client's address: the one our outermost trusted proxy saw, with ``proxies`` of them in front."""
+    forwarded = [address.strip() for address in request.headers.get('X-Forwarded-For', '').split(',')
+                 if address.strip()]
+    if proxies and len(forwarded) >= proxies:
+        return forwarded[-proxies]
+    return request.remote_addr or 'unknown'
+
+
+def client_key(api_keys, proxies):
+    """Whose bucket a request draws from: its API key, else its address.
+
+    Not its login session: anyone can log in again for a fresh one.
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key and api_key in api_keys:
+        return 'key:' + _digest(api_key)
+    return 'ip:' + client_address(proxies)
+
+
+def request_cost(view_class):
+    """Tokens this request costs.
+
+    ``rate_cost`` on the resource is a number, or a dict by HTTP method where
+    ``'list'`` is a GET of a route without URL parameters (the collection);
+    DEFAULT_COST otherwise. 0 exempts the request.
+    """
+    if request.method == 'OPTIONS':
+        return 0  # CORS preflights
+    cost = getattr(view_class, 'rate_cost', DEFAULT_COST)
+    if not isinstance(cost, dict):
+        return cost
+    if request.method == 'GET' and not request.view_args and 'list' in cost:
+        return cost['list']
+    return cost.get(request.method, DEFAULT_COST)
+
+
+def refusal(status, message, retry_after):
+    response = current_app.json.response({'error': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def init_app(app):
+    """Limit every request to ``app`` as configured."""
+    buckets = make_buckets(app.config)
+    rate, burst = app.config['RATE_LIMIT'], app.config['RATE_LIMIT_BURST']
+    proxies = app.config['RATE_LIMIT_PROXIES']
+    api_keys = frozenset(key.strip() for key in (app.config['RATE_LIMIT_API_KEYS'] or '').split(',') if key.strip())
+    limit = app.config['ADMISSION_LIMIT']
+    admission = Admission(limit, app.config['ADMISSION_WAIT_MS'] / 1000) if limit > 0 else None
+
+    @app.before_request
+    def _limit():
+        view_class = getattr(app.view_functions.get(request.endpoint), 'view_class', None)
+        cost = request_cost(view_class)
+        if not cost:
+            return None
+        endpoint = request.endpoint or 'unmatched'
+        if buckets is not None:
+            # A request dearer than the whole burst could never be granted
+            wait = buckets.take(client_key(api_keys, proxies), min(cost, burst), rate, burst)
+            if wait:
+                THROTTLED.inc((endpoint, 'rate'))
+                return refusal(429, 'Too many requests', wait)
+        if admission is not None and cost >= EXPENSIVE_COST:
+            if not admission.enter():
+                THROTTLED.inc((endpoint, 'concurrency'))
+                return refusal(503, 'Server busy, try again shortly', 1)
+            g.admitted = True
+        return None
+
+    @app.after_request
+    def _release_when_built(response):
+        # A streamed response (an export) does its work while it is sent, so
+        # it keeps the slot until the server closes it
+        if g.pop('admitted', False):
+            if response.is_streamed:
+                response.call_on_close(admission.leave)
+            else:
+                admission.leave()
+        return response
+
+    @app.teardown_request
+    def _release(exc):
+        # The view raised and no response was built
+        if g.pop('admitted', False):
+            admission.leave()
@@ -0,0 +1,143 @@
+# Medication history read model: patient_medications holds one row per
+# patient and medicine, so "what is this patient taking" and "who takes this
+# medicine" are one indexed query instead of a walk through every appointment
+# and prescription. SQLite triggers refresh the pairs each write touches,
+# which is why create_app refuses other databases; `flask medications
+# rebuild` backfills the table
+import sys
+import time as clock
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import DDL, event, func, text
+
+from config import db
+from models import PatientMedication
+
+# ?current=1: prescribed at an appointment no more than this many days ago, or upcoming
+CURRENT_DAYS = 90
+
+_TABLE = PatientMedication.__tablename__
+_COLUMNS = ('user_id, medicine, prescription_count, first_date, last_date, dosage, instructions, '
+            'doctor_id, appointment_id, prescription_id')
+
+
+def _history(where):
+    """Prescriptions matching ``where``, live and archived, with their appointment's patient, doctor and date."""
+    return ' UNION ALL '.join(
+        'SELECT a.user_id, pr.medicine, a.date, a.time, a.doctor_id, pr.appointment_id, pr.id, pr.dosage, '
+        f'pr.instructions FROM {prescriptions} pr JOIN {appointments} a ON a.id = pr.appointment_id WHERE {where}'
+        for prescriptions, appointments in (('prescriptions', 'appointments'),
+                                            ('prescriptions_archive', 'appointments_archive')))
+
+
+def _fill(where):
+    """Insert the row of every (patient, medicine) pair the prescriptions matching ``where`` make up."""
+    return (f'INSERT INTO {_TABLE} ({_COLUMNS}) SELECT user_id, medicine, n, first_date, date, dosage, instructions, '
+            'doctor_id, appointment_id, id FROM (SELECT h.*, count(*) OVER pair AS n, '
+            'min(h.date) OVER pair AS first_date, '
+            'row_number() OVER (pair ORDER BY h.date DESC, h.time DESC, h.id DESC) AS latest '
+            f'FROM ({_history(where)}) h WINDOW pair AS (PARTITION BY h.user_id, h.medicine)) ranked '
+            'WHERE latest = 1;')
+
+
+def _refresh(users, medicines):
+    """Recompute the rows of the pairs in ``users`` x ``medicines`` (SQL lists) from their prescriptions."""
+    return (f'DELETE FROM {_TABLE} WHERE user_id IN {users} AND medicine IN {medicines}; '
+            + _fill(f'a.user_id IN {users} AND pr.medicine IN {medicines}'))
+
+
+def _prescription(row):
+    # The patient is found through the appointment, which a prescription is always deleted before
+    return _refresh(f'(SELECT user_id FROM appointments WHERE id = {row}.appointment_id)', f'({row}.medicine)')
+
+
+def ddl():
+    """Triggers maintaining the read model (SQLite).
+
+    Archived prescriptions keep counting: archive.py copies rows to the
+    archive tables before deleting them, so the refresh the deletes trigger
+    finds them there.
+    """
+    def trigger(name, event_, table, body, when=None):
+        condition = f' WHEN {when}' if when else ''
+        return f'CREATE TRIGGER IF NOT EXISTS medications_{name} {event_} ON {table}{condition} BEGIN {body} END'
+
+    return [
+        trigger('prescriptions_insert', 'AFTER INSERT', 'prescriptions', _prescription('new')),
+        trigger('prescriptions_delete', 'AFTER DELETE', 'prescriptions', _prescription('old')),
+        trigger('prescriptions_update', 'AFTER UPDATE OF appointment_id, medicine, dosage, instructions',
+                'prescriptions', _prescription('old') + ' ' + _prescription('new'),
+                'old.appointment_id IS NOT new.appointment_id OR old.medicine IS NOT new.medicine '
+                'OR old.dosage IS NOT new.dosage OR old.instructions IS NOT new.instructions'),
+        # Moving or reassigning an appointment can change which prescription is the latest, or whose it is
+        trigger('appointments_update', 'AFTER UPDATE OF user_id, doctor_id, date, time', 'appointments',
+                _refresh('(old.user_id, new.user_id)', '(SELECT medicine FROM prescriptions WHERE appointment_id = new.id)'),
+                'old.user_id IS NOT new.user_id OR old.doctor_id IS NOT new.doctor_id '
+                'OR old.date IS NOT new.date OR old.time IS NOT new.time'),
+    ]
+
+
+TRIGGERS = ['prescriptions_insert', 'prescriptions_delete', 'prescriptions_update', 'appointments_update']
+
+
+def rebuild(session):
+    """Recompute every row from the prescriptions and appointments tables, archived ones included."""
+    session.execute(text(f'DELETE FROM {_TABLE}'))
+    session.execute(text(_fill('1 = 1')))
+
+
+def _installed(session):
+    return session.get_bind().dialect.name == 'sqlite' and session.execute(text(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name = 'medications_prescriptions_insert'"
+    )).scalar()
+
+
+@contextmanager
+def bulk_load(session):
+    """Run a bulk load with the triggers dropped, then rebuild and restore them (see analytics.bulk_load)."""
+    if not _installed(session):
+        yield
+        return
+    for name in TRIGGERS:
+        session.execute(text(f'DROP TRIGGER IF EXISTS medications_{name}'))
+    session.commit()
+    try:
+        yield
+    finally:
+        session.rollback()
+        rebuild(session)
+        for statement in ddl():
+            session.execute(text(statement))
+        session.commit()
+
+
+def current_since(today=None):
+    """Earliest last_date a medication can have to count as current."""
+    return (today or date.today()) - timedelta(days=CURRENT_DAYS)
+
+
+# db.create_all() / drop_all() manage the triggers too, as in analytics.py
+for _statement in ddl():
+    event.listen(db.metadata, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _name in TRIGGERS:
+    event.listen(db.metadata, 'before_drop', DDL(f'DROP TRIGGER IF EXISTS medications_{_name}').execute_if(dialect='sqlite'))
+
+
+@click.group('medications')
+def medications_command():
+    """Maintain the patient_medications read model."""
+
+
+@medications_command.command('rebuild')
+@with_appcontext
+def rebuild_command():
+    """Backfill the read model from existing prescriptions, replacing what it holds."""
+    started = clock.perf_counter()
+    db.session.info['immediate'] = True
+    rebuild(db.session)
+    db.session.commit()
+    rows = db.session.query(func.count()).select_from(PatientMedication).scalar()
+    click.echo(f'Rebuilt {rows} patient medication rows in {clock.perf_counter() - started:.1f} s', file=sys.stderr)
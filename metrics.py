@@ -0,0 +1,228 @@
+# Request instrumentation: per-endpoint latency histograms, SQL counts and
+# time, serialization and bcrypt time; exported as Prometheus text and as
+# Server-Timing headers, plus an opt-in slow-request log with query plans
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, labels)} {value:g}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = (*self.labels, 'le')
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, '+Inf'), counts):
+                    cumulative += count
+                    bound = bound if bound == '+Inf' else f'{bound:g}'
+                    lines.append(f'{self.name}_bucket{_labels(names, (*labels, bound))} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {total:g}')
+                lines.append(f'{self.name}_count{_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs):
+        self.metrics.append(Counter(*args, **kwargs))
+        return self.metrics[-1]
+
+    def histogram(self, *args, **kwargs):
+        self.metrics.append(Histogram(*args, **kwargs))
+        return self.metrics[-1]
+
+    def render(self):
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+registry = Registry()
+REQUESTS = registry.counter('http_requests_total', 'Requests served.', ('endpoint', 'method', 'status'))
+LATENCY = registry.histogram('http_request_duration_seconds', 'Time to build the response.', ('endpoint', 'method'))
+QUERIES = registry.histogram('http_request_sql_queries', 'SQL statements per request.', ('endpoint',), QUERY_BUCKETS)
+PHASES = registry.counter('http_request_phase_seconds_total',
+                          'Time spent in SQL, serialization, JSON encoding, compression and bcrypt.',
+                          ('endpoint', 'phase'))
+
+
+class RequestTimings:
+    """What one request spent its time on; lives in a context variable for the request."""
+
+    __slots__ = ('started', 'phases', 'active', 'queries', 'statements')
+
+    def __init__(self, record_statements=False):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.active = set()
+        self.queries = 0
+        # (engine, statement, parameters, seconds), only kept for the slow-request log
+        self.statements = [] if record_statements else None
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+_current = ContextVar('request_timings', default=None)
+
+
+def timed(phase):
+    """Decorator adding the wrapped call's duration to ``phase`` of the current request.
+
+    Re-entrant calls (nested ``to_dict()``) are only counted once.
+    """
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            timings = _current.get()
+            if timings is None or phase in timings.active:
+                return fn(*args, **kwargs)
+            timings.active.add(phase)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timings.active.discard(phase)
+                timings.add(phase, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def _instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        timings = _current.get()
+        if timings is not None:
+            timings.queries += 1
+            timings.add('sql', elapsed)
+            if timings.statements is not None and not executemany:
+                timings.statements.append((engine, statement, parameters, elapsed))
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_started'):
+            connection.info['query_started'].pop()
+
+
+def _plan(engine, statement, parameters):
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    try:
+        with engine.connect() as connection:
+            rows = connection.exec_driver_sql(prefix + statement, parameters).fetchall()
+    except Exception as e:
+        return [f'(no plan: {e})']
+    return [' '.join(str(value) for value in row) for row in rows]
+
+
+def _log_slow_request(timings, total):
+    path = request.full_path.rstrip('?')
+    lines = [f'Slow request: {request.method} {path} {total * 1000:.1f} ms, '
+             f'{timings.queries} queries, {timings.phases.get("sql", 0.0) * 1000:.1f} ms SQL']
+    for engine, statement, parameters, elapsed in sorted(timings.statements, key=lambda item: -item[3]):
+        lines.append(f'  {elapsed * 1000:.1f} ms: {" ".join(statement.split())}  {parameters!r}')
+        if statement.lstrip()[:6].upper() == 'SELECT':
+            lines.extend(f'      {step}' for step in _plan(engine, statement, parameters))
+    current_app.logger.warning('\n'.join(lines))
+
+
+def server_timing(timings, total):
+    parts = [f'total;dur={total * 1000:.1f}']
+    for phase in ('sql', 'serialize', 'encode', 'compress', 'bcrypt'):
+        if phase in timings.phases:
+            desc = f';desc="{timings.queries} queries"' if phase == 'sql' else ''
+            parts.append(f'{phase};dur={timings.phases[phase] * 1000:.1f}{desc}')
+    return ', '.join(parts)
+
+
+def init_app(app, db):
+    """Instrument ``app`` and every engine ``db`` has for it."""
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        _instrument_engine(engine)
+
+    slow_seconds = app.config['SLOW_REQUEST_MS'] / 1000
+
+    @app.before_request
+    def _start_timing():
+        _current.set(RequestTimings(record_statements=slow_seconds > 0))
+
+    @app.after_request
+    def _record_timing(response):
+        timings = _current.get()
+        if timings is None:
+            return response
+        total = time.perf_counter() - timings.started
+        endpoint = request.endpoint or 'unmatched'
+        REQUESTS.inc((endpoint, request.method, response.status_code))
+        LATENCY.observe(total, (endpoint, request.method))
+        QUERIES.observe(timings.queries, (endpoint,))
+        for phase, seconds in timings.phases.items():
+            PHASES.inc((endpoint, phase), seconds)
+        if app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = server_timing(timings, total)
+        if slow_seconds and total >= slow_seconds:
+            _log_slow_request(timings, total)
+        return response
+
+    @app.teardown_request
+    def _stop_timing(exception):
+        _current.set(None)
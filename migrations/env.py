@@ -90,13 +90,25 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # The FTS5 search tables and their shadow tables (search.py) are created
+    # by raw DDL, not the models' metadata; autogenerate must not drop them
+    def include_name(name, type_, parent_names):
+        return not (type_ == 'table' and (name.endswith('_fts') or '_fts_' in name))
+
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_name") is None:
+        conf_args["include_name"] = include_name
 
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            # Batch operations rebuild tables by copy-and-drop, which foreign key
+            # enforcement would block; the pragma only applies outside a transaction
+            connection.connection.driver_connection.execute('PRAGMA foreign_keys = OFF')
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
@@ -106,6 +118,9 @@ def run_migrations_online():
         with context.begin_transaction():
             context.run_migrations()
 
+        if sqlite:
+            connection.connection.driver_connection.execute('PRAGMA foreign_keys = ON')
+
 
 if context.is_offline_mode():
     run_migrations_offline()
@@ -0,0 +1,33 @@
+"""Add appointment calendar indexes
+
+Revision ID: 3f9a2c1d7e4b
+Revises: b43b96f5728a
+Create Date: 2026-10-17 09:12:44.518203
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a2c1d7e4b'
+down_revision = 'b43b96f5728a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.create_index('ix_appointments_doctor_id_date_time', ['doctor_id', 'date', 'time'], unique=False)
+        batch_op.create_index('ix_appointments_user_id_date', ['user_id', 'date'], unique=False)
+
+    with op.batch_alter_table('prescriptions', schema=None) as batch_op:
+        batch_op.create_index('ix_prescriptions_appointment_id', ['appointment_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('prescriptions', schema=None) as batch_op:
+        batch_op.drop_index('ix_prescriptions_appointment_id')
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointments_user_id_date')
+        batch_op.drop_index('ix_appointments_doctor_id_date_time')
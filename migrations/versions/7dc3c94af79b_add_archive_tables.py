@@ -0,0 +1,62 @@
+"""Add archive tables
+
+Revision ID: 7dc3c94af79b
+Revises: a5c2e8f04b71
+Create Date: 2026-10-17 15:51:47.700312
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7dc3c94af79b'
+down_revision = 'a5c2e8f04b71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('appointments_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('time', sa.Time(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['doctor_id'], ['doctors.id'], name='fk_appointments_archive_doctor_id'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='fk_appointments_archive_user_id'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('appointments_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_appointments_archive_doctor_id_date_time', ['doctor_id', 'date', 'time'], unique=False)
+        batch_op.create_index('ix_appointments_archive_user_id_date', ['user_id', 'date'], unique=False)
+
+    op.create_table('prescriptions_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('appointment_id', sa.Integer(), nullable=False),
+    sa.Column('medicine', sa.String(), nullable=False),
+    sa.Column('dosage', sa.String(), nullable=False),
+    sa.Column('instructions', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['appointment_id'], ['appointments_archive.id'], name='fk_prescriptions_archive_appointment_id'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('prescriptions_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_prescriptions_archive_appointment_id', ['appointment_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('prescriptions_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_prescriptions_archive_appointment_id')
+
+    op.drop_table('prescriptions_archive')
+    with op.batch_alter_table('appointments_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointments_archive_user_id_date')
+        batch_op.drop_index('ix_appointments_archive_doctor_id_date_time')
+
+    op.drop_table('appointments_archive')
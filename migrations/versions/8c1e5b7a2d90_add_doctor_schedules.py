@@ -0,0 +1,53 @@
+"""Add doctor schedules and slot uniqueness
+
+Revision ID: 8c1e5b7a2d90
+Revises: 3f9a2c1d7e4b
+Create Date: 2026-10-17 11:02:17.304861
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1e5b7a2d90'
+down_revision = '3f9a2c1d7e4b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('working_hours',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('weekday', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.Time(), nullable=False),
+    sa.Column('end_time', sa.Time(), nullable=False),
+    sa.ForeignKeyConstraint(['doctor_id'], ['doctors.id'], name='fk_working_hours_doctor_id'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('working_hours', schema=None) as batch_op:
+        batch_op.create_index('ix_working_hours_doctor_id', ['doctor_id'], unique=False)
+
+    with op.batch_alter_table('doctors', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('slot_minutes', sa.Integer(), server_default='30', nullable=False))
+
+    # Fails if a doctor already holds two live bookings at the same start time;
+    # cancel or move the duplicates before upgrading.
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.create_index('uq_appointments_doctor_slot', ['doctor_id', 'date', 'time'], unique=True,
+                              sqlite_where=sa.text("status != 'Cancelled'"),
+                              postgresql_where=sa.text("status != 'Cancelled'"))
+
+
+def downgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_index('uq_appointments_doctor_slot')
+
+    with op.batch_alter_table('doctors', schema=None) as batch_op:
+        batch_op.drop_column('slot_minutes')
+
+    with op.batch_alter_table('working_hours', schema=None) as batch_op:
+        batch_op.drop_index('ix_working_hours_doctor_id')
+
+    op.drop_table('working_hours')
@@ -0,0 +1,67 @@
+"""Never reuse appointment and prescription ids
+
+Revision ID: 9e4b7d2a6c18
+Revises: c36c7ce19564
+Create Date: 2026-10-17 18:02:11.604927
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b7d2a6c18'
+down_revision = 'c36c7ce19564'
+branch_labels = None
+depends_on = None
+
+# hot table -> its archive, whose ids the hot table must never hand out again
+TABLES = {
+    'appointments': 'appointments_archive',
+    'prescriptions': 'prescriptions_archive',
+}
+
+
+def rebuild(autoincrement):
+    """Recreate the hot tables with or without AUTOINCREMENT (SQLite only).
+
+    A rebuild drops the triggers on the tables, and renaming the copy into
+    place fails while other tables' triggers name a table that is briefly
+    missing, so every trigger is dropped first and created again after.
+    Indexes are checked the same way, in case a rebuild did not carry one over.
+    """
+    bind = op.get_bind()
+    saved = bind.execute(sa.text(
+        "SELECT type, name, sql FROM sqlite_master WHERE type IN ('trigger', 'index') AND sql IS NOT NULL "
+        "AND (type = 'trigger' OR tbl_name IN :tables)").bindparams(sa.bindparam('tables', expanding=True)),
+        {'tables': list(TABLES)}).all()
+    for type_, name, _ in saved:
+        if type_ == 'trigger':
+            op.execute(f'DROP TRIGGER {name}')
+    for table in TABLES:
+        with op.batch_alter_table(table, recreate='always',
+                                  table_kwargs={'sqlite_autoincrement': autoincrement}):
+            pass
+    existing = set(bind.execute(sa.text('SELECT name FROM sqlite_master')).scalars())
+    for _, name, sql in saved:
+        if name not in existing:
+            op.execute(sql)
+
+
+def upgrade():
+    # Server databases draw ids from sequences, which never go back
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    rebuild(True)
+    # Continue after the highest id ever used, archived rows included
+    for table, archive in TABLES.items():
+        op.execute(f"INSERT INTO sqlite_sequence (name, seq) SELECT '{table}', 0 "
+                   f"WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = '{table}')")
+        op.execute(f"UPDATE sqlite_sequence SET seq = max(seq, coalesce((SELECT max(id) FROM {table}), 0), "
+                   f"coalesce((SELECT max(id) FROM {archive}), 0)) WHERE name = '{table}'")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    rebuild(False)
@@ -0,0 +1,119 @@
+"""Add analytics rollups
+
+Revision ID: a5c2e8f04b71
+Revises: f3a8c5d19e62
+Create Date: 2026-10-17 17:20:44.106392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5c2e8f04b71'
+down_revision = 'f3a8c5d19e62'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'metric, scope, scope_key, day, bucket, count'
+UPSERT = (f'INSERT INTO analytics_rollups ({COLUMNS}) {{select}} '
+          'ON CONFLICT (metric, scope, scope_key, day, bucket) DO UPDATE SET count = count + excluded.count;')
+FANOUT = ("CROSS JOIN (SELECT 'doctor' AS scope UNION ALL SELECT 'specialty' UNION ALL SELECT 'all') s "
+          "CROSS JOIN (SELECT 0 AS whole UNION ALL SELECT 1) p")
+SCOPE_KEY = "CASE s.scope WHEN 'doctor' THEN CAST(doc.id AS TEXT) WHEN 'specialty' THEN doc.specialty ELSE '' END"
+
+
+def contribution(metric, bucket, day, sign, source, where):
+    return UPSERT.format(select=(
+        f"SELECT '{metric}', s.scope, {SCOPE_KEY}, CASE p.whole WHEN 1 THEN '' ELSE {day} END, {bucket}, {sign} "
+        f'FROM {source} {FANOUT} WHERE {where}'))
+
+
+def appointment(row, sign):
+    return contribution('appointments', f'{row}.status', f'{row}.date', sign, 'doctors doc', f'doc.id = {row}.doctor_id')
+
+
+def prescription(row, sign):
+    return contribution('prescriptions', f'{row}.medicine', 'a.date', sign,
+                        'appointments a JOIN doctors doc ON doc.id = a.doctor_id', f'a.id = {row}.appointment_id')
+
+
+def moved_prescriptions(row, sign):
+    return contribution('prescriptions', 'pr.medicine', f'{row}.date', sign,
+                        f'prescriptions pr JOIN doctors doc ON doc.id = {row}.doctor_id', f'pr.appointment_id = {row}.id')
+
+
+def respecialize(specialty, sign):
+    return UPSERT.format(select=(
+        f"SELECT metric, 'specialty', {specialty}, day, bucket, {sign} * count FROM analytics_rollups "
+        "WHERE scope = 'doctor' AND scope_key = CAST(old.id AS TEXT)"))
+
+
+# name -> (event, table, body, WHEN condition)
+TRIGGERS = {
+    'appointments_insert': ('AFTER INSERT', 'appointments', appointment('new', 1), None),
+    'appointments_delete': ('AFTER DELETE', 'appointments', appointment('old', -1), None),
+    'appointments_update': ('AFTER UPDATE OF doctor_id, date, status', 'appointments',
+                            appointment('old', -1) + ' ' + appointment('new', 1),
+                            'old.doctor_id IS NOT new.doctor_id OR old.date IS NOT new.date OR old.status IS NOT new.status'),
+    'appointments_move': ('AFTER UPDATE OF doctor_id, date', 'appointments',
+                          moved_prescriptions('old', -1) + ' ' + moved_prescriptions('new', 1),
+                          'old.doctor_id IS NOT new.doctor_id OR old.date IS NOT new.date'),
+    'prescriptions_insert': ('AFTER INSERT', 'prescriptions', prescription('new', 1), None),
+    'prescriptions_delete': ('AFTER DELETE', 'prescriptions', prescription('old', -1), None),
+    'prescriptions_update': ('AFTER UPDATE OF appointment_id, medicine', 'prescriptions',
+                             prescription('old', -1) + ' ' + prescription('new', 1),
+                             'old.appointment_id IS NOT new.appointment_id OR old.medicine IS NOT new.medicine'),
+    'doctors_specialty': ('AFTER UPDATE OF specialty', 'doctors',
+                          respecialize('old.specialty', -1) + ' ' + respecialize('new.specialty', 1),
+                          'old.specialty IS NOT new.specialty'),
+}
+
+# Backfill: per doctor and day from the source tables, then the coarser rows from those
+BACKFILL = [
+    f"INSERT INTO analytics_rollups ({COLUMNS}) SELECT 'appointments', 'doctor', CAST(doctor_id AS TEXT), "
+    'CAST(date AS TEXT), status, count(*) FROM appointments GROUP BY doctor_id, date, status',
+    f"INSERT INTO analytics_rollups ({COLUMNS}) SELECT 'prescriptions', 'doctor', CAST(a.doctor_id AS TEXT), "
+    'CAST(a.date AS TEXT), pr.medicine, count(*) FROM prescriptions pr JOIN appointments a ON a.id = pr.appointment_id '
+    'GROUP BY a.doctor_id, a.date, pr.medicine',
+    f"INSERT INTO analytics_rollups ({COLUMNS}) SELECT r.metric, 'specialty', doc.specialty, r.day, r.bucket, sum(r.count) "
+    "FROM analytics_rollups r JOIN doctors doc ON CAST(doc.id AS TEXT) = r.scope_key WHERE r.scope = 'doctor' "
+    'GROUP BY r.metric, doc.specialty, r.day, r.bucket',
+    f"INSERT INTO analytics_rollups ({COLUMNS}) SELECT metric, 'all', '', day, bucket, sum(count) "
+    "FROM analytics_rollups WHERE scope = 'specialty' GROUP BY metric, day, bucket",
+    f"INSERT INTO analytics_rollups ({COLUMNS}) SELECT metric, scope, scope_key, '', bucket, sum(count) "
+    'FROM analytics_rollups GROUP BY metric, scope, scope_key, bucket',
+]
+
+
+def upgrade():
+    op.create_table('analytics_rollups',
+    sa.Column('metric', sa.String(), nullable=False),
+    sa.Column('scope', sa.String(), nullable=False),
+    sa.Column('scope_key', sa.String(), nullable=False),
+    sa.Column('day', sa.String(), nullable=False),
+    sa.Column('bucket', sa.String(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('metric', 'scope', 'scope_key', 'day', 'bucket')
+    )
+    with op.batch_alter_table('analytics_rollups', schema=None) as batch_op:
+        batch_op.create_index('ix_analytics_rollups_metric_scope_day', ['metric', 'scope', 'day'], unique=False)
+
+    # Other databases have no triggers: flask analytics rebuild refreshes them
+    for statement in BACKFILL:
+        op.execute(statement)
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for name, (event, table, body, when) in TRIGGERS.items():
+        condition = f' WHEN {when}' if when else ''
+        op.execute(f'CREATE TRIGGER analytics_{name} {event} ON {table}{condition} BEGIN {body} END')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for name in reversed(list(TRIGGERS)):
+            op.execute(f'DROP TRIGGER IF EXISTS analytics_{name}')
+    with op.batch_alter_table('analytics_rollups', schema=None) as batch_op:
+        batch_op.drop_index('ix_analytics_rollups_metric_scope_day')
+
+    op.drop_table('analytics_rollups')
@@ -0,0 +1,99 @@
+"""Add patient medications
+
+Revision ID: c36c7ce19564
+Revises: 7dc3c94af79b
+Create Date: 2026-10-17 16:18:13.500681
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c36c7ce19564'
+down_revision = '7dc3c94af79b'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('user_id, medicine, prescription_count, first_date, last_date, dosage, instructions, '
+           'doctor_id, appointment_id, prescription_id')
+
+
+def history(where):
+    return ' UNION ALL '.join(
+        'SELECT a.user_id, pr.medicine, a.date, a.time, a.doctor_id, pr.appointment_id, pr.id, pr.dosage, '
+        f'pr.instructions FROM {prescriptions} pr JOIN {appointments} a ON a.id = pr.appointment_id WHERE {where}'
+        for prescriptions, appointments in (('prescriptions', 'appointments'),
+                                            ('prescriptions_archive', 'appointments_archive')))
+
+
+def fill(where):
+    return (f'INSERT INTO patient_medications ({COLUMNS}) SELECT user_id, medicine, n, first_date, date, dosage, '
+            'instructions, doctor_id, appointment_id, id FROM (SELECT h.*, count(*) OVER pair AS n, '
+            'min(h.date) OVER pair AS first_date, '
+            'row_number() OVER (pair ORDER BY h.date DESC, h.time DESC, h.id DESC) AS latest '
+            f'FROM ({history(where)}) h WINDOW pair AS (PARTITION BY h.user_id, h.medicine)) ranked '
+            'WHERE latest = 1;')
+
+
+def refresh(users, medicines):
+    return (f'DELETE FROM patient_medications WHERE user_id IN {users} AND medicine IN {medicines}; '
+            + fill(f'a.user_id IN {users} AND pr.medicine IN {medicines}'))
+
+
+def prescription(row):
+    return refresh(f'(SELECT user_id FROM appointments WHERE id = {row}.appointment_id)', f'({row}.medicine)')
+
+
+# name -> (event, table, body, WHEN condition)
+TRIGGERS = {
+    'prescriptions_insert': ('AFTER INSERT', 'prescriptions', prescription('new'), None),
+    'prescriptions_delete': ('AFTER DELETE', 'prescriptions', prescription('old'), None),
+    'prescriptions_update': ('AFTER UPDATE OF appointment_id, medicine, dosage, instructions', 'prescriptions',
+                             prescription('old') + ' ' + prescription('new'),
+                             'old.appointment_id IS NOT new.appointment_id OR old.medicine IS NOT new.medicine '
+                             'OR old.dosage IS NOT new.dosage OR old.instructions IS NOT new.instructions'),
+    'appointments_update': ('AFTER UPDATE OF user_id, doctor_id, date, time', 'appointments',
+                            refresh('(old.user_id, new.user_id)',
+                                    '(SELECT medicine FROM prescriptions WHERE appointment_id = new.id)'),
+                            'old.user_id IS NOT new.user_id OR old.doctor_id IS NOT new.doctor_id '
+                            'OR old.date IS NOT new.date OR old.time IS NOT new.time'),
+}
+
+
+def upgrade():
+    op.create_table('patient_medications',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('medicine', sa.String(), nullable=False),
+    sa.Column('prescription_count', sa.Integer(), nullable=False),
+    sa.Column('first_date', sa.Date(), nullable=False),
+    sa.Column('last_date', sa.Date(), nullable=False),
+    sa.Column('dosage', sa.String(), nullable=False),
+    sa.Column('instructions', sa.String(), nullable=False),
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('appointment_id', sa.Integer(), nullable=False),
+    sa.Column('prescription_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['doctor_id'], ['doctors.id'], name='fk_patient_medications_doctor_id'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='fk_patient_medications_user_id'),
+    sa.PrimaryKeyConstraint('user_id', 'medicine')
+    )
+    with op.batch_alter_table('patient_medications', schema=None) as batch_op:
+        batch_op.create_index('ix_patient_medications_medicine_user_id', ['medicine', 'user_id'], unique=False)
+
+    # Backfill; other databases have no triggers: flask medications rebuild refreshes them
+    op.execute(fill('1 = 1'))
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for name, (event, table, body, when) in TRIGGERS.items():
+        condition = f' WHEN {when}' if when else ''
+        op.execute(f'CREATE TRIGGER medications_{name} {event} ON {table}{condition} BEGIN {body} END')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for name in reversed(list(TRIGGERS)):
+            op.execute(f'DROP TRIGGER IF EXISTS medications_{name}')
+    with op.batch_alter_table('patient_medications', schema=None) as batch_op:
+        batch_op.drop_index('ix_patient_medications_medicine_user_id')
+
+    op.drop_table('patient_medications')
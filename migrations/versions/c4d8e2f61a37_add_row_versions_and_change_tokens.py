@@ -0,0 +1,41 @@
+"""Add row versions and change tokens
+
+Revision ID: c4d8e2f61a37
+Revises: 8c1e5b7a2d90
+Create Date: 2026-10-17 13:41:05.118472
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8e2f61a37'
+down_revision = '8c1e5b7a2d90'
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ('users', 'doctors', 'appointments', 'prescriptions')
+
+
+def upgrade():
+    for table in VERSIONED_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False))
+
+    op.create_table('change_tokens',
+    sa.Column('table_name', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+
+
+def downgrade():
+    op.drop_table('change_tokens')
+
+    for table in reversed(VERSIONED_TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
@@ -0,0 +1,50 @@
+"""Add full-text search indexes
+
+Revision ID: d7a3f9b2c815
+Revises: c4d8e2f61a37
+Create Date: 2026-10-17 15:12:40.273916
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3f9b2c815'
+down_revision = 'c4d8e2f61a37'
+branch_labels = None
+depends_on = None
+
+# source table -> indexed columns; FTS5 is SQLite only, other databases search unindexed
+INDEXES = {
+    'doctors': ('name', 'specialty'),
+    'prescriptions': ('medicine', 'instructions'),
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for source, columns in INDEXES.items():
+        name = f'{source}_fts'
+        names = ', '.join(columns)
+        new = ', '.join(f'new.{col}' for col in columns)
+        old = ', '.join(f'old.{col}' for col in columns)
+        delete = f"INSERT INTO {name}({name}, rowid, {names}) VALUES ('delete', old.id, {old});"
+        insert = f'INSERT INTO {name}(rowid, {names}) VALUES (new.id, {new});'
+        op.execute(f"CREATE VIRTUAL TABLE {name} USING fts5({names}, content='{source}', "
+                   f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')")
+        op.execute(f'CREATE TRIGGER {name}_insert AFTER INSERT ON {source} BEGIN {insert} END')
+        op.execute(f'CREATE TRIGGER {name}_delete AFTER DELETE ON {source} BEGIN {delete} END')
+        op.execute(f'CREATE TRIGGER {name}_update AFTER UPDATE OF {names} ON {source} BEGIN {delete} {insert} END')
+        # Index the rows that already exist
+        op.execute(f"INSERT INTO {name}({name}) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for source in reversed(list(INDEXES)):
+        name = f'{source}_fts'
+        for event in ('update', 'delete', 'insert'):
+            op.execute(f'DROP TRIGGER IF EXISTS {name}_{event}')
+        op.execute(f'DROP TABLE IF EXISTS {name}')
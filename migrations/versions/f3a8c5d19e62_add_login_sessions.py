@@ -0,0 +1,39 @@
+"""Add login sessions
+
+Revision ID: f3a8c5d19e62
+Revises: e1b6c04a9d27
+Create Date: 2026-10-17 16:31:05.918244
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8c5d19e62'
+down_revision = 'e1b6c04a9d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('login_sessions',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('principal_id', sa.Integer(), nullable=False),
+    sa.Column('principal', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('login_sessions', schema=None) as batch_op:
+        batch_op.create_index('ix_login_sessions_expires_at', ['expires_at'], unique=False)
+        batch_op.create_index('ix_login_sessions_kind_principal_id', ['kind', 'principal_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('login_sessions', schema=None) as batch_op:
+        batch_op.drop_index('ix_login_sessions_kind_principal_id')
+        batch_op.drop_index('ix_login_sessions_expires_at')
+
+    op.drop_table('login_sessions')
@@ -1,10 +1,42 @@
-from sqlalchemy_serializer import SerializerMixin
-from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy_serializer import SerializerMixin as BaseSerializerMixin
+from sqlalchemy import event
+from sqlalchemy.orm import declared_attr, object_session
+from datetime import datetime, timezone
 from config import db
-import bcrypt
+from hashing import hasher
+from metrics import timed
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class SerializerMixin(BaseSerializerMixin):
+    @timed('serialize')
+    def to_dict(self, *args, **kwargs):
+        return super().to_dict(*args, **kwargs)
+
+# Row versioning used for ETags / Last-Modified: bumped on every UPDATE
+class VersionedMixin:
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, server_default=db.func.current_timestamp())
+
+@event.listens_for(VersionedMixin, 'before_update', propagate=True)
+def bump_version(mapper, connection, target):
+    # Relationship-only changes (e.g. a doctor's working hours) still change the representation
+    session = object_session(target)
+    if session is None or session.is_modified(target):
+        target.version = (target.version or 0) + 1
+        target.updated_at = utcnow()
+
+# Optimistic locking for rows that are edited concurrently: the flush's UPDATE
+# also matches the version that was read and raises StaleDataError when
+# another writer got there first. bump_version supplies the new value.
+class OptimisticMixin(VersionedMixin):
+    @declared_attr.directive
+    def __mapper_args__(cls):
+        return {'version_id_col': cls.version, 'version_id_generator': False}
 
 # Define the User model
-class User(db.Model, SerializerMixin):
+class User(db.Model, VersionedMixin, SerializerMixin):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -16,7 +48,7 @@ class User(db.Model, SerializerMixin):
 
     appointments = db.relationship('Appointment', back_populates='user', cascade='all, delete-orphan')
 
-    serialize_rules = ('-password_hash', '-appointments.user',)
+    serialize_rules = ('-password_hash', '-version', '-updated_at', '-appointments.user',)
 
     @property
     def password(self):
@@ -24,13 +56,13 @@ class User(db.Model, SerializerMixin):
 
     @password.setter
     def password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password_hash = hasher.hash(password)
 
     def verify_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return hasher.verify(password, self.password_hash)
 
 # Define the Doctor model
-class Doctor(db.Model, SerializerMixin):
+class Doctor(db.Model, VersionedMixin, SerializerMixin):
     __tablename__ = 'doctors'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -39,10 +71,12 @@ class Doctor(db.Model, SerializerMixin):
     specialty = db.Column(db.String, nullable=False)
     experience_years = db.Column(db.Integer, nullable=False)
     availability = db.Column(db.String, nullable=False)
+    slot_minutes = db.Column(db.Integer, nullable=False, default=30, server_default='30')
 
     appointments = db.relationship('Appointment', back_populates='doctor', cascade='all, delete-orphan')
+    working_hours = db.relationship('WorkingHours', back_populates='doctor', cascade='all, delete-orphan')
 
-    serialize_rules = ('-password_hash', '-appointments.doctor',)
+    serialize_rules = ('-password_hash', '-version', '-updated_at', '-appointments.doctor', '-working_hours.doctor',)
 
     @property
     def password(self):
@@ -50,13 +84,13 @@ class Doctor(db.Model, SerializerMixin):
 
     @password.setter
     def password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password_hash = hasher.hash(password)
 
     def verify_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return hasher.verify(password, self.password_hash)
 
 # Define the Appointment model
-class Appointment(db.Model, SerializerMixin):
+class Appointment(db.Model, OptimisticMixin, SerializerMixin):
     __tablename__ = 'appointments'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', name='fk_appointments_user_id'), nullable=False)
@@ -65,14 +99,26 @@ class Appointment(db.Model, SerializerMixin):
     time = db.Column(db.Time, nullable=False)
     status = db.Column(db.String, nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_appointments_doctor_id_date_time', 'doctor_id', 'date', 'time'),
+        db.Index('ix_appointments_user_id_date', 'user_id', 'date'),
+        # A doctor can hold one live booking per start time; cancelled ones free the slot
+        db.Index('uq_appointments_doctor_slot', 'doctor_id', 'date', 'time', unique=True,
+                 sqlite_where=db.text("status != 'Cancelled'"),
+                 postgresql_where=db.text("status != 'Cancelled'")),
+        # Ids are never reused, even after the newest row is archived or deleted;
+        # the archive tables keep the ids rows had here
+        {'sqlite_autoincrement': True},
+    )
+
     user = db.relationship('User', back_populates='appointments')
     doctor = db.relationship('Doctor', back_populates='appointments')
     prescriptions = db.relationship('Prescription', back_populates='appointment', cascade='all, delete-orphan')
     
-    serialize_rules = ('-user.appointments', '-doctor.appointments', '-prescriptions.appointment',)
+    serialize_rules = ('-version', '-updated_at', '-user.appointments', '-doctor.appointments', '-prescriptions.appointment',)
 
 # Define the Prescription model
-class Prescription(db.Model, SerializerMixin):
+class Prescription(db.Model, OptimisticMixin, SerializerMixin):
     __tablename__ = 'prescriptions'
     id = db.Column(db.Integer, primary_key=True)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointments.id', name='fk_prescriptions_appointment_id'), nullable=False)
@@ -80,6 +126,167 @@ class Prescription(db.Model, SerializerMixin):
     dosage = db.Column(db.String, nullable=False)
     instructions = db.Column(db.String, nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_prescriptions_appointment_id', 'appointment_id'),
+        {'sqlite_autoincrement': True},
+    )
+
     appointment = db.relationship('Appointment', back_populates='prescriptions')
 
-    serialize_rules = ('-appointment.prescriptions',)
+    serialize_rules = ('-version', '-updated_at', '-appointment.prescriptions',)
+
+# Define the archive models: appointments moved out of the hot table by
+# archive.py once they are older than ARCHIVE_AFTER_DAYS, with their
+# prescriptions. Rows keep their ids, versions and timestamps; they are only
+# read, by the appointment and prescription endpoints given ?archived=1
+class ArchivedAppointment(db.Model, SerializerMixin):
+    __tablename__ = 'appointments_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', name='fk_appointments_archive_user_id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id', name='fk_appointments_archive_doctor_id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    time = db.Column(db.Time, nullable=False)
+    status = db.Column(db.String, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    __table_args__ = (
+        db.Index('ix_appointments_archive_doctor_id_date_time', 'doctor_id', 'date', 'time'),
+        db.Index('ix_appointments_archive_user_id_date', 'user_id', 'date'),
+    )
+
+    user = db.relationship('User')
+    doctor = db.relationship('Doctor')
+    prescriptions = db.relationship('ArchivedPrescription', back_populates='appointment')
+
+    serialize_rules = ('-version', '-updated_at', '-archived_at', '-user.appointments', '-doctor.appointments',
+                       '-prescriptions.appointment',)
+
+class ArchivedPrescription(db.Model, SerializerMixin):
+    __tablename__ = 'prescriptions_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointments_archive.id', name='fk_prescriptions_archive_appointment_id'), nullable=False)
+    medicine = db.Column(db.String, nullable=False)
+    dosage = db.Column(db.String, nullable=False)
+    instructions = db.Column(db.String, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_prescriptions_archive_appointment_id', 'appointment_id'),
+    )
+
+    appointment = db.relationship('ArchivedAppointment', back_populates='prescriptions')
+
+    serialize_rules = ('-version', '-updated_at', '-appointment.prescriptions',)
+
+# Define the PatientMedication model: a read model with one row per patient
+# and medicine they were ever prescribed, archived prescriptions included,
+# carrying the latest dosage. Written only by triggers (see medications.py)
+class PatientMedication(db.Model, SerializerMixin):
+    __tablename__ = 'patient_medications'
+    # Its rows change with these tables, so their change tokens validate its lists
+    derived_from = ('appointments', 'prescriptions')
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', name='fk_patient_medications_user_id'), primary_key=True)
+    medicine = db.Column(db.String, primary_key=True)
+    prescription_count = db.Column(db.Integer, nullable=False)
+    first_date = db.Column(db.Date, nullable=False)
+    last_date = db.Column(db.Date, nullable=False)
+    # From the latest prescription: the one whose appointment comes last
+    dosage = db.Column(db.String, nullable=False)
+    instructions = db.Column(db.String, nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id', name='fk_patient_medications_doctor_id'), nullable=False)
+    # No foreign keys: the appointment and prescription may have been archived
+    appointment_id = db.Column(db.Integer, nullable=False)
+    prescription_id = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_patient_medications_medicine_user_id', 'medicine', 'user_id'),
+    )
+
+    user = db.relationship('User')
+    doctor = db.relationship('Doctor')
+
+    serialize_rules = ('-user.appointments', '-doctor.appointments',)
+
+# Define the WorkingHours model: one row per doctor, weekday and shift
+class WorkingHours(db.Model, SerializerMixin):
+    __tablename__ = 'working_hours'
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id', name='fk_working_hours_doctor_id'), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_working_hours_doctor_id', 'doctor_id'),
+    )
+
+    doctor = db.relationship('Doctor', back_populates='working_hours')
+
+    serialize_rules = ('-doctor.working_hours',)
+
+# Define the ChangeToken model: one counter per table, bumped by every
+# transaction that writes to it, used as the collection-level ETag
+class ChangeToken(db.Model):
+    __tablename__ = 'change_tokens'
+    table_name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+# Define the OutboxMessage model: notifications written in the same commit as
+# the appointment change that caused them, delivered later by outbox.py
+class OutboxMessage(db.Model):
+    __tablename__ = 'outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String, nullable=False)
+    # No foreign key: the message outlives a deleted appointment
+    appointment_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String, nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Not delivered before this time: reminders, retry backoff and claim leases
+    available_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String)
+
+    __table_args__ = (
+        db.Index('ix_outbox_status_available_at', 'status', 'available_at'),
+    )
+
+class LoginSession(db.Model):
+    __tablename__ = 'login_sessions'
+    # Random token from the signed session cookie
+    id = db.Column(db.String, primary_key=True)
+    # 'user' or 'doctor'; no foreign key, revocation removes a deleted principal's rows
+    kind = db.Column(db.String, nullable=False)
+    principal_id = db.Column(db.Integer, nullable=False)
+    # Serialized principal returned by /check_session, cleared when the row behind it changes
+    principal = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_login_sessions_kind_principal_id', 'kind', 'principal_id'),
+        db.Index('ix_login_sessions_expires_at', 'expires_at'),
+    )
+
+# Define the AnalyticsRollup model: pre-aggregated counts behind /analytics,
+# maintained by triggers (see analytics.py)
+class AnalyticsRollup(db.Model):
+    __tablename__ = 'analytics_rollups'
+    # 'appointments' (bucket = status) or 'prescriptions' (bucket = medicine)
+    metric = db.Column(db.String, primary_key=True)
+    # 'doctor' (scope_key = doctor id), 'specialty' (scope_key = specialty) or 'all' (scope_key = '')
+    scope = db.Column(db.String, primary_key=True)
+    scope_key = db.Column(db.String, primary_key=True)
+    # YYYY-MM-DD of the appointment, or '' for the all-time total
+    day = db.Column(db.String, primary_key=True)
+    bucket = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_analytics_rollups_metric_scope_day', 'metric', 'scope', 'day'),
+    )
@@ -0,0 +1,405 @@
+# Transactional outbox: appointment notifications and reminders are written
+# in the same commit as the appointment, then delivered by `flask outbox run`
+import json
+import logging
+import os
+import random
+import signal
+import smtplib
+import sys
+import threading
+import time as clock
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta, timezone
+from email.message import EmailMessage
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, insert, inspect, update
+from sqlalchemy.orm import Session
+
+from config import db
+from models import Appointment, OutboxMessage, User, utcnow
+
+PENDING, SENT, FAILED, SKIPPED = 'pending', 'sent', 'failed', 'skipped'
+CREATED, UPDATED, DELETED, REMINDER = (
+    'appointment.created', 'appointment.updated', 'appointment.deleted', 'appointment.reminder')
+CANCELLED = 'Cancelled'
+FIELDS = ('id', 'user_id', 'doctor_id', 'date', 'time', 'status')
+CHUNK_SIZE = 500
+BACKOFF_BASE = 5  # seconds, doubled per failed attempt
+BACKOFF_MAX = 3600
+
+logger = logging.getLogger(__name__)
+
+Notification = namedtuple('Notification', ['id', 'topic', 'recipient', 'payload'])
+
+
+def _value(value):
+    if isinstance(value, time):
+        return value.strftime('%H:%M')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _appointment(appointment):
+    return {name: _value(getattr(appointment, name)) for name in FIELDS}
+
+
+def _starts_at(appointment):
+    """Start of the appointment in UTC; dates and times are stored in server-local time."""
+    local = datetime.combine(appointment.date, appointment.time).astimezone()
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _messages(appointment, topic, now, **extra):
+    """Outbox rows for one appointment change: the notification and, while
+    the appointment is live, a reminder that becomes due REMINDER_HOURS before it."""
+    payload = _appointment(appointment)
+    rows = [{'topic': topic, 'appointment_id': appointment.id, 'payload': {'appointment': payload, **extra},
+             'status': PENDING, 'attempts': 0, 'available_at': now, 'created_at': now}]
+    hours = current_app.config['REMINDER_HOURS']
+    if topic != DELETED and hours and appointment.status != CANCELLED:
+        starts_at = _starts_at(appointment)
+        if starts_at > now:
+            # Only the reminder matching the appointment's current version is
+            # sent; any later change enqueues a fresh one and retires this
+            rows.append({'topic': REMINDER, 'appointment_id': appointment.id,
+                         'payload': {'appointment': payload, 'version': appointment.version},
+                         'status': PENDING, 'attempts': 0, 'created_at': now,
+                         'available_at': max(now, starts_at - timedelta(hours=hours))})
+    return rows
+
+
+def _changes(appointment):
+    state = inspect(appointment)
+    changes = {}
+    for name in FIELDS[1:]:
+        history = state.attrs[name].history
+        if history.deleted:
+            changes[name] = [_value(history.deleted[0]), _value(getattr(appointment, name))]
+    return changes
+
+
+def _write(connection, rows):
+    if rows:
+        connection.execute(insert(OutboxMessage.__table__), rows)
+
+
+@event.listens_for(Session, 'after_flush')
+def _enqueue_appointment_changes(session, flush_context):
+    now, rows = utcnow(), []
+    for obj in session.new:
+        if isinstance(obj, Appointment):
+            rows.extend(_messages(obj, CREATED, now))
+    for obj in session.dirty:
+        if isinstance(obj, Appointment) and session.is_modified(obj):
+            changes = _changes(obj)
+            if changes:
+                rows.extend(_messages(obj, UPDATED, now, changes=changes))
+    for obj in session.deleted:
+        if isinstance(obj, Appointment):
+            rows.extend(_messages(obj, DELETED, now))
+    # Same connection, same transaction: the messages commit or roll back with the change
+    _write(session.connection(), rows)
+
+
+def snapshot(ids):
+    """The notified fields of appointments ``ids`` as stored, keyed by id; take
+    it before a bulk statement changes them and pass it to enqueue."""
+    ids, before = sorted(ids), {}
+    columns = [getattr(Appointment, name) for name in FIELDS]
+    for start in range(0, len(ids), CHUNK_SIZE):
+        for row in db.session.query(*columns).filter(Appointment.id.in_(ids[start:start + CHUNK_SIZE])):
+            before[row.id] = {name: _value(value) for name, value in zip(FIELDS, row)}
+    return before
+
+
+def enqueue(topic, ids, before=None):
+    """Enqueue ``topic`` for appointments written with bulk statements, which
+    bypass the flush hook. Call inside the writing transaction. With the
+    snapshot taken before an update, the messages carry its changes as the
+    flush hook's do."""
+    now, rows = utcnow(), []
+    ids = sorted(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        appointments = db.session.query(Appointment).filter(Appointment.id.in_(chunk)).populate_existing()
+        for appointment in appointments:
+            extra = {}
+            if before is not None:
+                old, new = before[appointment.id], _appointment(appointment)
+                extra['changes'] = {name: [old[name], new[name]] for name in FIELDS[1:] if old[name] != new[name]}
+            rows.extend(_messages(appointment, topic, now, **extra))
+    _write(db.session.connection(), rows)
+
+
+# Sinks: anything with send(notification); raising means "retry later"
+
+class LogSink:
+    def send(self, notification):
+        logger.info('%s %s', notification.topic, json.dumps(notification.payload))
+
+
+class FileSink:
+    """Appends one JSON line per notification; a local stand-in for a real transport."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, notification):
+        line = json.dumps({**notification._asdict(), 'delivered_at': utcnow().isoformat()})
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+SUBJECTS = {
+    CREATED: 'Your appointment on {date} at {time} is booked',
+    UPDATED: 'Your appointment on {date} at {time} has changed',
+    DELETED: 'Your appointment on {date} at {time} was removed',
+    REMINDER: 'Reminder: appointment on {date} at {time}',
+}
+
+
+class SMTPSink:
+    """Emails the patient over one connection per batch."""
+
+    def __init__(self, host, port=25, sender='noreply@localhost', username=None, password=None,
+                 starttls=False, timeout=10):
+        self.host, self.port, self.sender = host, port, sender
+        self.username, self.password, self.starttls = username, password, starttls
+        self.timeout = timeout
+        self._smtp = None
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def send(self, notification):
+        if not notification.recipient:
+            return
+        appointment = notification.payload['appointment']
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = notification.recipient
+        message['Subject'] = SUBJECTS[notification.topic].format(**appointment)
+        message.set_content(json.dumps(notification.payload, indent=2))
+        try:
+            if self._smtp is None:
+                self._smtp = self._connect()
+            self._smtp.send_message(message)
+        except (OSError, smtplib.SMTPException):
+            self.close()
+            raise
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (OSError, smtplib.SMTPException):
+                pass
+            self._smtp = None
+
+
+def make_sink(config):
+    name = config['OUTBOX_SINK']
+    if name == 'smtp':
+        return SMTPSink(config['SMTP_HOST'], config['SMTP_PORT'], config['SMTP_SENDER'],
+                        config['SMTP_USERNAME'], config['SMTP_PASSWORD'], config['SMTP_STARTTLS'])
+    if name == 'file':
+        return FileSink(config['OUTBOX_FILE'] or os.path.join(current_app.instance_path, 'outbox.ndjson'))
+    if name == 'log':
+        return LogSink()
+    raise ValueError(f'Unknown OUTBOX_SINK {name!r}')
+
+
+class RateLimiter:
+    """Token bucket: at most ``rate`` sends per second, bursts of ``burst``."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = clock.monotonic()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = clock.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            clock.sleep((1 - self._tokens) / self.rate)
+
+
+class Dispatcher:
+    """Drains the outbox in batches: claim, deliver, record.
+
+    A claim pushes ``available_at`` out by a lease instead of holding a lock
+    while sending, so several dispatchers can run side by side and messages
+    claimed by a dispatcher that died are picked up again when the lease
+    runs out. Delivery is at least once; sinks get the message id to
+    deduplicate on.
+    """
+
+    def __init__(self, sink, batch_size=100, rate=20.0, max_attempts=8, lease=60):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(rate)
+        self.max_attempts = max_attempts
+        # Long enough to send a whole batch at the rate limit
+        self.lease = timedelta(seconds=max(lease, 2 * batch_size / rate if rate else 0))
+
+    def _claim(self):
+        now = utcnow()
+        rows = (db.session.query(OutboxMessage.id, OutboxMessage.topic, OutboxMessage.payload,
+                                 OutboxMessage.attempts)
+                .filter(OutboxMessage.status == PENDING, OutboxMessage.available_at <= now)
+                .order_by(OutboxMessage.available_at, OutboxMessage.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+                .all())
+        if rows:
+            db.session.execute(update(OutboxMessage).where(OutboxMessage.id.in_([row.id for row in rows]))
+                               .values(available_at=now + self.lease, attempts=OutboxMessage.attempts + 1))
+        db.session.commit()
+        return rows
+
+    def _context(self, rows):
+        """Recipients and the current state of reminded appointments for a batch: two IN queries."""
+        user_ids = {row.payload['appointment']['user_id'] for row in rows}
+        emails = dict(db.session.query(User.id, User.email).filter(User.id.in_(user_ids))) if user_ids else {}
+        reminded = {row.payload['appointment']['id'] for row in rows if row.topic == REMINDER}
+        current = {}
+        if reminded:
+            columns = [getattr(Appointment, name) for name in FIELDS]
+            for row in db.session.query(Appointment.version, *columns).filter(Appointment.id.in_(reminded)):
+                current[row.id] = {'appointment': _appointment(row), 'version': row.version}
+        db.session.commit()
+        return emails, current
+
+    def _backoff(self, attempts):
+        seconds = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+        return timedelta(seconds=seconds * random.uniform(0.5, 1.0))
+
+    def run_once(self):
+        """Deliver one batch; returns how many messages it handled."""
+        rows = self._claim()
+        if not rows:
+            return 0
+        emails, current = self._context(rows)
+        results = []
+        for row in rows:
+            appointment = row.payload['appointment']
+            # The whole snapshot, not only the version: SQLite can reuse a deleted row's id
+            if row.topic == REMINDER and current.get(appointment['id']) != row.payload:
+                # Changed, cancelled or deleted since: a newer reminder (if any) replaces it
+                results.append({'id': row.id, 'status': SKIPPED})
+                continue
+            self.limiter.acquire()
+            try:
+                self.sink.send(Notification(row.id, row.topic, emails.get(appointment['user_id']), row.payload))
+            except Exception as e:
+                attempts = row.attempts + 1
+                logger.warning('Outbox message %s failed (attempt %s): %s', row.id, attempts, e)
+                if attempts >= self.max_attempts:
+                    results.append({'id': row.id, 'status': FAILED, 'last_error': str(e)[:500]})
+                else:
+                    results.append({'id': row.id, 'status': PENDING, 'last_error': str(e)[:500],
+                                    'available_at': utcnow() + self._backoff(attempts)})
+                continue
+            results.append({'id': row.id, 'status': SENT, 'sent_at': utcnow()})
+        if hasattr(self.sink, 'close'):
+            self.sink.close()
+        # Bulk UPDATE by primary key, one executemany per shape of result
+        for keys in {tuple(sorted(result)) for result in results}:
+            db.session.execute(update(OutboxMessage), [result for result in results
+                                                        if tuple(sorted(result)) == keys])
+        db.session.commit()
+        return len(rows)
+
+    def run(self, interval=1.0, stop=None):
+        """Deliver until ``stop`` is set, sleeping ``interval`` seconds whenever the outbox is drained."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                handled = self.run_once()
+            except Exception:
+                db.session.rollback()
+                logger.exception('Outbox batch failed')
+                handled = 0
+            if handled < self.batch_size:
+                stop.wait(interval)
+
+
+@click.group('outbox')
+def outbox_command():
+    """Deliver appointment notifications and reminders."""
+
+
+@outbox_command.command('run')
+@click.option('--once', is_flag=True, help='Deliver what is due now and exit.')
+@click.option('--batch-size', type=int, help='Messages claimed per batch (default OUTBOX_BATCH_SIZE).')
+@click.option('--rate', type=float, help='Sends per second, 0 for no limit (default OUTBOX_RATE).')
+@click.option('--interval', default=1.0, show_default=True, help='Seconds to wait when the outbox is empty.')
+@with_appcontext
+def run_command(once, batch_size, rate, interval):
+    """Run the dispatcher until interrupted (SIGINT/SIGTERM finish the current batch)."""
+    config = current_app.config
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    dispatcher = Dispatcher(
+        make_sink(config),
+        batch_size=batch_size or config['OUTBOX_BATCH_SIZE'],
+        rate=config['OUTBOX_RATE'] if rate is None else rate,
+        max_attempts=config['OUTBOX_MAX_ATTEMPTS'],
+    )
+    # Claims read then write: take SQLite's write lock up front like write requests do
+    db.session.info['immediate'] = True
+    if once:
+        total = 0
+        while True:
+            handled = dispatcher.run_once()
+            total += handled
+            if handled < dispatcher.batch_size:
+                break
+        click.echo(f'Delivered {total} messages', file=sys.stderr)
+        return
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop.set())
+    dispatcher.run(interval, stop)
+
+
+@outbox_command.command('stats')
+@with_appcontext
+def stats_command():
+    """Messages per status, and how overdue the oldest pending one is."""
+    now = utcnow()
+    for status, count in db.session.query(OutboxMessage.status, func.count()).group_by(OutboxMessage.status):
+        click.echo(f'{status:<10}{count:>10}')
+    oldest = db.session.query(func.min(OutboxMessage.available_at)).filter(
+        OutboxMessage.status == PENDING, OutboxMessage.available_at <= now).scalar()
+    if oldest is not None:
+        click.echo(f'lag       {(now - oldest).total_seconds():>9.0f}s')
+
+
+@outbox_command.command('purge')
+@click.option('--days', default=7, show_default=True, help='Delete delivered messages older than this.')
+@with_appcontext
+def purge_command(days):
+    """Delete sent and skipped messages."""
+    cutoff = utcnow() - timedelta(days=days)
+    deleted = db.session.query(OutboxMessage).filter(
+        OutboxMessage.status.in_([SENT, SKIPPED]), OutboxMessage.created_at < cutoff).delete(
+        synchronize_session=False)
+    db.session.commit()
+    click.echo(f'Deleted {deleted} messages', file=sys.stderr)
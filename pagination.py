@@ -0,0 +1,137 @@
+# Keyset (cursor) pagination and query-string filters for the list endpoints
+import base64
+import json
+from datetime import date, time
+from urllib.parse import urlencode
+
+from flask import request
+from sqlalchemy import tuple_
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class QueryError(ValueError):
+    """Raised when a list request carries an invalid limit, cursor or filter."""
+
+
+def _dump(value):
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return value
+
+
+def _load(value, column):
+    python_type = column.type.python_type
+    if python_type is date:
+        return date.fromisoformat(value)
+    if python_type is time:
+        return time.fromisoformat(value)
+    return python_type(value)
+
+
+def encode_cursor(row, order_by, order=None):
+    values = [_dump(getattr(row, column.key)) for column in order_by]
+    if order is not None:
+        values.insert(0, order)
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, order_by, order=None):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if order is not None:
+            cursor_order, values = values[0], values[1:]
+    except (ValueError, TypeError, IndexError, KeyError):
+        raise QueryError('Invalid cursor')
+    if order is not None and cursor_order != order:
+        raise QueryError("The results are no longer in the cursor's order; start again without 'after'")
+    try:
+        if len(values) != len(order_by):
+            raise ValueError
+        return [_load(value, column) for value, column in zip(values, order_by)]
+    except (ValueError, TypeError):
+        raise QueryError('Invalid cursor')
+
+
+def parse_limit():
+    raw = request.args.get('limit')
+    if raw is None:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise QueryError("'limit' must be an integer")
+    if limit < 1:
+        raise QueryError("'limit' must be positive")
+    return min(limit, MAX_LIMIT)
+
+
+def parse_int(name, default, minimum, maximum):
+    raw = request.args.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise QueryError(f"'{name}' must be an integer")
+    if not minimum <= value <= maximum:
+        raise QueryError(f"'{name}' must be between {minimum} and {maximum}")
+    return value
+
+
+def parse_flag(name):
+    raw = request.args.get(name)
+    if raw is None:
+        return False
+    if raw in ('1', 'true'):
+        return True
+    if raw in ('0', 'false'):
+        return False
+    raise QueryError(f"'{name}' must be 1 or 0")
+
+
+def apply_filters(query, filters, args=None):
+    """Apply ``{arg: (column, operator, cast)}`` filters found in ``args`` (default: the query string)."""
+    args = request.args if args is None else args
+    for arg, (column, operator, cast) in filters.items():
+        raw = args.get(arg)
+        if raw is None:
+            continue
+        try:
+            value = cast(raw)
+        except ValueError:
+            raise QueryError(f"Invalid value for '{arg}'")
+        query = query.filter(operator(column, value))
+    return query
+
+
+def paginate(query, order_by, order=None):
+    """Return one page of ``query`` and the response headers pointing at the next.
+
+    ``order_by`` must end with a unique column (the primary key) so that the
+    ordering is total and a cursor always resumes exactly after the last row.
+    Each page is a single ``WHERE (cols) > (cursor) ORDER BY cols LIMIT n``
+    query, so cost does not grow with the size of the table or the page depth.
+    Where one request can be answered in more than one ordering, ``order``
+    names the one used; it is kept in the cursor and a cursor from another
+    ordering is refused.
+    """
+    limit = parse_limit()
+    after = request.args.get('after')
+    if after:
+        values = decode_cursor(after, order_by, order)
+        query = query.filter(tuple_(*order_by) > tuple_(*values))
+
+    rows = query.order_by(*order_by).limit(limit + 1).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], order_by, order)
+        args = request.args.to_dict()
+        args['after'] = next_cursor
+        headers['X-Next-Cursor'] = next_cursor
+        headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return rows, headers
@@ -0,0 +1,857 @@
+# HTTP resources; imported lazily by config.create_app
+from datetime import date
+
+from flask import Response, current_app, request, session, stream_with_context
+from flask_restful import Api, Resource
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.orm.exc import StaleDataError
+
+from config import db
+from models import (User, Doctor, Appointment, Prescription, WorkingHours, ArchivedAppointment, ArchivedPrescription,
+                    PatientMedication)
+from pagination import QueryError, apply_filters, paginate, parse_flag, parse_int
+from serializers import FIELDS, parse_view, view as compile_view
+from hashing import HashingBusy, hasher
+from bulk import BulkError, bulk_create, bulk_update, read_items, reference_errors
+from scheduling import availability, booking_conflicts
+from cache import cache
+from metrics import registry
+from conditional import (collection_validators, if_match_versions, not_modified, row_etag,
+                         row_validators, validator_headers)
+from encoding import output_json
+from export import FORMATS, export_query, gzip_stream, stream
+from filters import (APPOINTMENT_FILTERS, APPOINTMENT_ORDER, ARCHIVED_APPOINTMENT_FILTERS, ARCHIVED_APPOINTMENT_ORDER,
+                     ARCHIVED_CALENDAR_FILTERS, ARCHIVED_PRESCRIPTION_FILTERS, CALENDAR_FILTERS, DOCTOR_FILTERS,
+                     MEDICATION_FILTERS, PATIENT_MEDICATION_FILTERS, PATIENT_MEDICATION_ORDER, PRESCRIPTION_FILTERS)
+from medications import current_since
+from search import INDEXES, terms as search_terms
+from sessions import KINDS, session_store
+from schemas import APPOINTMENT, DOCTOR, LOGIN, PRESCRIPTION, SCHEDULE, SIGNUP, USER, ValidationError
+import analytics
+import outbox
+
+
+def represent(obj):
+    """The default flat representation of ``obj``, as a GET of the row returns it."""
+    return compile_view(type(obj)).one(obj)
+
+def cached_detail(model, view, object_id, etag):
+    """Serialized ``model`` row through the read-through cache, or None if missing.
+
+    The key includes the row's current ``etag``, read from the database, so a
+    write made by another process is never served from this one's cache
+    under the new ETag.
+    """
+    def build():
+        obj = model.query.options(*view.options).get(object_id)
+        return view.one(obj) if obj else None
+
+    name = f'{model.__name__.lower()}:{object_id}'
+    return cache.get_or_set(name, (name, *view.tables), etag, build)
+
+def detail_response(model, view, object_id):
+    """Conditional GET of one row: 304 when the client's validators still match."""
+    validators = row_validators(model, object_id, view)
+    if validators is None:
+        return None
+    headers = validator_headers(validators)
+    if not_modified(validators):
+        return {}, 304, headers
+    body = cached_detail(model, view, object_id, validators[0])
+    if body is None:
+        return None
+    return body, 200, headers
+
+def list_response(model, view, build, cached=None):
+    """Conditional GET of a page; ``build()`` returns ``(body, headers)`` and only runs on a miss.
+
+    With ``cached``, whole pages are kept in the read-through cache under
+    that name, keyed on the collection's ETag like cached_detail.
+    """
+    validators = collection_validators(model, view)
+    headers = validator_headers(validators)
+    if not_modified(validators):
+        return {}, 304, headers
+    if cached:
+        body, page_headers = cache.get_or_set(cached, (cached, *view.tables), validators[0], build)
+    else:
+        body, page_headers = build()
+    return body, 200, {**page_headers, **headers}
+
+def appointment_source(live_filters=APPOINTMENT_FILTERS, archived_filters=ARCHIVED_APPOINTMENT_FILTERS):
+    """``(model, filters, order)`` to read appointments from: the archive with ?archived=1."""
+    if parse_flag('archived'):
+        return ArchivedAppointment, archived_filters, ARCHIVED_APPOINTMENT_ORDER
+    return Appointment, live_filters, APPOINTMENT_ORDER
+
+def busy_response(error):
+    return {'error': str(error)}, 503, {'Retry-After': '1'}
+
+# Rows a foreign key column must point at; checked before the flush, since
+# with foreign_keys=ON the database would only answer with an IntegrityError
+APPOINTMENT_REFERENCES = {'user_id': User, 'doctor_id': Doctor}
+PRESCRIPTION_REFERENCES = {'appointment_id': Appointment}
+
+def load_body(schema, partial=False, references=None):
+    """The request's JSON body coerced by ``schema``; raises ValidationError.
+
+    ``references`` maps foreign key fields to the model whose row they must name.
+    """
+    data = schema.load(request.get_json(silent=True), partial)
+    errors = reference_errors(data, references) if references else None
+    if errors:
+        raise ValidationError(errors)
+    return data
+
+def slot_taken(error):
+    """Whether an IntegrityError is the uq_appointments_doctor_slot violation: a lost race for the slot."""
+    message = str(error.orig)
+    return 'uq_appointments_doctor_slot' in message or 'appointments.doctor_id, appointments.date' in message
+
+def invalid_response(error):
+    return {'error': 'Invalid request body', 'errors': error.errors}, 400
+
+def conflict_response(obj):
+    """409 for a write conditional on a version ``obj`` no longer has, with its current ETag."""
+    return ({'error': f'{type(obj).__name__} was changed by another request; fetch it and try again'},
+            409, {'ETag': row_etag(type(obj), obj.id, obj.version)})
+
+# Authentication and User Management. Each request hashes or checks a
+# password with bcrypt, so each one draws ``rate_cost`` tokens (see limits.py)
+class Signup(Resource):
+    rate_cost = 10
+
+    def post(self):
+        try:
+            data = load_body(SIGNUP)
+        except ValidationError as e:
+            return invalid_response(e)
+        password = data.pop('password')
+        new_user = User(**data)
+        try:
+            new_user.password = password
+        except HashingBusy as e:
+            return busy_response(e)
+        db.session.add(new_user)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return {'error': 'Email already registered'}, 409
+        return represent(new_user), 201
+
+class Login(Resource):
+    read_mostly = True
+    rate_cost = 10
+
+    def post(self):
+        try:
+            data = load_body(LOGIN)
+        except ValidationError as e:
+            return invalid_response(e)
+        user = User.query.filter_by(email=data['email']).first()
+        try:
+            verified = user is not None and user.verify_password(data['password'])
+            if verified and hasher.needs_rehash(user.password_hash):
+                user.password = data['password']
+                db.session.commit()
+        except HashingBusy as e:
+            return busy_response(e)
+        if verified:
+            session_store.login(user)
+            return represent(user), 200
+        return {'error': 'Invalid credentials'}, 401
+
+class DoctorLogin(Resource):
+    read_mostly = True
+    rate_cost = 10
+
+    def post(self):
+        try:
+            data = load_body(LOGIN)
+        except ValidationError as e:
+            return invalid_response(e)
+        doctor = Doctor.query.filter_by(email=data['email']).first()
+        try:
+            verified = doctor is not None and doctor.verify_password(data['password'])
+            if verified and hasher.needs_rehash(doctor.password_hash):
+                doctor.password = data['password']
+                db.session.commit()
+        except HashingBusy as e:
+            return busy_response(e)
+        if verified:
+            session_store.login(doctor)
+            return represent(doctor), 200
+        return {'error': 'Invalid credentials'}, 401
+
+class Logout(Resource):
+    def delete(self):
+        session_store.logout()
+        return {}, 204
+
+class CheckSession(Resource):
+    def get(self):
+        record = session_store.current()
+        if record is None:
+            return {}, 204
+        try:
+            if request.args.get('expand') or request.args.get('fields'):
+                model, view = KINDS[record.kind], parse_view(KINDS[record.kind])
+                validators = row_validators(model, record.principal_id, view)
+                body = cached_detail(model, view, record.principal_id, validators[0]) if validators else None
+            else:
+                # The principal cached with the session: no users/doctors query
+                body = session_store.principal(record)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+        return (body, 200) if body else ({}, 204)
+
+# Log out everywhere: end every session of the current user or doctor
+class Sessions(Resource):
+    def delete(self):
+        record = session_store.current()
+        if record is None:
+            return {'error': 'Not logged in'}, 401
+        revoked = session_store.revoke(record.kind, record.principal_id)
+        session.clear()
+        return {'revoked': revoked}, 200
+
+class ClearSession(Resource):
+    def delete(self):
+        session_store.logout()
+        session.clear()
+        return {}, 204
+
+# User Resource
+class UserResource(Resource):
+    # Pages of up to 500 rows, filtered, sorted and expanded
+    rate_cost = {'list': 5}
+
+    def get(self, user_id=None):
+        try:
+            view = parse_view(User)
+            if user_id:
+                return detail_response(User, view, user_id) or ({'error': 'User not found'}, 404)
+
+            def build():
+                users, headers = paginate(User.query.options(*view.options), (User.id,))
+                return view.many(users), headers
+
+            return list_response(User, view, build)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+
+    def put(self, user_id):
+        return self._update(user_id, partial=False)
+
+    def patch(self, user_id):
+        return self._update(user_id, partial=True)
+
+    def _update(self, user_id, partial):
+        try:
+            data = load_body(USER, partial)
+        except ValidationError as e:
+            return invalid_response(e)
+        user = User.query.get(user_id)
+        if not user:
+            return {'error': 'User not found'}, 404
+        password = data.pop('password', None)
+        for name, value in data.items():
+            setattr(user, name, value)
+        if password is not None:
+            try:
+                user.password = password
+            except HashingBusy as e:
+                db.session.rollback()
+                return busy_response(e)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return {'error': 'Email already registered'}, 409
+        if password is not None:
+            # Sessions on other devices end; this one stays logged in
+            record = session_store.current()
+            session_store.revoke('user', user_id, keep=record.id if record else None)
+        return represent(user), 200
+
+# Doctor Resource
+class DoctorResource(Resource):
+    # Pages of up to 500 rows, filtered, sorted and expanded
+    rate_cost = {'list': 5}
+
+    def get(self, doctor_id=None):
+        try:
+            view = parse_view(Doctor)
+            if doctor_id:
+                return detail_response(Doctor, view, doctor_id) or ({'error': 'Doctor not found'}, 404)
+
+            def build():
+                query = apply_filters(Doctor.query.options(*view.options), DOCTOR_FILTERS)
+                doctors, headers = paginate(query, (Doctor.id,))
+                return [view.many(doctors), headers]
+
+            # The directory is the most requested page: cache whole pages
+            return list_response(Doctor, view, build, cached='doctors')
+        except QueryError as e:
+            return {'error': str(e)}, 400
+
+    def post(self):
+        try:
+            data = load_body(DOCTOR)
+        except ValidationError as e:
+            return invalid_response(e)
+        password = data.pop('password')
+        new_doctor = Doctor(**data)
+        try:
+            new_doctor.password = password
+        except HashingBusy as e:
+            return busy_response(e)
+        db.session.add(new_doctor)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return {'error': 'Email already registered'}, 409
+        return represent(new_doctor), 201
+
+# Appointment Resource
+class AppointmentResource(Resource):
+    # Pages of up to 500 rows, filtered, sorted and expanded
+    rate_cost = {'list': 5}
+
+    def get(self, appointment_id=None):
+        try:
+            model, filters, order = appointment_source()
+            view = parse_view(model)
+            if appointment_id:
+                return detail_response(model, view, appointment_id) or ({'error': 'Appointment not found'}, 404)
+
+            def build():
+                query = apply_filters(model.query.options(*view.options), filters)
+                appointments, headers = paginate(query, order)
+                return view.many(appointments), headers
+
+            return list_response(model, view, build)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+
+    def post(self):
+        try:
+            data = load_body(APPOINTMENT, references=APPOINTMENT_REFERENCES)
+        except ValidationError as e:
+            return invalid_response(e)
+        try:
+            reason = booking_conflicts([(0, data)]).get(0)
+            if reason:
+                return {'error': reason}, 409
+
+            new_appointment = Appointment(**data)
+            db.session.add(new_appointment)
+            db.session.commit()
+            return represent(new_appointment), 201
+        except IntegrityError as e:
+            db.session.rollback()
+            if slot_taken(e):
+                # Lost a race for the slot: the partial unique index rejected it
+                return {'error': 'Slot already booked'}, 409
+            current_app.logger.exception('Failed to create appointment')
+            return {'error': 'Failed to create appointment'}, 400
+        except SQLAlchemyError:
+            # The message carries the SQL and its parameters: log it, never return it
+            db.session.rollback()
+            current_app.logger.exception('Failed to create appointment')
+            return {'error': 'Failed to create appointment'}, 500
+
+    def put(self, appointment_id):
+        return self._update(appointment_id, partial=False)
+
+    def patch(self, appointment_id):
+        return self._update(appointment_id, partial=True)
+
+    def _update(self, appointment_id, partial):
+        try:
+            data = load_body(APPOINTMENT, partial, APPOINTMENT_REFERENCES)
+        except ValidationError as e:
+            return invalid_response(e)
+        try:
+            appointment = Appointment.query.get(appointment_id)
+            if appointment:
+                versions = if_match_versions()
+                if versions is not None and appointment.version not in versions:
+                    return conflict_response(appointment)
+                # Only a booking that moves, or a cancelled one revived, needs a free slot
+                reason = booking_conflicts([(0, {**data, 'id': appointment.id})]).get(0)
+                if reason:
+                    return {'error': reason}, 409
+                # The slot check and the change notification need the row as it
+                # was; the flush's UPDATE still only matches the version read here
+                for name, value in data.items():
+                    setattr(appointment, name, value)
+                db.session.commit()
+                return represent(appointment), 200, {'ETag': row_etag(Appointment, appointment.id, appointment.version)}
+            return {'error': 'Appointment not found'}, 404
+        except IntegrityError as e:
+            db.session.rollback()
+            if slot_taken(e):
+                return {'error': 'Slot already booked'}, 409
+            current_app.logger.exception('Failed to update appointment')
+            return {'error': 'Failed to update appointment'}, 400
+        except StaleDataError:
+            db.session.rollback()
+            return conflict_response(Appointment.query.get(appointment_id))
+        except SQLAlchemyError:
+            db.session.rollback()
+            current_app.logger.exception('Failed to update appointment')
+            return {'error': 'Failed to update appointment'}, 500
+
+    def delete(self, appointment_id):
+        appointment = Appointment.query.get(appointment_id)
+        if appointment is None:
+            return {'error': 'Appointment not found'}, 404
+        versions = if_match_versions()
+        if versions is not None and appointment.version not in versions:
+            return conflict_response(appointment)
+        try:
+            db.session.delete(appointment)
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            current = Appointment.query.get(appointment_id)
+            if current is None:
+                return {'error': 'Appointment not found'}, 404
+            return conflict_response(current)
+        return {}, 204
+
+# Batch imports: JSON array or NDJSON body, per-item results, one transaction
+class AppointmentBulk(Resource):
+    rate_cost = 20
+    references = APPOINTMENT_REFERENCES
+
+    def post(self):
+        return run_bulk(bulk_create, Appointment, APPOINTMENT, self.references,
+                        lambda ids: outbox.enqueue(outbox.CREATED, ids), booking_conflicts)
+
+    def put(self):
+        before = {}
+        return run_bulk(bulk_update, Appointment, APPOINTMENT, self.references,
+                        lambda ids: outbox.enqueue(outbox.UPDATED, ids, before), booking_conflicts,
+                        before_write=lambda ids: before.update(outbox.snapshot(ids)))
+
+class PrescriptionBulk(Resource):
+    rate_cost = 20
+    references = PRESCRIPTION_REFERENCES
+
+    def post(self):
+        return run_bulk(bulk_create, Prescription, PRESCRIPTION, self.references)
+
+    def put(self):
+        return run_bulk(bulk_update, Prescription, PRESCRIPTION, self.references)
+
+def run_bulk(operation, model, schema, references, after_write=None, check=None, **options):
+    try:
+        body, status = operation(model, read_items(), schema, references, after_write, check, **options)
+        # Bulk statements bypass the session hooks that keep the index and cache current
+        if model is Appointment:
+            availability.reset()
+        name = model.__name__.lower()
+        cache.invalidate(model.__tablename__, *(f"{name}:{result['id']}" for result in body['results']
+                                                 if result['status'] == 200))
+        return body, status
+    except BulkError as e:
+        return {'error': str(e)}, 400
+    except SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.exception('Bulk %s failed', model.__tablename__)
+        return {'error': 'Batch failed, nothing was written'}, 500
+
+# Streaming exports for reporting jobs: ?format=ndjson|csv, list filters, after=<id>, limit
+class Export(Resource):
+    # Streams for as long as the client keeps reading
+    request_timeout = None
+    rate_cost = 50
+
+    def get(self, table):
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in FORMATS:
+            return {'error': f"'format' must be one of {', '.join(FORMATS)}"}, 400
+        try:
+            after = parse_int('after', None, 0, 2 ** 63 - 1)
+            limit = parse_int('limit', None, 1, 2 ** 63 - 1)
+            names, query = export_query(table, request.args, after, limit)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+        chunks = stream(table, names, query, fmt)
+        headers = {'Content-Disposition': f'attachment; filename={table}.{fmt}', 'Vary': 'Accept-Encoding'}
+        if request.accept_encodings.quality('gzip') > 0:
+            chunks = gzip_stream(chunks)
+            headers['Content-Encoding'] = 'gzip'
+        return Response(stream_with_context(chunks), mimetype=FORMATS[fmt], headers=headers)
+
+# Ranked prefix search: ?q=card smi plus the list filters, pagination and views
+class Search(Resource):
+    rate_cost = 5
+    filters = {'doctors': DOCTOR_FILTERS, 'prescriptions': PRESCRIPTION_FILTERS}
+
+    def get(self, table):
+        text = request.args.get('q', '').strip()
+        if not text:
+            return {'error': "'q' is required"}, 400
+        if not search_terms(text):
+            return {'error': "'q' must contain a letter or digit"}, 400
+        index = INDEXES[table]
+        try:
+            view = parse_view(index.model)
+
+            def build():
+                query, order_by, order = index.query(db.session, text)
+                query = apply_filters(query.options(*view.options), self.filters[table])
+                # The order turns over when the matches cross RANK_LIMIT; a
+                # cursor from the other one would skip or repeat rows
+                rows, headers = paginate(query, order_by, order)
+                return view.many(row[0] for row in rows), headers
+
+            return list_response(index.model, view, build)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+
+# Aggregates read from the analytics rollups, so cost does not grow with history:
+# ?doctor_id= or ?specialty= (everyone by default), optional date_from/date_to
+class AppointmentAnalytics(Resource):
+    def get(self):
+        try:
+            scope, key = analytics.subject(request.args)
+            start, end = analytics.date_range(request.args)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        body = analytics.appointments(db.session, scope, key, start, end)
+        return {**analytics_period(start, end), **body}, 200
+
+class SpecialtyAnalytics(Resource):
+    def get(self):
+        try:
+            start, end = analytics.date_range(request.args)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        counts = analytics.by_key(db.session, analytics.SPECIALTY, None, start, end)
+        return [{'specialty': specialty, **body} for specialty, body in counts.items()], 200
+
+class DoctorAnalytics(Resource):
+    def get(self):
+        try:
+            start, end = analytics.date_range(request.args)
+            query = apply_filters(db.session.query(Doctor.id, Doctor.name, Doctor.specialty), DOCTOR_FILTERS)
+            doctors, headers = paginate(query, (Doctor.id,))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        counts = analytics.by_key(db.session, analytics.DOCTOR, [str(doctor.id) for doctor in doctors], start, end)
+        return [{'doctor_id': doctor.id, 'name': doctor.name, 'specialty': doctor.specialty, **counts[str(doctor.id)]}
+                for doctor in doctors], 200, headers
+
+class PrescriptionAnalytics(Resource):
+    def get(self):
+        try:
+            scope, key = analytics.subject(request.args)
+            start, end = analytics.date_range(request.args)
+            limit = parse_int('limit', 50, 1, 500)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        medicines = analytics.medicines(db.session, scope, key, start, end, limit)
+        return {**analytics_period(start, end), 'medicines': medicines}, 200
+
+def analytics_period(start, end):
+    if start is None:
+        return {'date_from': None, 'date_to': None}
+    return {'date_from': start.isoformat(), 'date_to': end.isoformat()}
+
+# Scrapes and probes are never limited
+class Metrics(Resource):
+    rate_cost = 0
+
+    def get(self):
+        # Per-process counters: scrape every worker, or run a single one per port
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Liveness: the process answers. Readiness: so does every database bind, with
+# the schema in place; a load balancer should only route to ready workers
+class Health(Resource):
+    rate_cost = 0
+
+    def get(self):
+        return {'status': 'ok'}, 200
+
+class Readiness(Resource):
+    rate_cost = 0
+
+    def get(self):
+        checks = {}
+        for key, engine in db.engines.items():
+            try:
+                with engine.connect() as connection:
+                    connection.execute(select(User.id).limit(1))
+                checks[key or 'primary'] = 'ok'
+            except SQLAlchemyError as e:
+                current_app.logger.warning('Readiness check failed for %s: %s', key or 'primary', e)
+                checks[key or 'primary'] = 'unavailable'
+        ready = all(state == 'ok' for state in checks.values())
+        return {'status': 'ok' if ready else 'unavailable', 'checks': checks}, 200 if ready else 503
+
+# Scheduling: working hours and free slots
+class DoctorScheduleResource(Resource):
+    def get(self, doctor_id):
+        doctor = Doctor.query.get(doctor_id)
+        if not doctor:
+            return {'error': 'Doctor not found'}, 404
+        return schedule_to_dict(doctor), 200
+
+    def put(self, doctor_id):
+        try:
+            data = load_body(SCHEDULE)
+            for index, shift in enumerate(data['working_hours']):
+                if shift['start_time'] >= shift['end_time']:
+                    raise ValidationError({'working_hours': {index: {'end_time': 'must be after start_time'}}})
+        except ValidationError as e:
+            return invalid_response(e)
+        doctor = Doctor.query.get(doctor_id)
+        if not doctor:
+            return {'error': 'Doctor not found'}, 404
+        doctor.slot_minutes = data.get('slot_minutes', doctor.slot_minutes)
+        doctor.working_hours = [WorkingHours(**shift) for shift in data['working_hours']]
+        db.session.commit()
+        return schedule_to_dict(doctor), 200
+
+def schedule_to_dict(doctor):
+    return {
+        'doctor_id': doctor.id,
+        'slot_minutes': doctor.slot_minutes,
+        'working_hours': [
+            {'weekday': shift.weekday, 'start_time': shift.start_time.strftime('%H:%M'),
+             'end_time': shift.end_time.strftime('%H:%M')}
+            for shift in sorted(doctor.working_hours, key=lambda shift: (shift.weekday, shift.start_time))
+        ],
+    }
+
+class Availability(Resource):
+    # Free slots of every doctor in a specialty, or of one
+    rate_cost = {'list': 5, 'GET': 2}
+
+    def get(self, doctor_id=None):
+        try:
+            start = request.args.get('from')
+            start = date.fromisoformat(start) if start else None
+        except ValueError:
+            return {'error': "Invalid value for 'from'"}, 400
+        try:
+            days = parse_int('days', 7, 1, 90)
+            limit = parse_int('limit', 50, 1, 500)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+        if doctor_id is None:
+            specialty = request.args.get('specialty')
+            if not specialty:
+                return {'error': "'specialty' is required"}, 400
+            slots = availability.free_slots(specialty=specialty, start=start, days=days, limit=limit)
+        else:
+            if not Doctor.query.get(doctor_id):
+                return {'error': 'Doctor not found'}, 404
+            slots = availability.free_slots(doctor_id=doctor_id, start=start, days=days, limit=limit)
+        return [
+            {'doctor_id': slot_doctor, 'date': day.isoformat(), 'time': start_time.strftime('%H:%M')}
+            for slot_doctor, day, start_time in slots
+        ], 200
+
+# Per-patient and per-doctor calendars, served by the
+# appointments(user_id, date) and appointments(doctor_id, date, time) indexes
+class UserAppointments(Resource):
+    def get(self, user_id):
+        if not User.query.get(user_id):
+            return {'error': 'User not found'}, 404
+        try:
+            model, filters, order = appointment_source(CALENDAR_FILTERS, ARCHIVED_CALENDAR_FILTERS)
+            view = parse_view(model)
+
+            def build():
+                query = model.query.options(*view.options).filter_by(user_id=user_id)
+                appointments, headers = paginate(apply_filters(query, filters), order)
+                return view.many(appointments), headers
+
+            return list_response(model, view, build)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+
+class DoctorAppointments(Resource):
+    def get(self, doctor_id):
+        if not Doctor.query.get(doctor_id):
+            return {'error': 'Doctor not found'}, 404
+        try:
+            model, filters, order = appointment_source(CALENDAR_FILTERS, ARCHIVED_CALENDAR_FILTERS)
+            view = parse_view(model)
+
+            def build():
+                query = model.query.options(*view.options).filter_by(doctor_id=doctor_id)
+                appointments, headers = paginate(apply_filters(query, filters), order)
+                return view.many(appointments), headers
+
+            return list_response(model, view, build)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+
+# Prescription Resource
+class PrescriptionResource(Resource):
+    # Pages of up to 500 rows, filtered, sorted and expanded
+    rate_cost = {'list': 5}
+
+    def get(self, prescription_id=None):
+        try:
+            if parse_flag('archived'):
+                model, filters = ArchivedPrescription, ARCHIVED_PRESCRIPTION_FILTERS
+            else:
+                model, filters = Prescription, PRESCRIPTION_FILTERS
+            view = parse_view(model)
+            if prescription_id:
+                return detail_response(model, view, prescription_id) or ({'error': 'Prescription not found'}, 404)
+
+            def build():
+                query = apply_filters(model.query.options(*view.options), filters)
+                prescriptions, headers = paginate(query, (model.id,))
+                return view.many(prescriptions), headers
+
+            return list_response(model, view, build)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+
+    def post(self):
+        try:
+            data = load_body(PRESCRIPTION, references=PRESCRIPTION_REFERENCES)
+        except ValidationError as e:
+            return invalid_response(e)
+        new_prescription = Prescription(**data)
+        db.session.add(new_prescription)
+        db.session.commit()
+        return represent(new_prescription), 201
+
+    def put(self, prescription_id):
+        return self._update(prescription_id, partial=False)
+
+    def patch(self, prescription_id):
+        return self._update(prescription_id, partial=True)
+
+    def _update(self, prescription_id, partial):
+        try:
+            data = load_body(PRESCRIPTION, partial, PRESCRIPTION_REFERENCES)
+        except ValidationError as e:
+            return invalid_response(e)
+        try:
+            prescription = Prescription.query.get(prescription_id)
+            if prescription is None:
+                return {'error': 'Prescription not found'}, 404
+            versions = if_match_versions()
+            if versions is not None and prescription.version not in versions:
+                return conflict_response(prescription)
+            for name, value in data.items():
+                setattr(prescription, name, value)
+            db.session.commit()
+            return represent(prescription), 200, {'ETag': row_etag(Prescription, prescription.id, prescription.version)}
+        except StaleDataError:
+            db.session.rollback()
+            return conflict_response(Prescription.query.get(prescription_id))
+
+    def delete(self, prescription_id):
+        prescription = Prescription.query.get(prescription_id)
+        if prescription is None:
+            return {'error': 'Prescription not found'}, 404
+        versions = if_match_versions()
+        if versions is not None and prescription.version not in versions:
+            return conflict_response(prescription)
+        try:
+            db.session.delete(prescription)
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            current = Prescription.query.get(prescription_id)
+            if current is None:
+                return {'error': 'Prescription not found'}, 404
+            return conflict_response(current)
+        return {}, 204
+
+# Medication history from the patient_medications read model (medications.py):
+# a patient's medicines, or the patients on a medicine, in one indexed query
+def medication_query(view):
+    query = PatientMedication.query.options(*view.options)
+    if parse_flag('current'):
+        query = query.filter(PatientMedication.last_date >= current_since())
+    return query
+
+class UserMedications(Resource):
+    def get(self, user_id):
+        if not User.query.get(user_id):
+            return {'error': 'User not found'}, 404
+        try:
+            view = parse_view(PatientMedication)
+
+            def build():
+                query = apply_filters(medication_query(view).filter_by(user_id=user_id), MEDICATION_FILTERS)
+                # One row per medicine, so never more than a page
+                rows = query.order_by(PatientMedication.last_date.desc(), PatientMedication.medicine).all()
+                return view.many(rows), {}
+
+            return list_response(PatientMedication, view, build)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+
+class Medications(Resource):
+    rate_cost = {'list': 5}
+
+    def get(self):
+        try:
+            view = parse_view(PatientMedication)
+
+            def build():
+                query = apply_filters(medication_query(view), PATIENT_MEDICATION_FILTERS)
+                rows, headers = paginate(query, PATIENT_MEDICATION_ORDER)
+                return view.many(rows), headers
+
+            return list_response(PatientMedication, view, build)
+        except QueryError as e:
+            return {'error': str(e)}, 400
+
+def register(app):
+    """Route every resource on ``app`` and build what the first requests would."""
+    api = Api(app)
+    api.representation('application/json')(output_json)
+    api.add_resource(Signup, '/signup')
+    api.add_resource(Login, '/login')
+    api.add_resource(DoctorLogin, '/doctor_login')
+    api.add_resource(Logout, '/logout')
+    api.add_resource(CheckSession, '/check_session')
+    api.add_resource(Sessions, '/sessions')
+    api.add_resource(ClearSession, '/clear')
+    api.add_resource(UserResource, '/users', '/users/<int:user_id>')
+    api.add_resource(DoctorResource, '/doctors', '/doctors/<int:doctor_id>')
+    api.add_resource(Metrics, '/metrics')
+    api.add_resource(Health, '/health')
+    api.add_resource(Readiness, '/ready')
+    api.add_resource(AppointmentAnalytics, '/analytics/appointments')
+    api.add_resource(SpecialtyAnalytics, '/analytics/specialties')
+    api.add_resource(DoctorAnalytics, '/analytics/doctors')
+    api.add_resource(PrescriptionAnalytics, '/analytics/prescriptions')
+    api.add_resource(Export, '/<any(appointments, prescriptions):table>/export')
+    api.add_resource(Search, '/<any(doctors, prescriptions):table>/search')
+    api.add_resource(DoctorScheduleResource, '/doctors/<int:doctor_id>/schedule')
+    api.add_resource(Availability, '/availability', '/doctors/<int:doctor_id>/availability')
+    api.add_resource(AppointmentResource, '/appointments', '/appointments/<int:appointment_id>')
+    api.add_resource(AppointmentBulk, '/appointments/bulk')
+    api.add_resource(UserAppointments, '/appointments/user/<int:user_id>')
+    api.add_resource(DoctorAppointments, '/appointments/doctor/<int:doctor_id>')
+    api.add_resource(PrescriptionResource, '/prescriptions', '/prescriptions/<int:prescription_id>')
+    api.add_resource(PrescriptionBulk, '/prescriptions/bulk')
+    api.add_resource(UserMedications, '/users/<int:user_id>/medications')
+    api.add_resource(Medications, '/medications')
+
+    # Done once before workers fork, so they inherit it instead of paying on first use
+    configure_mappers()
+    for model in FIELDS:
+        compile_view(model)
+    return api
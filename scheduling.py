@@ -0,0 +1,394 @@
+# Doctor availability: working hours, fixed-size slots and an in-memory
+# index of booked slots that is kept current from Appointment writes
+import threading
+import time as clock
+from bisect import bisect_left, insort
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import and_, event, inspect, or_
+from sqlalchemy.orm import Session
+
+from config import db
+from models import Doctor, Appointment, WorkingHours
+
+CANCELLED = 'Cancelled'
+MINUTES_PER_DAY = 24 * 60
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _key(day, start):
+    return day.toordinal() * MINUTES_PER_DAY + _minutes(start)
+
+
+class DoctorSchedule:
+    __slots__ = ('specialty', 'slot_minutes', 'hours', 'booked')
+
+    def __init__(self, specialty, slot_minutes, hours):
+        self.specialty = specialty
+        self.slot_minutes = slot_minutes
+        # weekday -> [(start_minute, end_minute)]
+        self.hours = hours
+        # Sorted start keys (ordinal day * 1440 + minute) of live bookings
+        self.booked = []
+
+    def overlaps(self, key):
+        """Whether a slot starting at ``key`` overlaps any booking."""
+        length = self.slot_minutes
+        index = bisect_left(self.booked, key - length + 1)
+        return index < len(self.booked) and self.booked[index] < key + length
+
+    def within_hours(self, day, start):
+        if not self.hours:
+            return True
+        begin = _minutes(start)
+        return any(low <= begin and begin + self.slot_minutes <= high
+                   for low, high in self.hours.get(day.weekday(), ()))
+
+    def free_slots(self, day, not_before=0):
+        base = day.toordinal() * MINUTES_PER_DAY
+        for low, high in self.hours.get(day.weekday(), ()):
+            for minute in range(low, high - self.slot_minutes + 1, self.slot_minutes):
+                if minute >= not_before and not self.overlaps(base + minute):
+                    yield minute
+
+
+class AvailabilityIndex:
+    """Per-doctor booked-slot arrays answering free-slot queries.
+
+    The index is built once from the database and then patched from
+    committed Appointment changes (see the session hooks below), so queries
+    never rescan the appointments table. Doctors whose profile or working
+    hours changed are reloaded individually on the next query. Other
+    processes' writes are picked up by a full reload every ``max_age``
+    seconds, so until then free_slots can offer a slot another process has
+    just booked (or miss one it has freed). That is why the index only
+    serves free-slot search: booking it is checked against the table by
+    ``booking_conflicts`` and answers 409 if it was taken.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._doctors = None
+        self._by_specialty = {}
+        self._stale = set()
+        self._loaded_at = 0.0
+
+    # Building
+
+    def reset(self):
+        """Forget everything; the next query rebuilds from the database."""
+        with self._lock:
+            self._doctors = None
+
+    def clear(self):
+        """Start from an empty, loaded index (used by load() and benchmarks)."""
+        with self._lock:
+            self._doctors, self._by_specialty, self._stale = {}, {}, set()
+            self._loaded_at = clock.monotonic()
+
+    def set_doctor(self, doctor_id, specialty, slot_minutes, hours):
+        with self._lock:
+            previous = self._doctors.get(doctor_id)
+            if previous is not None:
+                self._by_specialty.get(previous.specialty, set()).discard(doctor_id)
+            schedule = DoctorSchedule(specialty, slot_minutes, hours)
+            if previous is not None:
+                schedule.booked = previous.booked
+            self._doctors[doctor_id] = schedule
+            self._by_specialty.setdefault(specialty, set()).add(doctor_id)
+
+    def add_booking(self, doctor_id, day, start):
+        schedule = self._doctors.get(doctor_id)
+        if schedule is not None:
+            insort(schedule.booked, _key(day, start))
+        else:
+            # Unknown doctor (created since the last load): fetch it whole on the next query
+            self._stale.add(doctor_id)
+
+    def drop_doctor(self, doctor_id):
+        with self._lock:
+            schedule = self._doctors.pop(doctor_id, None)
+            if schedule is not None:
+                self._by_specialty.get(schedule.specialty, set()).discard(doctor_id)
+
+    def remove_booking(self, doctor_id, day, start):
+        schedule = self._doctors.get(doctor_id)
+        if schedule is None:
+            return
+        key = _key(day, start)
+        index = bisect_left(schedule.booked, key)
+        if index < len(schedule.booked) and schedule.booked[index] == key:
+            del schedule.booked[index]
+
+    def _load_doctors(self, doctor_ids=None):
+        """Load doctors, their hours and live bookings from today on (all, or ``doctor_ids``)."""
+        hours_query = db.session.query(WorkingHours.doctor_id, WorkingHours.weekday,
+                                       WorkingHours.start_time, WorkingHours.end_time)
+        doctor_query = db.session.query(Doctor.id, Doctor.specialty, Doctor.slot_minutes)
+        booking_query = db.session.query(Appointment.doctor_id, Appointment.date, Appointment.time).filter(
+            Appointment.date >= date.today(), Appointment.status != CANCELLED)
+        if doctor_ids is not None:
+            hours_query = hours_query.filter(WorkingHours.doctor_id.in_(doctor_ids))
+            doctor_query = doctor_query.filter(Doctor.id.in_(doctor_ids))
+            booking_query = booking_query.filter(Appointment.doctor_id.in_(doctor_ids))
+            for doctor_id in doctor_ids:
+                self.drop_doctor(doctor_id)
+
+        hours = {}
+        for doctor_id, weekday, start, end in hours_query:
+            hours.setdefault(doctor_id, {}).setdefault(weekday, []).append((_minutes(start), _minutes(end)))
+        for by_day in hours.values():
+            for shifts in by_day.values():
+                shifts.sort()
+        for doctor_id, specialty, slot_minutes in doctor_query:
+            self.set_doctor(doctor_id, specialty, slot_minutes, hours.get(doctor_id, {}))
+        for doctor_id, day, start in booking_query.yield_per(10000):
+            schedule = self._doctors.get(doctor_id)
+            if schedule is not None:
+                schedule.booked.append(_key(day, start))
+        for doctor_id in (self._doctors if doctor_ids is None else doctor_ids):
+            if doctor_id in self._doctors:
+                self._doctors[doctor_id].booked.sort()
+
+    def load(self):
+        """Full rebuild from the database."""
+        with self._lock:
+            self.clear()
+            try:
+                self._load_doctors()
+            except Exception:
+                # Interrupted (e.g. at REQUEST_TIMEOUT): a half-built index
+                # would offer booked slots, so the next query starts over
+                self.reset()
+                raise
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._doctors is None or clock.monotonic() - self._loaded_at > self.max_age:
+                self.load()
+            elif self._stale:
+                stale, self._stale = self._stale, set()
+                try:
+                    self._load_doctors(sorted(stale))
+                except Exception:
+                    self._stale |= stale
+                    raise
+
+    # Queries
+
+    def free_slots(self, specialty=None, doctor_id=None, start=None, days=7, limit=50, now=None):
+        """Earliest free slots, ordered by date and time, for a specialty or one doctor."""
+        now = now or datetime.now()
+        start = max(start or now.date(), now.date())
+        with self._lock:
+            self._ensure_loaded()
+            if doctor_id is not None:
+                doctor_ids = [doctor_id] if doctor_id in self._doctors else []
+            else:
+                doctor_ids = sorted(self._by_specialty.get(specialty, ()))
+            slots = []
+            for offset in range(days):
+                day = start + timedelta(days=offset)
+                not_before = _minutes(now) if day == now.date() else 0
+                found = [(minute, doctor) for doctor in doctor_ids
+                         for minute in self._doctors[doctor].free_slots(day, not_before)]
+                found.sort()
+                slots.extend((doctor, day, time(minute // 60, minute % 60)) for minute, doctor in found)
+                if len(slots) >= limit:
+                    break
+            return slots[:limit]
+
+    # Incremental maintenance
+
+    def apply(self, changes):
+        with self._lock:
+            if self._doctors is None:
+                return
+            for kind, values in changes:
+                if kind == 'book':
+                    self.add_booking(*values)
+                elif kind == 'release':
+                    self.remove_booking(*values)
+                elif kind == 'drop':
+                    self.drop_doctor(values)
+                    self._stale.discard(values)
+                else:
+                    self._stale.add(values)
+
+
+availability = AvailabilityIndex()
+
+
+CHUNK_SIZE = 500
+_SLOT_COLUMNS = ('doctor_id', 'date', 'time', 'status')
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = sorted(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _schedules(doctor_ids):
+    """``{doctor_id: DoctorSchedule}`` with working hours, read from the database."""
+    schedules = {}
+    for chunk in _chunks(doctor_ids):
+        for doctor_id, specialty, slot_minutes in db.session.query(
+                Doctor.id, Doctor.specialty, Doctor.slot_minutes).filter(Doctor.id.in_(chunk)):
+            schedules[doctor_id] = DoctorSchedule(specialty, slot_minutes, {})
+        for doctor_id, weekday, start, end in db.session.query(
+                WorkingHours.doctor_id, WorkingHours.weekday, WorkingHours.start_time,
+                WorkingHours.end_time).filter(WorkingHours.doctor_id.in_(chunk)):
+            schedules[doctor_id].hours.setdefault(weekday, []).append((_minutes(start), _minutes(end)))
+    return schedules
+
+
+def _bookings(days):
+    """``{doctor_id: sorted [(key, (0, appointment_id))]}`` of live bookings on ``(doctor_id, date)`` pairs."""
+    by_doctor = {}
+    for doctor_id, day in sorted(days):
+        by_doctor.setdefault(doctor_id, []).append(day)
+    # One (doctor_id = ? AND date IN (...)) term per doctor, about CHUNK_SIZE dates
+    # per statement: SQLite seeks each term in the calendar index, where a
+    # row-value IN over the pairs would scan all of it
+    statements, size = [[]], 0
+    for doctor_id, doctor_days in by_doctor.items():
+        for start in range(0, len(doctor_days), CHUNK_SIZE):
+            if size >= CHUNK_SIZE:
+                statements.append([])
+                size = 0
+            part = doctor_days[start:start + CHUNK_SIZE]
+            statements[-1].append(and_(Appointment.doctor_id == doctor_id, Appointment.date.in_(part)))
+            size += len(part)
+    booked = {}
+    for terms in filter(None, statements):
+        rows = db.session.query(Appointment.id, Appointment.doctor_id, Appointment.date, Appointment.time).filter(
+            or_(*terms), Appointment.status != CANCELLED)
+        for appointment_id, doctor_id, day, start in rows:
+            booked.setdefault(doctor_id, []).append((_key(day, start), (0, appointment_id)))
+    for entries in booked.values():
+        entries.sort()
+    return booked
+
+
+def booking_conflicts(items):
+    """Why each booking in ``items`` cannot be taken: ``{index: reason}``.
+
+    ``items`` are ``(index, values)`` pairs in request order, where ``values``
+    holds a new appointment's columns or an ``id`` plus the columns an update
+    changes. Only a live booking that is new, moves or is revived is checked: against the doctor's working hours,
+    the live appointments in the table and the bookings accepted before it in
+    ``items``. Call it inside the write transaction; on SQLite that began
+    IMMEDIATE, so nothing can book between the check and the write.
+    """
+    previous = {}
+    for chunk in _chunks({values['id'] for _, values in items if 'id' in values}):
+        for row in db.session.query(Appointment.id, *(getattr(Appointment, name) for name in _SLOT_COLUMNS)).filter(
+                Appointment.id.in_(chunk)):
+            previous[row.id] = row
+
+    # (index, owner, merged slot, whether it needs checking); the owner names
+    # the booking's entry in ``booked``: (0, id) for a row, (1, index) for a new one
+    plan = []
+    for index, values in items:
+        row = previous.get(values.get('id'))
+        merged = {name: values.get(name, getattr(row, name, None)) for name in _SLOT_COLUMNS}
+        moved = row is None or row.status == CANCELLED or any(
+            merged[name] != getattr(row, name) for name in ('doctor_id', 'date', 'time'))
+        owner = (0, row.id) if row is not None else (1, index)
+        plan.append((index, owner, merged, merged['status'] != CANCELLED and moved))
+
+    checked = [merged for _, _, merged, check in plan if check]
+    schedules = _schedules({merged['doctor_id'] for merged in checked})
+    # A slot near midnight can overlap a booking on the day before or after
+    booked = _bookings({(merged['doctor_id'], merged['date'] + timedelta(days=offset))
+                        for merged in checked for offset in (-1, 0, 1)})
+    where = {owner: (doctor_id, key) for doctor_id, entries in booked.items() for key, owner in entries}
+
+    def release(owner):
+        if owner in where:
+            doctor_id, key = where.pop(owner)
+            entries = booked[doctor_id]
+            del entries[bisect_left(entries, (key, owner))]
+
+    conflicts = {}
+    for index, owner, merged, check in plan:
+        if merged['status'] == CANCELLED:
+            release(owner)
+            continue
+        schedule = schedules.get(merged['doctor_id'])
+        if not check or schedule is None:
+            continue
+        if not schedule.within_hours(merged['date'], merged['time']):
+            conflicts[index] = 'Outside working hours'
+            continue
+        key = _key(merged['date'], merged['time'])
+        entries = booked.setdefault(merged['doctor_id'], [])
+        position = bisect_left(entries, (key - schedule.slot_minutes + 1,))
+        if any(other != owner for _, other in
+               entries[position:bisect_left(entries, (key + schedule.slot_minutes,))]):
+            conflicts[index] = 'Slot already booked'
+            continue
+        release(owner)
+        insort(entries, (key, owner))
+        where[owner] = (merged['doctor_id'], key)
+    return conflicts
+
+
+def _slot(appointment):
+    return (appointment.doctor_id, appointment.date, appointment.time)
+
+
+def _previous_slot(appointment):
+    state = inspect(appointment)
+    previous = {}
+    for name in ('doctor_id', 'date', 'time', 'status'):
+        history = state.attrs[name].history
+        previous[name] = history.deleted[0] if history.deleted else getattr(appointment, name)
+    return previous
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_schedule_changes(session, flush_context):
+    changes = session.info.setdefault('schedule_changes', [])
+    for obj in session.new:
+        if isinstance(obj, Appointment) and obj.status != CANCELLED:
+            changes.append(('book', _slot(obj)))
+        elif isinstance(obj, Doctor):
+            changes.append(('doctor', obj.id))
+        elif isinstance(obj, WorkingHours):
+            changes.append(('doctor', obj.doctor_id))
+    for obj in session.dirty:
+        if isinstance(obj, Appointment):
+            previous = _previous_slot(obj)
+            if previous['status'] != CANCELLED:
+                changes.append(('release', (previous['doctor_id'], previous['date'], previous['time'])))
+            if obj.status != CANCELLED:
+                changes.append(('book', _slot(obj)))
+        elif isinstance(obj, Doctor):
+            changes.append(('doctor', obj.id))
+        elif isinstance(obj, WorkingHours):
+            changes.append(('doctor', obj.doctor_id))
+    for obj in session.deleted:
+        if isinstance(obj, Appointment) and obj.status != CANCELLED:
+            changes.append(('release', _slot(obj)))
+        elif isinstance(obj, Doctor):
+            changes.append(('drop', obj.id))
+        elif isinstance(obj, WorkingHours):
+            changes.append(('doctor', obj.doctor_id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_schedule_changes(session):
+    changes = session.info.pop('schedule_changes', None)
+    if changes:
+        availability.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_schedule_changes(session):
+    session.info.pop('schedule_changes', None)
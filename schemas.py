@@ -0,0 +1,181 @@
+# Request body schemas: declared once per resource, compiled to a tuple of
+# parsers and applied to a JSON object in one pass, before any query or hashing
+from datetime import date, time
+
+
+class ValidationError(ValueError):
+    """A body that does not match its schema; ``errors`` maps each field to its problem."""
+
+    def __init__(self, errors):
+        super().__init__('Invalid request body')
+        self.errors = errors
+
+
+def integer(minimum=None, maximum=None):
+    def parse(value):
+        # bool is an int subclass, but true is not a valid age
+        if value.__class__ is not int:
+            raise ValueError('must be an integer')
+        if minimum is not None and value < minimum:
+            raise ValueError(f'must be at least {minimum}')
+        if maximum is not None and value > maximum:
+            raise ValueError(f'must be at most {maximum}')
+        return value
+    return parse
+
+
+def string(max_length=255):
+    def parse(value):
+        if value.__class__ is not str or not value.strip():
+            raise ValueError('must be a non-empty string')
+        if len(value) > max_length:
+            raise ValueError(f'must be at most {max_length} characters')
+        return value
+    return parse
+
+
+_email = string(254)
+_password = string(1024)
+
+
+def email(value):
+    value = _email(value)
+    local, _, domain = value.rpartition('@')
+    if not local or '.' not in domain or ' ' in value:
+        raise ValueError('must be an email address')
+    return value
+
+
+def password(value):
+    value = _password(value)
+    # bcrypt only reads the first 72 bytes and bcrypt>=5 refuses longer input
+    if len(value.encode('utf-8')) > 72:
+        raise ValueError('must be at most 72 bytes')
+    return value
+
+
+def date_(value):
+    # fromisoformat is an order of magnitude faster than strptime; the length
+    # check keeps it to the YYYY-MM-DD form it would otherwise widen
+    try:
+        if len(value) == 10:
+            return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        pass
+    raise ValueError('must be a date (YYYY-MM-DD)')
+
+
+def time_(value):
+    try:
+        # H:MM as well, e.g. 9:00
+        if len(value) == 4 and value[1] == ':':
+            value = '0' + value
+        if len(value) == 5 and value[2] == ':':
+            return time.fromisoformat(value)
+    except (TypeError, ValueError):
+        pass
+    raise ValueError('must be a time (HH:MM)')
+
+
+def items(schema, max_items=100):
+    """A list of objects, each loaded with ``schema``; errors are keyed by position."""
+    def parse(value):
+        if value.__class__ is not list:
+            raise ValueError('must be a list')
+        if len(value) > max_items:
+            raise ValueError(f'must have at most {max_items} items')
+        loaded, errors = [], {}
+        for index, item in enumerate(value):
+            values, item_errors = schema.validate(item)
+            if item_errors:
+                errors[index] = item_errors
+            loaded.append(values)
+        if errors:
+            raise ValidationError(errors)
+        return loaded
+    return parse
+
+
+class Schema:
+    """Named parsers for the fields of a JSON object.
+
+    Every field in ``required`` must be present unless the body is loaded
+    with ``partial=True`` (PATCH and bulk updates); ``optional`` fields may
+    always be left out. Keys the schema does not name are ignored, so a
+    client can send back a representation it read. Each parser takes the
+    raw JSON value and returns the coerced one or raises ValueError.
+    """
+
+    def __init__(self, required=None, optional=None):
+        self.fields = {**(required or {}), **(optional or {})}
+        self._compiled = tuple((name, parse, name in (required or {})) for name, parse in self.fields.items())
+
+    def validate(self, data, partial=False):
+        """Coerce ``data``; returns ``(values, errors)`` with only the fields it contained."""
+        if data.__class__ is not dict:
+            return None, {'body': 'must be a JSON object'}
+        values, errors = {}, {}
+        for name, parse, required in self._compiled:
+            if name not in data:
+                if required and not partial:
+                    errors[name] = 'is required'
+                continue
+            try:
+                values[name] = parse(data[name])
+            except ValidationError as e:
+                errors[name] = e.errors
+            except ValueError as e:
+                errors[name] = str(e)
+        return values, errors
+
+    def load(self, data, partial=False):
+        """Coerced values of ``data``, or ValidationError with every bad field at once."""
+        values, errors = self.validate(data, partial)
+        if errors:
+            raise ValidationError(errors)
+        if partial and not values:
+            raise ValidationError({'body': 'has no fields to update'})
+        return values
+
+
+SIGNUP = Schema(required={
+    'name': string(),
+    'email': email,
+    'password': password,
+    'age': integer(0, 150),
+    'gender': string(),
+    'phone_number': string(32),
+})
+# Not ``password``: passwords set before the 72-byte cap must still log in
+LOGIN = Schema(required={'email': _email, 'password': _password})
+USER = Schema(required={
+    'name': string(),
+    'email': email,
+    'age': integer(0, 150),
+    'gender': string(),
+    'phone_number': string(32),
+}, optional={'password': password})
+DOCTOR = Schema(required={
+    'name': string(),
+    'email': email,
+    'password': password,
+    'specialty': string(),
+    'experience_years': integer(0, 80),
+    'availability': string(),
+})
+SHIFT = Schema(required={'weekday': integer(0, 6), 'start_time': time_, 'end_time': time_})
+SCHEDULE = Schema(required={'working_hours': items(SHIFT, max_items=7 * 24)},
+                  optional={'slot_minutes': integer(5, 240)})
+APPOINTMENT = Schema(required={
+    'user_id': integer(1),
+    'doctor_id': integer(1),
+    'date': date_,
+    'time': time_,
+    'status': string(),
+})
+PRESCRIPTION = Schema(required={
+    'appointment_id': integer(1),
+    'medicine': string(),
+    'dosage': string(),
+    'instructions': string(2000),
+})
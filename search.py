@@ -0,0 +1,115 @@
+# Full-text search: SQLite FTS5 indexes over doctors and prescriptions, kept
+# in sync by triggers, with bm25 ranking, prefix matching and cursor pages
+import re
+
+from sqlalchemy import DDL, Float, Integer, and_, column, event, func, literal_column, or_, table, text
+
+from models import Doctor, Prescription
+
+MAX_TERMS = 8
+# bm25 costs a couple of microseconds per matching row: rank at most this
+# many matches, and stream broader queries in id order instead
+RANK_LIMIT = 2000
+# How a query's rows are ordered; its cursors only resume the same order
+RANKED, BY_ID = 'rank', 'id'
+# Letters and digits; everything else (including FTS5 query syntax) separates terms
+_TERM = re.compile(r'\w+')
+
+
+def terms(text):
+    """The words of ``text`` that a search matches on, at most MAX_TERMS."""
+    return _TERM.findall(text)[:MAX_TERMS]
+
+
+class SearchIndex:
+    """An external-content FTS5 table over some text columns of ``model``.
+
+    The index stores only the tokens; rows are read back from the model's
+    table by rowid. Triggers on that table keep it current for every write,
+    ORM or not (bulk endpoints, ``flask generate``). A migration that
+    recreates the table (Alembic batch mode on SQLite) drops the triggers
+    with it and has to create them again.
+    """
+
+    def __init__(self, model, columns, weights):
+        self.model = model
+        self.columns = columns
+        # bm25 weight per column: a hit in a doctor's name counts more than in the specialty
+        self.weights = weights
+        self.name = f'{model.__tablename__}_fts'
+        self.table = table(self.name, column('rowid', Integer))
+
+    def ddl(self):
+        source, name = self.model.__tablename__, self.name
+        names = ', '.join(self.columns)
+        new = ', '.join(f'new.{col}' for col in self.columns)
+        old = ', '.join(f'old.{col}' for col in self.columns)
+        delete = f"INSERT INTO {name}({name}, rowid, {names}) VALUES ('delete', old.id, {old});"
+        insert = f'INSERT INTO {name}(rowid, {names}) VALUES (new.id, {new});'
+        return [
+            # prefix='2 3 4': dedicated indexes for the short prefixes typed first
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({names}, content='{source}', "
+            f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')",
+            f'CREATE TRIGGER IF NOT EXISTS {name}_insert AFTER INSERT ON {source} BEGIN {insert} END',
+            f'CREATE TRIGGER IF NOT EXISTS {name}_delete AFTER DELETE ON {source} BEGIN {delete} END',
+            f'CREATE TRIGGER IF NOT EXISTS {name}_update AFTER UPDATE OF {names} ON {source} '
+            f'BEGIN {delete} {insert} END',
+        ]
+
+    def query(self, session, text):
+        """``(query, order_by, order)`` for the rows matching every term of ``text``.
+
+        The last term matches as a prefix (search as you type), the others as
+        whole words. Rows come back as ``(model, ...)`` and ``order_by`` suits
+        ``pagination.paginate``: best match first (``order`` RANKED) when at
+        most RANK_LIMIT rows match, id order (BY_ID) otherwise. Outside SQLite
+        the terms are matched with unindexed ILIKE, in id order. ``text`` must
+        hold at least one term.
+        """
+        words = terms(text)
+        if not words:
+            raise ValueError('Nothing to search for')
+        model = self.model
+        if session.get_bind().dialect.name != 'sqlite':
+            matches = and_(*(or_(*(getattr(model, col).ilike(f'%{term}%') for col in self.columns))
+                             for term in words))
+            return session.query(model, model.id).filter(matches), (model.id,), BY_ID
+        # Each term quoted, so user input can never be read as FTS5 syntax
+        expression = ' '.join([*(f'"{term}"' for term in words[:-1]), f'"{words[-1]}"*'])
+        fts, rowid = literal_column(self.name), self.table.c.rowid
+        match = fts.op('MATCH')(expression)
+        # Counting stops at RANK_LIMIT + 1, so this is cheap however broad the query
+        ranked = session.query(rowid).filter(match).limit(RANK_LIMIT + 1).count() <= RANK_LIMIT
+        if ranked:
+            rank = func.bm25(fts, *self.weights, type_=Float).label('rank')
+            columns, order_by, order = (rank, rowid), (rank, rowid), RANKED
+        else:
+            columns, order_by, order = (rowid,), (rowid,), BY_ID
+        query = (session.query(model, *columns)
+                 .select_from(self.table)
+                 .join(model, model.id == rowid)
+                 .filter(match))
+        return query, order_by, order
+
+    def optimize(self, session):
+        """Merge the index into a single b-tree (SQLite).
+
+        A mass delete (archival) leaves a delete marker per row in new
+        segments, which every query then reads through until they merge.
+        """
+        if session.get_bind().dialect.name == 'sqlite':
+            session.execute(text(f"INSERT INTO {self.name}({self.name}) VALUES ('optimize')"))
+
+
+INDEXES = {
+    'doctors': SearchIndex(Doctor, ('name', 'specialty'), (10.0, 5.0)),
+    'prescriptions': SearchIndex(Prescription, ('medicine', 'instructions'), (10.0, 1.0)),
+}
+
+# db.create_all() / drop_all() (seed.py, scratch databases) manage the indexes
+# too; an existing database gets them from the migration
+for _index in INDEXES.values():
+    for _statement in _index.ddl():
+        event.listen(_index.model.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+    event.listen(_index.model.__table__, 'before_drop',
+                 DDL(f'DROP TABLE IF EXISTS {_index.name}').execute_if(dialect='sqlite'))
@@ -4,9 +4,11 @@
 from datetime import datetime
 
 # Local imports
-from app import app, db
+from config import create_app, db
 from models import User, Doctor, Appointment, Prescription
 
+app = create_app(resources=False)
+
 with app.app_context():
     # Drop existing tables
     db.drop_all()
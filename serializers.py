@@ -0,0 +1,205 @@
+# Precompiled serializers and eager-loading options for the hot read endpoints
+from collections import namedtuple
+from functools import lru_cache
+from operator import attrgetter
+
+from flask import request
+from sqlalchemy import Date, Time, inspect
+from sqlalchemy.orm import joinedload, selectinload
+
+from metrics import timed
+from models import (User, Doctor, Appointment, Prescription, WorkingHours, ArchivedAppointment, ArchivedPrescription,
+                    PatientMedication)
+from pagination import QueryError
+
+# Same formats SerializerMixin uses, so responses are unchanged
+DATE_FORMAT = '%Y-%m-%d'
+TIME_FORMAT = '%H:%M'
+
+# Explicit column lists per model; password_hash is never serialized
+FIELDS = {
+    User: ('id', 'name', 'email', 'age', 'gender', 'phone_number'),
+    Doctor: ('id', 'name', 'email', 'specialty', 'experience_years', 'availability', 'slot_minutes'),
+    Appointment: ('id', 'user_id', 'doctor_id', 'date', 'time', 'status'),
+    Prescription: ('id', 'appointment_id', 'medicine', 'dosage', 'instructions'),
+    WorkingHours: ('id', 'doctor_id', 'weekday', 'start_time', 'end_time'),
+    # Archived rows look exactly like the live ones
+    ArchivedAppointment: ('id', 'user_id', 'doctor_id', 'date', 'time', 'status'),
+    ArchivedPrescription: ('id', 'appointment_id', 'medicine', 'dosage', 'instructions'),
+    PatientMedication: ('user_id', 'medicine', 'prescription_count', 'first_date', 'last_date', 'dosage', 'instructions',
+                        'doctor_id', 'appointment_id', 'prescription_id'),
+}
+
+
+def _excluded(model):
+    return {rule[1:] for rule in getattr(model, 'serialize_rules', ()) if rule.startswith('-')}
+
+
+def relationship_tree(model, path=(), excluded=frozenset()):
+    """Return the nested relationships ``to_dict()`` walks for ``model``.
+
+    A relationship is followed unless a ``serialize_rules`` exclusion on the
+    root or on the model itself names it, or it leads back to a model already
+    on the current path (the back-references the rules exist to cut).
+    """
+    excluded = set(excluded) | _excluded(model)
+    tree = {}
+    for rel in inspect(model).relationships:
+        target = rel.mapper.class_
+        if rel.key in excluded or target in path or target is model:
+            continue
+        nested = {rule[len(rel.key) + 1:] for rule in excluded if rule.startswith(rel.key + '.')}
+        tree[rel.key] = (rel, relationship_tree(target, path + (model,), nested))
+    return tree
+
+
+def _loader_options(tree, parent=None):
+    options = []
+    for key, (rel, subtree) in tree.items():
+        attr = getattr(rel.parent.class_, key)
+        if rel.uselist:
+            loader = parent.selectinload(attr) if parent else selectinload(attr)
+        else:
+            loader = parent.joinedload(attr) if parent else joinedload(attr)
+        options.append(loader)
+        options.extend(_loader_options(subtree, loader))
+    return options
+
+
+def formatter(column_type):
+    """Value formatter for a column type, or None when the value is used as is."""
+    # isoformat() gives the DATE_FORMAT / TIME_FORMAT strings several times
+    # faster than strftime()
+    if isinstance(column_type, Date):
+        return lambda value: value.isoformat() if value is not None else None
+    if isinstance(column_type, Time):
+        return lambda value: value.isoformat('minutes') if value is not None else None
+    return None
+
+
+def compile_serializer(model, tree, fields=None, prefix=''):
+    """Build a flat function turning a ``model`` instance into a dict.
+
+    Column access is one ``attrgetter`` call and type formatting is resolved
+    once here instead of per value, which is what makes this cheaper than
+    the generic recursive ``to_dict()``. ``fields`` maps a relationship path
+    ('' for the root) to the columns to keep at that level.
+    """
+    names = (fields or {}).get(prefix) or FIELDS[model]
+    getter = attrgetter(*names)
+    table = inspect(model).columns
+    formatters = [(index, name, fmt) for index, name in enumerate(names)
+                  if (fmt := formatter(table[name].type)) is not None]
+    relations = [(key, rel.uselist,
+                  compile_serializer(rel.mapper.class_, subtree, fields, f'{prefix}.{key}'.lstrip('.')))
+                 for key, (rel, subtree) in tree.items()]
+
+    def serialize(obj):
+        values = getter(obj) if len(names) > 1 else (getter(obj),)
+        data = dict(zip(names, values))
+        for index, name, fmt in formatters:
+            data[name] = fmt(values[index])
+        for key, uselist, nested in relations:
+            value = getattr(obj, key)
+            if uselist:
+                data[key] = [nested(item) for item in value]
+            else:
+                data[key] = nested(value) if value is not None else None
+        return data
+
+    return serialize
+
+
+def _select(tree, paths):
+    """Prune the full relationship tree down to the requested expansions."""
+    selected = {}
+    for path in paths:
+        node, out = tree, selected
+        for key in path.split('.'):
+            if key not in node:
+                raise QueryError(f"Cannot expand '{path}'")
+            rel, subtree = node[key]
+            out = out.setdefault(key, (rel, {}))[1]
+            node = subtree
+    return selected
+
+
+def _resolve_fields(model, tree, fields):
+    resolved = {}
+    for field in fields:
+        path, _, name = field.rpartition('.')
+        target = model
+        for key in filter(None, path.split('.')):
+            if key not in tree:
+                raise QueryError(f"Unknown field '{field}'")
+            rel, tree = tree[key]
+            target = rel.mapper.class_
+        if name not in FIELDS[target]:
+            raise QueryError(f"Unknown field '{field}'")
+        resolved.setdefault(path, []).append(name)
+    return {path: tuple(names) for path, names in resolved.items()}
+
+
+class View(namedtuple('View', ['options', 'serialize', 'tables'])):
+    """One representation of a model. ``serialize`` turns one row into it;
+    ``one`` and ``many`` also time the work as the request's serialize phase,
+    once per call rather than once per row."""
+
+    __slots__ = ()
+
+    @timed('serialize')
+    def one(self, obj):
+        return self.serialize(obj)
+
+    @timed('serialize')
+    def many(self, rows):
+        return [self.serialize(row) for row in rows]
+
+
+def _tables(tree):
+    for rel, subtree in tree.values():
+        yield rel.mapper.class_.__tablename__
+        yield from _tables(subtree)
+
+
+@lru_cache(maxsize=256)
+def view(model, expand=(), fields=()):
+    """Loader options and serializer for one representation of ``model``.
+
+    The default is the flat row with no relationships. ``expand`` lists
+    dotted relationship paths to embed and ``fields`` optionally narrows the
+    columns at any level (``name`` or ``appointments.date``). Only the
+    expanded relationships are eager-loaded, so payload size and query cost
+    follow what the client asked for rather than the history behind a row.
+    ``tables`` names the related tables embedded by the expansion.
+    """
+    tree = _select(_TREES[model], expand)
+    resolved = _resolve_fields(model, tree, fields)
+    tables = tuple(sorted(set(_tables(tree))))
+    return View(_loader_options(tree), compile_serializer(model, tree, resolved), tables)
+
+
+def _split(name):
+    raw = request.args.get(name)
+    return tuple(sorted({item.strip() for item in raw.split(',') if item.strip()})) if raw else ()
+
+
+def parse_view(model):
+    """Build the view requested by the ``expand=`` and ``fields=`` query arguments."""
+    return view(model, _split('expand'), _split('fields'))
+
+
+_TREES = {model: relationship_tree(model) for model in FIELDS}
+_OPTIONS = {model: _loader_options(tree) for model, tree in _TREES.items()}
+_SERIALIZERS = {model: compile_serializer(model, tree) for model, tree in _TREES.items()}
+
+
+def eager_options(model):
+    """Loader options for the full, ``to_dict()``-equivalent representation."""
+    return _OPTIONS[model]
+
+
+@timed('serialize')
+def serialize(obj):
+    """Serialize ``obj`` with every relationship ``to_dict()`` would include."""
+    return _SERIALIZERS[type(obj)](obj)
@@ -0,0 +1,379 @@
+# Server-side login sessions: the signed cookie carries only a random id, the
+# store maps it to the principal and keeps that principal's serialized form
+import json
+import secrets
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+import click
+from flask import session
+from flask.cli import with_appcontext
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.orm import Session
+
+from config import db
+from models import Doctor, LoginSession, User, utcnow
+from serializers import view
+
+KINDS = {'user': User, 'doctor': Doctor}
+_KIND_OF = {model: kind for kind, model in KINDS.items()}
+COOKIE_KEY = 'sid'
+SWEEP_INTERVAL = 60  # seconds between sweeps of expired in-process sessions
+
+# ``principal`` is None once the row behind it has changed; it is rebuilt on the next lookup
+Record = namedtuple('Record', ['id', 'kind', 'principal_id', 'principal'])
+
+
+def _new_id():
+    return secrets.token_urlsafe(32)
+
+
+def principal(obj):
+    """What /check_session returns for a logged-in user or doctor: the flat row."""
+    return view(type(obj)).one(obj)
+
+
+class MemoryStore:
+    """In-process store: fastest, but lost on restart and not shared between workers."""
+
+    def __init__(self):
+        self._sessions = {}  # id -> (kind, principal_id, expires)
+        self._by_principal = {}  # (kind, principal_id) -> session ids
+        self._principals = {}  # (kind, principal_id) -> serialized principal
+        self._lock = threading.Lock()
+        self._swept = time.monotonic()
+
+    def create(self, kind, principal_id, value, ttl):
+        sid, now = _new_id(), time.monotonic()
+        with self._lock:
+            if now - self._swept > SWEEP_INTERVAL:
+                self._purge(now)
+            self._sessions[sid] = (kind, principal_id, now + ttl)
+            self._by_principal.setdefault((kind, principal_id), set()).add(sid)
+            self._principals[kind, principal_id] = value
+        return sid
+
+    def load(self, sid, ttl, refresh):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            kind, principal_id, expires = entry
+            if expires < now:
+                self._discard(sid)
+                return None
+            # Sliding expiry costs nothing here, so ``refresh`` is not needed
+            self._sessions[sid] = (kind, principal_id, now + ttl)
+            return Record(sid, kind, principal_id, self._principals.get((kind, principal_id)))
+
+    def remember(self, kind, principal_id, value):
+        with self._lock:
+            if (kind, principal_id) in self._by_principal:
+                self._principals[kind, principal_id] = value
+
+    def forget(self, kind, principal_id):
+        with self._lock:
+            self._principals.pop((kind, principal_id), None)
+
+    def delete(self, sid):
+        with self._lock:
+            self._discard(sid)
+
+    def revoke(self, kind, principal_id, keep=None):
+        with self._lock:
+            sids = [sid for sid in self._by_principal.get((kind, principal_id), ()) if sid != keep]
+            for sid in sids:
+                self._discard(sid)
+            return len(sids)
+
+    def purge(self):
+        with self._lock:
+            return self._purge(time.monotonic())
+
+    def _purge(self, now):
+        self._swept = now
+        expired = [sid for sid, (_, _, expires) in self._sessions.items() if expires < now]
+        for sid in expired:
+            self._discard(sid)
+        return len(expired)
+
+    def _discard(self, sid):
+        entry = self._sessions.pop(sid, None)
+        if entry is None:
+            return
+        key = entry[:2]
+        sids = self._by_principal.get(key)
+        sids.discard(sid)
+        if not sids:
+            del self._by_principal[key]
+            self._principals.pop(key, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class RedisStore:
+    """Shared store for multi-process deployments; needs the optional ``redis`` package.
+
+    Redis expires the keys itself; a principal's set of session ids lives as
+    long as its newest session and may briefly list ones that have expired.
+    """
+
+    def __init__(self, url, prefix='good-doctor:'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def _key(self, *parts):
+        return self._prefix + ':'.join(map(str, parts))
+
+    def create(self, kind, principal_id, value, ttl):
+        sid = _new_id()
+        members = self._key('sessions', kind, principal_id)
+        pipeline = self._client.pipeline()
+        pipeline.set(self._key('session', sid), json.dumps([kind, principal_id]), ex=ttl)
+        pipeline.sadd(members, sid)
+        pipeline.expire(members, ttl)
+        pipeline.set(self._key('principal', kind, principal_id), json.dumps(value), ex=ttl)
+        pipeline.execute()
+        return sid
+
+    def load(self, sid, ttl, refresh):
+        key = self._key('session', sid)
+        raw, remaining = self._client.pipeline().get(key).ttl(key).execute()
+        if raw is None:
+            return None
+        kind, principal_id = json.loads(raw)
+        pipeline = self._client.pipeline()
+        pipeline.get(self._key('principal', kind, principal_id))
+        if remaining < ttl - refresh:
+            for name in (key, self._key('sessions', kind, principal_id), self._key('principal', kind, principal_id)):
+                pipeline.expire(name, ttl)
+        value = pipeline.execute()[0]
+        return Record(sid, kind, principal_id, json.loads(value) if value is not None else None)
+
+    def remember(self, kind, principal_id, value):
+        ttl = self._client.ttl(self._key('sessions', kind, principal_id))
+        if ttl > 0:
+            self._client.set(self._key('principal', kind, principal_id), json.dumps(value), ex=ttl)
+
+    def forget(self, kind, principal_id):
+        self._client.delete(self._key('principal', kind, principal_id))
+
+    def delete(self, sid):
+        key = self._key('session', sid)
+        raw = self._client.get(key)
+        if raw is not None:
+            kind, principal_id = json.loads(raw)
+            self._client.srem(self._key('sessions', kind, principal_id), sid)
+        self._client.delete(key)
+
+    def revoke(self, kind, principal_id, keep=None):
+        members = self._key('sessions', kind, principal_id)
+        sids = [sid.decode() for sid in self._client.smembers(members)]
+        sids = [sid for sid in sids if sid != keep]
+        if not sids:
+            return 0
+        pipeline = self._client.pipeline()
+        pipeline.delete(*(self._key('session', sid) for sid in sids))
+        pipeline.srem(members, *sids)
+        return pipeline.execute()[0]
+
+    def purge(self):
+        return 0
+
+    def __len__(self):
+        return sum(1 for _ in self._client.scan_iter(self._key('session', '*')))
+
+
+class DatabaseStore:
+    """The ``login_sessions`` table: shared by every worker and kept across restarts.
+
+    Statements run on their own short transactions against the primary, not
+    on the request's session: a GET (routed to the read-only bind) can still
+    slide the expiry, and a rolled-back request cannot undo a logout. The
+    expiry is only written once it has slid by ``refresh`` seconds, so most
+    lookups are a single primary-key read.
+    """
+
+    table = LoginSession.__table__
+
+    def create(self, kind, principal_id, value, ttl):
+        sid, now = _new_id(), utcnow()
+        with db.engine.begin() as connection:
+            connection.execute(self.table.insert().values(
+                id=sid, kind=kind, principal_id=principal_id, principal=value,
+                created_at=now, expires_at=now + timedelta(seconds=ttl)))
+        return sid
+
+    def load(self, sid, ttl, refresh):
+        t, now = self.table, utcnow()
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                select(t.c.kind, t.c.principal_id, t.c.principal, t.c.expires_at).where(t.c.id == sid)).first()
+        if row is None or row.expires_at < now:
+            return None
+        if row.expires_at < now + timedelta(seconds=ttl - refresh):
+            with db.engine.begin() as connection:
+                connection.execute(update(t).where(t.c.id == sid).values(expires_at=now + timedelta(seconds=ttl)))
+        return Record(sid, row.kind, row.principal_id, row.principal)
+
+    def _principal(self, kind, principal_id):
+        t = self.table
+        return (t.c.kind == kind) & (t.c.principal_id == principal_id)
+
+    def remember(self, kind, principal_id, value):
+        with db.engine.begin() as connection:
+            connection.execute(update(self.table).where(self._principal(kind, principal_id)).values(principal=value))
+
+    def forget(self, kind, principal_id):
+        with db.engine.begin() as connection:
+            connection.execute(update(self.table).where(self._principal(kind, principal_id)).values(principal=None))
+
+    def delete(self, sid):
+        with db.engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.id == sid))
+
+    def revoke(self, kind, principal_id, keep=None):
+        condition = self._principal(kind, principal_id)
+        if keep is not None:
+            condition &= self.table.c.id != keep
+        with db.engine.begin() as connection:
+            return connection.execute(delete(self.table).where(condition)).rowcount
+
+    def purge(self):
+        with db.engine.begin() as connection:
+            return connection.execute(delete(self.table).where(self.table.c.expires_at < utcnow())).rowcount
+
+    def __len__(self):
+        with db.engine.connect() as connection:
+            return connection.execute(select(func.count()).select_from(self.table)).scalar()
+
+
+def make_store(config):
+    """The store named by SESSION_BACKEND: ``database`` (default), ``memory`` or ``redis``."""
+    name = config['SESSION_BACKEND']
+    if name == 'redis':
+        return RedisStore(config['SESSION_URL'])
+    if name == 'memory':
+        return MemoryStore()
+    if name == 'database':
+        return DatabaseStore()
+    raise ValueError(f'Unknown SESSION_BACKEND {name!r}')
+
+
+class SessionStore:
+    """Login state for the current request, backed by one of the stores above.
+
+    Sessions slide: each lookup pushes the expiry ``ttl`` seconds ahead. The
+    principal is cached alongside, so /check_session never reads the users
+    or doctors tables unless that row changed since it was cached.
+    """
+
+    def __init__(self, backend=None, ttl=7 * 24 * 3600, refresh=300):
+        self.backend = backend or MemoryStore()
+        self.ttl = ttl
+        self.refresh = refresh
+
+    def configure(self, backend=None, ttl=None, refresh=None):
+        if backend is not None:
+            self.backend = backend
+        if ttl is not None:
+            self.ttl = ttl
+        if refresh is not None:
+            self.refresh = refresh
+
+    def login(self, obj):
+        """Start a session for a user or doctor, replacing any the cookie carried."""
+        self.logout()
+        session.clear()
+        session.permanent = True
+        session[COOKIE_KEY] = self.backend.create(_KIND_OF[type(obj)], obj.id, principal(obj), self.ttl)
+
+    def current(self):
+        """The request's Record, or None when it is not logged in (or the session expired)."""
+        sid = session.get(COOKIE_KEY)
+        if sid is None:
+            return None
+        record = self.backend.load(sid, self.ttl, self.refresh)
+        if record is None:
+            session.pop(COOKIE_KEY, None)
+        return record
+
+    def principal(self, record):
+        """The record's serialized principal, read again from its table after a change."""
+        if record.principal is not None:
+            return record.principal
+        obj = db.session.get(KINDS[record.kind], record.principal_id)
+        if obj is None:
+            return None
+        value = principal(obj)
+        self.backend.remember(record.kind, record.principal_id, value)
+        return value
+
+    def logout(self):
+        sid = session.pop(COOKIE_KEY, None)
+        if sid is not None:
+            self.backend.delete(sid)
+
+    def revoke(self, kind, principal_id, keep=None):
+        """End every session of one user or doctor, except ``keep``; returns how many."""
+        return self.backend.revoke(kind, principal_id, keep)
+
+
+session_store = SessionStore()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_principal_changes(db_session, flush_context):
+    changes = db_session.info.setdefault('principal_changes', {})
+    for obj in db_session.dirty:
+        kind = _KIND_OF.get(type(obj))
+        if kind is not None and db_session.is_modified(obj):
+            changes.setdefault((kind, obj.id), 'forget')
+    for obj in db_session.deleted:
+        kind = _KIND_OF.get(type(obj))
+        if kind is not None:
+            changes[kind, obj.id] = 'revoke'
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_principal_changes(db_session):
+    changes = db_session.info.pop('principal_changes', None)
+    for (kind, principal_id), action in (changes or {}).items():
+        if action == 'revoke':
+            session_store.revoke(kind, principal_id)
+        else:
+            session_store.backend.forget(kind, principal_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_principal_changes(db_session):
+    db_session.info.pop('principal_changes', None)
+
+
+@click.group('sessions')
+def sessions_command():
+    """Manage server-side login sessions."""
+
+
+@sessions_command.command('revoke')
+@click.argument('kind', type=click.Choice(sorted(KINDS)))
+@click.argument('principal_id', type=int)
+@with_appcontext
+def revoke_command(kind, principal_id):
+    """Log a user or doctor out everywhere."""
+    revoked = session_store.revoke(kind, principal_id)
+    click.echo(f'Revoked {revoked} sessions', file=sys.stderr)
+
+
+@sessions_command.command('purge')
+@with_appcontext
+def purge_command():
+    """Delete expired sessions (the Redis store expires its own)."""
+    purged = session_store.backend.purge()
+    click.echo(f'Deleted {purged} expired sessions', file=sys.stderr)
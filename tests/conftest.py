@@ -0,0 +1,64 @@
+"""Fixtures: the full app on a throwaway SQLite file, like benchmarks/common.py."""
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import create_app, db  # noqa: E402
+from models import Doctor, User  # noqa: E402
+from scheduling import availability  # noqa: E402
+
+# Limits and the hashing pool are off: tests are one client in one process
+SETTINGS = {'RATE_LIMIT_BACKEND': 'none', 'ADMISSION_LIMIT': 0, 'HASHING_WORKERS': 0, 'BCRYPT_ROUNDS': 4}
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    return f'sqlite:///{tmp_path / "test.db"}'
+
+
+@pytest.fixture
+def app(database_url):
+    app = create_app({'DATABASE_URL': database_url, **SETTINGS})
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([
+            User(name='Ada Moreau', email='ada@example.com', password_hash='x', age=36, gender='Female',
+                 phone_number='555-0100'),
+            Doctor(name='Dr. Grace Okafor', email='grace@example.com', password_hash='x', specialty='Cardiology',
+                   experience_years=12, availability='Available'),
+        ])
+        db.session.commit()
+    # The availability index is per process; rebuild it from this database
+    availability.reset()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def other_worker(database_url):
+    """Run requests in a separate process on the same database, like another gunicorn worker.
+
+    Called with ``(method, path, json)`` tuples; returns their status codes.
+    """
+    def run(*requests):
+        script = textwrap.dedent(f'''
+            from config import create_app
+            client = create_app({{'DATABASE_URL': {database_url!r}, **{SETTINGS!r}}}).test_client()
+            for method, path, body in {requests!r}:
+                print(client.open(path, method=method, json=body).status_code)
+        ''')
+        result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True,
+                                check=True)
+        return [int(line) for line in result.stdout.split()]
+
+    return run
@@ -0,0 +1,148 @@
+"""Analytics served from the trigger-maintained rollups."""
+from datetime import date, time
+
+import pytest
+
+import analytics
+import datagen
+from config import db
+from models import AnalyticsRollup, Appointment, Doctor, Prescription
+
+
+@pytest.fixture
+def history(app):
+    with app.app_context():
+        db.session.add(Doctor(name='Dr. Lin Park', email='lin@example.com', password_hash='x', specialty='Neurology',
+                              experience_years=3, availability='Available'))
+        db.session.add_all([
+            Appointment(user_id=1, doctor_id=doctor_id, date=date(2030, 1, day), time=time(hour), status=status)
+            for doctor_id, day, hour, status in [
+                (1, 7, 9, 'Scheduled'), (1, 7, 10, 'Cancelled'), (1, 8, 9, 'Completed'), (2, 8, 9, 'Scheduled'),
+            ]
+        ])
+        db.session.add_all([
+            Prescription(appointment_id=appointment_id, medicine=medicine, dosage='1 x 10 mg', instructions='Daily')
+            for appointment_id, medicine in [(1, 'Aspirin'), (3, 'Aspirin'), (3, 'Metformin'), (4, 'Ibuprofen')]
+        ])
+        db.session.commit()
+
+
+def rollups(app):
+    with app.app_context():
+        return sorted(db.session.query(AnalyticsRollup.metric, AnalyticsRollup.scope, AnalyticsRollup.scope_key,
+                                       AnalyticsRollup.day, AnalyticsRollup.bucket, AnalyticsRollup.count)
+                      .filter(AnalyticsRollup.count != 0))
+
+
+def rebuilt(app):
+    with app.app_context():
+        analytics.rebuild(db.session)
+        db.session.commit()
+    return rollups(app)
+
+
+def statuses(response):
+    assert response.status_code == 200, response.json
+    return {status: value['count'] for status, value in response.json['statuses'].items()}
+
+
+def test_appointment_counts_and_ratios(client, history):
+    response = client.get('/analytics/appointments')
+    assert response.json == {
+        'date_from': None, 'date_to': None, 'total': 4,
+        'statuses': {'Cancelled': {'count': 1, 'ratio': 0.25}, 'Completed': {'count': 1, 'ratio': 0.25},
+                     'Scheduled': {'count': 2, 'ratio': 0.5}},
+    }
+    assert statuses(client.get('/analytics/appointments?doctor_id=2')) == {'Scheduled': 1}
+    assert statuses(client.get('/analytics/appointments?specialty=Cardiology')) == {
+        'Cancelled': 1, 'Completed': 1, 'Scheduled': 1}
+    assert client.get('/analytics/appointments?doctor_id=9').json['total'] == 0
+
+
+def test_date_range_adds_a_daily_series(client, history):
+    response = client.get('/analytics/appointments?date_from=2030-01-08&date_to=2030-01-31')
+    assert response.json['total'] == 2
+    assert response.json['days'] == [{'date': '2030-01-08', 'total': 2, 'statuses': {'Completed': 1, 'Scheduled': 1}}]
+    # One end alone covers DEFAULT_DAYS
+    response = client.get('/analytics/appointments?date_to=2030-01-07')
+    assert (response.json['date_from'], response.json['date_to']) == ('2029-12-09', '2030-01-07')
+    assert response.json['total'] == 2
+
+
+@pytest.mark.parametrize('query', [
+    'date_from=2030-13-01', 'date_from=2030-02-01&date_to=2030-01-01', 'date_from=2030-01-01&date_to=2031-01-02',
+    'doctor_id=1&specialty=Neurology', 'doctor_id=one',
+])
+def test_invalid_arguments_are_rejected(client, query):
+    response = client.get(f'/analytics/appointments?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+
+def test_specialties_and_doctors(client, history):
+    response = client.get('/analytics/specialties')
+    assert [(row['specialty'], row['total']) for row in response.json] == [('Cardiology', 3), ('Neurology', 1)]
+
+    first = client.get('/analytics/doctors?limit=1')
+    assert [(row['doctor_id'], row['name'], row['total']) for row in first.json] == [(1, 'Dr. Grace Okafor', 3)]
+    second = client.get('/analytics/doctors', query_string={'limit': 1, 'after': first.headers['X-Next-Cursor']})
+    assert [(row['doctor_id'], row['total']) for row in second.json] == [(2, 1)]
+    assert [row['doctor_id'] for row in client.get('/analytics/doctors?specialty=Neurology').json] == [2]
+
+
+def test_prescriptions_per_medicine(client, history):
+    response = client.get('/analytics/prescriptions')
+    assert response.json['medicines'] == [
+        {'medicine': 'Aspirin', 'count': 2}, {'medicine': 'Ibuprofen', 'count': 1}, {'medicine': 'Metformin', 'count': 1}]
+    assert client.get('/analytics/prescriptions?limit=1').json['medicines'] == [{'medicine': 'Aspirin', 'count': 2}]
+    response = client.get('/analytics/prescriptions?doctor_id=1&date_from=2030-01-08&date_to=2030-01-08')
+    assert response.json['medicines'] == [{'medicine': 'Aspirin', 'count': 1}, {'medicine': 'Metformin', 'count': 1}]
+    assert client.get('/analytics/prescriptions?limit=0').status_code == 400
+
+
+def test_writes_keep_the_rollups_current(app, client, history):
+    assert client.patch('/appointments/1', json={'status': 'Completed'}).status_code == 200
+    # Moving an appointment moves its prescriptions with it
+    assert client.patch('/appointments/3', json={'doctor_id': 2, 'time': '10:00'}).status_code == 200
+    assert client.patch('/prescriptions/4', json={'medicine': 'Aspirin'}).status_code == 200
+    assert client.delete('/appointments/2').status_code == 204
+    assert client.post('/appointments/bulk', json=[
+        {'user_id': 1, 'doctor_id': 1, 'date': '2030-01-09', 'time': '09:00', 'status': 'Scheduled'}]).status_code == 201
+
+    assert statuses(client.get('/analytics/appointments?doctor_id=1')) == {'Completed': 1, 'Scheduled': 1}
+    assert statuses(client.get('/analytics/appointments?doctor_id=2')) == {'Completed': 1, 'Scheduled': 1}
+    assert client.get('/analytics/prescriptions?doctor_id=2').json['medicines'] == [
+        {'medicine': 'Aspirin', 'count': 2}, {'medicine': 'Metformin', 'count': 1}]
+    # The triggers end where a recount from scratch does
+    assert rollups(app) == rebuilt(app)
+
+
+def test_specialty_change_moves_a_doctors_counts(app, client, history):
+    with app.app_context():
+        db.session.get(Doctor, 2).specialty = 'Cardiology'
+        db.session.commit()
+    response = client.get('/analytics/specialties')
+    assert [(row['specialty'], row['total']) for row in response.json] == [('Cardiology', 4)]
+    assert rollups(app) == rebuilt(app)
+
+
+def test_rebuild_command_recounts(app, history):
+    expected = rollups(app)
+    with app.app_context():
+        db.session.query(AnalyticsRollup).delete()
+        db.session.commit()
+    result = app.test_cli_runner().invoke(args=['analytics', 'rebuild'])
+    assert result.exit_code == 0, result.output
+    assert 'Rebuilt' in result.output
+    assert rollups(app) == expected
+
+
+def test_generate_recounts_instead_of_firing_triggers(app, history):
+    with app.app_context():
+        datagen.generate(users=5, doctors=2, appointments=20, prescriptions=30, start=date(2030, 2, 4), days=7)
+        names = {row[0] for row in db.session.execute(db.text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'analytics_%'"))}
+    assert names == {f'analytics_{name}' for name in analytics.TRIGGERS}
+    assert rollups(app) == rebuilt(app)
+    with app.app_context():
+        assert analytics.appointments(db.session, analytics.ALL, '')['total'] == 24
@@ -0,0 +1,70 @@
+"""The create_app() factory."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, SETTINGS
+from config import create_app, db
+
+
+def run(script, **env):
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True,
+                            env={**os.environ, **env})
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip()
+
+
+def test_scripts_do_not_load_the_http_layer(database_url):
+    output = run(f'''
+import sys
+from config import create_app
+app = create_app({{'DATABASE_URL': {database_url!r}}}, resources=False)
+print(sorted(rule.endpoint for rule in app.url_map.iter_rules()), 'resources' in sys.modules)
+''')
+    assert output == "['static'] False"
+
+
+def test_app_module_reads_the_environment(database_url):
+    output = run('from app import app; print(app.config["SQLALCHEMY_DATABASE_URI"])',
+                 DATABASE_URL=database_url, HASHING_WORKERS='0')
+    assert output == database_url
+
+
+def test_overrides_win_over_the_environment(monkeypatch, database_url):
+    monkeypatch.setenv('CACHE_TTL', '5')
+    app = create_app({'DATABASE_URL': database_url, 'CACHE_TTL': 7, **SETTINGS})
+    assert app.config['CACHE_TTL'] == 7
+    assert app.config['SQLALCHEMY_DATABASE_URI'] == database_url
+
+
+def test_apps_are_independent(tmp_path):
+    first = create_app({'DATABASE_URL': f'sqlite:///{tmp_path / "a.db"}', **SETTINGS})
+    second = create_app({'DATABASE_URL': f'sqlite:///{tmp_path / "b.db"}', **SETTINGS})
+    with first.app_context():
+        db.create_all()
+    with second.app_context():
+        assert db.inspect(db.engine).get_table_names() == []
+    assert first.test_client().get('/doctors').json == []
+
+
+def test_forked_children_do_not_reuse_pooled_connections(app):
+    with app.app_context():
+        engine = db.engine
+        with engine.connect():
+            pass
+        pooled = engine.pool.checkedin()
+        assert pooled
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if engine.pool.checkedin() == 0 else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+        assert engine.pool.checkedin() == pooled
+
+
+def test_other_databases_are_refused():
+    # Before any connection is attempted
+    with pytest.raises(ValueError, match='must be a SQLite database, not postgresql.*medication history'):
+        create_app({'DATABASE_URL': 'postgres://clinic@db.invalid/clinic', **SETTINGS})
@@ -0,0 +1,152 @@
+"""Archival of old appointments and prescriptions, and ?archived=1 reads."""
+from datetime import date, time
+
+import pytest
+
+import analytics
+from archive import archive, archive_batch
+from config import db
+from models import AnalyticsRollup, Appointment, ArchivedAppointment, ArchivedPrescription, Prescription
+
+CUTOFF = date(2025, 1, 1)
+APPOINTMENT = {'user_id': 1, 'doctor_id': 1, 'time': '10:00', 'status': 'Completed'}
+
+
+@pytest.fixture
+def history(app):
+    # Two old appointments with prescriptions, one old without, and two recent ones
+    with app.app_context():
+        db.session.add_all([
+            Appointment(user_id=1, doctor_id=1, date=day, time=time(9), status=status)
+            for day, status in [(date(2020, 1, 6), 'Completed'), (date(2020, 1, 7), 'Cancelled'),
+                                (date(2021, 3, 1), 'Completed'), (date(2030, 1, 7), 'Scheduled'),
+                                (date(2030, 1, 8), 'Scheduled')]
+        ])
+        db.session.add_all([
+            Prescription(appointment_id=appointment_id, medicine=medicine, dosage='1 x 10 mg', instructions='Daily')
+            for appointment_id, medicine in [(1, 'Aspirin'), (1, 'Metformin'), (3, 'Aspirin'), (4, 'Ibuprofen')]
+        ])
+        db.session.commit()
+
+
+def rollups(app):
+    with app.app_context():
+        return sorted(db.session.query(AnalyticsRollup.metric, AnalyticsRollup.scope, AnalyticsRollup.scope_key,
+                                       AnalyticsRollup.day, AnalyticsRollup.bucket, AnalyticsRollup.count)
+                      .filter(AnalyticsRollup.count != 0))
+
+
+def ids(response):
+    assert response.status_code == 200, response.json
+    return [row['id'] for row in response.json]
+
+
+def test_old_appointments_move_with_their_prescriptions(app, client, history):
+    with app.app_context():
+        assert archive(db.session, CUTOFF) == (3, 3)
+        assert db.session.query(Appointment.id).order_by(Appointment.id).all() == [(4,), (5,)]
+        assert [row.id for row in db.session.query(Prescription)] == [4]
+        archived = db.session.get(ArchivedAppointment, 1)
+        assert (archived.date, archived.status, archived.version) == (date(2020, 1, 6), 'Completed', 1)
+        assert archived.archived_at is not None
+        assert sorted(row.id for row in archived.prescriptions) == [1, 2]
+        # Nothing left to move
+        assert archive(db.session, CUTOFF) == (0, 0)
+
+
+def test_batches_are_separate_transactions(app, history):
+    with app.app_context():
+        assert archive_batch(db.session, CUTOFF, 2) == (2, 2)
+        assert db.session.query(ArchivedAppointment).count() == 2
+        reports = []
+        assert archive(db.session, CUTOFF, batch_size=1, report=lambda *moved: reports.append(moved)) == (1, 1)
+        # A short batch ends the run
+        assert reports == [(1, 1), (1, 1)]
+
+
+def test_archived_rows_are_read_with_the_flag(app, client, history):
+    with app.app_context():
+        archive(db.session, CUTOFF)
+    assert ids(client.get('/appointments')) == [4, 5]
+    assert ids(client.get('/appointments?archived=1')) == [1, 2, 3]
+    assert ids(client.get('/appointments?archived=1&status=Completed')) == [1, 3]
+    assert ids(client.get('/appointments/user/1?archived=1&date_to=2020-12-31')) == [1, 2]
+    assert ids(client.get('/appointments/doctor/1?archived=1')) == [1, 2, 3]
+    assert ids(client.get('/prescriptions?archived=1&medicine=Aspirin')) == [1, 3]
+
+    assert client.get('/appointments/1').status_code == 404
+    response = client.get('/appointments/1?archived=1&expand=prescriptions')
+    assert response.status_code == 200
+    assert response.json['date'] == '2020-01-06'
+    assert [row['medicine'] for row in response.json['prescriptions']] == ['Aspirin', 'Metformin']
+    assert client.get('/prescriptions/2?archived=1&fields=id,dosage').json == {'id': 2, 'dosage': '1 x 10 mg'}
+    assert client.get('/prescriptions/4?archived=1').status_code == 404
+
+    first = client.get('/appointments?archived=1&limit=2')
+    second = client.get('/appointments', query_string={'archived': 1, 'limit': 2,
+                                                       'after': first.headers['X-Next-Cursor']})
+    assert ids(first) + ids(second) == [1, 2, 3]
+    assert client.get('/appointments?archived=yes').status_code == 400
+
+
+def test_archiving_changes_etags(app, client, history):
+    live = client.get('/appointments')
+    archived = client.get('/appointments?archived=1')
+    assert live.headers['ETag'] != archived.headers['ETag']
+    with app.app_context():
+        archive(db.session, CUTOFF)
+    for path, response in (('/appointments', live), ('/appointments?archived=1', archived)):
+        assert client.get(path, headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+
+def test_analytics_still_count_archived_history(app, client, history):
+    before = rollups(app)
+    with app.app_context():
+        archive(db.session, CUTOFF)
+    assert rollups(app) == before
+    with app.app_context():
+        analytics.rebuild(db.session)
+        db.session.commit()
+    assert rollups(app) == before
+    assert client.get('/analytics/appointments').json['total'] == 5
+
+
+def test_search_covers_live_prescriptions_only(app, client, history):
+    assert len(client.get('/prescriptions/search?q=aspirin').json) == 2
+    with app.app_context():
+        archive(db.session, CUTOFF)
+    assert client.get('/prescriptions/search?q=aspirin').json == []
+    assert [row['id'] for row in client.get('/prescriptions/search?q=ibuprofen').json] == [4]
+
+
+def test_cli(app, history):
+    runner = app.test_cli_runner()
+    # Everything dated more than --days ago
+    result = runner.invoke(args=['archive', 'run', '--days', str((date.today() - CUTOFF).days), '--pause', '0'])
+    assert result.exit_code == 0, result.output
+    assert f'Archived 3 appointments and 3 prescriptions before {CUTOFF}' in result.output
+
+    result = runner.invoke(args=['archive', 'stats'])
+    assert result.exit_code == 0, result.output
+    counts = dict(line.split() for line in result.output.splitlines()[:4])
+    assert counts == {'appointments': '2', 'appointments_archive': '3', 'prescriptions': '1',
+                      'prescriptions_archive': '3'}
+    assert 'oldest hot appointment    2030-01-07' in result.output
+    with app.app_context():
+        assert db.session.query(ArchivedPrescription).count() == 3
+
+
+def test_archived_ids_are_not_reused(app, client):
+    # A historical import between recent bookings: a high id with an old date
+    first, imported, newest = client.post('/appointments/bulk', json=[
+        {**APPOINTMENT, 'date': '2031-01-06'}, {**APPOINTMENT, 'date': '2020-01-06'},
+        {**APPOINTMENT, 'date': '2031-01-07'}]).json['results']
+    with app.app_context():
+        assert archive(db.session, CUTOFF) == (1, 0)
+    assert client.delete(f"/appointments/{newest['id']}").status_code == 204
+
+    created = client.post('/appointments', json={**APPOINTMENT, 'date': '2032-01-05'})
+    assert created.status_code == 201
+    assert created.json['id'] > newest['id']
+    assert client.get(f"/appointments/{imported['id']}?archived=1").json['date'] == '2020-01-06'
+    assert client.get(f"/appointments/{first['id']}").status_code == 200
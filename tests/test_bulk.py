@@ -0,0 +1,105 @@
+"""Bulk create/update: per-item results, one transaction, the item cap."""
+import json
+
+import pytest
+from sqlalchemy import text
+
+import bulk
+from config import db
+from models import Appointment, Prescription
+
+
+def appointment(**overrides):
+    return {'user_id': 1, 'doctor_id': 1, 'date': '2024-05-01', 'time': '09:00', 'status': 'scheduled',
+            **overrides}
+
+
+def prescription(**overrides):
+    return {'appointment_id': 1, 'medicine': 'Aspirin', 'dosage': '100mg', 'instructions': 'Daily', **overrides}
+
+
+def count(app, model):
+    with app.app_context():
+        return db.session.query(model).count()
+
+
+def test_all_valid_items_are_created(app, client):
+    response = client.post('/appointments/bulk', json=[appointment(time='09:00'), appointment(time='09:30')])
+    assert response.status_code == 201
+    assert response.json['results'] == [{'index': 0, 'status': 201, 'id': 1}, {'index': 1, 'status': 201, 'id': 2}]
+    assert count(app, Appointment) == 2
+
+
+def test_invalid_items_are_reported_and_the_rest_written(app, client):
+    response = client.post('/appointments/bulk', json=[
+        appointment(), appointment(date='May 1st'), appointment(user_id=99, time='10:00'), 'not an object',
+        appointment(time='11:00'),
+    ])
+    assert response.status_code == 207
+    results = response.json['results']
+    assert [result['status'] for result in results] == [201, 400, 400, 400, 201]
+    assert 'date' in results[1]['errors']
+    assert results[2]['errors'] == {'user_id': 'does not exist'}
+    assert count(app, Appointment) == 2
+
+
+def test_ndjson_body(app, client):
+    body = '\n'.join(json.dumps(appointment(time=f'{hour:02}:00')) for hour in (9, 10, 11)) + '\n\n'
+    response = client.post('/appointments/bulk', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 201
+    assert count(app, Appointment) == 3
+
+    response = client.post('/appointments/bulk', data='{}\nnot json\n', content_type='application/x-ndjson')
+    assert response.status_code == 400
+    assert 'line 2' in response.json['error']
+
+
+def test_updates_report_missing_rows(app, client):
+    client.post('/appointments/bulk', json=[appointment()])
+    client.post('/prescriptions/bulk', json=[prescription()])
+    response = client.put('/prescriptions/bulk', json=[
+        {'id': 1, 'dosage': '200mg'}, {'id': 2, 'dosage': '5mg'}, {'id': 1}, {'dosage': '5mg'},
+        {'id': 1, 'appointment_id': 42},
+    ])
+    assert response.status_code == 207
+    assert [result['status'] for result in response.json['results']] == [200, 404, 400, 400, 400]
+    assert response.json['results'][4]['errors'] == {'appointment_id': 'does not exist'}
+    with app.app_context():
+        assert db.session.get(Prescription, 1).dosage == '200mg'
+        assert db.session.get(Prescription, 1).appointment_id == 1
+
+
+def test_database_failure_writes_nothing(app, client, monkeypatch):
+    monkeypatch.setattr(bulk, 'CHUNK_SIZE', 2)
+    with app.app_context():
+        db.session.execute(text(
+            "CREATE TRIGGER reject_poison BEFORE INSERT ON prescriptions WHEN NEW.medicine = 'Poison' "
+            "BEGIN SELECT RAISE(ABORT, 'rejected'); END"))
+        db.session.commit()
+    client.post('/appointments/bulk', json=[appointment()])
+
+    # The failing row is in the second chunk: the first chunk is rolled back with it
+    response = client.post('/prescriptions/bulk', json=[prescription(), prescription(), prescription(medicine='Poison')])
+    assert response.status_code == 500
+    # The database's message carries the rows' values: logged, never returned
+    assert response.json == {'error': 'Batch failed, nothing was written'}
+    assert count(app, Prescription) == 0
+
+
+@pytest.mark.parametrize('content_type', ['application/json', 'application/x-ndjson'])
+def test_item_cap(app, client, monkeypatch, content_type):
+    monkeypatch.setattr(bulk, 'MAX_ITEMS', 2)
+    items = [appointment(time=f'{hour:02}:00') for hour in (9, 10, 11)]
+    if content_type == 'application/json':
+        body = json.dumps(items)
+    else:
+        body = '\n'.join(json.dumps(item) for item in items)
+    response = client.post('/appointments/bulk', data=body, content_type=content_type)
+    assert response.status_code == 400
+    assert 'At most 2 items' in response.json['error']
+    assert count(app, Appointment) == 0
+    assert client.post('/appointments/bulk', json=items[:2]).status_code == 201
+
+
+def test_body_must_be_an_array(client):
+    assert client.post('/appointments/bulk', json={'user_id': 1}).status_code == 400
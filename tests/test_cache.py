@@ -0,0 +1,89 @@
+"""Read-through cache of doctor and user representations, across processes too."""
+import time
+
+from cache import LRUBackend
+
+DOCTOR = {'name': 'Dr. Ines Salo', 'email': 'ines@example.com', 'password': 'secret', 'specialty': 'Cardiology',
+          'experience_years': 4, 'availability': 'Available'}
+USER = {'name': 'Ada Lovelace', 'email': 'ada@example.com', 'age': 36, 'gender': 'Female',
+        'phone_number': '555-0100'}
+
+
+def lookups(client):
+    samples = dict(line.rsplit(' ', 1) for line in client.get('/metrics').text.splitlines()
+                   if line.startswith('cache_lookups_total{'))
+    return {result: int(float(samples.get(f'cache_lookups_total{{result="{result}"}}', 0)))
+            for result in ('hit', 'miss')}
+
+
+def test_second_read_is_a_hit(client):
+    before = lookups(client)
+    assert client.get('/doctors/1').json['name'] == 'Dr. Grace Okafor'
+    assert client.get('/doctors/1').json['name'] == 'Dr. Grace Okafor'
+    after = lookups(client)
+    assert (after['hit'] - before['hit'], after['miss'] - before['miss']) == (1, 1)
+    # Different representations are cached apart
+    assert client.get('/doctors/1?fields=name').json == {'name': 'Dr. Grace Okafor'}
+    assert lookups(client)['miss'] - before['miss'] == 2
+
+
+def test_writes_invalidate_details_and_pages(client):
+    assert client.get('/users/1').json['name'] == 'Ada Moreau'
+    assert [doctor['id'] for doctor in client.get('/doctors').json] == [1]
+
+    assert client.put('/users/1', json=USER).status_code == 200
+    assert client.post('/doctors', json=DOCTOR).status_code == 201
+    assert client.get('/users/1').json['name'] == 'Ada Lovelace'
+    assert [doctor['id'] for doctor in client.get('/doctors').json] == [1, 2]
+
+
+def test_expanded_representations_follow_embedded_tables(client):
+    assert client.get('/doctors/1?expand=appointments').json['appointments'] == []
+    client.post('/appointments', json={'user_id': 1, 'doctor_id': 1, 'date': '2030-01-07', 'time': '09:00',
+                                       'status': 'Scheduled'})
+    assert len(client.get('/doctors/1?expand=appointments').json['appointments']) == 1
+
+    client.post('/appointments/bulk', json=[{'user_id': 1, 'doctor_id': 1, 'date': '2030-01-07', 'time': '10:00',
+                                             'status': 'Scheduled'}])
+    assert len(client.get('/doctors/1?expand=appointments').json['appointments']) == 2
+
+
+def test_lru_backend_evicts_and_expires():
+    backend = LRUBackend(max_entries=2)
+    backend.set('a', 1, ttl=60)
+    backend.set('b', 2, ttl=60)
+    assert backend.get('a') == 1
+    backend.set('c', 3, ttl=60)
+    assert backend.get('b') is None and backend.get('a') == 1 and len(backend) == 2
+
+    backend.set('d', 4, ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get('d') is None
+
+
+def test_detail_is_not_served_stale_after_another_process_writes(client, other_worker):
+    first = client.get('/users/1')
+    assert first.json['name'] == 'Ada Moreau'
+    assert client.get('/users/1').json['name'] == 'Ada Moreau'  # now from this process's cache
+
+    assert other_worker(('PATCH', '/users/1', {'name': 'Ada Lovelace'})) == [200]
+
+    response = client.get('/users/1', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.json['name'] == 'Ada Lovelace'
+    assert response.headers['ETag'] != first.headers['ETag']
+    assert client.get('/users/1', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_cached_pages_are_not_served_stale_after_another_process_writes(client, other_worker):
+    first = client.get('/doctors')
+    assert first.json[0]['slot_minutes'] == 30
+    assert client.get('/doctors').json == first.json
+
+    schedule = {'slot_minutes': 20, 'working_hours': [{'weekday': 0, 'start_time': '09:00', 'end_time': '17:00'}]}
+    assert other_worker(('PUT', '/doctors/1/schedule', schedule)) == [200]
+
+    response = client.get('/doctors', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.json[0]['slot_minutes'] == 20
+    assert client.get('/doctors/1').json['slot_minutes'] == 20
@@ -0,0 +1,60 @@
+"""Per-user and per-doctor appointment calendars."""
+from datetime import date, time
+
+import pytest
+from sqlalchemy import text
+
+from config import db
+from models import Appointment, Doctor
+
+
+@pytest.fixture
+def appointments(app):
+    with app.app_context():
+        db.session.add(Doctor(name='Dr. Hugo Brandt', email='hugo@example.com', password_hash='x',
+                              specialty='Dermatology', experience_years=3, availability='Available'))
+        db.session.add_all([
+            Appointment(user_id=1, doctor_id=1, date=date(2024, 5, 2), time=time(9), status='scheduled'),
+            Appointment(user_id=1, doctor_id=2, date=date(2024, 5, 1), time=time(14), status='cancelled'),
+            Appointment(user_id=1, doctor_id=1, date=date(2024, 5, 1), time=time(10), status='scheduled'),
+        ])
+        db.session.commit()
+
+
+def test_user_calendar_is_ordered_by_date_and_time(client, appointments):
+    response = client.get('/appointments/user/1')
+    assert response.status_code == 200
+    assert [a['id'] for a in response.json] == [3, 2, 1]
+
+
+def test_doctor_calendar_only_has_that_doctors_appointments(client, appointments):
+    assert [a['id'] for a in client.get('/appointments/doctor/1').json] == [3, 1]
+    assert [a['id'] for a in client.get('/appointments/doctor/2').json] == [2]
+
+
+def test_calendar_filters_and_pages(client, appointments):
+    assert [a['id'] for a in client.get('/appointments/user/1?status=scheduled').json] == [3, 1]
+    assert [a['id'] for a in client.get('/appointments/user/1?date_from=2024-05-02').json] == [1]
+
+    first = client.get('/appointments/user/1?limit=2')
+    assert [a['id'] for a in first.json] == [3, 2]
+    rest = client.get('/appointments/user/1', query_string={'limit': 2, 'after': first.headers['X-Next-Cursor']})
+    assert [a['id'] for a in rest.json] == [1]
+
+
+def test_unknown_owner_is_not_found(client):
+    assert client.get('/appointments/user/99').status_code == 404
+    assert client.get('/appointments/doctor/99').status_code == 404
+
+
+def test_calendar_queries_use_the_indexes(app):
+    with app.app_context():
+        for sql, index in [
+            ('SELECT id FROM appointments WHERE doctor_id = 1 ORDER BY date, time, id',
+             'ix_appointments_doctor_id_date_time'),
+            ('SELECT id FROM appointments WHERE user_id = 1 AND date >= :day', 'ix_appointments_user_id_date'),
+            ('SELECT id FROM prescriptions WHERE appointment_id = 1', 'ix_prescriptions_appointment_id'),
+        ]:
+            plan = ' '.join(row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql),
+                                                                   {'day': '2024-05-01'}))
+            assert index in plan
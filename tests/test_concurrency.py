@@ -0,0 +1,156 @@
+"""Optimistic concurrency: row versions, If-Match and lost-update detection."""
+from datetime import date, time
+
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+
+from config import db
+from models import Appointment, Prescription
+
+BOOKING = {'user_id': 1, 'doctor_id': 1, 'date': '2030-01-07', 'time': '09:00', 'status': 'Scheduled'}
+PRESCRIPTION = {'appointment_id': 1, 'medicine': 'Aspirin', 'dosage': '1 x 10 mg', 'instructions': 'Daily'}
+PATHS = {'/appointments/1': {'status': 'Completed'}, '/prescriptions/1': {'dosage': '2 x 10 mg'}}
+
+
+@pytest.fixture
+def rows(app):
+    with app.app_context():
+        db.session.add(Appointment(user_id=1, doctor_id=1, date=date(2030, 1, 7), time=time(9), status='Scheduled'))
+        db.session.add(Prescription(appointment_id=1, medicine='Aspirin', dosage='1 x 10 mg', instructions='Daily'))
+        db.session.commit()
+
+
+def etag(client, path):
+    return client.get(path).headers['ETag']
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_row_etags_lead_with_the_version(client, rows, path):
+    first = etag(client, path)
+    assert first.startswith('"1.')
+    assert client.patch(path, json=PATHS[path]).status_code == 200
+    assert etag(client, path).startswith('"2.')
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_matching_if_match_writes_and_returns_the_new_etag(client, rows, path):
+    response = client.patch(path, json=PATHS[path], headers={'If-Match': etag(client, path)})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == etag(client, path)
+    # And the new ETag is good for a conditional GET
+    assert client.get(path, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_stale_if_match_is_a_conflict(client, rows, path):
+    stale = etag(client, path)
+    assert client.patch(path, json=PATHS[path]).status_code == 200
+    current = etag(client, path)
+
+    response = client.patch(path, json=PATHS[path], headers={'If-Match': stale})
+    assert response.status_code == 409
+    assert 'changed by another request' in response.json['error']
+    assert response.headers['ETag'] == current
+    # Nothing was written
+    assert etag(client, path) == current
+    assert client.get(path, headers={'If-None-Match': stale}).status_code == 200
+
+
+@pytest.mark.parametrize('path', PATHS)
+@pytest.mark.parametrize('header', ['*', 'W/{tag}', '"9.abc", {tag}'])
+def test_if_match_forms(client, rows, path, header):
+    header = header.format(tag=etag(client, path))
+    assert client.patch(path, json=PATHS[path], headers={'If-Match': header}).status_code == 200
+
+
+@pytest.mark.parametrize('path', PATHS)
+@pytest.mark.parametrize('header', ['"abc"', 'garbage', '"1"'])
+def test_if_match_without_a_row_version_never_matches(client, rows, path, header):
+    assert client.patch(path, json=PATHS[path], headers={'If-Match': header}).status_code == 409
+
+
+def test_put_honours_if_match(client, rows):
+    stale = etag(client, '/appointments/1')
+    # An unchanged PUT writes nothing and keeps the version
+    assert client.put('/appointments/1', json=BOOKING, headers={'If-Match': stale}).status_code == 200
+    assert client.put('/appointments/1', json={**BOOKING, 'status': 'Completed'},
+                      headers={'If-Match': stale}).status_code == 200
+    assert client.put('/appointments/1', json=BOOKING, headers={'If-Match': stale}).status_code == 409
+
+    stale = etag(client, '/prescriptions/1')
+    assert client.put('/prescriptions/1', json=PRESCRIPTION, headers={'If-Match': stale}).status_code == 200
+    assert client.put('/prescriptions/1', json={**PRESCRIPTION, 'dosage': '2 x 10 mg'},
+                      headers={'If-Match': stale}).status_code == 200
+    assert client.put('/prescriptions/1', json=PRESCRIPTION, headers={'If-Match': stale}).status_code == 409
+
+
+@pytest.mark.parametrize('path', ['/appointments/9', '/prescriptions/9'])
+def test_unknown_row_is_not_found(client, rows, path):
+    assert client.patch(path, json={'status': 'Completed', 'dosage': '1 mg'},
+                        headers={'If-Match': '"1.abc"'}).status_code == 404
+
+
+def test_without_if_match_the_last_write_wins(client, rows):
+    assert client.patch('/prescriptions/1', json={'dosage': '2 x 10 mg'}).status_code == 200
+    assert client.patch('/prescriptions/1', json={'dosage': '3 x 10 mg'}).status_code == 200
+    assert client.get('/prescriptions/1').json['dosage'] == '3 x 10 mg'
+
+
+def test_prescription_write_invalidates_cached_reads(client, rows):
+    before = client.get('/appointments/1?expand=prescriptions')
+    assert client.patch('/prescriptions/1', json={'dosage': '2 x 10 mg'}).status_code == 200
+    after = client.get('/appointments/1?expand=prescriptions', headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200
+    assert after.json['prescriptions'][0]['dosage'] == '2 x 10 mg'
+    assert client.get('/prescriptions', headers={'If-None-Match': before.headers['ETag']}).status_code == 200
+
+
+def test_flush_detects_a_concurrent_write(app, rows):
+    with app.app_context():
+        # Keep what was read across the end of the read transaction, as a
+        # client holding an ETag does
+        db.session().expire_on_commit = False
+        appointment = db.session.get(Appointment, 1)
+        db.session.commit()
+        # Another writer commits between our read and our flush
+        with db.engine.begin() as connection:
+            connection.execute(Appointment.__table__.update().values(version=Appointment.version + 1))
+        appointment.status = 'Completed'
+        with pytest.raises(StaleDataError):
+            db.session.commit()
+        db.session.rollback()
+        assert db.session.get(Appointment, 1).status == 'Scheduled'
+
+
+def test_bulk_updates_bump_versions(client, rows):
+    response = client.put('/appointments/bulk', json=[{'id': 1, 'status': 'Completed'}])
+    assert response.status_code == 200
+    assert etag(client, '/appointments/1').startswith('"2.')
+    response = client.put('/prescriptions/bulk', json=[{'id': 1, 'dosage': '2 x 10 mg'}])
+    assert response.status_code == 200
+    assert etag(client, '/prescriptions/1').startswith('"2.')
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_delete_honours_if_match(client, rows, path):
+    stale = etag(client, path)
+    assert client.patch(path, json=PATHS[path]).status_code == 200
+    response = client.delete(path, headers={'If-Match': stale})
+    assert response.status_code == 409
+    assert response.headers['ETag'] == etag(client, path)
+    assert client.delete(path, headers={'If-Match': etag(client, path)}).status_code == 204
+    assert client.get(path).status_code == 404
+    assert client.delete(path, headers={'If-Match': stale}).status_code == 404
+
+
+def test_prescription_write_checks_the_version_it_read(app, rows):
+    with app.app_context():
+        db.session().expire_on_commit = False
+        prescription = db.session.get(Prescription, 1)
+        db.session.commit()
+        with db.engine.begin() as connection:
+            connection.execute(Prescription.__table__.update().values(version=Prescription.version + 1))
+        prescription.dosage = '2 x 10 mg'
+        with pytest.raises(StaleDataError):
+            db.session.commit()
+        db.session.rollback()
@@ -0,0 +1,102 @@
+"""Conditional GETs: ETag, Last-Modified and 304."""
+import pytest
+
+from config import db
+from models import ChangeToken, Doctor
+
+USER = {'name': 'Ada Lovelace', 'email': 'ada@example.com', 'age': 36, 'gender': 'Female',
+        'phone_number': '555-0100'}
+APPOINTMENT = {'user_id': 1, 'doctor_id': 1, 'date': '2030-01-07', 'time': '09:00', 'status': 'Scheduled'}
+
+
+def revalidate(client, path, response):
+    return client.get(path, headers={'If-None-Match': response.headers['ETag']})
+
+
+@pytest.mark.parametrize('path', ['/users/1', '/doctors/1', '/users', '/doctors', '/appointments',
+                                  '/prescriptions', '/appointments/user/1', '/doctors/1?expand=appointments'])
+def test_unchanged_resources_answer_304(client, path):
+    first = client.get(path)
+    assert first.status_code == 200
+    assert first.headers['ETag'].startswith('"')
+
+    again = revalidate(client, path, first)
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == first.headers['ETag']
+
+
+def test_row_etag_changes_on_update(client):
+    first = client.get('/users/1')
+    assert client.put('/users/1', json=USER).status_code == 200
+
+    response = revalidate(client, '/users/1', first)
+    assert response.status_code == 200
+    assert response.json['name'] == 'Ada Lovelace'
+    assert response.headers['ETag'] != first.headers['ETag']
+
+
+def test_representations_have_their_own_etags(client):
+    assert client.get('/users/1').headers['ETag'] != client.get('/users/1?fields=name').headers['ETag']
+    assert client.get('/users?limit=1').headers['ETag'] != client.get('/users').headers['ETag']
+
+
+def test_list_and_expanded_etags_follow_their_tables(client):
+    page = client.get('/appointments')
+    expanded = client.get('/doctors/1?expand=appointments')
+    flat = client.get('/doctors/1')
+    assert client.post('/appointments', json=APPOINTMENT).status_code == 201
+
+    assert revalidate(client, '/appointments', page).status_code == 200
+    assert revalidate(client, '/doctors/1?expand=appointments', expanded).status_code == 200
+    assert revalidate(client, '/doctors/1', flat).status_code == 304
+
+
+def test_bulk_writes_change_etags(client):
+    client.post('/appointments', json=APPOINTMENT)
+    page = client.get('/appointments')
+    detail = client.get('/appointments/1')
+    response = client.put('/appointments/bulk', json=[{'id': 1, 'status': 'Confirmed'}])
+    assert response.status_code == 200
+
+    assert revalidate(client, '/appointments', page).status_code == 200
+    assert revalidate(client, '/appointments/1', detail).json['status'] == 'Confirmed'
+
+
+def test_if_modified_since(client):
+    first = client.get('/doctors/1')
+    last_modified = first.headers['Last-Modified']
+    assert client.get('/doctors/1', headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert client.get('/doctors/1', headers={'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'}).status_code == 200
+    assert client.get('/doctors/1', headers={'If-Modified-Since': 'yesterday'}).status_code == 200
+    # If-None-Match wins over If-Modified-Since
+    assert client.get('/doctors/1', headers={'If-None-Match': '"other"',
+                                             'If-Modified-Since': last_modified}).status_code == 200
+
+
+def test_missing_row_is_not_found(client):
+    response = client.get('/users/99', headers={'If-None-Match': '*'})
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
+
+
+def tokens(app):
+    with app.app_context():
+        return dict(db.session.query(ChangeToken.table_name, ChangeToken.version))
+
+
+def test_tokens_advance_after_the_write_commits(app):
+    before = tokens(app)
+    with app.app_context():
+        db.session.get(Doctor, 1).experience_years += 1
+        db.session.flush()
+        # Not inside the write's transaction, which would hold the token row's lock until commit
+        assert db.session.scalar(db.select(ChangeToken.version).filter_by(table_name='doctors')) == before['doctors']
+        db.session.commit()
+    assert tokens(app)['doctors'] == before['doctors'] + 1
+
+    with app.app_context():
+        db.session.get(Doctor, 1).experience_years += 1
+        db.session.flush()
+        db.session.rollback()
+    assert tokens(app)['doctors'] == before['doctors'] + 1
@@ -0,0 +1,97 @@
+"""Engine profile: SQLite pragmas, explicit BEGIN and read-only GETs."""
+import pytest
+from flask import Flask
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import database
+from config import db
+from models import Prescription
+
+
+def pragma(engine, name):
+    with engine.connect() as connection:
+        return connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+
+
+def test_sqlite_pragmas(app):
+    with app.app_context():
+        for engine in (db.engines[None], db.engines[database.READ_BIND]):
+            assert pragma(engine, 'journal_mode') == 'wal'
+            assert pragma(engine, 'foreign_keys') == 1
+            assert pragma(engine, 'synchronous') == 1
+            assert pragma(engine, 'busy_timeout') == 5000
+        assert pragma(db.engines[None], 'query_only') == 0
+        assert pragma(db.engines[database.READ_BIND], 'query_only') == 1
+
+
+def test_foreign_keys_are_enforced(app):
+    with app.app_context():
+        db.session.add(Prescription(appointment_id=99, medicine='Aspirin', dosage='100mg', instructions='Daily'))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+
+
+def test_read_bind_refuses_writes(app):
+    with app.app_context():
+        with db.engines[database.READ_BIND].connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute(text("UPDATE users SET name = 'x'"))
+
+
+@pytest.fixture
+def begins(app):
+    """Record the BEGIN statements each engine issues."""
+    seen = []
+    with app.app_context():
+        engines = {'write': db.engines[None], 'read': db.engines[database.READ_BIND]}
+    listeners = []
+    for name, engine in engines.items():
+        def record(conn, cursor, statement, *args, name=name):
+            if statement.startswith('BEGIN'):
+                seen.append((name, statement))
+        event.listen(engine, 'before_cursor_execute', record)
+        listeners.append((engine, record))
+    yield seen
+    for engine, record in listeners:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_gets_read_from_the_read_bind_and_writes_begin_immediate(client, begins):
+    assert client.get('/doctors/1').status_code == 200
+    assert begins and set(begins) == {('read', 'BEGIN')}
+
+    begins.clear()
+    assert client.post('/appointments', json={'user_id': 1, 'doctor_id': 1, 'date': '2030-01-07',
+                                              'time': '09:00', 'status': 'Scheduled'}).status_code == 201
+    assert ('write', 'BEGIN IMMEDIATE') in begins
+    assert all(name == 'write' for name, _ in begins)
+
+
+def test_logins_begin_deferred(client, begins):
+    client.post('/signup', json={'name': 'Lin Park', 'email': 'lin@example.com', 'password': 'correct horse',
+                                 'age': 29, 'gender': 'Female', 'phone_number': '555-0101'})
+    begins.clear()
+    assert client.post('/login', json={'email': 'lin@example.com', 'password': 'correct horse'}).status_code == 200
+    # The login and the session row it creates, neither holding the write lock while bcrypt runs
+    assert begins and set(begins) == {('write', 'BEGIN')}
+
+
+def test_configure_reads_the_environment(monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', 'postgres://clinic@db.internal/clinic')
+    monkeypatch.setenv('DATABASE_POOL_SIZE', '12')
+    app = Flask(__name__)
+    database.configure(app)
+    assert app.config['SQLALCHEMY_DATABASE_URI'] == 'postgresql://clinic@db.internal/clinic'
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'] == 12
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_pre_ping'] is True
+    read = app.config['SQLALCHEMY_BINDS'][database.READ_BIND]
+    assert read['url'] == 'postgresql://clinic@db.internal/clinic'
+    assert read['execution_options'] == {'postgresql_readonly': True}
+
+
+def test_memory_database_has_no_read_bind():
+    app = Flask(__name__)
+    database.configure(app, url='sqlite://')
+    assert app.config['SQLALCHEMY_BINDS'] == {}
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS'] == {}
@@ -0,0 +1,72 @@
+"""Synthetic data generation (flask generate)."""
+from datetime import date
+
+import pytest
+from sqlalchemy import func
+
+import datagen
+from conftest import SETTINGS
+from config import create_app, db
+from models import Appointment, Doctor, Prescription, User, WorkingHours
+
+
+def counts():
+    return [db.session.query(model).count() for model in (User, Doctor, WorkingHours, Appointment, Prescription)]
+
+
+def test_generate_appends_consistent_rows(app):
+    with app.app_context():
+        datagen.generate(users=20, doctors=3, appointments=40, prescriptions=60, start=date(2030, 1, 7), days=14,
+                         batch_size=7)
+        assert counts() == [21, 4, 15, 40, 60]
+        # Ids continue after the rows already there
+        assert db.session.get(User, 2).email == 'user2@example.com'
+        assert db.session.get(Doctor, 2).name.startswith('Dr. ')
+        # No doctor is booked twice for a slot, and everything is inside working hours
+        duplicates = (db.session.query(Appointment.doctor_id, Appointment.date, Appointment.time)
+                      .group_by(Appointment.doctor_id, Appointment.date, Appointment.time)
+                      .having(func.count() > 1).all())
+        assert duplicates == []
+        for appointment in Appointment.query:
+            assert appointment.date.weekday() < 5
+            assert 9 <= appointment.time.hour < 17
+        assert db.session.query(func.min(Prescription.appointment_id)).scalar() >= 1
+
+
+def test_generated_accounts_can_log_in_and_lists_see_the_rows(app, client):
+    etag = client.get('/appointments').headers['ETag']
+    with app.app_context():
+        datagen.generate(users=2, doctors=1, appointments=2, prescriptions=0, start=date(2030, 1, 7), days=7)
+    assert client.post('/login', json={'email': 'user2@example.com', 'password': 'password'}).status_code == 200
+    response = client.get('/appointments', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.json) == 2
+
+
+def test_same_seed_same_rows(tmp_path):
+    rows = []
+    for name in ('a', 'b'):
+        app = create_app({'DATABASE_URL': f'sqlite:///{tmp_path / name}.db', **SETTINGS}, resources=False)
+        with app.app_context():
+            db.create_all()
+            datagen.generate(users=5, doctors=2, appointments=10, prescriptions=5, start=date(2030, 1, 7), days=7,
+                             seed=42)
+            rows.append([(a.user_id, a.doctor_id, a.date, a.time, a.status) for a in Appointment.query])
+    assert rows[0] == rows[1]
+
+
+def test_impossible_volumes_are_refused(app):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            datagen.generate(users=1, doctors=1, appointments=1000, prescriptions=0, start=date(2030, 1, 7), days=7)
+        with pytest.raises(ValueError):
+            datagen.generate(users=0, doctors=0, appointments=0, prescriptions=5)
+
+
+def test_cli(app):
+    result = app.test_cli_runner().invoke(args=[
+        'generate', '--users', '3', '--doctors', '1', '--appointments', '4', '--prescriptions', '2',
+        '--start', '2030-01-07', '--days', '7'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert counts() == [4, 2, 5, 4, 2]
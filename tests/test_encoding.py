@@ -0,0 +1,123 @@
+"""JSON providers and negotiated response compression."""
+import gzip
+import json
+import sys
+from datetime import date, datetime, time
+
+import pytest
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+import encoding
+from config import create_app, db
+from conftest import SETTINGS
+from models import Doctor
+
+BODY = {'when': date(2030, 1, 7), 'at': time(9, 30), 'stamp': datetime(2030, 1, 7, 9, 30, 15), 'name': 'Zoë',
+        'nested': [1, 2.5, None, True]}
+
+
+@pytest.fixture
+def doctors(app):
+    # Enough rows for the list to pass COMPRESS_MIN_SIZE
+    with app.app_context():
+        db.session.add_all([
+            Doctor(name=f'Dr. {n}', email=f'doctor{n}@example.com', password_hash='x', specialty='Cardiology',
+                   experience_years=n, availability='Available')
+            for n in range(2, 30)
+        ])
+        db.session.commit()
+
+
+def make_app(database_url, **config):
+    return create_app({'DATABASE_URL': database_url, **SETTINGS, **config})
+
+
+@pytest.mark.parametrize('provider', ['stdlib', 'orjson'])
+def test_providers_write_compact_json_with_iso_dates(database_url, provider):
+    if provider == 'orjson':
+        pytest.importorskip('orjson')
+    app = make_app(database_url, JSON_PROVIDER=provider)
+    assert app.json.name == provider
+    encoded = app.json.encode(BODY)
+    assert encoded == ('{"when":"2030-01-07","at":"09:30:00","stamp":"2030-01-07T09:30:15","name":"Zoë",'
+                       '"nested":[1,2.5,null,true]}').encode('utf-8')
+    assert app.json.loads(encoded) == json.loads(encoded)
+
+
+def test_auto_prefers_orjson(database_url, monkeypatch):
+    pytest.importorskip('orjson')
+    assert make_app(database_url).json.name == 'orjson'
+    # Not installed: the standard library
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    assert make_app(database_url).json.name == 'stdlib'
+
+
+def test_responses_go_through_the_provider(client, doctors):
+    response = client.get('/doctors/1')
+    assert b', ' not in response.data and b': ' not in response.data
+    assert response.json['name'] == 'Dr. Grace Okafor'
+    assert 'encode;dur=' in response.headers['Server-Timing']
+
+
+def test_large_responses_are_gzipped(client, doctors):
+    plain = client.get('/doctors')
+    assert 'Content-Encoding' not in plain.headers
+    assert len(plain.data) >= 1024
+
+    response = client.get('/doctors', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == plain.data
+    assert 'compress;dur=' in response.headers['Server-Timing']
+
+
+def test_small_responses_are_not_compressed(client):
+    response = client.get('/doctors/1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_compressed_etag_is_weak_and_still_matches(client, doctors):
+    plain = client.get('/doctors')
+    compressed = client.get('/doctors', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['ETag'] == 'W/' + plain.headers['ETag']
+    for etag in (plain.headers['ETag'], compressed.headers['ETag']):
+        response = client.get('/doctors', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        assert response.status_code == 304
+        assert 'Content-Encoding' not in response.headers
+
+
+def test_compression_can_be_turned_off(database_url, doctors):
+    app = make_app(database_url, COMPRESS=False)
+    response = app.test_client().get('/doctors', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_brotli_only_when_installed(database_url, doctors, monkeypatch):
+    monkeypatch.setattr(encoding, '_brotli', lambda: None)
+    app = make_app(database_url)
+    response = app.test_client().get('/doctors', headers={'Accept-Encoding': 'br'})
+    assert 'Content-Encoding' not in response.headers
+    response = app.test_client().get('/doctors', headers={'Accept-Encoding': 'br, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_brotli_wins_a_tie(database_url, doctors):
+    brotli = pytest.importorskip('brotli')
+    client = make_app(database_url).test_client()
+    plain = client.get('/doctors')
+    response = client.get('/doctors', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == plain.data
+
+
+@pytest.mark.parametrize('header, available, expected', [
+    ('gzip, br', ('br', 'gzip'), 'br'),
+    ('gzip;q=1.0, br;q=0.5', ('br', 'gzip'), 'gzip'),
+    ('br;q=0, gzip', ('br', 'gzip'), 'gzip'),
+    ('*', ('gzip',), 'gzip'),
+    ('identity', ('br', 'gzip'), None),
+    ('', ('gzip',), None),
+])
+def test_negotiate(header, available, expected):
+    assert encoding.negotiate(parse_accept_header(header, Accept), available) == expected
@@ -0,0 +1,100 @@
+"""Streaming NDJSON/CSV exports and the flask export command."""
+import gzip
+import json
+from datetime import date, time, timedelta
+
+import pytest
+
+import export
+from config import db
+from models import Appointment
+
+
+@pytest.fixture
+def appointments(app, monkeypatch):
+    # Small chunks, so the stream is really written in pieces
+    monkeypatch.setattr(export, 'CHUNK_ROWS', 2)
+    with app.app_context():
+        db.session.add_all([
+            Appointment(user_id=1, doctor_id=1, date=date(2030, 1, 7) + timedelta(days=n), time=time(9),
+                        status='Cancelled' if n % 3 == 0 else 'Scheduled')
+            for n in range(7)
+        ])
+        db.session.commit()
+
+
+def lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_ndjson_export_streams_every_row_in_id_order(client, appointments):
+    response = client.get('/appointments/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=appointments.ndjson'
+    rows = lines(response)
+    assert [row['id'] for row in rows] == list(range(1, 8))
+    assert rows[0] == {'id': 1, 'user_id': 1, 'doctor_id': 1, 'date': '2030-01-07', 'time': '09:00',
+                       'status': 'Cancelled'}
+
+
+def test_csv_export(client, appointments):
+    response = client.get('/appointments/export?format=csv&status=Cancelled')
+    assert response.mimetype == 'text/csv'
+    assert response.get_data(as_text=True).splitlines() == [
+        'id,user_id,doctor_id,date,time,status',
+        '1,1,1,2030-01-07,09:00,Cancelled',
+        '4,1,1,2030-01-10,09:00,Cancelled',
+        '7,1,1,2030-01-13,09:00,Cancelled',
+    ]
+
+
+def test_after_resumes_and_limit_caps(client, appointments):
+    assert [row['id'] for row in lines(client.get('/appointments/export?after=3&limit=2'))] == [4, 5]
+    assert lines(client.get('/appointments/export?after=7')) == []
+    assert client.get('/prescriptions/export').get_data() == b''
+
+
+def test_gzip_when_accepted(client, appointments):
+    response = client.get('/appointments/export', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert len(gzip.decompress(response.get_data()).splitlines()) == 7
+
+
+@pytest.mark.parametrize('query', ['format=xml', 'after=-1', 'after=x', 'limit=0', 'date_from=May'])
+def test_invalid_arguments(client, query):
+    assert client.get(f'/appointments/export?{query}').status_code == 400
+
+
+def test_unknown_table_is_not_routed(client):
+    assert client.get('/users/export').status_code == 404
+
+
+def test_cli_export(app, appointments, tmp_path):
+    output = tmp_path / 'appointments.csv.gz'
+    result = app.test_cli_runner().invoke(args=[
+        'export', 'appointments', '--format', 'csv', '--filter', 'status=Scheduled', '--after', '2', '--gzip',
+        '-o', str(output)])
+    assert result.exit_code == 0, result.output
+    assert 'Exported 3 appointments, last id 6' in result.output
+    rows = gzip.decompress(output.read_bytes()).decode().splitlines()
+    assert [row.split(',')[0] for row in rows] == ['id', '3', '5', '6']
+
+
+def test_cli_rejects_bad_filters(app):
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['export', 'appointments', '--filter', 'status']).exit_code == 2
+    assert runner.invoke(args=['export', 'appointments', '--filter', 'user_id=x']).exit_code == 2
+
+
+
+def test_stream_returns_its_connection_when_done(app, appointments):
+    # Streamed responses outlive the request teardown that would otherwise close the session
+    with app.app_context():
+        names, query = export.export_query('appointments', {})
+        chunks = export.stream('appointments', names, query, 'ndjson')
+        assert next(chunks)
+        assert db.engine.pool.checkedout() == 1
+        assert len(b''.join(chunks).splitlines()) == 5
+        assert db.engine.pool.checkedout() == 0
@@ -0,0 +1,89 @@
+"""Password hashing off the request thread, with backpressure."""
+import threading
+import time
+
+import pytest
+
+from config import db
+from hashing import HashingBusy, HashingService, hash_rounds, hasher
+from models import User
+
+SIGNUP = {'name': 'Lin Park', 'email': 'lin@example.com', 'password': 'correct horse', 'age': 29,
+          'gender': 'Female', 'phone_number': '555-0101'}
+
+
+def test_signup_then_login(client):
+    assert client.post('/signup', json=SIGNUP).status_code == 201
+    assert client.post('/login', json={'email': 'lin@example.com', 'password': 'correct horse'}).status_code == 200
+    assert client.post('/login', json={'email': 'lin@example.com', 'password': 'wrong'}).status_code == 401
+    assert client.post('/login', json={'email': 'nobody@example.com', 'password': 'x'}).status_code == 401
+
+
+def test_login_rehashes_at_the_configured_cost(app, client):
+    client.post('/signup', json=SIGNUP)
+    hasher.configure(rounds=5)
+    assert client.post('/login', json={'email': 'lin@example.com', 'password': 'correct horse'}).status_code == 200
+    with app.app_context():
+        assert hash_rounds(User.query.filter_by(email='lin@example.com').one().password_hash) == 5
+    assert client.post('/login', json={'email': 'lin@example.com', 'password': 'correct horse'}).status_code == 200
+
+
+def test_busy_hasher_answers_503_with_retry_after(app, client, monkeypatch):
+    def busy(password):
+        raise HashingBusy('Too many password operations in progress')
+
+    monkeypatch.setattr(hasher, 'hash', busy)
+    response = client.post('/signup', json=SIGNUP)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    with app.app_context():
+        assert db.session.query(User).count() == 1
+
+
+@pytest.fixture
+def pooled():
+    service = HashingService(rounds=4, workers=1, max_pending=1)
+    yield service
+    service.configure()
+
+
+def test_pool_hashes_and_verifies(pooled):
+    hashed = pooled.hash('secret')
+    assert hash_rounds(hashed) == 4
+    assert pooled.verify('secret', hashed)
+    assert not pooled.verify('other', hashed)
+
+
+def test_pool_refuses_work_beyond_max_pending(pooled):
+    cheap = pooled.hash('cheap')
+    pooled.configure(rounds=14)
+    slow = threading.Thread(target=pooled.hash, args=('slow',))
+    slow.start()
+    refused = False
+    while slow.is_alive() and not refused:
+        try:
+            pooled.verify('cheap', cheap)
+        except HashingBusy:
+            refused = True
+    slow.join()
+    assert refused
+    assert pooled.verify('cheap', cheap)
+
+
+def test_a_timed_out_job_keeps_its_slot_until_it_finishes(pooled):
+    cheap = pooled.hash('cheap')
+    pooled.configure(rounds=14, timeout=0.01)
+    with pytest.raises(HashingBusy, match='timed out'):
+        pooled.hash('slow')
+    with pytest.raises(HashingBusy, match='Too many'):
+        pooled.verify('cheap', cheap)
+    pooled.configure(timeout=10.0)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            assert pooled.verify('cheap', cheap)
+            break
+        except HashingBusy:
+            time.sleep(0.05)
+    else:
+        pytest.fail('the slot was never released')
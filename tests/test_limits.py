@@ -0,0 +1,121 @@
+"""Per-client rate limits and admission control."""
+import pytest
+
+import limits
+from config import create_app, db
+from conftest import SETTINGS
+from models import User
+
+
+def make_client(database_url, **config):
+    # The app fixture has created the schema and rows; this app only changes the limits
+    return create_app({'DATABASE_URL': database_url, **SETTINGS, 'RATE_LIMIT_BACKEND': 'memory',
+                       'RATE_LIMIT': 0.001, 'RATE_LIMIT_BURST': 3, **config}).test_client()
+
+
+def test_a_spent_bucket_answers_429_with_retry_after(app, database_url):
+    client = make_client(database_url)
+    assert [client.get('/doctors/1').status_code for _ in range(3)] == [200, 200, 200]
+    response = client.get('/doctors/1')
+    assert response.status_code == 429
+    assert response.json == {'error': 'Too many requests'}
+    # One token at 0.001 a second
+    assert 990 <= int(response.headers['Retry-After']) <= 1000
+
+
+def test_requests_cost_what_their_resource_declares(app, database_url):
+    client = make_client(database_url, RATE_LIMIT_BURST=6)
+    # A list page costs 5, a detail 1
+    assert client.get('/doctors').status_code == 200
+    assert client.get('/doctors').status_code == 429
+    assert client.get('/doctors/1').status_code == 200
+    assert client.get('/doctors/1').status_code == 429
+
+
+def test_a_request_dearer_than_the_burst_can_still_be_paid(app, database_url):
+    client = make_client(database_url, RATE_LIMIT_BURST=2)
+    assert client.get('/appointments/export').status_code == 200
+    assert client.get('/doctors/1').status_code == 429
+
+
+def test_probes_and_metrics_are_free(app, database_url):
+    client = make_client(database_url, RATE_LIMIT_BURST=1)
+    for _ in range(3):
+        for path in ('/health', '/ready', '/metrics'):
+            assert client.get(path).status_code == 200
+        assert client.options('/doctors').status_code == 200
+
+
+def test_refusals_are_counted(app, database_url):
+    client = make_client(database_url, RATE_LIMIT_BURST=1)
+    client.get('/doctors/1')
+    client.get('/doctors/1')
+    assert 'http_requests_throttled_total{endpoint="doctorresource",reason="rate"}' in client.get('/metrics').text
+
+
+def test_clients_are_told_apart(app, database_url):
+    client = make_client(database_url, RATE_LIMIT_BURST=1, RATE_LIMIT_PROXIES=1, RATE_LIMIT_API_KEYS='k1, k2')
+    for headers in ({'X-API-Key': 'k1'}, {'X-API-Key': 'k2'}, {'X-Forwarded-For': '10.0.0.1'},
+                    {'X-Forwarded-For': '192.0.2.9, 10.0.0.2'}):
+        assert client.get('/doctors/1', headers=headers).status_code == 200
+        assert client.get('/doctors/1', headers=headers).status_code == 429
+    # An unknown key is no key: the address's bucket, already spent
+    assert client.get('/doctors/1', headers={'X-API-Key': 'k3', 'X-Forwarded-For': '10.0.0.1'}).status_code == 429
+
+
+def test_a_fresh_login_session_is_no_fresh_bucket(app, database_url):
+    with app.app_context():
+        db.session.get(User, 1).password = 'correct horse'
+        db.session.commit()
+    client = make_client(database_url, RATE_LIMIT_BURST=30)
+    login = {'email': 'ada@example.com', 'password': 'correct horse'}
+    # A login costs 10, so the third takes the rest of the bucket
+    assert [client.post('/login', json=login).status_code for _ in range(3)] == [200, 200, 200]
+    assert client.get('/doctors/1').status_code == 429
+    assert client.post('/login', json=login).status_code == 429
+
+
+def test_forwarded_for_is_ignored_without_trusted_proxies(app, database_url):
+    client = make_client(database_url, RATE_LIMIT_BURST=1)
+    assert client.get('/doctors/1', headers={'X-Forwarded-For': '10.0.0.1'}).status_code == 200
+    assert client.get('/doctors/1', headers={'X-Forwarded-For': '10.0.0.2'}).status_code == 429
+
+
+def test_admission_sheds_expensive_requests_while_cheap_ones_run(app, database_url):
+    client = make_client(database_url, RATE_LIMIT_BACKEND='none', ADMISSION_LIMIT=1)
+    # A streamed export holds its slot until the response is closed
+    export = client.get('/appointments/export', buffered=False)
+    assert export.status_code == 200
+    response = client.get('/doctors')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert client.get('/doctors/1').status_code == 200
+    assert 'reason="concurrency"' in client.get('/metrics').text
+    export.close()
+    assert client.get('/doctors').status_code == 200
+    # Released after a plain response too
+    assert client.get('/doctors').status_code == 200
+
+
+def test_memory_buckets_refill():
+    buckets = limits.MemoryBuckets()
+    assert buckets.take('a', 3, 1, 3) == 0
+    assert buckets.take('a', 2, 1, 3) == pytest.approx(2, abs=0.01)
+    # The refused request took nothing
+    assert buckets.take('a', 1, 1, 3) == pytest.approx(1, abs=0.01)
+    assert buckets.take('b', 3, 1, 3) == 0
+    assert len(buckets) == 2
+
+
+def test_admission_slots():
+    admission = limits.Admission(1, 0)
+    assert admission.enter() is True
+    assert admission.enter() is False
+    admission.leave()
+    assert admission.enter() is True
+    assert limits.Admission(1, 0.01).enter() is True
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        limits.make_buckets({'RATE_LIMIT_BACKEND': 'memcached'})
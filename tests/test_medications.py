@@ -0,0 +1,132 @@
+"""The patient_medications read model and the medication history endpoints."""
+from datetime import date, time, timedelta
+
+import pytest
+
+import datagen
+import medications
+from archive import archive
+from config import db
+from models import Appointment, PatientMedication, Prescription, User
+
+
+@pytest.fixture
+def history(app):
+    # Ada: Aspirin twice (10 mg, then 20 mg), Metformin once. Ben: Aspirin once
+    with app.app_context():
+        db.session.add(User(name='Ben Ito', email='ben@example.com', password_hash='x', age=50, gender='Male',
+                            phone_number='555-0102'))
+        db.session.add_all([
+            Appointment(user_id=user_id, doctor_id=1, date=day, time=time(hour), status='Completed')
+            for user_id, day, hour in [(1, date(2020, 1, 6), 9), (1, date(2030, 1, 7), 9), (2, date(2030, 1, 7), 10)]
+        ])
+        db.session.add_all([
+            Prescription(appointment_id=appointment_id, medicine=medicine, dosage=dosage, instructions='Daily')
+            for appointment_id, medicine, dosage in [(1, 'Aspirin', '10 mg'), (1, 'Metformin', '500 mg'),
+                                                     (2, 'Aspirin', '20 mg'), (3, 'Aspirin', '10 mg')]
+        ])
+        db.session.commit()
+
+
+def rows(app):
+    with app.app_context():
+        return sorted((row.user_id, row.medicine, row.prescription_count, row.first_date, row.last_date, row.dosage,
+                       row.doctor_id, row.appointment_id, row.prescription_id)
+                      for row in db.session.query(PatientMedication))
+
+
+def rebuilt(app):
+    with app.app_context():
+        medications.rebuild(db.session)
+        db.session.commit()
+    return rows(app)
+
+
+def medicines(response):
+    assert response.status_code == 200, response.json
+    return [(row['medicine'], row['prescription_count'], row['dosage']) for row in response.json]
+
+
+def test_a_patients_medicines_latest_first(client, history):
+    response = client.get('/users/1/medications')
+    assert medicines(response) == [('Aspirin', 2, '20 mg'), ('Metformin', 1, '500 mg')]
+    assert response.json[0] == {
+        'user_id': 1, 'medicine': 'Aspirin', 'prescription_count': 2, 'first_date': '2020-01-06',
+        'last_date': '2030-01-07', 'dosage': '20 mg', 'instructions': 'Daily', 'doctor_id': 1,
+        'appointment_id': 2, 'prescription_id': 3,
+    }
+    assert medicines(client.get('/users/2/medications')) == [('Aspirin', 1, '10 mg')]
+    assert client.get('/users/9/medications').status_code == 404
+
+
+def test_filters_and_current(client, history):
+    assert medicines(client.get('/users/1/medications?medicine=Metformin')) == [('Metformin', 1, '500 mg')]
+    assert medicines(client.get('/users/1/medications?date_to=2025-01-01')) == [('Metformin', 1, '500 mg')]
+    assert medicines(client.get('/users/1/medications?current=1')) == [('Aspirin', 2, '20 mg')]
+    assert client.get('/users/1/medications?date_from=soon').status_code == 400
+    assert client.get('/users/1/medications?current=maybe').status_code == 400
+
+
+def test_patients_on_a_medicine(client, history):
+    response = client.get('/medications?medicine=Aspirin')
+    assert [(row['user_id'], row['dosage']) for row in response.json] == [(1, '20 mg'), (2, '10 mg')]
+    first = client.get('/medications?limit=2')
+    second = client.get('/medications', query_string={'limit': 2, 'after': first.headers['X-Next-Cursor']})
+    assert [(row['medicine'], row['user_id']) for row in first.json + second.json] == [
+        ('Aspirin', 1), ('Aspirin', 2), ('Metformin', 1)]
+    response = client.get('/medications?user_id=2&expand=user&fields=medicine,user.name')
+    assert response.json == [{'medicine': 'Aspirin', 'user': {'name': 'Ben Ito'}}]
+
+
+def test_writes_keep_the_read_model_current(app, client, history):
+    assert client.patch('/prescriptions/3', json={'dosage': '30 mg'}).status_code == 200
+    assert client.post('/prescriptions', json={'appointment_id': 3, 'medicine': 'Ibuprofen', 'dosage': '200 mg',
+                                               'instructions': 'As needed'}).status_code == 201
+    # Moving Ben's appointment to Ada hands her his prescriptions, later that day than hers
+    assert client.patch('/appointments/3', json={'user_id': 1, 'time': '11:00'}).status_code == 200
+    assert client.delete('/prescriptions/2').status_code == 204
+    assert medicines(client.get('/users/1/medications')) == [
+        ('Aspirin', 3, '10 mg'), ('Ibuprofen', 1, '200 mg')]
+    assert client.get('/users/2/medications').json == []
+    # The triggers end where a recount from scratch does
+    assert rows(app) == rebuilt(app)
+
+
+def test_etag_changes_with_prescriptions(client, history):
+    etag = client.get('/users/1/medications').headers['ETag']
+    assert client.get('/users/1/medications', headers={'If-None-Match': etag}).status_code == 304
+    assert client.patch('/prescriptions/1', json={'dosage': '15 mg'}).status_code == 200
+    assert client.get('/users/1/medications', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_archived_prescriptions_still_count(app, client, history):
+    before = rows(app)
+    with app.app_context():
+        assert archive(db.session, date(2025, 1, 1)) == (1, 2)
+    assert rows(app) == before
+    assert rebuilt(app) == before
+    assert medicines(client.get('/users/1/medications')) == [('Aspirin', 2, '20 mg'), ('Metformin', 1, '500 mg')]
+
+
+def test_current_since():
+    assert medications.current_since(date(2030, 4, 1)) == date(2030, 4, 1) - timedelta(days=medications.CURRENT_DAYS)
+
+
+def test_rebuild_command(app, history):
+    expected = rows(app)
+    with app.app_context():
+        db.session.query(PatientMedication).delete()
+        db.session.commit()
+    result = app.test_cli_runner().invoke(args=['medications', 'rebuild'])
+    assert result.exit_code == 0, result.output
+    assert 'Rebuilt 3 patient medication rows' in result.output
+    assert rows(app) == expected
+
+
+def test_generate_rebuilds_instead_of_firing_triggers(app, history):
+    with app.app_context():
+        datagen.generate(users=5, doctors=2, appointments=20, prescriptions=30, start=date(2030, 2, 4), days=7)
+        names = {row[0] for row in db.session.execute(db.text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'medications_%'"))}
+    assert names == {f'medications_{name}' for name in medications.TRIGGERS}
+    assert rows(app) == rebuilt(app)
@@ -0,0 +1,89 @@
+"""Request metrics, /metrics, Server-Timing and the slow-request log."""
+import logging
+import re
+
+from conftest import SETTINGS
+from config import create_app, db
+from metrics import Counter, Histogram, RequestTimings
+from models import User
+
+
+def sample(text, name, **labels):
+    """Value of one sample in Prometheus text, or 0 when absent."""
+    wanted = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf'^{re.escape(name)}{{{re.escape(wanted)}}} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else 0
+
+
+def test_requests_are_counted_per_endpoint_and_status(client):
+    before = client.get('/metrics').get_data(as_text=True)
+    client.get('/doctors/1')
+    client.get('/doctors/99')
+    text = client.get('/metrics').get_data(as_text=True)
+
+    for status, count in (('200', 1), ('404', 1)):
+        labels = {'endpoint': 'doctorresource', 'method': 'GET', 'status': status}
+        assert sample(text, 'http_requests_total', **labels) - sample(before, 'http_requests_total', **labels) == count
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert 'http_request_sql_queries_bucket{endpoint="doctorresource",le="+Inf"}' in text
+    assert sample(text, 'http_request_phase_seconds_total', endpoint='doctorresource', phase='sql') > 0
+
+
+def test_server_timing_header(client):
+    response = client.get('/users')
+    assert re.fullmatch(r'total;dur=[\d.]+, sql;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, encode;dur=[\d.]+',
+                        response.headers['Server-Timing'])
+
+
+def test_a_page_is_timed_as_one_serialization(app, client, monkeypatch):
+    with app.app_context():
+        db.session.add_all(User(name=f'User {n}', email=f'user{n}@example.com', password_hash='x', age=30,
+                                gender='Female', phone_number='555-0100') for n in range(5))
+        db.session.commit()
+    phases = []
+    add = RequestTimings.add
+    monkeypatch.setattr(RequestTimings, 'add', lambda self, phase, seconds: phases.append(phase) or add(
+        self, phase, seconds))
+    assert len(client.get('/users').json) == 6
+    assert phases.count('serialize') == 1
+
+
+def test_server_timing_can_be_turned_off(database_url):
+    app = create_app({'DATABASE_URL': database_url, 'SERVER_TIMING': False, **SETTINGS})
+    with app.app_context():
+        db.create_all()
+    assert 'Server-Timing' not in app.test_client().get('/users').headers
+
+
+def test_slow_requests_are_logged_with_query_plans(database_url, caplog):
+    app = create_app({'DATABASE_URL': database_url, 'SLOW_REQUEST_MS': 1, **SETTINGS})
+    with app.app_context():
+        db.create_all()
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        # Ask until one is slow enough; an empty table can answer in under a millisecond
+        for _ in range(50):
+            app.test_client().get('/appointments?user_id=1')
+            if caplog.records:
+                break
+    message = caplog.records[0].getMessage()
+    assert message.startswith('Slow request: GET /appointments?user_id=1 ')
+    assert 'SELECT' in message and 'SEARCH appointments' in message
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('latency', 'Latency.', ('endpoint',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, ('x',))
+    assert histogram.render()[2:] == [
+        'latency_bucket{endpoint="x",le="0.1"} 1',
+        'latency_bucket{endpoint="x",le="1"} 2',
+        'latency_bucket{endpoint="x",le="+Inf"} 3',
+        'latency_sum{endpoint="x"} 5.55',
+        'latency_count{endpoint="x"} 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter('hits', 'Hits.', ('path',))
+    counter.inc(('a"b\\c',))
+    assert counter.render()[-1] == 'hits{path="a\\"b\\\\c"} 1'
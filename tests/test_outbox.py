@@ -0,0 +1,214 @@
+"""Appointment notifications and reminders through the transactional outbox."""
+import json
+from datetime import date, time, timedelta
+
+import pytest
+
+import outbox
+from config import db
+from models import Appointment, OutboxMessage, utcnow
+
+FUTURE = date.today() + timedelta(days=30)
+
+
+def booking(day=FUTURE, time='10:00', status='Scheduled'):
+    return {'user_id': 1, 'doctor_id': 1, 'date': day.isoformat(), 'time': time, 'status': status}
+
+
+def messages(app):
+    with app.app_context():
+        return [(m.topic, m.appointment_id, m.status) for m in OutboxMessage.query.order_by(OutboxMessage.id)]
+
+
+class Sink:
+    def __init__(self, fail=False):
+        self.fail, self.sent = fail, []
+
+    def send(self, notification):
+        if self.fail:
+            raise OSError('connection refused')
+        self.sent.append(notification)
+
+
+def dispatch(app, sink, **options):
+    with app.app_context():
+        return outbox.Dispatcher(sink, rate=0, **options).run_once()
+
+
+def test_writes_enqueue_notifications_and_reminders(app, client):
+    assert client.post('/appointments', json=booking()).status_code == 201
+    assert messages(app) == [(outbox.CREATED, 1, 'pending'), (outbox.REMINDER, 1, 'pending')]
+
+    assert client.put('/appointments/1', json=booking(time='11:00')).status_code == 200
+    with app.app_context():
+        updated = OutboxMessage.query.filter_by(topic=outbox.UPDATED).one()
+        assert updated.payload['changes'] == {'time': ['10:00', '11:00']}
+        assert updated.payload['appointment']['time'] == '11:00'
+
+    assert client.delete('/appointments/1').status_code == 204
+    assert [topic for topic, _, _ in messages(app)] == [
+        outbox.CREATED, outbox.REMINDER, outbox.UPDATED, outbox.REMINDER, outbox.DELETED]
+
+
+def test_reminder_is_due_before_the_appointment(app, client):
+    client.post('/appointments', json=booking())
+    with app.app_context():
+        reminder = OutboxMessage.query.filter_by(topic=outbox.REMINDER).one()
+        starts_at = outbox._starts_at(db.session.get(Appointment, 1))
+        assert reminder.available_at == starts_at - timedelta(hours=24)
+
+
+@pytest.mark.parametrize('body', [
+    booking(day=date.today() - timedelta(days=1)),
+    booking(status='Cancelled'),
+])
+def test_past_and_cancelled_appointments_get_no_reminder(app, client, body):
+    assert client.post('/appointments', json=body).status_code == 201
+    assert [topic for topic, _, _ in messages(app)] == [outbox.CREATED]
+
+
+def test_reminders_can_be_turned_off(app, client):
+    app.config['REMINDER_HOURS'] = 0
+    client.post('/appointments', json=booking())
+    assert [topic for topic, _, _ in messages(app)] == [outbox.CREATED]
+
+
+def test_unchanged_write_enqueues_nothing(app, client):
+    client.post('/appointments', json=booking())
+    client.put('/appointments/1', json=booking())
+    assert len(messages(app)) == 2
+
+
+def test_messages_roll_back_with_the_change(app):
+    with app.app_context():
+        db.session.add(Appointment(user_id=1, doctor_id=1, date=FUTURE, time=time(10),
+                                   status='Scheduled'))
+        db.session.flush()
+        assert OutboxMessage.query.count() == 2
+        db.session.rollback()
+    assert messages(app) == []
+
+
+def test_bulk_writes_enqueue(app, client):
+    response = client.post('/appointments/bulk', json=[booking(time='09:00'), booking(time='09:30')])
+    assert response.status_code == 201
+    assert sorted(messages(app)) == [
+        (outbox.CREATED, 1, 'pending'), (outbox.CREATED, 2, 'pending'),
+        (outbox.REMINDER, 1, 'pending'), (outbox.REMINDER, 2, 'pending')]
+
+    assert client.put('/appointments/bulk', json=[{'id': 2, 'status': 'Cancelled'},
+                                                  {'id': 1, 'time': '11:00', 'status': 'Scheduled'}]).status_code == 200
+    assert (outbox.UPDATED, 2, 'pending') in messages(app)
+    with app.app_context():
+        changes = {message.appointment_id: message.payload['changes']
+                   for message in OutboxMessage.query.filter_by(topic=outbox.UPDATED)}
+    # As the flush hook reports them: only the fields that changed
+    assert changes == {1: {'time': ['09:00', '11:00']}, 2: {'status': ['Scheduled', 'Cancelled']}}
+
+
+def test_dispatcher_delivers_due_messages(app, client):
+    client.post('/appointments', json=booking())
+    sink = Sink()
+    assert dispatch(app, sink) == 1
+    [notification] = sink.sent
+    assert notification.topic == outbox.CREATED
+    assert notification.recipient == 'ada@example.com'
+    assert notification.payload['appointment'] == {
+        'id': 1, 'user_id': 1, 'doctor_id': 1, 'date': FUTURE.isoformat(), 'time': '10:00', 'status': 'Scheduled'}
+    # The reminder is not due yet
+    assert messages(app) == [(outbox.CREATED, 1, 'sent'), (outbox.REMINDER, 1, 'pending')]
+    assert dispatch(app, sink) == 0
+
+
+def test_failed_sends_back_off_then_fail(app, client):
+    client.post('/appointments', json=booking())
+    assert dispatch(app, Sink(fail=True), max_attempts=2) == 1
+    with app.app_context():
+        message = db.session.get(OutboxMessage, 1)
+        assert (message.status, message.attempts) == ('pending', 1)
+        assert message.last_error == 'connection refused'
+        assert message.available_at > utcnow()
+        # Due again
+        message.available_at = utcnow()
+        db.session.commit()
+
+    assert dispatch(app, Sink(fail=True), max_attempts=2) == 1
+    with app.app_context():
+        message = db.session.get(OutboxMessage, 1)
+        assert (message.status, message.attempts) == ('failed', 2)
+
+
+def test_claimed_messages_are_leased(app, client):
+    client.post('/appointments', json=booking())
+    with app.app_context():
+        dispatcher = outbox.Dispatcher(Sink(), rate=0)
+        assert len(dispatcher._claim()) == 1
+        # A second dispatcher does not see it until the lease runs out
+        assert dispatcher._claim() == []
+
+
+def test_stale_reminders_are_skipped(app, client):
+    client.post('/appointments', json=booking())
+    client.put('/appointments/1', json=booking(time='11:00'))
+    with app.app_context():
+        OutboxMessage.query.update({OutboxMessage.available_at: utcnow()})
+        db.session.commit()
+
+    sink = Sink()
+    assert dispatch(app, sink) == 4
+    assert [n.topic for n in sink.sent] == [outbox.CREATED, outbox.UPDATED, outbox.REMINDER]
+    assert sink.sent[-1].payload['appointment']['time'] == '11:00'
+    assert [status for _, _, status in messages(app)] == ['sent', 'skipped', 'sent', 'sent']
+
+
+def test_file_sink_appends_json_lines(tmp_path):
+    sink = outbox.FileSink(tmp_path / 'outbox.ndjson')
+    sink.send(outbox.Notification(1, outbox.CREATED, 'ada@example.com', {'appointment': {'id': 1}}))
+    sink.send(outbox.Notification(2, outbox.DELETED, None, {'appointment': {'id': 1}}))
+    lines = [json.loads(line) for line in (tmp_path / 'outbox.ndjson').read_text().splitlines()]
+    assert [(line['id'], line['topic'], line['recipient']) for line in lines] == [
+        (1, outbox.CREATED, 'ada@example.com'), (2, outbox.DELETED, None)]
+
+
+def test_rate_limiter_spaces_sends(monkeypatch):
+    now, sleeps = [0.0], []
+    monkeypatch.setattr(outbox.clock, 'monotonic', lambda: now[0])
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(outbox.clock, 'sleep', sleep)
+    limiter = outbox.RateLimiter(2)
+    for _ in range(4):
+        limiter.acquire()
+    # A burst of two, then one every half second
+    assert sleeps == [0.5, 0.5]
+
+
+def test_cli_run_stats_and_purge(app, client, tmp_path):
+    client.post('/appointments', json=booking())
+    client.post('/appointments', json=booking(time='11:00'))
+    app.config.update(OUTBOX_FILE=str(tmp_path / 'sent.ndjson'), OUTBOX_RATE=0)
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['outbox', 'run', '--once'])
+    assert result.exit_code == 0, result.output
+    assert 'Delivered 2 messages' in result.output
+    assert len((tmp_path / 'sent.ndjson').read_text().splitlines()) == 2
+
+    result = runner.invoke(args=['outbox', 'stats'])
+    assert result.output.split() == ['pending', '2', 'sent', '2']
+
+    with app.app_context():
+        OutboxMessage.query.update({OutboxMessage.created_at: utcnow() - timedelta(days=8)})
+        db.session.commit()
+    result = runner.invoke(args=['outbox', 'purge'])
+    assert 'Deleted 2 messages' in result.output
+    assert [status for _, _, status in messages(app)] == ['pending', 'pending']
+
+
+def test_unknown_sink_is_rejected(app):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            outbox.make_sink({**app.config, 'OUTBOX_SINK': 'pigeon'})
@@ -0,0 +1,94 @@
+"""Keyset pagination and filters on the list endpoints."""
+from datetime import date, time
+
+import pytest
+
+from config import db
+from models import Appointment, Doctor
+
+
+@pytest.fixture
+def doctors(app):
+    with app.app_context():
+        db.session.add_all([
+            Doctor(name=f'Dr. {n}', email=f'doctor{n}@example.com', password_hash='x',
+                   specialty='Cardiology' if n % 2 else 'Dermatology', experience_years=n, availability='Available')
+            for n in range(2, 8)
+        ])
+        db.session.commit()
+
+
+def pages(client, path):
+    ids, cursors = [], []
+    while path:
+        response = client.get(path)
+        assert response.status_code == 200
+        ids.extend(row['id'] for row in response.json)
+        cursor = response.headers.get('X-Next-Cursor')
+        cursors.append(cursor)
+        path = response.headers['Link'][1:response.headers['Link'].index('>')] if cursor else None
+    return ids, cursors
+
+
+def test_pages_follow_the_cursor_without_gaps_or_repeats(client, doctors):
+    ids, cursors = pages(client, '/doctors?limit=3')
+    assert ids == list(range(1, 8))
+    assert len(cursors) == 3 and cursors[-1] is None
+
+
+def test_link_header_keeps_filters_and_limit(client, doctors):
+    response = client.get('/doctors?specialty=Cardiology&limit=2')
+    assert [doctor['specialty'] for doctor in response.json] == ['Cardiology', 'Cardiology']
+    assert 'specialty=Cardiology' in response.headers['Link']
+    assert 'limit=2' in response.headers['Link']
+    assert response.headers['Link'].endswith('; rel="next"')
+
+    ids, _ = pages(client, '/doctors?specialty=Cardiology&limit=2')
+    assert ids == [1, 3, 5, 7]
+
+
+def test_cursor_round_trips_dates_and_times(app, client):
+    with app.app_context():
+        db.session.add_all([
+            Appointment(user_id=1, doctor_id=1, date=date(2024, 5, day), time=time(hour), status='scheduled')
+            for day in (2, 1) for hour in (11, 9)
+        ])
+        db.session.commit()
+
+    first = client.get('/appointments?limit=3')
+    assert [(a['date'], a['time']) for a in first.json] == [
+        ('2024-05-01', '09:00'), ('2024-05-01', '11:00'), ('2024-05-02', '09:00')]
+    rest = client.get('/appointments', query_string={'limit': 3, 'after': first.headers['X-Next-Cursor']})
+    assert [(a['date'], a['time']) for a in rest.json] == [('2024-05-02', '11:00')]
+    assert 'X-Next-Cursor' not in rest.headers
+
+
+def test_date_range_filters_are_inclusive(app, client):
+    with app.app_context():
+        db.session.add_all([
+            Appointment(user_id=1, doctor_id=1, date=date(2024, 5, day), time=time(9), status='scheduled')
+            for day in (1, 2, 3)
+        ])
+        db.session.commit()
+
+    response = client.get('/appointments?date_from=2024-05-02&date_to=2024-05-03')
+    assert [a['date'] for a in response.json] == ['2024-05-02', '2024-05-03']
+
+
+@pytest.mark.parametrize('query', [
+    'after=not-a-cursor', 'after=WyJ4Il0', 'after=WzEsMl0',
+    'limit=abc', 'limit=0', 'limit=-5',
+])
+def test_invalid_cursor_or_limit_is_rejected(client, query):
+    response = client.get(f'/doctors?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+
+def test_invalid_filter_is_rejected(client):
+    assert client.get('/appointments?date_from=May').status_code == 400
+    assert client.get('/appointments?user_id=one').status_code == 400
+
+
+def test_limit_is_capped(client, doctors):
+    assert len(client.get('/doctors?limit=100000').json) == 7
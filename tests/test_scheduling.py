@@ -0,0 +1,154 @@
+"""Working hours, free slots and double-booking checks."""
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import scheduling
+from config import db
+
+# Next Monday, so every slot on it is in the future
+MONDAY = date.today() + timedelta(days=7 - date.today().weekday())
+SCHEDULE = {'slot_minutes': 30, 'working_hours': [{'weekday': 0, 'start_time': '09:00', 'end_time': '11:00'}]}
+
+
+def booking(time, status='Scheduled', doctor_id=1, day=MONDAY):
+    return {'user_id': 1, 'doctor_id': doctor_id, 'date': day.isoformat(), 'time': time, 'status': status}
+
+
+def free(client, doctor_id=1):
+    response = client.get(f'/doctors/{doctor_id}/availability', query_string={'from': MONDAY.isoformat(), 'days': 1})
+    assert response.status_code == 200
+    return [slot['time'] for slot in response.json]
+
+
+@pytest.fixture
+def schedule(client):
+    assert client.put('/doctors/1/schedule', json=SCHEDULE).status_code == 200
+
+
+def test_schedule_round_trip(client, schedule):
+    assert client.get('/doctors/1/schedule').json == {'doctor_id': 1, **SCHEDULE}
+    assert free(client) == ['09:00', '09:30', '10:00', '10:30']
+
+
+@pytest.mark.parametrize('body', [
+    {'slot_minutes': 1, 'working_hours': []},
+    {'working_hours': [{'weekday': 7, 'start_time': '09:00', 'end_time': '11:00'}]},
+    {'working_hours': [{'weekday': 0, 'start_time': '11:00', 'end_time': '09:00'}]},
+    {'slot_minutes': 30},
+])
+def test_invalid_schedule_is_rejected(client, body):
+    assert client.put('/doctors/1/schedule', json=body).status_code == 400
+
+
+def test_bookings_take_slots_and_cancelling_frees_them(client, schedule):
+    assert client.post('/appointments', json=booking('09:30')).status_code == 201
+    assert free(client) == ['09:00', '10:00', '10:30']
+
+    assert client.put('/appointments/1', json=booking('09:30', status='Cancelled')).status_code == 200
+    assert free(client) == ['09:00', '09:30', '10:00', '10:30']
+
+
+def test_double_booking_and_hours_are_checked(client, schedule):
+    assert client.post('/appointments', json=booking('09:00')).status_code == 201
+
+    response = client.post('/appointments', json=booking('09:00'))
+    assert response.status_code == 409
+    assert response.json['error'] == 'Slot already booked'
+    assert client.post('/appointments', json=booking('09:15')).status_code == 409
+    assert client.post('/appointments', json=booking('10:45')).json['error'] == 'Outside working hours'
+    assert client.post('/appointments', json=booking('09:00', status='Cancelled')).status_code == 201
+
+
+def test_moving_an_appointment(client, schedule):
+    client.post('/appointments', json=booking('09:00'))
+    client.post('/appointments', json=booking('10:00'))
+    assert client.put('/appointments/2', json=booking('09:00')).status_code == 409
+    # Its own slot does not count against it
+    assert client.put('/appointments/2', json=booking('10:00', status='Confirmed')).status_code == 200
+    assert client.put('/appointments/2', json=booking('09:30')).status_code == 200
+    assert free(client) == ['10:00', '10:30']
+
+
+def test_the_unique_index_catches_bookings_the_index_has_not_seen(app, client, schedule):
+    assert free(client) == ['09:00', '09:30', '10:00', '10:30']
+    with app.app_context():
+        db.session.execute(text(
+            "INSERT INTO appointments (user_id, doctor_id, date, time, status) "
+            "VALUES (1, 1, :day, '09:00:00.000000', 'Scheduled')"), {'day': MONDAY.isoformat()})
+        db.session.commit()
+    assert client.post('/appointments', json=booking('09:00')).status_code == 409
+
+
+def test_availability_by_specialty(client, schedule):
+    client.post('/doctors', json={'name': 'Dr. Ines Salo', 'email': 'ines@example.com', 'password': 'secret',
+                                  'specialty': 'Cardiology', 'experience_years': 4, 'availability': 'Available'})
+    client.put('/doctors/2/schedule', json={
+        'slot_minutes': 60, 'working_hours': [{'weekday': 0, 'start_time': '09:30', 'end_time': '10:30'}]})
+    client.post('/appointments', json=booking('09:00'))
+
+    response = client.get('/availability', query_string={'specialty': 'Cardiology', 'from': MONDAY.isoformat(),
+                                                         'days': 1, 'limit': 3})
+    assert [(slot['doctor_id'], slot['time']) for slot in response.json] == [(1, '09:30'), (2, '09:30'), (1, '10:00')]
+    assert client.get('/availability?specialty=Dermatology').json == []
+    assert client.get('/availability').status_code == 400
+    assert client.get('/availability?specialty=Cardiology&days=0').status_code == 400
+    assert client.get('/doctors/99/availability').status_code == 404
+
+
+def test_bookings_are_checked_against_the_table(app, client, schedule):
+    # Written by another worker: the in-memory index has not seen it, and it
+    # overlaps rather than repeats the slot, so the unique index would not either
+    assert free(client) == ['09:00', '09:30', '10:00', '10:30']
+    with app.app_context():
+        db.session.execute(text(
+            "INSERT INTO appointments (user_id, doctor_id, date, time, status) "
+            "VALUES (1, 1, :day, '09:15:00.000000', 'Scheduled')"), {'day': MONDAY.isoformat()})
+        db.session.commit()
+    # Free-slot search is up to a reload behind; booking is not
+    assert free(client) == ['09:00', '09:30', '10:00', '10:30']
+    response = client.post('/appointments', json=booking('09:00'))
+    assert (response.status_code, response.json['error']) == (409, 'Slot already booked')
+    assert client.post('/appointments', json=booking('10:00')).status_code == 201
+
+
+def test_bulk_items_are_checked_in_order(app, client, schedule):
+    response = client.post('/appointments/bulk', json=[
+        booking('09:00'), booking('09:00'), booking('09:15'), booking('10:45'), booking('09:30'),
+        booking('09:30', status='Cancelled'),
+    ])
+    assert response.status_code == 207
+    assert [(result['status'], result.get('error')) for result in response.json['results']] == [
+        (201, None), (409, 'Slot already booked'), (409, 'Slot already booked'), (409, 'Outside working hours'),
+        (201, None), (201, None)]
+    assert free(client) == ['10:00', '10:30']
+
+    # Updates: a slot freed earlier in the batch can be taken, a taken one cannot
+    response = client.put('/appointments/bulk', json=[
+        {'id': 1, 'time': '10:00'}, {'id': 2, 'status': 'Cancelled'}, {'id': 3, 'time': '10:00'},
+        {'id': 3, 'status': 'Scheduled'}, {'id': 4, 'time': '09:30', 'status': 'Scheduled'},
+    ])
+    assert response.status_code == 207
+    assert [(result['status'], result.get('errors')) for result in response.json['results']] == [
+        (200, None), (200, None), (200, None), (400, {'id': 'appears more than once in the batch'}),
+        (404, {'id': 'not found'})]
+    response = client.put('/appointments/bulk', json=[{'id': 1, 'time': '09:00'}, {'id': 2, 'status': 'Scheduled'},
+                                                      {'id': 3, 'time': '09:30', 'status': 'Scheduled'}])
+    assert [result['status'] for result in response.json['results']] == [200, 200, 409]
+    assert client.put('/appointments/bulk', json=[{'id': 3, 'status': 'Scheduled'}]).status_code == 200
+    # 09:30 is freed by id 2 before id 3 takes it: written in request order, not grouped by fields
+    response = client.put('/appointments/bulk', json=[{'id': 1, 'time': '10:30'}, {'id': 2, 'status': 'Cancelled'},
+                                                      {'id': 3, 'time': '09:30'}])
+    assert response.status_code == 200
+    assert free(client) == ['09:00', '10:00']
+
+
+def test_bulk_checks_span_statements(client, schedule, monkeypatch):
+    monkeypatch.setattr(scheduling, 'CHUNK_SIZE', 2)
+    weeks = [MONDAY + timedelta(weeks=week) for week in range(5)]
+    assert client.post('/appointments/bulk', json=[booking('09:00', day=day) for day in weeks]).status_code == 201
+    # Every booked Monday is found though the lookups are split across statements
+    response = client.post('/appointments/bulk', json=[booking('09:15', day=day) for day in weeks] + [
+        booking('10:00', day=day) for day in weeks])
+    assert [result['status'] for result in response.json['results']] == [409] * 5 + [201] * 5
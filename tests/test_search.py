@@ -0,0 +1,178 @@
+"""Ranked prefix search over doctors and prescriptions."""
+from datetime import date, time
+
+import pytest
+
+import search
+from config import db
+from models import Appointment, Doctor, Prescription
+
+
+@pytest.fixture
+def doctors(app):
+    with app.app_context():
+        db.session.add_all([
+            Doctor(name=name, email=f'doctor{n}@example.com', password_hash='x', specialty=specialty,
+                   experience_years=n, availability='Available')
+            for n, (name, specialty) in enumerate([
+                ('Dr. Cardin Mwangi', 'Dermatology'),
+                ('Dr. Zoë Nguyen', 'Neurology'),
+                ('Dr. Amina Cardoso', 'Cardiology'),
+                ('Dr. Omar Haddad', 'Cardiology'),
+            ], start=2)
+        ])
+        db.session.commit()
+
+
+@pytest.fixture
+def prescriptions(app):
+    with app.app_context():
+        db.session.add(Appointment(user_id=1, doctor_id=1, date=date(2030, 1, 7), time=time(9), status='Scheduled'))
+        db.session.add_all([
+            Prescription(appointment_id=1, medicine=medicine, dosage='1 x 10 mg', instructions=instructions)
+            for medicine, instructions in [
+                ('Aspirin', 'Take after meal'),
+                ('Amoxicillin', 'Take with water'),
+                ('Ibuprofen', 'Take after meal'),
+                ('Metformin', 'Avoid alcohol'),
+            ]
+        ])
+        db.session.commit()
+
+
+def ids(response):
+    assert response.status_code == 200, response.json
+    return [row['id'] for row in response.json]
+
+
+def test_prefix_search_finds_doctor(client):
+    response = client.get('/doctors/search?q=cardiology gra')
+    assert response.status_code == 200
+    assert [doctor['id'] for doctor in response.json] == [1]
+
+
+def test_last_term_matches_as_prefix_and_others_as_words(client, doctors):
+    assert ids(client.get('/doctors/search?q=cardi')) == [2, 1, 4, 5]
+    assert ids(client.get('/doctors/search?q=cardiology am')) == [4]
+    # Only the last term is a prefix
+    assert ids(client.get('/doctors/search?q=cardio amina')) == []
+
+
+def test_matches_in_name_rank_above_specialty(client, doctors):
+    # Dr. Cardoso matches on both columns, Dr. Mwangi on the name only and
+    # the other two on the specialty only
+    assert ids(client.get('/doctors/search?q=card'))[:2] == [4, 2]
+
+
+def test_broad_queries_page_in_id_order(client, doctors, monkeypatch):
+    monkeypatch.setattr(search, 'RANK_LIMIT', 2)
+    assert ids(client.get('/doctors/search?q=card')) == [1, 2, 4, 5]
+
+
+def test_accents_are_folded(client, doctors):
+    assert ids(client.get('/doctors/search?q=zoe')) == [3]
+    assert ids(client.get('/doctors/search?q=Zoë')) == [3]
+
+
+def test_search_input_is_never_fts_syntax(client, doctors):
+    for q in ('card*', 'card OR neuro', 'name:amina', 'NEAR(amina cardoso)', '"card'):
+        assert client.get('/doctors/search', query_string={'q': q}).status_code == 200
+    assert ids(client.get('/doctors/search', query_string={'q': 'amina OR'})) == []
+
+
+def test_index_follows_writes(client, prescriptions):
+    response = client.post('/prescriptions', json={
+        'appointment_id': 1, 'medicine': 'Warfarin', 'dosage': '1 x 5 mg', 'instructions': 'Avoid alcohol'})
+    assert response.status_code == 201
+    assert ids(client.get('/prescriptions/search?q=warf')) == [5]
+
+    assert client.put('/prescriptions/5', json={
+        'appointment_id': 1, 'medicine': 'Losartan', 'dosage': '1 x 5 mg', 'instructions': 'Avoid alcohol'}).status_code == 200
+    assert ids(client.get('/prescriptions/search?q=warf')) == []
+    assert ids(client.get('/prescriptions/search?q=losar')) == [5]
+
+    assert client.delete('/prescriptions/5').status_code in (200, 204)
+    assert ids(client.get('/prescriptions/search?q=losar')) == []
+
+
+def test_filters_apply_to_search(client, doctors):
+    assert ids(client.get('/doctors/search?q=card&specialty=Dermatology')) == [2]
+    assert client.get('/doctors/search?q=card&specialty=').status_code == 200
+
+
+def test_ranked_results_page_with_the_cursor(client, doctors):
+    everything = ids(client.get('/doctors/search?q=card'))
+    first = client.get('/doctors/search?q=card&limit=2')
+    assert ids(first) == everything[:2]
+    assert 'q=card' in first.headers['Link']
+    second = client.get('/doctors/search', query_string={
+        'q': 'card', 'limit': 2, 'after': first.headers['X-Next-Cursor']})
+    assert ids(second) == everything[2:]
+    assert 'X-Next-Cursor' not in second.headers
+
+
+def test_unranked_results_page_with_the_cursor(client, doctors, monkeypatch):
+    monkeypatch.setattr(search, 'RANK_LIMIT', 2)
+    first = client.get('/doctors/search?q=card&limit=3')
+    assert ids(first) == [1, 2, 4]
+    second = client.get('/doctors/search', query_string={
+        'q': 'card', 'limit': 3, 'after': first.headers['X-Next-Cursor']})
+    assert ids(second) == [5]
+
+
+def test_cursors_only_resume_their_own_order(client, doctors, monkeypatch):
+    ranked = client.get('/doctors/search?q=card&limit=1').headers['X-Next-Cursor']
+    monkeypatch.setattr(search, 'RANK_LIMIT', 2)
+    by_id = client.get('/doctors/search?q=card&limit=1').headers['X-Next-Cursor']
+    # The matches now exceed the limit, so the ranked cursor is stale
+    response = client.get('/doctors/search', query_string={'q': 'card', 'after': ranked})
+    assert response.status_code == 400
+    assert "start again without 'after'" in response.json['error']
+    monkeypatch.setattr(search, 'RANK_LIMIT', 2000)
+    assert client.get('/doctors/search', query_string={'q': 'card', 'after': by_id}).status_code == 400
+    # Nor does a search cursor page a plain list
+    assert client.get('/doctors', query_string={'after': ranked}).status_code == 400
+
+
+def test_prescription_search(client, prescriptions):
+    assert ids(client.get('/prescriptions/search?q=after')) == [1, 3]
+    assert ids(client.get('/prescriptions/search?q=ibu')) == [3]
+    assert ids(client.get('/prescriptions/search?q=a&medicine=Metformin')) == [4]
+
+
+def test_search_supports_expand_and_fields(client, prescriptions):
+    response = client.get('/prescriptions/search?q=aspirin&fields=id,medicine')
+    assert response.json == [{'id': 1, 'medicine': 'Aspirin'}]
+    response = client.get('/prescriptions/search?q=aspirin&expand=appointment')
+    assert response.json[0]['appointment']['id'] == 1
+
+
+@pytest.mark.parametrize('path', ['/doctors/search', '/doctors/search?q=', '/doctors/search?q=%20%20'])
+def test_q_is_required(client, path):
+    response = client.get(path)
+    assert response.status_code == 400
+    assert 'q' in response.json['error']
+
+
+def test_invalid_arguments_are_rejected(client, doctors):
+    assert client.get('/doctors/search?q=card&limit=0').status_code == 400
+    assert client.get('/doctors/search?q=card&after=not-a-cursor').status_code == 400
+    assert client.get('/users/search?q=ada').status_code == 404
+
+
+def test_search_responses_are_conditional(client, prescriptions):
+    first = client.get('/prescriptions/search?q=take')
+    again = client.get('/prescriptions/search?q=take', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+
+    assert client.put('/prescriptions/2', json={
+        'appointment_id': 1, 'medicine': 'Amoxicillin', 'dosage': '2 x 10 mg', 'instructions': 'Take with water'}).status_code == 200
+    changed = client.get('/prescriptions/search?q=take', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+
+
+@pytest.mark.parametrize('q', ['---', '"*"', '()'])
+def test_query_without_terms_is_rejected(client, q):
+    response = client.get('/doctors/search', query_string={'q': q})
+    assert response.status_code == 400
+    assert 'q' in response.json['error']
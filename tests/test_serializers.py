@@ -0,0 +1,65 @@
+"""Eager loading and precompiled serializers on the read endpoints."""
+from datetime import date, time, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from cache import cache
+from config import db
+from models import Appointment, Doctor, Prescription, User
+
+
+def add_appointments(count):
+    start = Appointment.query.count()
+    for n in range(start, start + count):
+        appointment = Appointment(user_id=1, doctor_id=1, date=date(2024, 5, 1) + timedelta(days=n), time=time(9),
+                                  status='scheduled')
+        appointment.prescriptions = [Prescription(medicine='Aspirin', dosage='100mg', instructions='Daily')]
+        db.session.add(appointment)
+    db.session.commit()
+
+
+def count_statements(app, path, client):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        assert client.get(path).status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return len(statements)
+
+
+# Expanding every relationship gives back what to_dict() returns
+@pytest.mark.parametrize('model, path, expand', [
+    (User, '/users', 'appointments.doctor.working_hours,appointments.prescriptions'),
+    (Doctor, '/doctors', 'appointments.user,appointments.prescriptions,working_hours'),
+    (Appointment, '/appointments', 'user,doctor.working_hours,prescriptions'),
+    (Prescription, '/prescriptions', 'appointment.user,appointment.doctor.working_hours'),
+])
+def test_full_expansion_matches_to_dict(app, client, model, path, expand):
+    with app.app_context():
+        add_appointments(2)
+        expected = [row.to_dict() for row in model.query.order_by(model.id)]
+    response = client.get(path, query_string={'expand': expand})
+    assert sorted(response.json, key=lambda row: row['id']) == expected
+    assert client.get(f'{path}/{expected[0]["id"]}', query_string={'expand': expand}).json == expected[0]
+
+
+@pytest.mark.parametrize('path', [
+    '/users', '/doctors', '/appointments', '/prescriptions', '/users/1',
+    '/users?expand=appointments.doctor,appointments.prescriptions', '/prescriptions?expand=appointment.doctor',
+])
+def test_statement_count_does_not_grow_with_rows(app, client, monkeypatch, path):
+    monkeypatch.setattr(cache, 'enabled', False)
+    with app.app_context():
+        add_appointments(1)
+    few = count_statements(app, path, client)
+    with app.app_context():
+        add_appointments(10)
+    assert count_statements(app, path, client) == few
@@ -0,0 +1,114 @@
+"""Production server settings, request deadlines and health checks."""
+import os
+import runpy
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+import database
+import datagen
+from config import create_app, db
+from conftest import ROOT, SETTINGS
+from scheduling import availability
+
+# Enough rows that loading them takes more than a few progress-handler polls
+SLOW_QUERY = text('WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 1000000) '
+                  'SELECT count(*) FROM n')
+
+
+def test_health(client):
+    response = client.get('/health')
+    assert (response.status_code, response.json) == (200, {'status': 'ok'})
+
+
+def test_ready_checks_every_bind(client):
+    response = client.get('/ready')
+    assert response.status_code == 200
+    assert response.json == {'status': 'ok', 'checks': {'primary': 'ok', 'read': 'ok'}}
+
+
+def test_not_ready_without_the_schema(tmp_path):
+    app = create_app({'DATABASE_URL': f'sqlite:///{tmp_path / "empty.db"}', **SETTINGS})
+    response = app.test_client().get('/ready')
+    assert response.status_code == 503
+    assert response.json['status'] == 'unavailable'
+    assert set(response.json['checks'].values()) == {'unavailable'}
+    assert app.test_client().get('/health').status_code == 200
+
+
+def test_statements_past_the_deadline_are_interrupted(app):
+    app.config['REQUEST_TIMEOUT'] = 0.001
+    with app.test_request_context('/doctors'):
+        app.preprocess_request()
+        with pytest.raises(database.QueryTimeout) as raised:
+            db.session.execute(SLOW_QUERY)
+        assert raised.value.code == 503
+        db.session.rollback()
+
+
+def test_deadline_is_per_request(app):
+    app.config['REQUEST_TIMEOUT'] = 0.001
+    with app.test_request_context('/doctors'):
+        app.preprocess_request()
+    # Torn down with the request: later statements run unbounded
+    with app.app_context():
+        assert db.session.execute(SLOW_QUERY).scalar() == 1000000
+
+
+def test_exports_opt_out_of_the_deadline(app):
+    app.config['REQUEST_TIMEOUT'] = 0.001
+    with app.test_request_context('/appointments/export'):
+        app.preprocess_request()
+        assert db.session.execute(SLOW_QUERY).scalar() == 1000000
+
+
+def test_timed_out_request_answers_503_and_keeps_no_partial_index(app, client):
+    with app.app_context():
+        datagen.generate(users=50, doctors=5, appointments=3000, prescriptions=0, start=date.today(), days=90)
+    app.config['REQUEST_TIMEOUT'] = 0.000001
+    response = client.get('/availability?specialty=Cardiology')
+    assert response.status_code == 503
+    assert response.json == {'error': 'Request timed out'}
+    assert availability._doctors is None
+
+    app.config['REQUEST_TIMEOUT'] = 30
+    assert client.get('/availability?specialty=Cardiology').status_code == 200
+
+
+def gunicorn_settings(monkeypatch, **env):
+    for name in ('WEB_CONCURRENCY', 'WEB_THREADS', 'WEB_MAX_REQUESTS', 'WEB_PRELOAD', 'HASHING_WORKERS',
+                 'ADMISSION_LIMIT'):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return runpy.run_path(os.path.join(ROOT, 'gunicorn.conf.py'))
+
+
+def test_gunicorn_settings_come_from_the_environment(monkeypatch):
+    settings = gunicorn_settings(monkeypatch, WEB_CONCURRENCY='3', WEB_THREADS='8', WEB_MAX_REQUESTS='1000',
+                                 WEB_PRELOAD='0', PORT='9000')
+    assert (settings['workers'], settings['threads'], settings['worker_class']) == (3, 8, 'gthread')
+    assert (settings['max_requests'], settings['max_requests_jitter']) == (1000, 100)
+    assert settings['preload_app'] is False
+    assert settings['bind'] == '0.0.0.0:9000'
+
+
+def test_gunicorn_splits_the_hashing_pool_between_workers(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+    gunicorn_settings(monkeypatch, WEB_CONCURRENCY='1')
+    assert os.environ['HASHING_WORKERS'] == '2'
+    # Half the CPUs between them
+    gunicorn_settings(monkeypatch, WEB_CONCURRENCY='4')
+    assert os.environ['HASHING_WORKERS'] == '1'
+    gunicorn_settings(monkeypatch, WEB_CONCURRENCY='16')
+    assert os.environ['HASHING_WORKERS'] == '1'
+    gunicorn_settings(monkeypatch, WEB_CONCURRENCY='16', HASHING_WORKERS='6')
+    assert os.environ['HASHING_WORKERS'] == '6'
+
+
+def test_gunicorn_keeps_a_thread_for_cheap_requests(monkeypatch):
+    gunicorn_settings(monkeypatch, WEB_THREADS='8')
+    assert os.environ['ADMISSION_LIMIT'] == '7'
+    gunicorn_settings(monkeypatch, WEB_THREADS='1')
+    assert os.environ['ADMISSION_LIMIT'] == '1'
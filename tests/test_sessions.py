@@ -0,0 +1,204 @@
+"""Server-side login sessions with a cached principal."""
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import event
+
+import sessions
+from config import db
+from models import Doctor, LoginSession, User, utcnow
+from sessions import MemoryStore, session_store
+
+SIGNUP = {'name': 'Lin Park', 'email': 'lin@example.com', 'password': 'correct horse', 'age': 29,
+          'gender': 'Female', 'phone_number': '555-0101'}
+LOGIN = {'email': 'lin@example.com', 'password': 'correct horse'}
+PROFILE = {key: SIGNUP[key] for key in ('name', 'email', 'age', 'gender', 'phone_number')}
+
+
+@pytest.fixture
+def user(client):
+    assert client.post('/signup', json=SIGNUP).status_code == 201
+    return 2
+
+
+def login(app):
+    client = app.test_client()
+    assert client.post('/login', json=LOGIN).status_code == 200
+    return client
+
+
+def session_rows(app):
+    with app.app_context():
+        return db.session.query(LoginSession).count()
+
+
+@pytest.fixture
+def statements(app):
+    seen = []
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    def record(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', record)
+    yield seen
+    for engine in engines:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_cookie_carries_only_the_session_id(app, user):
+    client = login(app)
+    with client.session_transaction() as cookie:
+        assert set(cookie) - {'_permanent'} == {'sid'}
+    assert session_rows(app) == 1
+
+
+def test_check_session_serves_the_cached_principal(app, user, statements):
+    client = login(app)
+    statements.clear()
+    response = client.get('/check_session')
+    assert response.status_code == 200
+    assert response.json['email'] == 'lin@example.com'
+    assert 'password_hash' not in response.json
+    assert not any('FROM users' in statement for statement in statements)
+
+
+def test_check_session_with_expand_reads_the_row(app, user):
+    client = login(app)
+    response = client.get('/check_session?fields=id,name')
+    assert response.json == {'id': user, 'name': 'Lin Park'}
+
+
+def test_changed_principal_is_read_again(app, user):
+    client = login(app)
+    assert client.put(f'/users/{user}', json={**PROFILE, 'name': 'Lin Park-Moreau'}).status_code == 200
+    assert client.get('/check_session').json['name'] == 'Lin Park-Moreau'
+
+
+def test_logout_ends_the_session(app, user):
+    client = login(app)
+    assert client.delete('/logout').status_code == 204
+    assert client.get('/check_session').status_code == 204
+    assert session_rows(app) == 0
+
+
+def test_clear_ends_the_session(app, user):
+    client = login(app)
+    assert client.delete('/clear').status_code == 204
+    assert session_rows(app) == 0
+
+
+def test_logging_in_again_replaces_the_session(app, user):
+    client = login(app)
+    assert client.post('/login', json=LOGIN).status_code == 200
+    assert session_rows(app) == 1
+
+
+def test_log_out_everywhere(app, user, client):
+    first, second = login(app), login(app)
+    response = first.delete('/sessions')
+    assert response.status_code == 200
+    assert response.json == {'revoked': 2}
+    assert first.get('/check_session').status_code == 204
+    assert second.get('/check_session').status_code == 204
+    assert client.delete('/sessions').status_code == 401
+
+
+def test_password_change_ends_other_sessions(app, user):
+    here, elsewhere = login(app), login(app)
+    response = here.put(f'/users/{user}', json={**PROFILE, 'password': 'battery staple'})
+    assert response.status_code == 200
+    assert here.get('/check_session').status_code == 200
+    assert elsewhere.get('/check_session').status_code == 204
+
+
+def test_deleted_principal_is_logged_out(app, user):
+    client = login(app)
+    with app.app_context():
+        db.session.delete(db.session.get(User, user))
+        db.session.commit()
+    assert client.get('/check_session').status_code == 204
+    assert session_rows(app) == 0
+
+
+def test_doctor_sessions(app, client):
+    with app.app_context():
+        db.session.get(Doctor, 1).password = 'stethoscope'
+        db.session.commit()
+    assert client.post('/doctor_login', json={'email': 'grace@example.com', 'password': 'stethoscope'}).status_code == 200
+    assert client.get('/check_session').json['specialty'] == 'Cardiology'
+
+
+def test_sessions_expire_without_activity(app, user, monkeypatch):
+    client = login(app)
+    later = utcnow() + timedelta(seconds=session_store.ttl + 1)
+    monkeypatch.setattr(sessions, 'utcnow', lambda: later)
+    assert client.get('/check_session').status_code == 204
+
+
+def test_database_store_slides_the_expiry_after_refresh(app, user, monkeypatch):
+    client = login(app)
+    with app.app_context():
+        expires = db.session.query(LoginSession.expires_at).scalar()
+    now = utcnow()
+    monkeypatch.setattr(sessions, 'utcnow', lambda: now + timedelta(seconds=session_store.refresh - 10))
+    client.get('/check_session')
+    with app.app_context():
+        assert db.session.query(LoginSession.expires_at).scalar() == expires
+
+    later = now + timedelta(seconds=session_store.refresh + 10)
+    monkeypatch.setattr(sessions, 'utcnow', lambda: later)
+    client.get('/check_session')
+    with app.app_context():
+        assert db.session.query(LoginSession.expires_at).scalar() == later + timedelta(seconds=session_store.ttl)
+
+
+def test_cli_revoke_and_purge(app, user):
+    login(app)
+    login(app)
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['sessions', 'revoke', 'user', str(user)])
+    assert result.exit_code == 0
+    assert 'Revoked 2 sessions' in result.output
+    assert session_rows(app) == 0
+
+    login(app)
+    with app.app_context():
+        db.session.query(LoginSession).update({LoginSession.expires_at: utcnow() - timedelta(seconds=1)})
+        db.session.commit()
+    result = runner.invoke(args=['sessions', 'purge'])
+    assert 'Deleted 1 expired sessions' in result.output
+    assert session_rows(app) == 0
+
+
+def test_memory_store(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, 'monotonic', lambda: now[0])
+    store = MemoryStore()
+    first = store.create('user', 1, {'id': 1}, ttl=10)
+    second = store.create('user', 1, {'id': 1}, ttl=10)
+    other = store.create('doctor', 1, {'id': 1}, ttl=10)
+    assert store.load(first, 10, 0) == sessions.Record(first, 'user', 1, {'id': 1})
+
+    store.forget('user', 1)
+    assert store.load(first, 10, 0).principal is None
+    store.remember('user', 1, {'id': 1, 'name': 'Ada'})
+    assert store.load(second, 10, 0).principal == {'id': 1, 'name': 'Ada'}
+
+    assert store.revoke('user', 1, keep=second) == 1
+    assert store.load(first, 10, 0) is None
+
+    # Loading slides the expiry; the doctor's session was last used at the start
+    now[0] += 8
+    assert store.load(second, 10, 0) is not None
+    now[0] += 8
+    assert store.load(second, 10, 0) is not None
+    assert store.load(other, 10, 0) is None
+    assert len(store) == 1
+
+
+def test_unknown_backend_is_rejected(app):
+    with pytest.raises(ValueError):
+        sessions.make_store({**app.config, 'SESSION_BACKEND': 'cookie'})
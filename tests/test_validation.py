@@ -0,0 +1,211 @@
+"""Request body schemas, strict types and PATCH."""
+from datetime import date, time
+
+import bcrypt
+import pytest
+
+from config import db
+from models import Appointment, Prescription, User
+from schemas import APPOINTMENT, SCHEDULE, SIGNUP, ValidationError
+
+SIGNUP_BODY = {'name': 'Lin Park', 'email': 'lin@example.com', 'password': 'correct horse', 'age': 29,
+               'gender': 'Female', 'phone_number': '555-0101'}
+BOOKING = {'user_id': 1, 'doctor_id': 1, 'date': '2030-01-07', 'time': '09:00', 'status': 'Scheduled'}
+
+
+@pytest.fixture
+def appointment(app):
+    with app.app_context():
+        db.session.add(Appointment(user_id=1, doctor_id=1, date=date(2030, 1, 7), time=time(9), status='Scheduled'))
+        db.session.add(Prescription(appointment_id=1, medicine='Aspirin', dosage='1 x 10 mg',
+                                    instructions='Take after meal'))
+        db.session.commit()
+
+
+def test_every_field_error_is_reported_at_once(client):
+    response = client.post('/signup', json={'name': 'Lin Park', 'email': 'lin', 'age': '29'})
+    assert response.status_code == 400
+    assert response.json == {'error': 'Invalid request body', 'errors': {
+        'email': 'must be an email address',
+        'password': 'is required',
+        'age': 'must be an integer',
+        'gender': 'is required',
+        'phone_number': 'is required',
+    }}
+
+
+@pytest.mark.parametrize('field, value, message', [
+    ('age', True, 'must be an integer'),
+    ('age', 29.0, 'must be an integer'),
+    ('age', -1, 'must be at least 0'),
+    ('name', '   ', 'must be a non-empty string'),
+    ('name', 7, 'must be a non-empty string'),
+    ('phone_number', '5' * 33, 'must be at most 32 characters'),
+    ('email', 'lin park@example.com', 'must be an email address'),
+    ('password', 'é' * 37, 'must be at most 72 bytes'),
+])
+def test_types_are_strict(client, field, value, message):
+    response = client.post('/signup', json={**SIGNUP_BODY, field: value})
+    assert response.status_code == 400
+    assert response.json['errors'] == {field: message}
+
+
+@pytest.mark.parametrize('kwargs', [{'data': 'not json', 'content_type': 'application/json'}, {'json': [1, 2]},
+                                    {'json': 'body'}, {}])
+def test_body_must_be_an_object(client, kwargs):
+    response = client.post('/appointments', **kwargs)
+    assert response.status_code == 400
+    assert response.json['errors'] == {'body': 'must be a JSON object'}
+
+
+@pytest.mark.parametrize('field, value, message', [
+    ('date', '2030-1-7', 'must be a date (YYYY-MM-DD)'),
+    ('date', '2030-02-30', 'must be a date (YYYY-MM-DD)'),
+    ('date', '20300107', 'must be a date (YYYY-MM-DD)'),
+    ('time', '25:00', 'must be a time (HH:MM)'),
+    ('time', '09:00:00', 'must be a time (HH:MM)'),
+    ('time', '9:0', 'must be a time (HH:MM)'),
+    ('time', '9:60', 'must be a time (HH:MM)'),
+    ('time', 900, 'must be a time (HH:MM)'),
+    ('doctor_id', 0, 'must be at least 1'),
+])
+def test_dates_and_times_are_checked(client, field, value, message):
+    response = client.post('/appointments', json={**BOOKING, field: value})
+    assert response.status_code == 400
+    assert response.json['errors'] == {field: message}
+
+
+def test_single_digit_hours_are_times(client):
+    response = client.post('/appointments', json={**BOOKING, 'time': '9:00'})
+    assert response.status_code == 201
+    assert response.json['time'] == '09:00'
+
+
+def test_unknown_keys_are_ignored(client):
+    response = client.post('/appointments', json={**BOOKING, 'id': 99, 'doctor': {'name': 'x'}})
+    assert response.status_code == 201
+    assert response.json['id'] == 1
+
+
+def test_duplicate_email_is_a_conflict(client):
+    assert client.post('/signup', json=SIGNUP_BODY).status_code == 201
+    response = client.post('/signup', json=SIGNUP_BODY)
+    assert response.status_code == 409
+    response = client.put('/users/1', json={**SIGNUP_BODY, 'email': 'lin@example.com'})
+    assert response.status_code == 409
+    assert client.patch('/users/1', json={'email': 'lin@example.com'}).status_code == 409
+
+
+def test_login_body_is_validated(client):
+    response = client.post('/login', json={'email': 'ada@example.com'})
+    assert response.status_code == 400
+    assert response.json['errors'] == {'password': 'is required'}
+
+
+def test_passwords_longer_than_bcrypt_reads_still_log_in(app, client):
+    # Set before the 72-byte cap: bcrypt hashed the first 72 bytes
+    long = 'correct horse battery staple ' * 4
+    with app.app_context():
+        db.session.get(User, 1).password_hash = bcrypt.hashpw(long.encode()[:72], bcrypt.gensalt(4)).decode()
+        db.session.commit()
+    assert client.post('/login', json={'email': 'ada@example.com', 'password': long}).status_code == 200
+    assert client.post('/login', json={'email': 'ada@example.com', 'password': 'x' * 100}).status_code == 401
+    # Only new passwords are capped
+    response = client.patch('/users/1', json={'password': long})
+    assert response.status_code == 400
+    assert response.json['errors'] == {'password': 'must be at most 72 bytes'}
+
+
+def test_put_needs_every_field(client, appointment):
+    response = client.put('/appointments/1', json={'status': 'Completed'})
+    assert response.status_code == 400
+    assert set(response.json['errors']) == {'user_id', 'doctor_id', 'date', 'time'}
+
+
+def test_patch_changes_only_the_fields_sent(client, appointment):
+    response = client.patch('/appointments/1', json={'status': 'Completed'})
+    assert response.status_code == 200
+    assert response.json['status'] == 'Completed'
+    assert (response.json['date'], response.json['time']) == ('2030-01-07', '09:00')
+
+    response = client.patch('/prescriptions/1', json={'dosage': '2 x 10 mg'})
+    assert response.status_code == 200
+    assert (response.json['medicine'], response.json['dosage']) == ('Aspirin', '2 x 10 mg')
+
+    response = client.patch('/users/1', json={'age': 37})
+    assert response.status_code == 200
+    assert (response.json['name'], response.json['age']) == ('Ada Moreau', 37)
+
+
+def test_patch_validates_the_fields_sent(client, appointment):
+    response = client.patch('/appointments/1', json={'time': '9am', 'status': ''})
+    assert response.status_code == 400
+    assert set(response.json['errors']) == {'time', 'status'}
+    assert client.get('/appointments/1').json['time'] == '09:00'
+
+
+@pytest.mark.parametrize('path', ['/appointments/1', '/prescriptions/1', '/users/1'])
+def test_empty_patch_is_rejected(client, appointment, path):
+    response = client.patch(path, json={'ignored': True})
+    assert response.status_code == 400
+    assert response.json['errors'] == {'body': 'has no fields to update'}
+
+
+@pytest.mark.parametrize('path', ['/appointments/9', '/prescriptions/9', '/users/9'])
+def test_patch_unknown_row(client, path):
+    assert client.patch(path, json={'status': 'Completed', 'dosage': '1 mg', 'age': 3}).status_code == 404
+
+
+def test_patch_only_checks_the_slot_when_the_booking_moves(client, appointment):
+    assert client.post('/appointments', json={**BOOKING, 'time': '10:00'}).status_code == 201
+    # Not moving: no conflict with itself
+    assert client.patch('/appointments/1', json={'status': 'Completed', 'time': '09:00'}).status_code == 200
+    response = client.patch('/appointments/1', json={'time': '10:00'})
+    assert response.status_code == 409
+    assert response.json['error'] == 'Slot already booked'
+
+    # A cancelled booking revived into a taken slot is refused too
+    assert client.patch('/appointments/2', json={'status': 'Cancelled'}).status_code == 200
+    assert client.patch('/appointments/1', json={'time': '10:00'}).status_code == 200
+    assert client.patch('/appointments/2', json={'status': 'Scheduled'}).status_code == 409
+
+
+def test_nested_items_report_errors_by_position(client):
+    response = client.put('/doctors/1/schedule', json={'working_hours': [
+        {'weekday': 0, 'start_time': '09:00', 'end_time': '11:00'},
+        {'weekday': 8, 'start_time': '09:00'},
+    ]})
+    assert response.status_code == 400
+    assert response.json['errors'] == {'working_hours': {'1': {'weekday': 'must be at most 6', 'end_time': 'is required'}}}
+
+
+def test_bulk_items_use_the_same_schema(client):
+    response = client.post('/appointments/bulk', json=[BOOKING, {**BOOKING, 'time': '9am'}])
+    assert response.status_code == 207
+    assert response.json['results'][1]['errors'] == {'time': 'must be a time (HH:MM)'}
+
+
+def test_schema_load():
+    assert APPOINTMENT.load(BOOKING) == {'user_id': 1, 'doctor_id': 1, 'date': date(2030, 1, 7), 'time': time(9),
+                                         'status': 'Scheduled'}
+    assert APPOINTMENT.load({'status': 'Completed'}, partial=True) == {'status': 'Completed'}
+    with pytest.raises(ValidationError) as raised:
+        SIGNUP.load({})
+    assert set(raised.value.errors) == set(SIGNUP.fields)
+    with pytest.raises(ValidationError) as raised:
+        SCHEDULE.load({'working_hours': 'all week'})
+    assert raised.value.errors == {'working_hours': 'must be a list'}
+
+
+@pytest.mark.parametrize('method, path, body, field', [
+    ('post', '/appointments', {**BOOKING, 'user_id': 9}, 'user_id'),
+    ('post', '/appointments', {**BOOKING, 'doctor_id': 9}, 'doctor_id'),
+    ('patch', '/appointments/1', {'doctor_id': 9}, 'doctor_id'),
+    ('post', '/prescriptions', {'appointment_id': 9, 'medicine': 'Aspirin', 'dosage': '1 mg', 'instructions': 'Daily'},
+     'appointment_id'),
+    ('patch', '/prescriptions/1', {'appointment_id': 9}, 'appointment_id'),
+])
+def test_unknown_references_are_bad_requests(client, appointment, method, path, body, field):
+    response = getattr(client, method)(path, json=body)
+    assert response.status_code == 400
+    assert response.json['errors'] == {field: 'does not exist'}
@@ -0,0 +1,75 @@
+"""Flat default representations, expand= and fields=."""
+from datetime import date, time
+
+import pytest
+
+from config import db
+from models import Appointment, Prescription
+
+
+@pytest.fixture
+def appointment(app):
+    with app.app_context():
+        appointment = Appointment(user_id=1, doctor_id=1, date=date(2024, 5, 1), time=time(9), status='scheduled')
+        appointment.prescriptions = [Prescription(medicine='Aspirin', dosage='100mg', instructions='Daily')]
+        db.session.add(appointment)
+        db.session.commit()
+
+
+def test_default_is_the_flat_row(client, appointment):
+    assert client.get('/doctors/1').json == {
+        'id': 1, 'name': 'Dr. Grace Okafor', 'email': 'grace@example.com', 'specialty': 'Cardiology',
+        'experience_years': 12, 'availability': 'Available', 'slot_minutes': 30}
+    assert client.get('/appointments').json == [
+        {'id': 1, 'user_id': 1, 'doctor_id': 1, 'date': '2024-05-01', 'time': '09:00', 'status': 'scheduled'}]
+
+
+def test_password_hash_is_never_returned(client):
+    assert 'password_hash' not in client.get('/users/1').json
+    assert client.get('/users/1?fields=password_hash').status_code == 400
+
+
+def test_expand_embeds_only_the_requested_paths(client, appointment):
+    doctor = client.get('/doctors/1?expand=appointments.user').json
+    [embedded] = doctor['appointments']
+    assert embedded['user']['name'] == 'Ada Moreau'
+    assert 'prescriptions' not in embedded and 'doctor' not in embedded
+
+    prescription = client.get('/prescriptions/1?expand=appointment').json
+    assert prescription['appointment']['date'] == '2024-05-01'
+    assert 'user' not in prescription['appointment']
+
+
+def test_fields_narrow_columns_at_each_level(client, appointment):
+    response = client.get('/doctors?expand=appointments&fields=name,appointments.date')
+    assert response.json == [{'name': 'Dr. Grace Okafor', 'appointments': [{'date': '2024-05-01'}]}]
+    assert client.get('/users/1?fields=email').json == {'email': 'ada@example.com'}
+
+
+@pytest.mark.parametrize('query', [
+    'expand=doctor', 'expand=appointments.doctor.appointments', 'fields=salary', 'fields=appointments.date',
+])
+def test_unknown_paths_and_fields_are_rejected(client, query):
+    response = client.get(f'/doctors?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.json
+
+
+def test_writes_and_logins_answer_with_the_flat_row(client, appointment):
+    body = {'name': 'Lin Park', 'email': 'lin@example.com', 'password': 'correct horse', 'age': 29,
+            'gender': 'Female', 'phone_number': '555-0101'}
+    created = client.post('/signup', json=body)
+    assert created.status_code == 201
+    assert created.json == client.get(f"/users/{created.json['id']}").json
+    login = client.post('/login', json={'email': 'lin@example.com', 'password': 'correct horse'})
+    assert login.json == created.json
+
+    for response in (client.patch('/appointments/1', json={'status': 'completed'}),
+                     client.post('/appointments', json={'user_id': 1, 'doctor_id': 1, 'date': '2024-05-02',
+                                                        'time': '10:00', 'status': 'scheduled'})):
+        assert response.status_code in (200, 201)
+        assert response.json == client.get(f"/appointments/{response.json['id']}").json
+        assert 'prescriptions' not in response.json and 'doctor' not in response.json
+    response = client.patch('/prescriptions/1', json={'dosage': '200mg'})
+    assert response.json == {'id': 1, 'appointment_id': 1, 'medicine': 'Aspirin', 'dosage': '200mg',
+                             'instructions': 'Daily'}